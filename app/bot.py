@@ -6,17 +6,27 @@ from telegram.ext import ContextTypes, Application, CommandHandler, MessageHandl
 from app.config import settings
 from app.context import CustomContext
 from app.bots import telegram_bot
+from app.libs.update_processor import ChatOrderedUpdateProcessor
 
 __all__ = ["application"]
 
 _context_types = ContextTypes(context=CustomContext)
 
-application = (
+_builder = (
     Application.builder()
     .token(settings.TELEGRAM_BOT_TOKEN)
     .context_types(_context_types)
-    .build()
 )
+if settings.TELEGRAM_CONCURRENT_UPDATES:
+    # updates of one chat keep their order, different chats are processed in parallel
+    _builder.concurrent_updates(
+        ChatOrderedUpdateProcessor(
+            workers=settings.TELEGRAM_UPDATE_WORKERS,
+            max_pending_updates=settings.TELEGRAM_MAX_PENDING_UPDATES,
+            update_deadline=settings.TELEGRAM_UPDATE_DEADLINE
+        )
+    )
+application = _builder.build()
 
 # register handlers
 application.add_handler(
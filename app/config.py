@@ -77,6 +77,15 @@ class Configuration(BaseSettings):
 
     # [Redis]
     REDIS_URL: str = os.getenv(key="REDIS_URL", default="redis://localhost:6379")
+    CACHE_ENABLED: bool = strtobool(os.getenv("CACHE_ENABLED", "true"))
+    CACHE_L1_TTL: float = float(os.getenv("CACHE_L1_TTL", "60"))
+    CACHE_L2_TTL: int = int(os.getenv("CACHE_L2_TTL", "300"))
+    # open order and pending cart of a chat, written through by the order provider
+    CHAT_STATE_CACHE: bool = strtobool(os.getenv("CHAT_STATE_CACHE", "true"))
+    WRITE_FINGERPRINTS: bool = strtobool(os.getenv("WRITE_FINGERPRINTS", "true"))
+    WRITE_FINGERPRINT_REDIS: bool = strtobool(os.getenv("WRITE_FINGERPRINT_REDIS", "true"))
+    WRITE_FINGERPRINT_TTL: int = int(os.getenv("WRITE_FINGERPRINT_TTL", "3600"))
+    WRITE_FINGERPRINT_MAX_SIZE: int = int(os.getenv("WRITE_FINGERPRINT_MAX_SIZE", "100000"))
 
     # [PostgreSQL]
     DATABASE_HOST: str = os.getenv(key="DATABASE_HOST", default="localhost")
@@ -89,21 +98,90 @@ class Configuration(BaseSettings):
 
     # [Database]
     DATABASE_POOL: bool = strtobool(os.getenv("DATABASE_POOL", "true"))
+    DATABASE_POOL_MIN_SIZE: int = int(os.getenv("DATABASE_POOL_MIN_SIZE", "0"))
+    DATABASE_POOL_MAX_SIZE: int = int(os.getenv("DATABASE_POOL_MAX_SIZE", "100"))
+    DATABASE_POOL_MAX_QUERIES: int = int(os.getenv("DATABASE_POOL_MAX_QUERIES", "50000"))
+    DATABASE_POOL_MAX_INACTIVE_LIFETIME: float = float(os.getenv("DATABASE_POOL_MAX_INACTIVE_LIFETIME", "600"))
+    DATABASE_POOL_ACQUIRE_TIMEOUT: float = float(os.getenv("DATABASE_POOL_ACQUIRE_TIMEOUT", "60"))
+    DATABASE_CONCURRENT_SESSION: bool = strtobool(os.getenv("DATABASE_CONCURRENT_SESSION", "true"))
+    DATABASE_PREPARED_STATEMENTS: bool = strtobool(os.getenv("DATABASE_PREPARED_STATEMENTS", "false"))
+    DATABASE_PREPARED_STATEMENT_CACHE_SIZE: int = int(os.getenv("DATABASE_PREPARED_STATEMENT_CACHE_SIZE", "100"))
+    DATABASE_REPLICA_URIS: str = os.getenv("DATABASE_REPLICA_URIS", "")
+    DATABASE_REPLICA_READS: bool = strtobool(os.getenv("DATABASE_REPLICA_READS", "true"))
+    DATABASE_REPLICA_MAX_STALENESS: float = float(os.getenv("DATABASE_REPLICA_MAX_STALENESS", "5"))
+    DATABASE_REPLICA_STICKY_SECONDS: float = float(os.getenv("DATABASE_REPLICA_STICKY_SECONDS", "2"))
+    DATABASE_REPLICA_LAG_CHECK_INTERVAL: float = float(os.getenv("DATABASE_REPLICA_LAG_CHECK_INTERVAL", "1"))
+    WRITE_BEHIND: bool = strtobool(os.getenv("WRITE_BEHIND", "true"))
+    WRITE_BEHIND_INTERVAL_MS: int = int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "200"))
+    WRITE_BEHIND_MAX_ROWS: int = int(os.getenv("WRITE_BEHIND_MAX_ROWS", "500"))
+    # flushes a row is tried in before it is dropped, a row the database rejects would be retried forever
+    WRITE_BEHIND_MAX_ATTEMPTS: int = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "5"))
+    ORDER_NO_ALLOCATOR: bool = strtobool(os.getenv("ORDER_NO_ALLOCATOR", "true"))
+    # order numbers a worker reserves at once, the unused ones of a stopped worker are skipped
+    ORDER_NO_BLOCK_SIZE: int = int(os.getenv("ORDER_NO_BLOCK_SIZE", "10"))
+    ORDER_EXPIRY: bool = strtobool(os.getenv("ORDER_EXPIRY", "true"))
+    ORDER_EXPIRY_BATCH_SIZE: int = int(os.getenv("ORDER_EXPIRY_BATCH_SIZE", "500"))
+    # expiry notices sent a second, below the telegram limit shared with the replies
+    ORDER_EXPIRY_NOTIFY_RATE: float = float(os.getenv("ORDER_EXPIRY_NOTIFY_RATE", "10"))
+    # seconds between reloads of the pending deadlines, picks up the orders of other processes
+    ORDER_EXPIRY_RELOAD_INTERVAL: float = float(os.getenv("ORDER_EXPIRY_RELOAD_INTERVAL", "300"))
     SQL_ECHO: bool = strtobool(os.getenv("SQL_ECHO", "false"))
+    SQL_STATEMENT_CACHE_SIZE: int = int(os.getenv("SQL_STATEMENT_CACHE_SIZE", "512"))
+    SQL_ROW_MAPPER: bool = strtobool(os.getenv("SQL_ROW_MAPPER", "true"))
+    SQL_WINDOW_COUNT_PAGES: bool = strtobool(os.getenv("SQL_WINDOW_COUNT_PAGES", "true"))
     SQLALCHEMY_DATABASE_URI: str = f'postgresql://{DATABASE_USER}:{DATABASE_PASSWORD}@' \
                                    f'{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}'
     ASYNC_DATABASE_URL: str = f'postgresql+asyncpg://{DATABASE_USER}:{DATABASE_PASSWORD}@' \
                               f'{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}'
 
+    # [Exchange Rate]
+    EXCHANGE_RATE_BOOK: bool = strtobool(os.getenv("EXCHANGE_RATE_BOOK", "true"))
+    EXCHANGE_RATE_BOOK_MAX_AGE: float = float(os.getenv("EXCHANGE_RATE_BOOK_MAX_AGE", "300"))
+
+    # [Handling Fee]
+    HANDLING_FEE_TABLE: bool = strtobool(os.getenv("HANDLING_FEE_TABLE", "true"))
+    HANDLING_FEE_TABLE_MAX_AGE: float = float(os.getenv("HANDLING_FEE_TABLE_MAX_AGE", "300"))
+
     # [Telegram]
     TELEGRAM_BOT_USERNAME: str = os.getenv(key="TELEGRAM_BOT_USERNAME")
     TELEGRAM_BOT_TOKEN: str = os.getenv(key="TELEGRAM_BOT_TOKEN")
     TELEGRAM_BOT_TYPE: BotType = BotType.CUSTOMER
+    TELEGRAM_CONCURRENT_UPDATES: bool = strtobool(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "true"))
+    TELEGRAM_UPDATE_WORKERS: int = int(os.getenv("TELEGRAM_UPDATE_WORKERS", "16"))
+    TELEGRAM_MAX_PENDING_UPDATES: int = int(os.getenv("TELEGRAM_MAX_PENDING_UPDATES", "1024"))
+    # seconds the http requests made for one update may take, retries included
+    TELEGRAM_UPDATE_DEADLINE: float = float(os.getenv("TELEGRAM_UPDATE_DEADLINE", "30"))
+    TELEGRAM_PREFETCH_CHAT_CONTEXT: bool = strtobool(os.getenv("TELEGRAM_PREFETCH_CHAT_CONTEXT", "true"))
+    # lookups of one message running at once, each holds a database connection while it runs
+    TELEGRAM_PREFETCH_CONCURRENCY: int = int(os.getenv("TELEGRAM_PREFETCH_CONCURRENCY", "2"))
+    # seconds between the gina reply and the exchange rate that follows it
+    TELEGRAM_EXCHANGE_RATE_REPLY_DELAY: float = float(os.getenv("TELEGRAM_EXCHANGE_RATE_REPLY_DELAY", "1.5"))
+
+    # [Broadcast]
+    BROADCAST_WORKERS: int = int(os.getenv("BROADCAST_WORKERS", "16"))
+    # telegram allows a bot about 30 messages a second and 20 a minute in one group
+    BROADCAST_RATE: float = float(os.getenv("BROADCAST_RATE", "25"))
+    BROADCAST_CHAT_RATE_PER_MINUTE: float = float(os.getenv("BROADCAST_CHAT_RATE_PER_MINUTE", "20"))
+    BROADCAST_MAX_ATTEMPTS: int = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "3"))
+    BROADCAST_BATCH_SIZE: int = int(os.getenv("BROADCAST_BATCH_SIZE", "100"))
 
     # [Gina]
     GINA_URL: str = os.getenv(key="GINA_URL")
     GINA_API_KEY: str = os.getenv(key="GINA_API_KEY")
 
+    # [Http Client]
+    HTTP_CLIENT_POOL: bool = strtobool(os.getenv("HTTP_CLIENT_POOL", "true"))
+    HTTP_CLIENT_MAX_CONNECTIONS: int = int(os.getenv("HTTP_CLIENT_MAX_CONNECTIONS", "100"))
+    HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    HTTP_CLIENT_KEEPALIVE_EXPIRY: float = float(os.getenv("HTTP_CLIENT_KEEPALIVE_EXPIRY", "30"))
+    # needs the h2 package (httpx[http2])
+    HTTP_CLIENT_HTTP2: bool = strtobool(os.getenv("HTTP_CLIENT_HTTP2", "false"))
+    HTTP_CLIENT_BREAKERS: bool = strtobool(os.getenv("HTTP_CLIENT_BREAKERS", "true"))
+    HTTP_CLIENT_BREAKER_FAILURES: int = int(os.getenv("HTTP_CLIENT_BREAKER_FAILURES", "5"))
+    HTTP_CLIENT_BREAKER_RESET_TIMEOUT: float = float(os.getenv("HTTP_CLIENT_BREAKER_RESET_TIMEOUT", "30"))
+    HTTP_CLIENT_RETRY_BUDGET_RATIO: float = float(os.getenv("HTTP_CLIENT_RETRY_BUDGET_RATIO", "0.2"))
+    HTTP_CLIENT_MAX_BACKOFF: float = float(os.getenv("HTTP_CLIENT_MAX_BACKOFF", "10"))
+
     # [Sentry]
     SENTRY_URL: str = os.getenv(key="SENTRY_URL")
 
@@ -124,7 +124,8 @@ class Container(containers.DeclarativeContainer):
     )
     exchange_rate_handler = providers.Factory(
         ExchangeRateHandler,
-        exchange_rate_provider=exchange_rate_provider
+        exchange_rate_provider=exchange_rate_provider,
+        price_provider=price_provider
     )
     file_handler = providers.Factory(
         FileHandler,
@@ -1,8 +1,10 @@
 """
 Top level controller package
 """
+from .chat_context import ChatContext
 from .messages import MessagesController
 
 __all__ = [
+    "ChatContext",
     "MessagesController"
 ]
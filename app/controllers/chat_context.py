@@ -0,0 +1,108 @@
+"""
+ChatContext
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.libs.consts.enums import OrderStatus
+from app.providers import TelegramAccountProvider, OrderProvider
+from app.schemas.order import Cart
+from app.serializers.v1.order import OrderDetail
+from app.serializers.v1.telegram import GroupInfo, TelegramAccount
+
+
+class ChatContext:
+    """
+    Lookups of one chat the reply to a message may need, started by prefetch while Gina classifies
+    the message. Each lookup runs at most once, a lookup that was not prefetched runs when it is
+    first awaited, a failed prefetch raises where its result is used. At most max_concurrency
+    lookups run at once, in the order they were started, so a message holds that many database
+    connections however many lookups are prefetched.
+    """
+    ORDER = "order"
+    CART = "cart"
+    CHAT_GROUP = "chat_group"
+    CUSTOMER_SERVICES = "customer_services"
+
+    def __init__(
+        self,
+        group_id: int,
+        telegram_account_provider: TelegramAccountProvider,
+        order_provider: OrderProvider,
+        max_concurrency: int = 1
+    ):
+        self.group_id = group_id
+        self._telegram_account_provider = telegram_account_provider
+        self._order_provider = order_provider
+        self._loaders: Dict[str, Callable[[], Awaitable[Any]]] = {
+            self.ORDER: lambda: self._order_provider.get_order_by_group_id(group_id=group_id),
+            self.CART: lambda: self._order_provider.get_cart_by_group_id(group_id=group_id),
+            self.CHAT_GROUP: lambda: self._telegram_account_provider.get_chat_group(group_id=group_id),
+            self.CUSTOMER_SERVICES: lambda: self._telegram_account_provider.get_group_customer_services(group_id=group_id),
+        }
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    def prefetch(self, *names: str) -> "ChatContext":
+        """
+        start lookups in the background
+        :param names: defaults to every lookup
+        :return:
+        """
+        for name in names or self._loaders:
+            self._start(name)
+        return self
+
+    def _start(self, name: str) -> asyncio.Task:
+        task = self._tasks.get(name)
+        if task is None:
+            # a task of its own, so a concurrent session leases it a connection of its own
+            task = self._tasks[name] = asyncio.create_task(self._load(name))
+        return task
+
+    async def _load(self, name: str) -> Any:
+        async with self._slots:
+            return await self._loaders[name]()
+
+    async def order(self, status: Optional[OrderStatus] = None) -> Optional[OrderDetail]:
+        """
+        latest order of the chat that is not done
+        :param status: only an order in this status
+        :return:
+        """
+        order = await self._start(self.ORDER)
+        if order is None or status is None or order.status == status:
+            return order
+        # an older order may have the status
+        return await self._order_provider.get_order_by_group_id(group_id=self.group_id, status=status)
+
+    async def cart(self) -> Optional[Cart]:
+        """
+        :return:
+        """
+        return await self._start(self.CART)
+
+    async def chat_group(self) -> Optional[GroupInfo]:
+        """
+        :return:
+        """
+        return await self._start(self.CHAT_GROUP)
+
+    async def customer_services(self) -> List[TelegramAccount]:
+        """
+        :return:
+        """
+        return await self._start(self.CUSTOMER_SERVICES)
+
+    def close(self):
+        """
+        cancel lookups the reply did not need
+        :return:
+        """
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                # an unused failed lookup is not an error of the reply
+                task.exception()
+        self._tasks.clear()
@@ -1,17 +1,18 @@
 """
 MessagesController
 """
-import asyncio
 import re
 from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal
+from typing import List, Optional
 from uuid import UUID
 
 import pytz
 from telegram import Update, User
 from telegram.constants import ParseMode
 
+from app.config import settings
 from app.libs.consts import messages
 from app.libs.consts.enums import GinaAction, CurrencySymbol, OperationType, OrderStatus, Language, CartStatus
 from app.libs.decorators.sentry_tracer import distributed_trace
@@ -20,6 +21,9 @@ from app.providers import TelegramAccountProvider, OrderProvider, VendorsBotProv
 from app.schemas.gina import GinaResponse
 from app.schemas.order import Order, Cart
 from app.schemas.vendors_bot import GetPaymentAccount, ConfirmPayment
+from app.serializers.v1.order import OrderDetail
+from app.serializers.v1.telegram import GroupInfo, TelegramAccount
+from .chat_context import ChatContext
 
 
 @dataclass
@@ -43,35 +47,91 @@ class MessagesController:
         self._order_provider = order_provider
         self._vendors_bot_provider = vendors_bot_provider
 
+    def chat_context(self, group_id: int) -> ChatContext:
+        """
+        lookups of a chat the handlers of this controller use, to be prefetched
+        :param group_id:
+        :return:
+        """
+        return ChatContext(
+            group_id=group_id,
+            telegram_account_provider=self._telegram_account_provider,
+            order_provider=self._order_provider,
+            max_concurrency=settings.TELEGRAM_PREFETCH_CONCURRENCY
+        )
+
+    async def _get_order(
+        self,
+        group_id: int,
+        status: Optional[OrderStatus] = None,
+        chat_context: ChatContext = None
+    ) -> Optional[OrderDetail]:
+        if chat_context is not None:
+            return await chat_context.order(status=status)
+        return await self._order_provider.get_order_by_group_id(group_id=group_id, status=status)
+
+    async def _get_cart(self, group_id: int, chat_context: ChatContext = None) -> Optional[Cart]:
+        if chat_context is not None:
+            return await chat_context.cart()
+        return await self._order_provider.get_cart_by_group_id(group_id=group_id)
+
+    async def _get_chat_group(self, group_id: int, chat_context: ChatContext = None) -> Optional[GroupInfo]:
+        if chat_context is not None:
+            return await chat_context.chat_group()
+        return await self._telegram_account_provider.get_chat_group(group_id=group_id)
+
+    async def _get_customer_services(self, group_id: int, chat_context: ChatContext = None) -> List[TelegramAccount]:
+        if chat_context is not None:
+            return await chat_context.customer_services()
+        return await self._telegram_account_provider.get_group_customer_services(group_id=group_id)
+
     @distributed_trace()
-    async def on_exchange_rate(self, update: Update, gina_resp: GinaResponse) -> messages.Message:
+    async def on_exchange_rate(
+        self,
+        update: Update,
+        gina_resp: GinaResponse,
+        chat_context: ChatContext = None
+    ) -> messages.Message:
         """
         on exchange rate
         :param update:
         :param gina_resp:
+        :param chat_context:
         :return:
         """
         match gina_resp.action:
             case GinaAction.EXCHANGE_RATE:
                 message = await self._exchange_rate(update=update, gina_resp=gina_resp)
             case GinaAction.EXCHANGE_RATE_MAIN_TOKEN:
-                message = await self._exchange_rate(update=update, gina_resp=gina_resp, get_default=True)
+                message = await self._exchange_rate(
+                    update=update,
+                    gina_resp=gina_resp,
+                    get_default=True,
+                    chat_context=chat_context
+                )
             case _:
                 message = messages.Message(text=gina_resp.reply)
         return message
 
     @distributed_trace()
-    async def _exchange_rate(self, update: Update, gina_resp: GinaResponse, get_default: bool = False) -> messages.Message:
+    async def _exchange_rate(
+        self,
+        update: Update,
+        gina_resp: GinaResponse,
+        get_default: bool = False,
+        chat_context: ChatContext = None
+    ) -> messages.Message:
         """
         exchange rate
         :param update:
         :param gina_resp:
         :param get_default:
+        :param chat_context:
         :return:
         """
         await update.effective_message.reply_text(text=gina_resp.reply)
         if get_default:
-            group = await self._telegram_account_provider.get_chat_group(group_id=update.effective_chat.id)
+            group = await self._get_chat_group(group_id=update.effective_chat.id, chat_context=chat_context)
             if not group.currency_symbol:
                 return messages.DefaultCurrencyNotFoundMessage.format(language=gina_resp.language)
             payment_currency = group.currency_symbol
@@ -96,31 +156,33 @@ class MessagesController:
                 exchange_currency=exchange_currency,
             )
 
-        await asyncio.sleep(1.5)
-        return messages.ExchangeRateMessage.format(
+        message = messages.ExchangeRateMessage.format(
             language=gina_resp.language,
             payment_currency=payment_currency,
             exchange_currency=exchange_currency,
             price=price_info.price
         )
+        message.delay = settings.TELEGRAM_EXCHANGE_RATE_REPLY_DELAY
+        return message
 
     @distributed_trace()
-    async def on_swap(self, update: Update, gina_resp: GinaResponse) -> messages.Message:
+    async def on_swap(self, update: Update, gina_resp: GinaResponse, chat_context: ChatContext = None) -> messages.Message:
         """
         on swap
         :param update:
         :param gina_resp:
+        :param chat_context:
         :return:
         """
-        order_info = await self._order_provider.get_order_by_group_id(group_id=update.effective_chat.id)
+        order_info = await self._get_order(group_id=update.effective_chat.id, chat_context=chat_context)
         if order_info:
             if order_info.status not in [OrderStatus.EXPIRE, OrderStatus.DONE, OrderStatus.CANCELLED]:
                 return messages.OrderInProgressMessage.format(language=gina_resp.language)
         match gina_resp.action:
             case GinaAction.SWAP:
-                message = await self._swap(update=update, gina_resp=gina_resp)
+                message = await self._swap(update=update, gina_resp=gina_resp, chat_context=chat_context)
             case GinaAction.SWAP_CRYPTO:
-                message = await self._swap(update=update, gina_resp=gina_resp)
+                message = await self._swap(update=update, gina_resp=gina_resp, chat_context=chat_context)
             case GinaAction.SWAP_LEGAL:
                 message = messages.Message(text=gina_resp.reply)
             case _:
@@ -128,11 +190,12 @@ class MessagesController:
         return message
 
     @distributed_trace()
-    async def _swap(self, update: Update, gina_resp: GinaResponse) -> messages.Message:
+    async def _swap(self, update: Update, gina_resp: GinaResponse, chat_context: ChatContext = None) -> messages.Message:
         """
         swap
         :param update:
         :param gina_resp:
+        :param chat_context:
         :return:
         """
         group_id = update.effective_chat.id
@@ -150,7 +213,7 @@ class MessagesController:
             currency = exchange_currency
 
         # try to get cart by group id
-        exist_cart = await self._order_provider.get_cart_by_group_id(group_id=group_id)
+        exist_cart = await self._get_cart(group_id=group_id, chat_context=chat_context)
         if exist_cart:
             if exist_cart.payment_currency != payment_currency or exist_cart.exchange_currency != exchange_currency:
                 return messages.CartCurrencyMismatchMessage.format(language=gina_resp.language)
@@ -219,33 +282,42 @@ class MessagesController:
         )
 
     @distributed_trace()
-    async def on_human_customer_service(self, update: Update, gina_resp: GinaResponse) -> messages.Message:
+    async def on_human_customer_service(
+        self,
+        update: Update,
+        gina_resp: GinaResponse,
+        chat_context: ChatContext = None
+    ) -> messages.Message:
         """
         on human customer service
         :param update:
         :param gina_resp:
+        :param chat_context:
         :return:
         """
         return messages.Message(
             text=await self.format_message(
                 message=gina_resp.reply,
                 group_id=update.effective_chat.id,
-                options=FormatOptions()
+                options=FormatOptions(),
+                chat_context=chat_context
             ),
             parse_mode=ParseMode.HTML
         )
 
     @distributed_trace()
-    async def on_get_account(self, update: Update, gina_resp: GinaResponse) -> messages.Message:
+    async def on_get_account(self, update: Update, gina_resp: GinaResponse, chat_context: ChatContext = None) -> messages.Message:
         """
 
         :param update:
         :param gina_resp:
+        :param chat_context:
         :return:
         """
-        order_info = await self._order_provider.get_order_by_group_id(
+        order_info = await self._get_order(
             group_id=update.effective_chat.id,
-            status=OrderStatus.WAIT_FOR_PAYMENT_ACCOUNT
+            status=OrderStatus.WAIT_FOR_PAYMENT_ACCOUNT,
+            chat_context=chat_context
         )
         if not order_info:
             return messages.OrderInfoNotFoundMessage.format(language=gina_resp.language)
@@ -261,14 +333,15 @@ class MessagesController:
         return messages.Message(text=gina_resp.reply)
 
     @distributed_trace()
-    async def on_confirm_payment(self, update: Update, gina_resp: GinaResponse) -> messages.Message:
+    async def on_confirm_payment(self, update: Update, gina_resp: GinaResponse, chat_context: ChatContext = None) -> messages.Message:
         """
 
         :param update:
         :param gina_resp:
+        :param chat_context:
         :return:
         """
-        order_info = await self._order_provider.get_order_by_group_id(group_id=update.effective_chat.id)
+        order_info = await self._get_order(group_id=update.effective_chat.id, chat_context=chat_context)
         if not order_info:
             if order_info.status != OrderStatus.WAIT_FOR_PAYMENT:
                 return messages.OrderInfoNotFoundMessage.format(language=gina_resp.language)
@@ -298,14 +371,15 @@ class MessagesController:
         return messages.Message(text=gina_resp.reply)
 
     @distributed_trace()
-    async def on_cancel_order(self, update: Update, gina_resp: GinaResponse) -> messages.Message:
+    async def on_cancel_order(self, update: Update, gina_resp: GinaResponse, chat_context: ChatContext = None) -> messages.Message:
         """
 
         :param update:
         :param gina_resp:
+        :param chat_context:
         :return:
         """
-        order_info = await self._order_provider.get_order_by_group_id(group_id=update.effective_chat.id)
+        order_info = await self._get_order(group_id=update.effective_chat.id, chat_context=chat_context)
         if not order_info:
             return messages.OrderInfoNotFoundMessage.format(language=gina_resp.language)
         order = Order(
@@ -317,16 +391,18 @@ class MessagesController:
         return messages.Message(text=gina_resp.reply)
 
     @distributed_trace()
-    async def on_hurry(self, update: Update, gina_resp: GinaResponse) -> messages.Message:
+    async def on_hurry(self, update: Update, gina_resp: GinaResponse, chat_context: ChatContext = None) -> messages.Message:
         """
 
         :param update:
         :param gina_resp:
+        :param chat_context:
         :return:
         """
-        order_info = await self._order_provider.get_order_by_group_id(
+        order_info = await self._get_order(
             group_id=update.effective_chat.id,
-            status=OrderStatus.WAIT_FOR_PAYMENT_ACCOUNT
+            status=OrderStatus.WAIT_FOR_PAYMENT_ACCOUNT,
+            chat_context=chat_context
         )
         if not order_info:
             return messages.OrderInfoNotFoundMessage.format(language=gina_resp.language)
@@ -342,16 +418,17 @@ class MessagesController:
         return messages.Message(text=gina_resp.reply)
 
     @distributed_trace()
-    async def on_fallback(self, update: Update, gina_resp: GinaResponse) -> messages.Message:
+    async def on_fallback(self, update: Update, gina_resp: GinaResponse, chat_context: ChatContext = None) -> messages.Message:
         """
         on fallback
         :param update:
         :param gina_resp:
+        :param chat_context:
         :return:
         """
         text = update.message.text
         intent_to_pay = re.compile(r"查收|完成|到|Finish|付款|轉帳|Done")
-        order_info = await self._order_provider.get_order_by_group_id(group_id=update.effective_chat.id)
+        order_info = await self._get_order(group_id=update.effective_chat.id, chat_context=chat_context)
         if order_info.status == OrderStatus.WAIT_FOR_PAYMENT and intent_to_pay.search(text):
             order = Order(
                 id=order_info.id,
@@ -408,29 +485,32 @@ class MessagesController:
         self,
         message: str,
         group_id: int,
-        options: FormatOptions = None
+        options: FormatOptions = None,
+        chat_context: ChatContext = None
     ) -> str:
         """
         format message
         :param message:
         :param group_id:
         :param options:
+        :param chat_context:
         :return:
         """
         if not options:
             return message
         if options.customer_service:
-            message = await self._format_customer_service(message=message, group_id=group_id)
+            message = await self._format_customer_service(message=message, group_id=group_id, chat_context=chat_context)
         return message
 
-    async def _format_customer_service(self, message: str, group_id: int) -> str:
+    async def _format_customer_service(self, message: str, group_id: int, chat_context: ChatContext = None) -> str:
         """
 
         :param message:
         :param group_id:
+        :param chat_context:
         :return:
         """
-        customer_services = await self._telegram_account_provider.get_group_customer_services(group_id=group_id)
+        customer_services = await self._get_customer_services(group_id=group_id, chat_context=chat_context)
         mention_customer_services = []
         for customer_service in customer_services:
             user = User(
@@ -6,15 +6,16 @@ from starlette import status
 from app.exceptions.api_base import APIException
 from app.libs.decorators.sentry_tracer import distributed_trace
 from app.libs.logger import logger
-from app.providers import ExchangeRateProvider
-from app.serializers.v1.exchange_rate import UpdateExchangeRate, ExchangeRateResponse
+from app.providers import ExchangeRateProvider, PriceProvider
+from app.serializers.v1.exchange_rate import UpdateExchangeRate, ExchangeRateResponse, QuoteRequest, QuoteResponse, Quote
 
 
 class ExchangeRateHandler:
     """ExchangeRateHandler"""
 
-    def __init__(self, exchange_rate_provider: ExchangeRateProvider):
+    def __init__(self, exchange_rate_provider: ExchangeRateProvider, price_provider: PriceProvider):
         self.exchange_rate_provider = exchange_rate_provider
+        self.price_provider = price_provider
 
     @distributed_trace()
     async def get_exchange_rate(self, group_id: int) -> ExchangeRateResponse:
@@ -25,6 +26,20 @@ class ExchangeRateHandler:
         result = await self.exchange_rate_provider.get_exchange_rate(group_id=group_id)
         return ExchangeRateResponse(exchange_rates=result)
 
+    @distributed_trace()
+    async def get_quotes(self, model: QuoteRequest) -> QuoteResponse:
+        """
+        Get quotes
+        :return:
+        """
+        price_infos = await self.price_provider.get_price_infos(queries=model.quotes)
+        return QuoteResponse(
+            quotes=[
+                Quote(**query.model_dump(), price_info=price_info)
+                for query, price_info in zip(model.quotes, price_infos)
+            ]
+        )
+
     @distributed_trace()
     async def update_exchange_rate(self, model: UpdateExchangeRate):
         """
@@ -1,8 +1,13 @@
 """
 OrderHandler
 """
+from typing import Optional
 from uuid import UUID
 
+from starlette import status
+
+from app.exceptions.api_base import APIException
+from app.libs.database.keyset import InvalidCursorError, encode_cursor
 from app.libs.decorators.sentry_tracer import distributed_trace
 from app.providers import OrderProvider
 from app.serializers.v1.order import OrderDetail, OrderList
@@ -21,19 +26,28 @@ class OrderHandler:
     async def get_order_page(
         self,
         page_index: int = 0,
-        page_size: int = 10
+        page_size: int = 10,
+        cursor: Optional[str] = None
     ) -> OrderList:
         """
         get order by pages
         :param page_index:
         :param page_size:
+        :param cursor:
         :return:
         """
-        orders, total = await self._order_provider.get_order_page(
-            page_index=page_index,
-            page_size=page_size
-        )
-        return OrderList(orders=orders, total=total)
+        try:
+            orders, total = await self._order_provider.get_order_page(
+                page_index=page_index,
+                page_size=page_size,
+                cursor=cursor
+            )
+        except InvalidCursorError:
+            raise APIException(status_code=status.HTTP_400_BAD_REQUEST, message="Invalid Cursor")
+        next_cursor = None
+        if len(orders) == page_size:
+            next_cursor = encode_cursor(orders[-1].created_at, orders[-1].id)
+        return OrderList(orders=orders, total=total, next_cursor=next_cursor)
 
     @distributed_trace()
     async def get_order_by_id(self, order_id: UUID) -> OrderDetail:
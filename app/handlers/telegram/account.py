@@ -6,6 +6,7 @@ from telegram import Bot
 
 from app.exceptions.api_base import APIException
 from app.libs.consts.enums import BotType
+from app.libs.database.keyset import InvalidCursorError, encode_cursor
 from app.libs.decorators.sentry_tracer import distributed_trace
 from app.providers import TelegramAccountProvider, TelegramGroupTypeProvider
 from app.schemas.group_type import GroupTypeRelation
@@ -99,10 +100,17 @@ class TelegramAccountHandler:
         :param group_query:
         :return:
         """
-        groups, total = await self._telegram_account_provider.get_chat_groups(query=group_query)
+        try:
+            groups, total = await self._telegram_account_provider.get_chat_groups(query=group_query)
+        except InvalidCursorError:
+            raise APIException(status_code=status.HTTP_400_BAD_REQUEST, message="Invalid Cursor")
+        next_cursor = None
+        if len(groups) == group_query.page_size:
+            next_cursor = encode_cursor(groups[-1].id)
         return GroupPage(
             total=total,
-            groups=groups
+            groups=groups,
+            next_cursor=next_cursor
         )
 
     @distributed_trace()
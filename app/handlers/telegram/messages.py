@@ -1,28 +1,31 @@
 """
 TelegramMessageHandler
 """
-import traceback
 from datetime import datetime, timedelta
 from decimal import Decimal
+from functools import partial
+from typing import Optional
+from uuid import UUID
 
 import pytz
 import telegram
-from httpx import HTTPStatusError
 from starlette import status
 from telegram import Bot
 
 from app.exceptions.api_base import APIException
+from app.libs.broadcaster import BroadcastJob, broadcaster
 from app.libs.consts.enums import OrderStatus, BotType, MessageStatus, OperationType
-from app.libs.consts.messages import ConfirmPayMessage
+from app.libs.consts.messages import ConfirmPayMessage, OrderExpiredMessage
 from app.libs.decorators.sentry_tracer import distributed_trace
-from app.libs.logger import logger
+from app.libs.order_expiry import order_expiry
 from app.libs.utils.calculator import Calculator
 from app.providers import TelegramAccountProvider, OrderProvider, MessageProvider, VendorsBotProvider, ExchangeRateProvider, PriceProvider
 from app.schemas.broadcast_message import BroadcastMessage, BroadcastMessageHistory
-from app.schemas.order import Order
+from app.schemas.order import Order, ExpiredOrder
 from app.schemas.vendors_bot import VendorBotBroadcast, GetPaymentAccount
 from app.serializers.v1.telegram import (
     TelegramBroadcast,
+    BroadcastProgress,
     PaymentAccount,
     GroupPaymentAccountStatus,
     ConfirmPay,
@@ -50,40 +53,89 @@ class TelegramMessageHandler:
         self._vendors_bot_provider = vendors_bot_provider
 
     @distributed_trace()
-    async def broadcast_message(self, model: TelegramBroadcast):
+    async def broadcast_message(self, model: TelegramBroadcast) -> BroadcastProgress:
         """
-        broadcast message
+        broadcast message, the message is sent in the background
         :param model:
         :return:
         """
         message = BroadcastMessage(content=model.message, type=model.type)
         broadcast_message_id = await self._message_provider.create_message(message=message)
-        for chat_id in model.chat_id_list:
-            history = BroadcastMessageHistory(message_id=broadcast_message_id, chat_group_id=chat_id)
-            await self._message_provider.create_message_history(message_history=history)
-            try:
-                match model.type:
-                    case BotType.CUSTOMER:
-                        resp = await self._bot.send_message(chat_id=chat_id, text=model.message)
-                        history.telegram_message_id = resp.message_id
-                    case BotType.VENDORS:
-                        payload = VendorBotBroadcast(chat_id=chat_id, message=model.message)
-                        resp = await self._vendors_bot_provider.broadcast(payload=payload)
-                        history.telegram_message_id = resp.message_id
-            except telegram.error.BadRequest as exc:
-                history.status = MessageStatus.FAILED
-                history.telegram_error_description = exc.message
-            except HTTPStatusError as exc:
-                history.status = MessageStatus.FAILED
-                history.telegram_error_description = f"({exc.response.status_code}) {exc.response.text}"
-            except Exception as exc:
-                history.status = MessageStatus.FAILED
-                history.telegram_error_description = traceback.format_exc()
-                logger.error(exc)
-            else:
-                history.status = MessageStatus.SENT
-            finally:
-                await self._message_provider.update_message_history(message_history=history)
+        histories = [
+            BroadcastMessageHistory(message_id=broadcast_message_id, chat_group_id=chat_id)
+            for chat_id in dict.fromkeys(model.chat_id_list)
+        ]
+        await self._message_provider.create_message_histories(message_histories=histories)
+        job = broadcaster.start(
+            message_id=broadcast_message_id,
+            histories=histories,
+            send=partial(self._send_broadcast, model.type, model.message),
+            write=self._message_provider.update_message_histories
+        )
+        return BroadcastProgress(**job.progress())
+
+    @distributed_trace()
+    async def resume_broadcast_message(self, message_id: UUID) -> BroadcastProgress:
+        """
+        send a broadcast to the chats it was not sent to yet, e.g. after a restart
+        :param message_id:
+        :return:
+        """
+        job = broadcaster.get_job(message_id)
+        if job is not None and job.state == BroadcastJob.RUNNING:
+            return BroadcastProgress(**job.progress())
+        message = await self._message_provider.get_message(message_id=message_id)
+        if not message:
+            raise APIException(status_code=status.HTTP_404_NOT_FOUND, message="message not found")
+        histories = await self._message_provider.get_pending_message_histories(message_id=message_id)
+        job = broadcaster.start(
+            message_id=message_id,
+            histories=histories,
+            send=partial(self._send_broadcast, message.type, message.content),
+            write=self._message_provider.update_message_histories
+        )
+        return BroadcastProgress(**job.progress())
+
+    @distributed_trace()
+    async def get_broadcast_progress(self, message_id: UUID) -> BroadcastProgress:
+        """
+        progress of a broadcast, from its job in this process or from its histories
+        :param message_id:
+        :return:
+        """
+        job = broadcaster.get_job(message_id)
+        if job is not None:
+            return BroadcastProgress(**job.progress())
+        counts = await self._message_provider.count_message_histories(message_id=message_id)
+        if not counts:
+            raise APIException(status_code=status.HTTP_404_NOT_FOUND, message="message not found")
+        pending = counts.get(None, 0)
+        return BroadcastProgress(
+            message_id=message_id,
+            state=BroadcastJob.CANCELLED if pending else BroadcastJob.FINISHED,
+            total=sum(counts.values()),
+            sent=counts.get(MessageStatus.SENT, 0),
+            failed=counts.get(MessageStatus.FAILED, 0),
+            pending=pending
+        )
+
+    async def _send_broadcast(self, bot_type: BotType, text: str, chat_id: int) -> Optional[int]:
+        """
+        send a broadcast message to one chat
+        :param bot_type:
+        :param text:
+        :param chat_id:
+        :return: telegram message id
+        """
+        match bot_type:
+            case BotType.CUSTOMER:
+                resp = await self._bot.send_message(chat_id=chat_id, text=text)
+                return resp.message_id
+            case BotType.VENDORS:
+                payload = VendorBotBroadcast(chat_id=chat_id, message=text)
+                resp = await self._vendors_bot_provider.broadcast(payload=payload)
+                return resp.message_id
+        return None
 
     @distributed_trace()
     async def receive_payment_account(self, model: PaymentAccount):
@@ -111,6 +163,7 @@ class TelegramMessageHandler:
                 status=OrderStatus.WAIT_FOR_PAYMENT
             )
             await self._order_provider.update_order(order=order)
+            order_expiry.schedule(order_id=order.id, expiration_of_pay=order.expiration_of_pay)
         except telegram.error.BadRequest as e:
             raise APIException(status_code=status.HTTP_400_BAD_REQUEST, message=str(e))
         except Exception as e:
@@ -198,8 +251,25 @@ class TelegramMessageHandler:
                 done_at=datetime.now(tz=pytz.UTC)
             )
             await self._order_provider.update_order(order=order)
+            order_expiry.cancel(order_id=order.id)
         except telegram.error.BadRequest as e:
             raise APIException(status_code=status.HTTP_400_BAD_REQUEST, message=str(e))
         except Exception as e:
             raise APIException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, message=str(e))
         return resp_message.to_dict()
+
+    @distributed_trace()
+    async def notify_order_expired(self, order: ExpiredOrder) -> None:
+        """
+        tell the chat its order expired before it was paid
+        :param order:
+        :return:
+        """
+        message = OrderExpiredMessage.format(language=order.language, order_no=order.order_no)
+        await self._bot.send_message(
+            chat_id=order.group_id,
+            text=message.text,
+            parse_mode=message.parse_mode,
+            reply_to_message_id=order.message_id,
+            allow_sending_without_reply=True
+        )
@@ -10,6 +10,7 @@ from telegram import Update, ChatMemberUpdated, ChatMember, Chat, User
 from app.config import settings
 from app.context import CustomContext
 from app.libs.database import RedisPool
+from app.libs.database.write_behind import write_behind
 from app.libs.decorators.sentry_tracer import distributed_trace
 from app.libs.logger import logger
 from app.providers import TelegramAccountProvider
@@ -78,6 +79,13 @@ class TelegramBotBaseHandler:
         :param is_customer_service:
         :return:
         """
+        if write_behind.running:
+            await self._telegram_account_provider.queue_account_info(
+                account=account,
+                chat_group=chat_group,
+                is_customer_service=is_customer_service
+            )
+            return
         tasks = [
             self._telegram_account_provider.set_account(account=account),
             self._telegram_account_provider.set_group(chat_group=chat_group),
@@ -1,17 +1,20 @@
 """
 TelegramBotMessagesHandler
 """
-from typing import cast
+import asyncio
+import functools
+from typing import Optional, cast
 
 from telegram import Update
 from telegram.constants import ParseMode
 
 from app.config import settings
 from app.context import CustomContext
-from app.controllers import MessagesController
+from app.controllers import ChatContext, MessagesController
 from app.libs.consts.enums import GinaIntention
 from app.libs.database import RedisPool
 from app.libs.decorators.sentry_tracer import distributed_trace
+from app.libs.delayed_delivery import delayed_delivery
 from app.libs.logger import logger
 from app.providers import TelegramAccountProvider, GinaProvider, FileProvider
 from app.schemas.files import TelegramFile
@@ -55,6 +58,26 @@ class TelegramBotMessagesHandler(TelegramBotBaseHandler):
         :param message:
         :return:
         """
+        chat_id = update.effective_chat.id
+        if message.delay > 0:
+            # the update handler is not held while the reply waits
+            delayed_delivery.schedule(
+                delay=message.delay,
+                deliver=functools.partial(self._send, update=update, message=message),
+                key=chat_id
+            )
+            return
+        # a delayed reply of an earlier update goes out first
+        await delayed_delivery.wait(chat_id)
+        await self._send(update=update, message=message)
+
+    @staticmethod
+    async def _send(update: Update, message: Message) -> None:
+        """
+        :param update:
+        :param message:
+        :return:
+        """
         match message.parse_mode:
             case ParseMode.MARKDOWN:
                 await update.effective_message.reply_markdown(
@@ -125,42 +148,94 @@ class TelegramBotMessagesHandler(TelegramBotBaseHandler):
                 bot_type=settings.TELEGRAM_BOT_TYPE
             )
         )
-        await update.effective_chat.send_chat_action("typing")
-        telegram_file = None
-        if update.message.document or update.message.photo:
-            telegram_file = await self.pre_process_files(update=update, context=context)
+        chat_context = None
+        if settings.TELEGRAM_PREFETCH_CHAT_CONTEXT:
+            # the lookups of the reply run while gina classifies the message
+            chat_context = self._messages_controller.chat_context(group_id=update.effective_chat.id).prefetch()
+        try:
+            message = await self._reply_to(update=update, context=context, chat_context=chat_context)
+        finally:
+            if chat_context is not None:
+                chat_context.close()
+        if message:
+            await self.reply_message(update=update, message=message)
 
-        result = await self._gina_provider.telegram_messages(update=update, telegram_file=telegram_file)
+    async def _reply_to(
+        self,
+        update: Update,
+        context: CustomContext,
+        chat_context: Optional[ChatContext]
+    ) -> Optional[Message]:
+        """
+        classify a message with gina and build the reply
+        :param update:
+        :param context:
+        :param chat_context:
+        :return: None when gina failed and the apology was sent
+        """
+        typing = asyncio.create_task(update.effective_chat.send_chat_action("typing"))
+        try:
+            telegram_file = None
+            if update.message.document or update.message.photo:
+                telegram_file = await self.pre_process_files(update=update, context=context)
+            result = await self._gina_provider.telegram_messages(update=update, telegram_file=telegram_file)
+        finally:
+            await typing
+        # the replies below follow a delayed reply of an earlier update of the chat
+        await delayed_delivery.wait(update.effective_chat.id)
         if not result:
             await update.effective_message.reply_text(text="Sorry, There is something wrong. Please try again later. 🙇🏼‍")
-            return
+            return None
 
         # [Flow] exchange rate process
         try:
             match result.intention:
                 case GinaIntention.EXCHANGE_RATE:
-                    message = await self._messages_controller.on_exchange_rate(update=update, gina_resp=result)
+                    message = await self._messages_controller.on_exchange_rate(
+                        update=update,
+                        gina_resp=result,
+                        chat_context=chat_context
+                    )
                 case GinaIntention.SWAP:
-                    message = await self._messages_controller.on_swap(update=update, gina_resp=result)
+                    message = await self._messages_controller.on_swap(update=update, gina_resp=result, chat_context=chat_context)
                 case GinaIntention.HUMAN_CUSTOMER_SERVICE:
-                    message = await self._messages_controller.on_human_customer_service(update=update, gina_resp=result)
+                    message = await self._messages_controller.on_human_customer_service(
+                        update=update,
+                        gina_resp=result,
+                        chat_context=chat_context
+                    )
                 case GinaIntention.GET_ACCOUNT:
-                    message = await self._messages_controller.on_get_account(update=update, gina_resp=result)
+                    message = await self._messages_controller.on_get_account(
+                        update=update,
+                        gina_resp=result,
+                        chat_context=chat_context
+                    )
                 case GinaIntention.RECEIPT:
-                    message = await self._messages_controller.on_confirm_payment(update=update, gina_resp=result)
+                    message = await self._messages_controller.on_confirm_payment(
+                        update=update,
+                        gina_resp=result,
+                        chat_context=chat_context
+                    )
                 case GinaIntention.PAYMENT_CHECK:
                     message = await self._messages_controller.on_payment_check(update=update, gina_resp=result)
                 case GinaIntention.CANCEL_ORDER:
-                    message = await self._messages_controller.on_cancel_order(update=update, gina_resp=result)
+                    message = await self._messages_controller.on_cancel_order(
+                        update=update,
+                        gina_resp=result,
+                        chat_context=chat_context
+                    )
                 case GinaIntention.HURRY:
-                    message = await self._messages_controller.on_hurry(update=update, gina_resp=result)
+                    message = await self._messages_controller.on_hurry(update=update, gina_resp=result, chat_context=chat_context)
                 case _:
-                    message = await self._messages_controller.on_fallback(update=update, gina_resp=result)
+                    message = await self._messages_controller.on_fallback(
+                        update=update,
+                        gina_resp=result,
+                        chat_context=chat_context
+                    )
         except Exception as e:
             logger.exception(e)
             message = await self._messages_controller.on_exception(update=update, gina_resp=result)
-
-        await self.reply_message(update=update, message=message)
+        return message
 
     @distributed_trace()
     async def order_confirmation(self, update: Update, context: CustomContext) -> None:
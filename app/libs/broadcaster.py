@@ -0,0 +1,327 @@
+"""
+Broadcast engine
+"""
+import asyncio
+import time
+import traceback
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+from uuid import UUID
+
+import telegram
+from httpx import HTTPStatusError
+
+from app.config import settings
+from app.libs.consts.enums import MessageStatus
+from app.libs.logger import logger
+from app.schemas.broadcast_message import BroadcastMessageHistory
+
+__all__ = ['TokenBucket', 'BroadcastJob', 'Broadcaster', 'broadcaster']
+
+# chat id -> telegram message id of the sent message
+SendMessage = Callable[[int], Awaitable[Optional[int]]]
+WriteHistories = Callable[[List[BroadcastMessageHistory]], Awaitable[None]]
+
+
+class TokenBucket:
+    """
+    Token bucket of `rate` tokens a second holding at most `capacity`, pause blocks it entirely
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def full(self) -> bool:
+        """
+        :return:
+        """
+        self._refill(time.monotonic())
+        return self._tokens >= self.capacity
+
+    def pause(self, seconds: float):
+        """
+        hand out no token for seconds, e.g. after telegram answered RetryAfter
+        :param seconds:
+        :return:
+        """
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        """
+        wait for a token and take it
+        :return:
+        """
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._blocked_until - now
+            if wait <= 0 and self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep(max(wait, (1 - self._tokens) / self.rate))
+
+
+class BroadcastJob:
+    """Progress of the broadcast of one message"""
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    CANCELLED = 'cancelled'
+    FAILED = 'failed'
+
+    def __init__(self, message_id: UUID, total: int):
+        self.message_id = message_id
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.state = self.RUNNING
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """
+        :return:
+        """
+        return self.total - self.sent - self.failed
+
+    def progress(self) -> dict:
+        """
+        :return:
+        """
+        end = self.finished_at or time.time()
+        return {
+            'message_id': self.message_id,
+            'state': self.state,
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'pending': self.pending,
+            'retried': self.retried,
+            'elapsed': round(end - self.started_at, 3),
+        }
+
+
+class Broadcaster:
+    """
+    Sends a message to many chats from `workers` tasks at once, within the telegram rate limits:
+    `rate` messages a second for the bot and `chat_rate_per_minute` for a chat, both token buckets
+    shared by every broadcast of the process. A RetryAfter pauses the bot-wide bucket for the time
+    telegram asked for and sends again, at most max_attempts times a chat.
+    Histories are written batch_size at a time, a chat whose history is still pending is sent
+    again when its broadcast is resumed.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        workers: int = 16,
+        rate: float = 25,
+        chat_rate_per_minute: float = 20,
+        max_attempts: int = 3,
+        batch_size: int = 100,
+        max_chat_buckets: int = 10_000,
+        max_jobs: int = 100
+    ):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.chat_rate_per_minute = chat_rate_per_minute
+        self.max_chat_buckets = max_chat_buckets
+        self.max_jobs = max_jobs
+        self.bucket = TokenBucket(rate=rate, capacity=max(1.0, rate))
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._jobs: OrderedDict[UUID, BroadcastJob] = OrderedDict()
+
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        """
+        :param chat_id:
+        :return:
+        """
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.max_chat_buckets:
+                # a full bucket is the same as a new one
+                self._chat_buckets = {key: value for key, value in self._chat_buckets.items() if not value.full}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(
+                rate=self.chat_rate_per_minute / 60,
+                capacity=max(1.0, self.chat_rate_per_minute)
+            )
+        return bucket
+
+    def get_job(self, message_id: UUID) -> Optional[BroadcastJob]:
+        """
+        :param message_id:
+        :return:
+        """
+        return self._jobs.get(message_id)
+
+    def start(
+        self,
+        message_id: UUID,
+        histories: List[BroadcastMessageHistory],
+        send: SendMessage,
+        write: WriteHistories
+    ) -> BroadcastJob:
+        """
+        broadcast in the background, a broadcast of the message already running is returned as is
+        :param message_id:
+        :param histories: pending histories of the chats to send to
+        :param send:
+        :param write: persists the status of sent and failed histories
+        :return:
+        """
+        job = self._jobs.get(message_id)
+        if job is not None and job.state == BroadcastJob.RUNNING:
+            return job
+        job = BroadcastJob(message_id=message_id, total=len(histories))
+        self._jobs[message_id] = job
+        self._jobs.move_to_end(message_id)
+        while len(self._jobs) > self.max_jobs:
+            oldest = next(iter(self._jobs.values()))
+            if oldest.state == BroadcastJob.RUNNING:
+                break
+            self._jobs.popitem(last=False)
+        job.task = asyncio.create_task(self.run(job, histories, send, write))
+        return job
+
+    async def wait(self, message_id: UUID) -> Optional[BroadcastJob]:
+        """
+        :param message_id:
+        :return: the job after it ended
+        """
+        job = self._jobs.get(message_id)
+        if job is not None and job.task is not None:
+            await asyncio.wait([job.task])
+        return job
+
+    async def run(
+        self,
+        job: BroadcastJob,
+        histories: List[BroadcastMessageHistory],
+        send: SendMessage,
+        write: WriteHistories
+    ):
+        """
+        :param job:
+        :param histories:
+        :param send:
+        :param write:
+        :return:
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for history in histories:
+            queue.put_nowait(history)
+        done: List[BroadcastMessageHistory] = []
+        write_lock = asyncio.Lock()
+
+        async def flush(size: int):
+            if size > 1 and write_lock.locked():
+                # the running write takes these next time
+                return
+            async with write_lock:
+                if len(done) < max(size, 1):
+                    return
+                batch = done[:]
+                del done[:]
+                try:
+                    await write(batch)
+                except BaseException:
+                    done[:0] = batch
+                    raise
+
+        async def worker():
+            while not queue.empty():
+                history = queue.get_nowait()
+                await self._deliver(job, history, send)
+                done.append(history)
+                if history.status == MessageStatus.SENT:
+                    job.sent += 1
+                else:
+                    job.failed += 1
+                await flush(self.batch_size)
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.workers, len(histories)))]
+        try:
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            job.state = BroadcastJob.CANCELLED
+            raise
+        except Exception as e:  # pylint: disable=broad-except
+            job.state = BroadcastJob.FAILED
+            logger.exception(e)
+        else:
+            job.state = BroadcastJob.FINISHED
+        finally:
+            for task in workers:
+                task.cancel()
+            try:
+                # what was sent is recorded, whatever stopped the broadcast
+                await flush(1)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.exception(e)
+            job.finished_at = time.time()
+
+    async def _deliver(self, job: BroadcastJob, history: BroadcastMessageHistory, send: SendMessage):
+        for attempt in range(self.max_attempts):
+            await self.bucket.acquire()
+            await self.chat_bucket(history.chat_group_id).acquire()
+            try:
+                history.telegram_message_id = await send(history.chat_group_id)
+            except telegram.error.RetryAfter as exc:
+                self.bucket.pause(_seconds(exc.retry_after))
+                if attempt + 1 < self.max_attempts:
+                    job.retried += 1
+                    continue
+                history.status = MessageStatus.FAILED
+                history.telegram_error_description = exc.message
+            except telegram.error.BadRequest as exc:
+                history.status = MessageStatus.FAILED
+                history.telegram_error_description = exc.message
+            except HTTPStatusError as exc:
+                history.status = MessageStatus.FAILED
+                history.telegram_error_description = f"({exc.response.status_code}) {exc.response.text}"
+            except Exception as exc:  # pylint: disable=broad-except
+                history.status = MessageStatus.FAILED
+                history.telegram_error_description = traceback.format_exc()
+                logger.error(exc)
+            else:
+                history.status = MessageStatus.SENT
+            return
+
+    async def stop(self):
+        """
+        cancel the running broadcasts, their pending chats are sent when they are resumed
+        :return:
+        """
+        tasks = [job.task for job in self._jobs.values() if job.task is not None and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+
+
+def _seconds(retry_after: Union[int, float, timedelta]) -> float:
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+broadcaster = Broadcaster(
+    workers=settings.BROADCAST_WORKERS,
+    rate=settings.BROADCAST_RATE,
+    chat_rate_per_minute=settings.BROADCAST_CHAT_RATE_PER_MINUTE,
+    max_attempts=settings.BROADCAST_MAX_ATTEMPTS,
+    batch_size=settings.BROADCAST_BATCH_SIZE
+)
@@ -24,6 +24,7 @@ class Message(BaseModel):
     text: str
     parse_mode: Optional[ParseMode] = Field(default=None)
     reply_markup: Optional[ReplyMarkup] = None
+    delay: float = Field(default=0, description="Seconds to wait before the message is sent")
 
 
 class MarkupButton(BaseModel):
@@ -201,3 +202,12 @@ class ConfirmPayMessage(MessagesBase):
         Language.EN_US: "Your order has been successfully paid",
     }
     parse_mode = ParseMode.MARKDOWN_V2
+
+
+class OrderExpiredMessage(MessagesBase):
+    """OrderExpiredMessage"""
+    message = {
+        Language.ZH_TW: "您的訂單 `{order_no}` 已超過付款時間，訂單已失效",
+        Language.EN_US: "Your order `{order_no}` was not paid in time and has expired",
+    }
+    parse_mode = ParseMode.MARKDOWN_V2
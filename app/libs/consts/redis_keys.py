@@ -40,3 +40,45 @@ def get_user_otp_secret_key(user_id: UUID) -> str:
     :return:
     """
     return get_redis_key(f"user:otp_secret:{str(user_id)}")
+
+
+def get_group_exchange_rate_key(group_id: int) -> str:
+    """
+    Get the exchange rate key of a group
+    :param group_id:
+    :return:
+    """
+    return get_redis_key(f"exchange_rate:group:{group_id}")
+
+
+def get_all_exchange_rate_key() -> str:
+    """
+    Get the exchange rate key of all groups
+    :return:
+    """
+    return get_redis_key("exchange_rate:all")
+
+
+def get_optimal_exchange_rate_key() -> str:
+    """
+    Get the optimal exchange rate key, a hash of currency and operation type
+    :return:
+    """
+    return get_redis_key("exchange_rate:optimal")
+
+
+def get_handling_fee_table_key() -> str:
+    """
+    Get the handling fee table key, only published to invalidate the table of every process
+    :return:
+    """
+    return get_redis_key("handling_fee:table")
+
+
+def get_chat_state_key(group_id: int) -> str:
+    """
+    Get the key of the open order and pending cart of a chat
+    :param group_id:
+    :return:
+    """
+    return get_redis_key(f"chat_state:{group_id}")
@@ -4,6 +4,7 @@ Top-level package for database.
 from .aio_orm import Session
 from .aio_pg import create_pool, Keys, create_connection
 from .aio_redis import RedisPool
+from .stats import database_stats
 
 __all__ = [
     "create_pool",
@@ -11,4 +12,5 @@ __all__ = [
     "Session",
     "RedisPool",
     "Keys",
+    "database_stats",
 ]
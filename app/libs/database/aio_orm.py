@@ -2,9 +2,10 @@ import asyncio
 import inspect
 import re
 import uuid
+import weakref
 from datetime import datetime, date
 from enum import Enum, StrEnum
-from typing import List, Callable, overload, Tuple, Union, TypeVar, Type, Any, Optional
+from typing import List, Callable, overload, Tuple, Union, TypeVar, Type, Any, Optional, NamedTuple, Sequence, AsyncIterator
 
 import asyncpg
 import sqlalchemy as sa
@@ -16,19 +17,34 @@ from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.dialects.postgresql.dml import Insert as PgInsert
 from sqlalchemy.dialects.postgresql.psycopg2 import PGCompiler_psycopg2
 from sqlalchemy.orm import Query
-from sqlalchemy.sql import FromClause
+from sqlalchemy.sql import FromClause, selectable
 from sqlalchemy.sql.dml import Update, Delete, Insert
 from sqlalchemy.sql.selectable import ScalarSelect
 
 from app.config import settings
 from app.libs.database.aio_pg import create_connection, create_pool
+from app.libs.database.keyset import decode_cursor
 from app.libs.database.orm import Base, ModelBase
+from app.libs.database.prepared_statements import PreparedStatementCache
+from app.libs.database.replica import REPLICA_ERRORS, ReplicaSet, reads_on_primary
+from app.libs.database.row_mapper import RowMapper
+from app.libs.database.statement_cache import CompiledStatement, StatementCache, statement_shape
 from app.libs.logger import logger
 from app.libs.shared import Converter, Assert, validator
 
 dialect = postgresql.dialect()
-
-__all__ = ['ISession', 'Session']
+statement_cache = StatementCache(maxsize=settings.SQL_STATEMENT_CACHE_SIZE)
+prepared_statement_cache = PreparedStatementCache(
+    enabled=settings.DATABASE_PREPARED_STATEMENTS,
+    maxsize=settings.DATABASE_PREPARED_STATEMENT_CACHE_SIZE
+)
+row_mapper = RowMapper(enabled=settings.SQL_ROW_MAPPER)
+replicas = ReplicaSet(
+    max_staleness=settings.DATABASE_REPLICA_MAX_STALENESS,
+    lag_check_interval=settings.DATABASE_REPLICA_LAG_CHECK_INTERVAL
+)
+
+__all__ = ['ISession', 'Session', 'UpsertResult']
 
 T = TypeVar('T')
 
@@ -40,12 +56,40 @@ class FetchMethod(StrEnum):
     FETCH = 'fetch'
     FETCH_VAL = 'fetch_val'
     FETCH_ROW = 'fetch_row'
+    FETCH_PAGE = 'fetch_page'
+    FETCH_VALS = 'fetch_vals'
+
+
+# label of the window count added by fetchpages
+PAGE_TOTAL = '__page_total__'
+
+_SELECT_SQL = re.compile(r'^\s*select\b', re.IGNORECASE)
+_LOCKING_SQL = re.compile(r'\bfor\s+(no\s+key\s+update|update|key\s+share|share)\b', re.IGNORECASE)
+
+
+class UpsertResult(NamedTuple):
+    """Rows inserted and updated by Session.bulk_upsert"""
+    inserted: int
+    updated: int
 
 
 def _format_value(value):
     return Converter.format_value(value)
 
 
+def _is_read_only(statement) -> bool:
+    """
+    the statement can run on a replica, row locks and data-modifying statements cannot
+    :param statement:
+    :return:
+    """
+    if isinstance(statement, str):
+        return bool(_SELECT_SQL.match(statement)) and not _LOCKING_SQL.search(statement)
+    if isinstance(statement, (selectable.Select, selectable.CompoundSelect)):
+        return getattr(statement, '_for_update_arg', None) is None
+    return False
+
+
 def _format_dict(item, as_model: Type[BaseModel] = None):
     if item is None:
         return item
@@ -61,6 +105,12 @@ def _format_dict(item, as_model: Type[BaseModel] = None):
         return data
 
 
+def _format_rows(rows, as_model: Type[BaseModel] = None) -> list:
+    if row_mapper.enabled:
+        return row_mapper.map(rows, as_model=as_model)
+    return [_format_dict(item=item, as_model=as_model) for item in rows]
+
+
 def _format_where(clauses: tuple) -> tuple:
     Assert.is_not_null(clauses, 'clauses')
     if len(clauses) > 2:
@@ -76,6 +126,26 @@ def _format_where(clauses: tuple) -> tuple:
     return whereclause
 
 
+def _last_per_key(records: Sequence[tuple], columns: Sequence[str], key_cols: Sequence[str]) -> Sequence[tuple]:
+    """
+    keep the last of the records sharing key_cols, records with a NULL key never conflict and are all kept
+    :param records:
+    :param columns:
+    :param key_cols:
+    :return:
+    """
+    if not all(column in columns for column in key_cols):
+        return records
+    indexes = [list(columns).index(column) for column in key_cols]
+    last = {}
+    for position, record in enumerate(records):
+        key = tuple(record[index] for index in indexes)
+        last[position if None in key else key] = record
+    if len(last) == len(records):
+        return records
+    return list(last.values())
+
+
 class _Insert:
     def __init__(self, insert: PgInsert, session: 'Session'):
         self._insert = insert
@@ -347,6 +417,26 @@ class _Select:
         self._select = self._select.having(having_clause)
         return self
 
+    def after(self, cursor: Optional[str], *columns, descending: bool = False) -> '_Select':
+        """
+        keyset pagination, order by the columns and keep the rows after the cursor
+        :param cursor: encode_cursor of the columns on the last row of the previous page, None for the first page
+        :param columns: keyset columns, the last one must be unique
+        :param descending:
+        :raise InvalidCursorError:
+        :return:
+        :rtype:_Select
+        """
+        direction = sa.desc if descending else sa.asc
+        self._select = self._select.order_by(*[direction(column) for column in columns])
+        if cursor is None:
+            return self
+        values = decode_cursor(cursor, *columns)
+        keys = sa.tuple_(*columns)
+        bounds = sa.tuple_(*[sa.literal(value, column.type) for column, value in zip(columns, values)])
+        self._select = self._select.filter(keys < bounds if descending else keys > bounds)
+        return self
+
     def offset(self, offset: int):
         """
         :param offset:
@@ -394,10 +484,36 @@ class _Select:
         """
         return await self._session.fetchgroup(self._select.statement, groupby=groupby, as_model=as_model)
 
-    async def fetchpages(self, no_order_by: bool = True, as_model: Type[BaseModel] = None) -> Tuple[List[T], int]:
+    async def fetchpages(
+        self,
+        no_order_by: bool = True,
+        as_model: Type[BaseModel] = None,
+        window_count: bool = None
+    ) -> Tuple[List[T], int]:
         """
         :param as_model:
         :param no_order_by:
+        :param window_count: count the total with count(*) OVER() in the page query,
+        defaults to settings.SQL_WINDOW_COUNT_PAGES
+        :return:
+        """
+        if window_count is None:
+            window_count = settings.SQL_WINDOW_COUNT_PAGES
+        # the window is evaluated before DISTINCT, so it would count duplicates
+        if window_count and not self._select._distinct:
+            select = self._select.add_columns(sa.func.count().over().label(PAGE_TOTAL))
+            data, count = await self._session.fetchpage(select.statement, as_model=as_model)
+            if count is not None or not self._select._offset:
+                return data, count or 0
+            # the page is past the end, only a separate count knows the total
+            return data, await self._count(no_order_by)
+        count = await self._count(no_order_by)
+        data = await self._session.fetch(self._select.statement, as_model=as_model)
+        return data, count
+
+    async def _count(self, no_order_by: bool = True) -> int:
+        """
+        :param no_order_by:
         :return:
         """
         counter = self._select._clone()
@@ -406,9 +522,16 @@ class _Select:
         if no_order_by:
             counter._order_by = None
         counter = counter.from_self(sa.func.count(sa.literal_column("*")))
-        count = await self._session.fetchval(counter.statement)
-        data = await self._session.fetch(self._select.statement, as_model=as_model)
-        return data, count
+        return await self._session.fetchval(counter.statement)
+
+    async def stream(self, batch_size: int = 1000, as_model: Type[BaseModel] = None) -> AsyncIterator[T]:
+        """
+        :param batch_size: rows fetched from the server-side cursor at a time
+        :param as_model:
+        :return:
+        """
+        async for item in self._session.stream(self._select.statement, batch_size=batch_size, as_model=as_model):
+            yield item
 
     async def fetchdict(self, key: str, value: str = None, as_model: Type[BaseModel] = None) -> dict:
         """
@@ -490,6 +613,36 @@ def convert_literal_value(value):
     return f"""'{value}'"""
 
 
+def _literal_sql(sql: str, params) -> str:
+    index = 1
+    for p in params:
+        sql = re.sub(
+            fr'\${index}(\D:?)', fr"{convert_literal_value(p)}\g<1>",
+            sql
+        )
+        index += 1
+    return sql
+
+
+def _bind_positions(compiled: PGCompiler_psycopg2, names: List[str], binds: list) -> Optional[Tuple[int, ...]]:
+    """
+    position of each compiled parameter in the bind list of the statement shape,
+    None when the compiler produced a parameter the shape does not know about
+    :param compiled:
+    :param names:
+    :param binds:
+    :return:
+    """
+    walk_order = {id(bind): position for position, bind in enumerate(binds)}
+    positions = []
+    for name in names:
+        position = walk_order.get(id(compiled.binds.get(name)))
+        if position is None:
+            return None
+        positions.append(position)
+    return tuple(positions)
+
+
 def exec_default(default):
     if default is None:
         return None
@@ -604,31 +757,121 @@ class ISession:
         pass
 
 
+class _SessionState:
+    """Connection and transaction owned by one session scope"""
+
+    def __init__(self):
+        self.conn: Optional[asyncpg.connection.Connection] = None
+        self.tx: Optional[asyncpg.connection.transaction.Transaction] = None
+        self.is_closed = False
+        self.locker = asyncio.Lock()
+        # reads stay on the primary until this loop time after a write
+        self.primary_until = 0.0
+
+
 class Session(ISession):
     def __init__(
         self,
         timeout: float = None,
         echo: bool = None,
         loop: asyncio.AbstractEventLoop = None,
-        use_poll: bool = None
+        use_poll: bool = None,
+        concurrent: bool = None,
+        use_replica: bool = None,
+        max_staleness: float = None
     ):
+        """
+        :param timeout:
+        :param echo:
+        :param loop:
+        :param use_poll:
+        :param concurrent: lease one pooled connection per asyncio task instead of sharing
+            a single locked connection, defaults: settings.DATABASE_CONCURRENT_SESSION
+        :param use_replica: send reads outside a transaction to a replica, defaults: settings.DATABASE_REPLICA_READS
+        :param max_staleness: seconds of replication lag reads tolerate, defaults: settings.DATABASE_REPLICA_MAX_STALENESS
+        """
         if use_poll is None:
             self._use_pool = settings.DATABASE_POOL
         else:
             self._use_pool = use_poll
-        self._tx: Optional[asyncpg.connection.transaction.Transaction] = None
+        if concurrent is None:
+            concurrent = settings.DATABASE_CONCURRENT_SESSION
+        self._concurrent = concurrent and self._use_pool
+        if use_replica is None:
+            use_replica = settings.DATABASE_REPLICA_READS
+        self._use_replica = use_replica and self._use_pool
+        self._max_staleness = max_staleness
         self._pool: Optional[asyncpg.pool.Pool] = None
-        self._conn: Optional[asyncpg.connection.Connection] = None
+        self._shared_state = _SessionState()
+        self._task_states: weakref.WeakKeyDictionary[asyncio.Task, _SessionState] = weakref.WeakKeyDictionary()
         self._timeout = timeout
         if echo is None:
             echo = settings.SQL_ECHO
         self._echo = echo
-        self._is_closed = False
         self._loop = loop or asyncio.get_event_loop()
-        self._locker = asyncio.Lock()
         self._retry_count = 0
         self._isolation = 'read_committed'
 
+    def _state(self) -> _SessionState:
+        """
+        state of the current scope, each asyncio task owns its own state in concurrent mode
+        :return:
+        """
+        if not self._concurrent:
+            return self._shared_state
+        task = asyncio.current_task()
+        if task is None:
+            return self._shared_state
+        state = self._task_states.get(task)
+        if state is None:
+            state = _SessionState()
+            self._task_states[task] = state
+            task.add_done_callback(self._release_task_state)
+        return state
+
+    def _release_task_state(self, task: asyncio.Task):
+        """
+        give back a connection the task forgot to close
+        :param task:
+        :return:
+        """
+        state = self._task_states.pop(task, None)
+        if state is None or state.conn is None or self._pool is None:
+            return
+        conn, state.conn, state.tx = state.conn, None, None
+        try:
+            self._loop.create_task(self._pool.release(conn))
+        except RuntimeError as e:
+            logger.warning(f'Failed to release the connection of a finished task ({e})')
+
+    @property
+    def _conn(self) -> Optional[asyncpg.connection.Connection]:
+        return self._state().conn
+
+    @_conn.setter
+    def _conn(self, value: Optional[asyncpg.connection.Connection]):
+        self._state().conn = value
+
+    @property
+    def _tx(self) -> Optional[asyncpg.connection.transaction.Transaction]:
+        return self._state().tx
+
+    @_tx.setter
+    def _tx(self, value: Optional[asyncpg.connection.transaction.Transaction]):
+        self._state().tx = value
+
+    @property
+    def _is_closed(self) -> bool:
+        return self._state().is_closed
+
+    @_is_closed.setter
+    def _is_closed(self, value: bool):
+        self._state().is_closed = value
+
+    @property
+    def _locker(self) -> asyncio.Lock:
+        return self._state().locker
+
     def set_isolation(self, isolation: str):
         """
         :param isolation: defaults: read_committed
@@ -657,7 +900,7 @@ class Session(ISession):
                 if self._pool is None:
                     self._pool = await create_pool(command_timeout=self._timeout)
                 if self._conn is None or self._conn.is_closed():
-                    self._conn = await self._pool.acquire(timeout=60)
+                    self._conn = await self._pool.acquire(timeout=settings.DATABASE_POOL_ACQUIRE_TIMEOUT)
             else:
                 if self._conn is None or self._conn.is_closed():
                     self._conn = await create_connection(
@@ -687,36 +930,50 @@ class Session(ISession):
             sql = statement
             raw_sql = sql
             if self._echo and params:
-                index = 1
-                for p in params:
-                    raw_sql = re.sub(
-                        fr'\${index}(\D:?)', fr"{convert_literal_value(p)}\g<1>",
-                        raw_sql
-                    )
-                    index += 1
+                raw_sql = _literal_sql(raw_sql, params)
         else:
-            result: PGCompiler_psycopg2 = statement.compile(dialect=postgresql.dialect())
-            sql = str(result)
-            raw_sql = sql
-            index = 1
-            params = []
             is_update = isinstance(statement, Update)
             is_insert = isinstance(statement, Insert)
-            if result.params:
-                data = result.params.copy()
-                if is_update or is_insert:
-                    validate(
-                        columns=statement.table.columns,
-                        data=data,
-                        is_update=is_update,
-                        is_insert=is_insert
-                    )
-                for name, value in data.items():
-                    sql = sql.replace(f'%({name})s', f'${index}')
-                    if self._echo:
-                        raw_sql = raw_sql.replace(f'%({name})s', convert_literal_value(value))
-                    params.append(value)
-                    index += 1
+            shape = None
+            compiled = None
+            if statement_cache.enabled and not (is_update or is_insert):
+                shape = statement_shape(statement)
+                if shape is None:
+                    statement_cache.uncacheable += 1
+                else:
+                    compiled = statement_cache.get(shape[0])
+            if compiled is not None:
+                binds = shape[1]
+                sql = compiled.sql
+                params = [binds[position].effective_value for position in compiled.positions]
+                raw_sql = _literal_sql(sql, params) if self._echo else sql
+            else:
+                result: PGCompiler_psycopg2 = statement.compile(dialect=postgresql.dialect())
+                sql = str(result)
+                raw_sql = sql
+                index = 1
+                params = []
+                names = []
+                if result.params:
+                    data = result.params.copy()
+                    if is_update or is_insert:
+                        validate(
+                            columns=statement.table.columns,
+                            data=data,
+                            is_update=is_update,
+                            is_insert=is_insert
+                        )
+                    for name, value in data.items():
+                        sql = sql.replace(f'%({name})s', f'${index}')
+                        if self._echo:
+                            raw_sql = raw_sql.replace(f'%({name})s', convert_literal_value(value))
+                        params.append(value)
+                        names.append(name)
+                        index += 1
+                if shape is not None:
+                    positions = _bind_positions(result, names, shape[1])
+                    if positions is not None:
+                        statement_cache.put(shape[0], CompiledStatement(sql=sql, positions=positions))
         if append_statement:
             sql += append_statement
             raw_sql += append_statement
@@ -745,6 +1002,35 @@ class Session(ISession):
         finally:
             self._locker.release()
 
+    async def execute_returning(
+        self,
+        statement,
+        *params,
+        timeout: float = None,
+        as_model: Type[BaseModel] = None
+    ) -> List[T]:
+        """
+        run a data-modifying statement with RETURNING in the session transaction, unlike fetch it
+        never goes to a replica or through the prepared statements of the read path
+        :param statement:
+        :param params:
+        :param timeout:
+        :param as_model:
+        :return: the rows returned
+        """
+        try:
+            await self._locker.acquire()
+            await self._ensure_connection(False)
+            await self._ensure_transaction(False)
+            sql, params = self._format_statement(statement, None, *params)
+            rows = await self._conn.fetch(sql, *params, timeout=timeout) or []
+            return _format_rows(rows, as_model=as_model)
+        except Exception:
+            await self.rollback(False)
+            raise
+        finally:
+            self._locker.release()
+
     def insert(self, table: TableTypes):
         return _Insert(PgInsert(table), self)
 
@@ -813,6 +1099,66 @@ class Session(ISession):
     async def fetchrow(self, statement, *params, timeout: float = None, as_model: Type[BaseModel] = None):
         return await self._fetch(FetchMethod.FETCH_ROW, statement, params, timeout=timeout, as_model=as_model)
 
+    async def fetchpage(
+        self,
+        statement,
+        *params,
+        timeout: float = None,
+        as_model: Type[BaseModel] = None
+    ) -> Tuple[List[T], Optional[int]]:
+        """
+        rows of a statement selecting a PAGE_TOTAL window count, and that total
+        :param statement:
+        :param params:
+        :param timeout:
+        :param as_model:
+        :return: total is None when the page is empty
+        """
+        return await self._fetch(FetchMethod.FETCH_PAGE, statement, params, timeout=timeout, as_model=as_model)
+
+    async def stream(
+        self,
+        statement,
+        *params,
+        batch_size: int = 1000,
+        timeout: float = None,
+        as_model: Type[BaseModel] = None
+    ) -> AsyncIterator[T]:
+        """
+        iterate the rows through a server-side cursor in the session transaction,
+        at most batch_size rows are held in memory at a time
+        :param statement:
+        :param params:
+        :param batch_size:
+        :param timeout:
+        :param as_model:
+        :return:
+        """
+        try:
+            await self._locker.acquire()
+            sql, params = self._format_statement(statement, None, *params)
+            await self._ensure_connection(False)
+            await self._ensure_transaction(False)
+            cursor = await self._conn.cursor(sql, *params, timeout=timeout)
+        except Exception:
+            await self.rollback(False)
+            raise
+        finally:
+            self._locker.release()
+        while True:
+            try:
+                await self._locker.acquire()
+                rows = await cursor.fetch(batch_size, timeout=timeout)
+            except Exception:
+                await self.rollback(False)
+                raise
+            finally:
+                self._locker.release()
+            if not rows:
+                return
+            for item in _format_rows(rows, as_model=as_model):
+                yield item
+
     async def fetchval(self, statement: Union[str, Any], *params, timeout: float = None):
         """
         :param statement:
@@ -823,10 +1169,7 @@ class Session(ISession):
         return await self._fetch(FetchMethod.FETCH_VAL, statement, params, timeout=timeout)
 
     async def fetchvals(self, statement, *params, timeout: float = None):
-        sql, params = self._format_statement(statement, None, *params)
-        await self._ensure_connection()
-        rows = await self._conn.fetch(sql, *params, timeout=timeout)
-        return [_format_value(item[0]) for item in rows]
+        return await self._fetch(FetchMethod.FETCH_VALS, statement, params, timeout=timeout)
 
     async def fetchdict(
         self,
@@ -857,6 +1200,33 @@ class Session(ISession):
                 results[_key] = _value
         return results
 
+    def _reader(self, conn: asyncpg.connection.Connection = None):
+        """
+        connection used by the fetch methods, reads go through cached prepared statements when enabled
+        :param conn: defaults to the connection of the session
+        :return:
+        """
+        conn = conn or self._conn
+        if prepared_statement_cache.enabled:
+            return prepared_statement_cache.executor(conn)
+        return conn
+
+    def _stick_to_primary(self):
+        if self._use_replica:
+            self._state().primary_until = self._loop.time() + settings.DATABASE_REPLICA_STICKY_SECONDS
+
+    async def _replica(self, statement) -> Optional[Tuple[str, asyncpg.pool.Pool]]:
+        """
+        replica for a read outside a transaction, None when the read has to go to the primary
+        :param statement:
+        :return:
+        """
+        if not self._use_replica or self._tx is not None or reads_on_primary() or not _is_read_only(statement):
+            return None
+        if self._loop.time() < self._state().primary_until:
+            return None
+        return await replicas.pool(self._max_staleness)
+
     async def _fetch(
         self,
         method: FetchMethod,
@@ -869,25 +1239,56 @@ class Session(ISession):
         try:
             await self._locker.acquire()
             sql, params = self._format_statement(statement, append_statement, *params)
+            replica = await self._replica(statement)
+            if replica is not None:
+                key, pool = replica
+                try:
+                    conn = await pool.acquire(timeout=settings.DATABASE_POOL_ACQUIRE_TIMEOUT)
+                    try:
+                        return await self._read(self._reader(conn), method, sql, params, timeout, as_model)
+                    finally:
+                        await pool.release(conn)
+                except REPLICA_ERRORS as e:
+                    logger.warning(f'Read on replica {key} failed, retry on the primary ({e})')
+                    replicas.mark_unavailable(key)
             await self._ensure_connection(False)
-            match method:
-                case FetchMethod.FETCH_VAL:
-                    value = await self._conn.fetchval(sql, *params, timeout=timeout)
-                    return _format_value(value)
-                case FetchMethod.FETCH_ROW:
-                    value = await self._conn.fetchrow(sql, *params, timeout=timeout)
-                    return _format_dict(item=value, as_model=as_model)
-                case FetchMethod.FETCH:
-                    rows = await self._conn.fetch(sql, *params, timeout=timeout) or []
-                    return [_format_dict(item=item, as_model=as_model) for item in rows]
-                case _:
-                    raise NotImplementedError()
+            return await self._read(self._reader(), method, sql, params, timeout, as_model)
         except Exception:
             await self.rollback(False)
             raise
         finally:
             self._locker.release()
 
+    @staticmethod
+    async def _read(reader, method: FetchMethod, sql: str, params, timeout: float, as_model: Type[BaseModel]):
+        match method:
+            case FetchMethod.FETCH_VAL:
+                value = await reader.fetchval(sql, *params, timeout=timeout)
+                return _format_value(value)
+            case FetchMethod.FETCH_VALS:
+                rows = await reader.fetch(sql, *params, timeout=timeout) or []
+                return [_format_value(item[0]) for item in rows]
+            case FetchMethod.FETCH_ROW:
+                value = await reader.fetchrow(sql, *params, timeout=timeout)
+                if value is None:
+                    return value
+                return _format_rows([value], as_model=as_model)[0]
+            case FetchMethod.FETCH:
+                rows = await reader.fetch(sql, *params, timeout=timeout) or []
+                return _format_rows(rows, as_model=as_model)
+            case FetchMethod.FETCH_PAGE:
+                rows = await reader.fetch(sql, *params, timeout=timeout) or []
+                if not rows:
+                    return [], None
+                total = rows[0][PAGE_TOTAL]
+                items = _format_rows(rows, as_model=as_model)
+                if not as_model:
+                    for item in items:
+                        item.pop(PAGE_TOTAL, None)
+                return items, total
+            case _:
+                raise NotImplementedError()
+
     async def copy_records_to_table(
         self,
         table_name: str, *,
@@ -905,6 +1306,7 @@ class Session(ISession):
         :return:
         """
         await self._ensure_connection()
+        self._stick_to_primary()
         return await self._conn.copy_records_to_table(
             table_name,
             records=records,
@@ -913,6 +1315,76 @@ class Session(ISession):
             timeout=timeout
         )
 
+    async def bulk_upsert(
+        self,
+        table: TableTypes,
+        records: Sequence[Union[tuple, dict]],
+        conflict_cols: Sequence[str],
+        update_cols: Sequence[str] = None,
+        columns: Sequence[str] = None,
+        update_values: dict = None,
+        timeout: float = None
+    ) -> UpsertResult:
+        """
+        COPY the records into a staging table and merge them with one INSERT ... ON CONFLICT,
+        the staging table is created once per connection and emptied on commit.
+        ON CONFLICT cannot update a row twice in one statement, so of the records sharing conflict_cols
+        only the last is merged, as if the records were upserted one by one
+        :param table:
+        :param records: tuples in the order of columns, or dicts keyed by column
+        :param conflict_cols: columns of the unique constraint the records are matched on
+        :param update_cols: columns updated from the record on conflict, defaults to every column but conflict_cols
+        :param columns: defaults to the keys of the first record, required for tuples
+        :param update_values: extra values set on conflict, python values or SQL expressions such as sa.func.now()
+        :param timeout:
+        :return:
+        """
+        if not records:
+            return UpsertResult(inserted=0, updated=0)
+        if isinstance(records[0], dict):
+            if columns is None:
+                columns = list(records[0].keys())
+            records = [tuple(record.get(column) for column in columns) for record in records]
+        elif columns is None:
+            raise ValueError('columns is required when the records are tuples')
+        records = _last_per_key(records, columns, conflict_cols)
+        if update_cols is None:
+            update_cols = [column for column in columns if column not in conflict_cols]
+        target = getattr(table, '__table__', table)
+        preparer = dialect.identifier_preparer
+        staging_name = f'_staging_{target.schema or "public"}_{target.name}'
+        staging = preparer.quote(staging_name)
+        target_name = preparer.format_table(target)
+        column_list = ', '.join(preparer.quote(column) for column in columns)
+        conflict_list = ', '.join(preparer.quote(column) for column in conflict_cols)
+        assignments = [f'{preparer.quote(column)} = EXCLUDED.{preparer.quote(column)}' for column in update_cols]
+        params = []
+        for column, value in (update_values or {}).items():
+            if isinstance(value, sa.sql.ClauseElement):
+                value = str(value.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+            else:
+                params.append(value)
+                value = f'${len(params)}'
+            assignments.append(f'{preparer.quote(column)} = {value}')
+        action = f'DO UPDATE SET {", ".join(assignments)}' if assignments else 'DO NOTHING'
+
+        await self.execute(
+            f'CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {target_name} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS; '
+            f'TRUNCATE {staging};'
+        )
+        await self.copy_records_to_table(staging_name, records=records, columns=list(columns), timeout=timeout)
+        # xmax is 0 on rows the INSERT created and set on rows the conflict updated
+        counts, = await self.execute_returning(
+            f'WITH merged AS ('
+            f'INSERT INTO {target_name} ({column_list}) SELECT {column_list} FROM {staging} '
+            f'ON CONFLICT ({conflict_list}) {action} RETURNING xmax = 0 AS inserted'
+            f') SELECT count(*) FILTER (WHERE inserted) AS inserted, count(*) FILTER (WHERE NOT inserted) AS updated '
+            f'FROM merged',
+            *params,
+            timeout=timeout
+        )
+        return UpsertResult(inserted=counts['inserted'], updated=counts['updated'])
+
     async def commit(self):
         async with self._locker:
             if self._tx is not None:
@@ -920,6 +1392,7 @@ class Session(ISession):
                     return
                 await self._tx.commit()
                 self._tx = None
+                self._stick_to_primary()
 
     async def rollback(self, lock: bool = True):
         lock and await self._locker.acquire()
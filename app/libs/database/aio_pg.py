@@ -1,14 +1,14 @@
 import asyncio
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 
 import asyncpg
 
 from app.config import settings
+from app.libs.database.pool_metrics import ManagedPool, PoolMetrics
 
 _AIO_DB_CONTEXTS = {}
-_lock = False
-__all__ = ['Keys', 'create_pool', 'setup', 'create_connection']
+__all__ = ['Keys', 'create_pool', 'setup', 'create_connection', 'replica_keys', 'pool_stats']
 
 
 class Keys(Enum):
@@ -22,20 +22,24 @@ class AioDbContext:
         key: str,
         schema: str = None,
         application_name: str = None,
+        replica_of: str = None,
         **connect_kwargs
     ):
         self.key: str = key
         self.schema: str = schema
         self.application_name: str = application_name
-        self.pool: Optional[asyncpg.pool.Pool] = None
+        self.replica_of: Optional[str] = replica_of
+        self.pool: Optional[ManagedPool] = None
+        self.metrics = PoolMetrics()
+        # held while the pool is created so concurrent callers wait for the same pool
+        self.lock = asyncio.Lock()
         self.connect_kwargs: dict = connect_kwargs
 
 
 async def create_pool(
     key: Keys = Keys.POOL,
     command_timeout: int = None
-) -> asyncpg.pool.Pool:
-    global _lock
+) -> ManagedPool:
     context = _get_context(key)
     if not context:
         if key == Keys.POOL:
@@ -44,8 +48,8 @@ async def create_pool(
                 dsn=settings.SQLALCHEMY_DATABASE_URI,
                 schema=settings.DATABASE_SCHEMA,
                 application_name=settings.DATABASE_APPLICATION_NAME,
-                min_size=0,
-                max_size=100,
+                min_size=settings.DATABASE_POOL_MIN_SIZE,
+                max_size=settings.DATABASE_POOL_MAX_SIZE,
                 command_timeout=command_timeout
             )
         else:
@@ -53,18 +57,22 @@ async def create_pool(
                             f'please register with setup first')
     if context.pool is not None:
         return context.pool
-    if _lock:
-        await asyncio.sleep(.1)
-        return await create_pool(key)
-    _lock = True
-    server_settings = await create_server_settings(context)
-    if command_timeout:
-        context.connect_kwargs['command_timeout'] = command_timeout
-    context.pool = await asyncpg.create_pool(
-        server_settings=server_settings,
-        max_inactive_connection_lifetime=60 * 10,
-        **context.connect_kwargs)
-    _lock = False
+    async with context.lock:
+        if context.pool is not None:
+            return context.pool
+        server_settings = await create_server_settings(context)
+        if command_timeout:
+            context.connect_kwargs['command_timeout'] = command_timeout
+        connect_kwargs = {
+            'max_queries': settings.DATABASE_POOL_MAX_QUERIES,
+            'max_inactive_connection_lifetime': settings.DATABASE_POOL_MAX_INACTIVE_LIFETIME,
+            **context.connect_kwargs
+        }
+        pool = await asyncpg.create_pool(
+            server_settings=server_settings,
+            init=context.metrics.on_connect,
+            **connect_kwargs)
+        context.pool = ManagedPool(pool, context.metrics, acquire_timeout=settings.DATABASE_POOL_ACQUIRE_TIMEOUT)
     return context.pool
 
 
@@ -105,17 +113,59 @@ async def create_server_settings(context):
     return None
 
 
-def setup(db=Keys.DEFAULT, application_name: str = None, **kwargs):
+def setup(db=Keys.DEFAULT, application_name: str = None, replica_of=None, **kwargs):
+    """
+    :param db:
+    :param application_name:
+    :param replica_of: key of the primary context, registers the context as a read replica of it
+    :param kwargs: asyncpg connect kwargs
+    :return:
+    """
     if not kwargs:
         raise TypeError('kwargs is not null')
     key = db.value if isinstance(db, Keys) else str(db)
+    if replica_of is not None:
+        replica_of = replica_of.value if isinstance(replica_of, Keys) else str(replica_of)
     if key in _AIO_DB_CONTEXTS:
         _AIO_DB_CONTEXTS[key].connect_kwargs = kwargs
+        _AIO_DB_CONTEXTS[key].replica_of = replica_of
     else:
-        _AIO_DB_CONTEXTS[key] = AioDbContext(key, application_name=application_name, **kwargs)
+        _AIO_DB_CONTEXTS[key] = AioDbContext(key, application_name=application_name, replica_of=replica_of, **kwargs)
     return _AIO_DB_CONTEXTS[key]
 
 
+def replica_keys(primary: Keys = Keys.POOL) -> List[str]:
+    """
+    keys of the replica contexts of a primary, the replicas in settings.DATABASE_REPLICA_URIS
+    are registered for Keys.POOL the first time
+    :param primary:
+    :return:
+    """
+    primary = primary.value if isinstance(primary, Keys) else str(primary)
+    if primary == Keys.POOL.value:
+        for index, dsn in enumerate(uri for uri in settings.DATABASE_REPLICA_URIS.split(",") if uri):
+            key = f'{Keys.POOL.value}_REPLICA_{index}'
+            if key not in _AIO_DB_CONTEXTS:
+                setup(
+                    key,
+                    replica_of=Keys.POOL,
+                    dsn=dsn,
+                    schema=settings.DATABASE_SCHEMA,
+                    application_name=settings.DATABASE_APPLICATION_NAME,
+                    min_size=settings.DATABASE_POOL_MIN_SIZE,
+                    max_size=settings.DATABASE_POOL_MAX_SIZE
+                )
+    return [key for key, context in _AIO_DB_CONTEXTS.items() if context.replica_of == primary]
+
+
+def pool_stats() -> dict:
+    """
+    sizing, acquire latency and connection churn of every pool that was created
+    :return:
+    """
+    return {key: context.pool.stats() for key, context in _AIO_DB_CONTEXTS.items() if isinstance(context.pool, ManagedPool)}
+
+
 def _get_context(key: Keys = Keys.DEFAULT) -> AioDbContext:
     real_key = key.value if isinstance(key, Keys) else str(key)
     return _AIO_DB_CONTEXTS.get(real_key, None)
@@ -0,0 +1,77 @@
+"""
+Keyset pagination cursor
+"""
+import base64
+import uuid
+from datetime import datetime, date
+from enum import Enum
+from typing import Any
+
+import ujson
+from sqlalchemy.dialects.postgresql import UUID
+
+__all__ = ['InvalidCursorError', 'encode_cursor', 'decode_cursor']
+
+
+class InvalidCursorError(ValueError):
+    """The cursor was not made by encode_cursor for the keyset columns"""
+
+
+def _encode_value(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def _decode_value(column, value: Any):
+    if value is None:
+        raise InvalidCursorError(f'Cursor value of {column} is null')
+    if isinstance(column.type, UUID):
+        try:
+            return uuid.UUID(value)
+        except (AttributeError, TypeError, ValueError) as e:
+            raise InvalidCursorError(f'Cursor value {value} of {column} is not a UUID') from e
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    try:
+        if python_type is datetime:
+            return datetime.fromisoformat(value)
+        if python_type is date:
+            return date.fromisoformat(value)
+        if python_type in (int, float, str) and isinstance(value, (int, float, str)):
+            return python_type(value)
+    except (TypeError, ValueError) as e:
+        raise InvalidCursorError(f'Cursor value {value} of {column} is not a {python_type.__name__}') from e
+    raise InvalidCursorError(f'Cursor value {value} of {column} is not a {python_type.__name__}')
+
+
+def encode_cursor(*values) -> str:
+    """
+    opaque cursor of the keyset values of the last row on a page
+    :param values:
+    :return:
+    """
+    payload = ujson.dumps([_encode_value(value) for value in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, *columns) -> tuple:
+    """
+    :param cursor: cursor from encode_cursor
+    :param columns: keyset columns, in the order the values were encoded
+    :raise InvalidCursorError: the cursor was not made for these columns
+    :return:
+    """
+    try:
+        values = ujson.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as e:
+        raise InvalidCursorError(f'Invalid cursor "{cursor}"') from e
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise InvalidCursorError(f'Invalid cursor "{cursor}"')
+    return tuple(_decode_value(column, value) for column, value in zip(columns, values))
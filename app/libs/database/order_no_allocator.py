@@ -0,0 +1,109 @@
+"""
+Daily order number allocator
+"""
+import asyncio
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+import pytz
+from redis.asyncio import Redis
+
+from app.config import settings
+from app.libs.consts.redis_keys import get_redis_key
+from app.libs.database.aio_redis import RedisPool
+
+__all__ = ['OrderNoAllocator', 'order_no_allocator']
+
+# day -> last sequence number of the day already in the database
+SeedLoader = Callable[[str], Awaitable[int]]
+
+
+class OrderNoAllocator:
+    """
+    Hands out order numbers {prefix}{yyyymmdd}{sequence} from a counter per day in Redis. INCRBY
+    reserves block_size numbers at a time, so a worker takes most numbers without a round trip,
+    numbers reserved by a worker that stops are skipped. Every reservation seeds the counter with
+    the numbers already in the database unless it exists, so a counter lost by a restart or flush
+    of Redis goes on after the last order instead of handing out the numbers of today again.
+    A new day starts a new counter.
+    """
+
+    def __init__(self, prefix: str = 'O', block_size: int = 10, digits: int = 7, ttl: int = 2 * 86400):
+        if block_size < 1:
+            raise ValueError('block_size must be a positive integer')
+        self.prefix = prefix
+        self.block_size = block_size
+        self.digits = digits
+        self.ttl = ttl
+        self._redis: Optional[Redis] = None
+        self._lock = asyncio.Lock()
+        self._day: Optional[str] = None
+        # next and last number of the reserved block
+        self._next = 1
+        self._last = 0
+        self.allocated = 0
+        self.reservations = 0
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = RedisPool().create()
+        return self._redis
+
+    @staticmethod
+    def today() -> str:
+        """
+        :return:
+        """
+        return datetime.now(tz=pytz.UTC).strftime('%Y%m%d')
+
+    def counter_key(self, day: str) -> str:
+        """
+        :param day:
+        :return:
+        """
+        return get_redis_key(f'order_no:{self.prefix}:{day}')
+
+    async def allocate(self, seed: SeedLoader) -> str:
+        """
+        :param seed: loads the last sequence number of a day in the database, awaited once a block
+        :return:
+        """
+        day = self.today()
+        while day != self._day or self._next > self._last:
+            async with self._lock:
+                # another task may have reserved a block while this one waited
+                if day != self._day or self._next > self._last:
+                    await self._reserve(day=day, seed=seed)
+        sequence = self._next
+        self._next += 1
+        self.allocated += 1
+        return f'{self.prefix}{day}{str(sequence).zfill(self.digits)}'
+
+    async def _reserve(self, day: str, seed: SeedLoader):
+        key = self.counter_key(day)
+        # numbers handed out before the counter existed, e.g. while redis was unavailable
+        last_sequence = await seed(day)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(key, last_sequence, ex=self.ttl, nx=True)
+            pipe.incrby(key, self.block_size)
+            _, last = await pipe.execute()
+        self.reservations += 1
+        self._day = day
+        self._next = last - self.block_size + 1
+        self._last = last
+
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            'day': self._day,
+            'block_size': self.block_size,
+            'remaining': max(self._last - self._next + 1, 0) if self._day == self.today() else 0,
+            'allocated': self.allocated,
+            'reservations': self.reservations,
+        }
+
+
+order_no_allocator = OrderNoAllocator(block_size=settings.ORDER_NO_BLOCK_SIZE)
@@ -0,0 +1,149 @@
+"""
+Connection pool metrics
+"""
+import asyncio
+import bisect
+import time
+from typing import Optional, Sequence
+
+import asyncpg
+
+__all__ = ['LatencyHistogram', 'PoolMetrics', 'ManagedPool']
+
+# upper bounds in milliseconds
+_LATENCY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram, counts are per bucket and the last bucket is unbounded"""
+
+    def __init__(self, buckets: Sequence[float] = _LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        """
+        :param seconds:
+        :return:
+        """
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        upper bound of the bucket the quantile falls into, None without observations
+        :param q:
+        :return:
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def snapshot(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count, 3) if self.count else None,
+            'max_ms': round(self.max, 3),
+            'p50_ms': self.quantile(.5),
+            'p95_ms': self.quantile(.95),
+            'p99_ms': self.quantile(.99),
+            'buckets': {
+                **{f'le_{bound}': count for bound, count in zip(self.buckets, self.counts)},
+                'inf': self.counts[-1]
+            },
+        }
+
+
+class PoolMetrics:
+    """Acquire latency and connection churn of one pool"""
+
+    def __init__(self):
+        self.acquire_latency = LatencyHistogram()
+        self.acquires = 0
+        self.acquire_timeouts = 0
+        self.releases = 0
+        self.connections_created = 0
+        self.connections_closed = 0
+
+    async def on_connect(self, conn: asyncpg.Connection):
+        """
+        init callback of asyncpg.create_pool, called once for every new connection
+        :param conn:
+        :return:
+        """
+        self.connections_created += 1
+        conn.add_termination_listener(self._on_close)
+
+    def _on_close(self, _: asyncpg.Connection):
+        self.connections_closed += 1
+
+
+class ManagedPool:
+    """asyncpg pool that records the time callers wait for a connection"""
+
+    def __init__(self, pool: asyncpg.pool.Pool, metrics: PoolMetrics, acquire_timeout: float = None):
+        self._pool = pool
+        self.metrics = metrics
+        self.acquire_timeout = acquire_timeout
+
+    async def acquire(self, timeout: float = None) -> asyncpg.Connection:
+        """
+        :param timeout: defaults: acquire_timeout of the pool
+        :return:
+        """
+        start = time.perf_counter()
+        try:
+            conn = await self._pool.acquire(timeout=timeout or self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.metrics.acquire_timeouts += 1
+            raise
+        finally:
+            self.metrics.acquire_latency.observe(time.perf_counter() - start)
+        self.metrics.acquires += 1
+        return conn
+
+    async def release(self, conn: asyncpg.Connection, timeout: float = None):
+        """
+        :param conn:
+        :param timeout:
+        :return:
+        """
+        self.metrics.releases += 1
+        await self._pool.release(conn, timeout=timeout)
+
+    def __getattr__(self, item):
+        return getattr(self._pool, item)
+
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        size, idle = self._pool.get_size(), self._pool.get_idle_size()
+        return {
+            'min_size': self._pool.get_min_size(),
+            'max_size': self._pool.get_max_size(),
+            'size': size,
+            'idle': idle,
+            'in_use': size - idle,
+            'acquires': self.metrics.acquires,
+            'acquire_timeouts': self.metrics.acquire_timeouts,
+            'releases': self.metrics.releases,
+            'connections_created': self.metrics.connections_created,
+            'connections_closed': self.metrics.connections_closed,
+            'acquire_latency': self.metrics.acquire_latency.snapshot(),
+        }
@@ -0,0 +1,125 @@
+"""
+Server-side prepared statement cache
+"""
+import weakref
+from collections import OrderedDict
+from typing import Any, Optional
+
+import asyncpg
+from asyncpg.prepared_stmt import PreparedStatement
+
+__all__ = ['PreparedStatementCache']
+
+
+class _PreparedExecutor:
+    """Connection-like wrapper that runs read queries through cached prepared statements"""
+
+    __slots__ = ('_cache', '_conn')
+
+    def __init__(self, cache: 'PreparedStatementCache', conn: asyncpg.Connection):
+        self._cache = cache
+        self._conn = conn
+
+    async def fetch(self, sql: str, *args, timeout: float = None) -> list:
+        return await self._cache.run(self._conn, 'fetch', sql, args, timeout)
+
+    async def fetchrow(self, sql: str, *args, timeout: float = None) -> Optional[asyncpg.Record]:
+        return await self._cache.run(self._conn, 'fetchrow', sql, args, timeout)
+
+    async def fetchval(self, sql: str, *args, timeout: float = None) -> Any:
+        return await self._cache.run(self._conn, 'fetchval', sql, args, timeout)
+
+
+class PreparedStatementCache:
+    """
+    Per-connection LRU of prepared statements keyed on SQL text. Statements are prepared
+    lazily the first time a pooled connection sees the SQL and reused on later executions.
+    """
+
+    def __init__(self, enabled: bool = False, maxsize: int = 100):
+        self.enabled = enabled and maxsize > 0
+        self.maxsize = maxsize
+        self._statements: weakref.WeakKeyDictionary[asyncpg.Connection, OrderedDict[str, PreparedStatement]] = (
+            weakref.WeakKeyDictionary()
+        )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _raw_connection(conn: asyncpg.Connection) -> asyncpg.Connection:
+        # pool connections are proxies that change on every acquire, the statements
+        # belong to the underlying connection
+        return getattr(conn, '_con', None) or conn
+
+    def executor(self, conn: asyncpg.Connection):
+        """
+        :param conn:
+        :return:
+        """
+        return _PreparedExecutor(self, conn)
+
+    async def prepare(self, conn: asyncpg.Connection, sql: str) -> PreparedStatement:
+        """
+        :param conn:
+        :param sql:
+        :return:
+        """
+        statements = self._statements.setdefault(self._raw_connection(conn), OrderedDict())
+        statement = statements.get(sql)
+        if statement is not None:
+            statements.move_to_end(sql)
+            self.hits += 1
+            return statement
+        self.misses += 1
+        statement = await conn.prepare(sql)
+        statements[sql] = statement
+        while len(statements) > self.maxsize:
+            statements.popitem(last=False)
+            self.evictions += 1
+        return statement
+
+    def evict(self, conn: asyncpg.Connection, sql: str):
+        """
+        :param conn:
+        :param sql:
+        :return:
+        """
+        statements = self._statements.get(self._raw_connection(conn))
+        if statements is not None:
+            statements.pop(sql, None)
+
+    async def run(self, conn: asyncpg.Connection, method: str, sql: str, args: tuple, timeout: float = None):
+        """
+        :param conn:
+        :param method: fetch, fetchrow or fetchval
+        :param sql:
+        :param args:
+        :param timeout:
+        :return:
+        """
+        statement = await self.prepare(conn, sql)
+        try:
+            return await getattr(statement, method)(*args, timeout=timeout)
+        except (asyncpg.InvalidCachedStatementError, asyncpg.exceptions.OutdatedSchemaCacheError):
+            # the schema changed under the statement, prepare it again once
+            self.evict(conn, sql)
+            self.invalidations += 1
+            statement = await self.prepare(conn, sql)
+            return await getattr(statement, method)(*args, timeout=timeout)
+
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            'enabled': self.enabled,
+            'connections': len(self._statements),
+            'statements': sum(len(statements) for statements in self._statements.values()),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
@@ -0,0 +1,136 @@
+"""
+Read replica routing
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Tuple
+
+import asyncpg
+
+from app.libs.logger import logger
+from app.libs.database.aio_pg import Keys, create_pool, replica_keys
+
+__all__ = ['ReplicaSet', 'REPLICA_ERRORS', 'primary_reads', 'reads_on_primary']
+
+# replication lag in seconds, 0 when the replica has replayed everything it received
+# and on a server that is not in recovery
+_LAG_SQL = (
+    'SELECT COALESCE(CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END, 0)'
+)
+
+# errors that take a replica out of rotation instead of failing the read
+REPLICA_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.InterfaceError, asyncpg.PostgresConnectionError)
+
+_PRIMARY_READS: ContextVar[bool] = ContextVar('primary_reads', default=False)
+
+
+@contextmanager
+def primary_reads() -> Iterator[None]:
+    """
+    send the reads of every session in the block to the primary, for values that are cached
+    after the read and must not be older than the write that made them load again
+    :return:
+    """
+    token = _PRIMARY_READS.set(True)
+    try:
+        yield
+    finally:
+        _PRIMARY_READS.reset(token)
+
+
+def reads_on_primary() -> bool:
+    """
+    :return: whether the current context is in a primary_reads block
+    """
+    return _PRIMARY_READS.get()
+
+
+class _ReplicaState:
+    __slots__ = ('lag', 'checked_at')
+
+    def __init__(self):
+        self.lag: Optional[float] = None
+        self.checked_at: float = float('-inf')
+
+
+class ReplicaSet:
+    """
+    Replicas of a primary context, picked round-robin among the ones whose replication lag
+    is within the staleness tolerance. The lag of each replica is checked at most once per
+    lag_check_interval, a replica that cannot be reached stays out until the next check.
+    """
+
+    def __init__(self, primary: Keys = Keys.POOL, max_staleness: float = 5, lag_check_interval: float = 1):
+        self.primary = primary
+        self.max_staleness = max_staleness
+        self.lag_check_interval = lag_check_interval
+        self._states: Dict[str, _ReplicaState] = {}
+        self._next = 0
+        self.reads = 0
+        self.stale = 0
+        self.failures = 0
+
+    async def pool(self, max_staleness: float = None) -> Optional[Tuple[str, asyncpg.pool.Pool]]:
+        """
+        :param max_staleness: seconds of replication lag the read tolerates, defaults: self.max_staleness
+        :return: key and pool of a fresh replica, None when the read has to go to the primary
+        """
+        keys = replica_keys(self.primary)
+        if not keys:
+            return None
+        if max_staleness is None:
+            max_staleness = self.max_staleness
+        now = time.monotonic()
+        for _ in range(len(keys)):
+            key = keys[self._next % len(keys)]
+            self._next += 1
+            lag = await self._lag(key, now)
+            if lag is not None and lag <= max_staleness:
+                self.reads += 1
+                return key, await create_pool(key)
+        self.stale += 1
+        return None
+
+    async def _lag(self, key: str, now: float) -> Optional[float]:
+        state = self._states.setdefault(key, _ReplicaState())
+        if now - state.checked_at < self.lag_check_interval:
+            return state.lag
+        # reads arriving while the check runs use the previous value
+        state.checked_at = now
+        try:
+            pool = await create_pool(key)
+            conn = await pool.acquire(timeout=self.lag_check_interval or None)
+            try:
+                state.lag = float(await conn.fetchval(_LAG_SQL, timeout=self.lag_check_interval or None))
+            finally:
+                await pool.release(conn)
+        except REPLICA_ERRORS as e:
+            logger.warning(f'Replica {key} is unavailable ({e})')
+            state.lag = None
+        return state.lag
+
+    def mark_unavailable(self, key: str):
+        """
+        take the replica out of rotation until its next lag check
+        :param key:
+        :return:
+        """
+        state = self._states.setdefault(key, _ReplicaState())
+        state.lag = None
+        state.checked_at = time.monotonic()
+        self.failures += 1
+
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            'replicas': {key: state.lag for key, state in self._states.items()},
+            'max_staleness': self.max_staleness,
+            'reads': self.reads,
+            'stale': self.stale,
+            'failures': self.failures,
+        }
@@ -0,0 +1,304 @@
+"""
+Row mapper
+"""
+import enum
+import operator
+import types
+import typing
+import uuid
+from collections import OrderedDict
+from datetime import datetime, date
+from decimal import Decimal
+from typing import Any, Callable, Hashable, List, NamedTuple, Optional, Sequence, Tuple, Type
+
+import asyncpg
+from pydantic import BaseModel
+from pydantic.fields import FieldInfo
+
+from app.libs.shared import Converter
+
+__all__ = ['RowMapper']
+
+_object_setattr = object.__setattr__
+
+# model config keys that make pydantic change values we would otherwise copy as they are
+_UNTRUSTED_CONFIG = (
+    'strict', 'validate_default', 'str_strip_whitespace', 'str_to_lower', 'str_to_upper',
+    'str_max_length', 'str_min_length', 'coerce_numbers_to_str', 'revalidate_instances'
+)
+
+
+class _Validate(Exception):
+    """The row has to go through model_validate"""
+
+
+def _identity(value):
+    return value
+
+
+def _format_sequence(value):
+    return [Converter.format_value(item) for item in value]
+
+
+def _format_datetime(value: datetime) -> str:
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _format_date(value: date) -> str:
+    return value.strftime("%Y-%m-%d")
+
+
+def _column_formatter(value) -> Callable:
+    """
+    Converter.format_value resolved once for a column
+    :param value: first non-null value of the column
+    :return:
+    """
+    if isinstance(value, (list, tuple)):
+        return _format_sequence
+    if isinstance(value, uuid.UUID):
+        return str
+    if isinstance(value, datetime):
+        return _format_datetime
+    if isinstance(value, date):
+        return _format_date
+    if isinstance(value, Decimal):
+        return int
+    return _identity
+
+
+def _unwrap_optional(annotation) -> Tuple[Any, bool]:
+    if typing.get_origin(annotation) in (typing.Union, types.UnionType):
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        nullable = len(args) != len(typing.get_args(annotation))
+        if len(args) == 1:
+            return args[0], nullable
+        return annotation, nullable
+    return annotation, annotation is Any
+
+
+def _field_converter(annotation, value, use_enum_values: bool) -> Optional[Callable]:
+    """
+    converter that turns a database value into what model_validate would store,
+    None when the field has to be validated by pydantic
+    :param annotation:
+    :param value: first non-null value of the column
+    :param use_enum_values:
+    :return:
+    """
+    if annotation is Any:
+        return _identity
+    if not isinstance(annotation, type):
+        return None
+    value_type = type(value)
+    if issubclass(annotation, enum.Enum):
+        # unknown values raise KeyError and the row falls back to model_validate
+        members = annotation._value2member_map_  # noqa
+        if use_enum_values:
+            return lambda item: members[item].value
+        return _identity if value_type is annotation else members.__getitem__
+    if annotation is float:
+        if value_type is float:
+            return _identity
+        return float if value_type in (int, Decimal) else None
+    if annotation is uuid.UUID:
+        return _identity if isinstance(value, uuid.UUID) else None
+    if annotation in (int, str, bool, datetime, date, Decimal):
+        return _identity if value_type is annotation else None
+    return None
+
+
+class _FieldPlan(NamedTuple):
+    """How one column is stored on the model"""
+    column: str
+    field: str
+    annotation: Any
+    nullable: bool
+
+
+class _ModelPlan(NamedTuple):
+    """Column-to-field plan of a model for one query shape, in model field order"""
+    fields: Tuple[_FieldPlan, ...]
+    defaults: Tuple[Tuple[str, FieldInfo], ...]
+    order: Tuple[str, ...]
+    fields_set: frozenset
+    use_enum_values: bool
+
+
+def _build_plan(model: Type[BaseModel], columns: Sequence[str]) -> Optional[_ModelPlan]:
+    """
+    :param model:
+    :param columns:
+    :return: None when the model has to be built by model_validate
+    """
+    config = model.model_config
+    decorators = model.__pydantic_decorators__
+    if (
+        getattr(model, '__pydantic_root_model__', False) or
+        model.__pydantic_post_init__ is not None or
+        model.__private_attributes__ or
+        decorators.model_validators or
+        decorators.root_validators or
+        config.get('extra') in ('allow', 'forbid') or
+        any(config.get(key) for key in _UNTRUSTED_CONFIG)
+    ):
+        return None
+    validated_fields = set()
+    for decorator in (*decorators.field_validators.values(), *decorators.validators.values()):
+        validated_fields.update(decorator.info.fields)
+    if '*' in validated_fields:
+        return None
+    columns = set(columns)
+    plans, defaults = [], []
+    for name, field in model.model_fields.items():
+        if field.validation_alias is not None and not isinstance(field.validation_alias, str):
+            return None
+        column = field.validation_alias or field.alias or name
+        if column not in columns and config.get('populate_by_name'):
+            column = name
+        if column not in columns:
+            if field.is_required() or getattr(field, 'default_factory_takes_data', False) or field.validate_default:
+                return None
+            defaults.append((name, field))
+            continue
+        if name in validated_fields or field.metadata:
+            return None
+        annotation, nullable = _unwrap_optional(field.annotation)
+        plans.append(_FieldPlan(column, name, annotation, nullable))
+    return _ModelPlan(
+        fields=tuple(plans),
+        defaults=tuple(defaults),
+        order=tuple(model.model_fields),
+        fields_set=frozenset(plan.field for plan in plans),
+        use_enum_values=bool(config.get('use_enum_values'))
+    )
+
+
+def _tuple_getter(positions: Sequence[int]) -> Callable[[asyncpg.Record], tuple]:
+    if not positions:
+        return lambda record: ()
+    if len(positions) == 1:
+        position, = positions
+        return lambda record: (record[position],)
+    return operator.itemgetter(*positions)
+
+
+def _first_values(rows: Sequence[asyncpg.Record], width: int) -> List[Any]:
+    """first non-null value of every column"""
+    values = [None] * width
+    pending = set(range(width))
+    for record in rows:
+        for index in list(pending):
+            value = record[index]
+            if value is not None:
+                values[index] = value
+                pending.discard(index)
+        if not pending:
+            break
+    return values
+
+
+class RowMapper:
+    """
+    Decode asyncpg records with a column-to-field plan cached per (model, query shape),
+    converters are resolved once per result set instead of once per value. Rows the plan
+    cannot handle fall back to model_validate, so errors are the same as before.
+    """
+
+    def __init__(self, enabled: bool = True, maxsize: int = 256):
+        self.enabled = enabled
+        self.maxsize = maxsize
+        self._plans: OrderedDict[Hashable, Optional[_ModelPlan]] = OrderedDict()
+
+    def _plan(self, model: Type[BaseModel], columns: Tuple[str, ...]) -> Optional[_ModelPlan]:
+        key = (model, columns)
+        try:
+            plan = self._plans[key]
+        except KeyError:
+            plan = self._plans[key] = _build_plan(model, columns)
+            while len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+        return plan
+
+    def map(self, rows: Sequence[asyncpg.Record], as_model: Type[BaseModel] = None) -> list:
+        """
+        :param rows:
+        :param as_model:
+        :return:
+        """
+        if not rows:
+            return []
+        columns = tuple(rows[0].keys())
+        if as_model is None:
+            return self._map_dicts(rows, columns)
+        plan = self._plan(as_model, columns)
+        if plan is None:
+            return [as_model.model_validate(dict(record)) for record in rows]
+        return self._map_models(rows, columns, as_model, plan)
+
+    @staticmethod
+    def _map_dicts(rows: Sequence[asyncpg.Record], columns: Tuple[str, ...]) -> List[dict]:
+        formatters = [
+            (column, formatter)
+            for column, value in zip(columns, _first_values(rows, len(columns)))
+            if value is not None and (formatter := _column_formatter(value)) is not _identity
+        ]
+        result = []
+        for record in rows:
+            data = dict(record)
+            for column, formatter in formatters:
+                value = data[column]
+                if value is not None:
+                    data[column] = formatter(value)
+            result.append(data)
+        return result
+
+    @staticmethod
+    def _map_models(
+        rows: Sequence[asyncpg.Record],
+        columns: Tuple[str, ...],
+        model: Type[BaseModel],
+        plan: _ModelPlan
+    ) -> List[BaseModel]:
+        first_values = _first_values(rows, len(columns))
+        positions = [columns.index(field.column) for field in plan.fields]
+        converters, not_null = [], []
+        for field, position in zip(plan.fields, positions):
+            value = first_values[position]
+            converter = _identity
+            if value is not None:
+                converter = _field_converter(field.annotation, value, plan.use_enum_values)
+            if converter is None:
+                # the column needs coercion only pydantic knows about
+                return [model.model_validate(dict(record)) for record in rows]
+            if converter is not _identity:
+                converters.append((field.field, converter))
+            if not field.nullable:
+                not_null.append(position)
+        names = tuple(field.field for field in plan.fields)
+        values_of = _tuple_getter(positions)
+        not_null_of = _tuple_getter(not_null)
+
+        result = []
+        for record in rows:
+            try:
+                if None in not_null_of(record):
+                    raise _Validate()
+                data = dict(zip(names, values_of(record)))
+                for name, converter in converters:
+                    value = data[name]
+                    if value is not None:
+                        data[name] = converter(value)
+                if plan.defaults:
+                    for name, field in plan.defaults:
+                        data[name] = field.get_default(call_default_factory=True)
+                    data = {name: data[name] for name in plan.order}
+                instance = model.__new__(model)
+                _object_setattr(instance, '__dict__', data)
+                _object_setattr(instance, '__pydantic_fields_set__', set(plan.fields_set))
+                _object_setattr(instance, '__pydantic_extra__', None)
+                _object_setattr(instance, '__pydantic_private__', None)
+            except Exception:  # pylint: disable=broad-except
+                instance = model.model_validate(dict(record))
+            result.append(instance)
+        return result
@@ -0,0 +1,337 @@
+"""
+Shared read-through cache
+"""
+import asyncio
+import copy
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import ujson
+from pydantic import TypeAdapter
+from redis.asyncio import Redis
+from redis.exceptions import RedisError, WatchError
+
+from app.config import settings
+from app.libs.consts.redis_keys import get_redis_key
+from app.libs.database.aio_redis import RedisPool
+from app.libs.database.replica import primary_reads
+from app.libs.logger import logger
+
+__all__ = ['SharedCache', 'shared_cache']
+
+
+class SharedCache:
+    """
+    Two-level read-through cache: a per-process L1 dict in front of Redis (L2).
+    Writers call invalidate, which deletes the Redis keys and publishes them on a channel, or
+    update, which replaces the value in Redis and publishes the key the same way,
+    every process listening on the channel drops its L1 copy and runs the invalidation hooks.
+    L1 is only used while the listener is subscribed, otherwise a process could keep serving
+    a value another process changed. Every invalidation also bumps a generation of the key in
+    Redis, a value loaded on a miss is stored only if the generation did not move during the load,
+    so a load racing an invalidation of another process does not put the old value back in L2.
+    L1 holds its own copy of a value and hands out copies, a caller changing the value it got
+    does not change what the other readers of the process see.
+    A process keeping its own copies registers a hook with on_invalidate, the listener runs and
+    invalidations are published for the hooks even when the cache is disabled.
+    """
+
+    def __init__(self, channel: str, l1_ttl: float = 60, l2_ttl: int = 300, enabled: bool = True):
+        self.channel = channel
+        self.l1_ttl = l1_ttl
+        self.l2_ttl = l2_ttl
+        self.enabled = enabled
+        self.origin = uuid.uuid4().hex
+        self._redis: Optional[Redis] = None
+        self._l1: Dict[str, Dict[Optional[str], Tuple[float, Any]]] = {}
+        # bumped on every invalidation of a key, a load that raced an invalidation is not stored
+        self._generations: Dict[str, int] = {}
+        self._hooks: List[Callable[[List[str]], None]] = []
+        self._listener: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.listening = False
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.invalidations_sent = 0
+        self.invalidations_received = 0
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = RedisPool().create()
+        return self._redis
+
+    def on_invalidate(self, hook: Callable[[List[str]], None]):
+        """
+        run hook with the keys another process invalidated, every process is expected to register
+        the same hooks, invalidations are published only while there is one or the cache is enabled
+        :param hook:
+        :return:
+        """
+        self._hooks.append(hook)
+
+    async def get(
+        self,
+        key: str,
+        adapter: TypeAdapter,
+        loader: Callable[[], Awaitable[Any]],
+        field: str = None
+    ) -> Any:
+        """
+        :param key: redis key
+        :param adapter: type adapter of the value
+        :param loader: loads the value on a miss, its reads go to the primary
+        :param field: field of the redis hash at key, entries of one key are invalidated together
+        :return:
+        """
+        if not self.enabled:
+            return await loader()
+        if self.listening:
+            entry = self._l1.get(key, {}).get(field)
+            if entry is not None and entry[0] > time.monotonic():
+                self.l1_hits += 1
+                return copy.deepcopy(entry[1])
+        generation = self._generations.get(key, 0)
+        raw, version, stored = None, None, False
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                if field is not None:
+                    pipe.hget(key, field)
+                else:
+                    pipe.get(key)
+                pipe.get(self.generation_key(key))
+                raw, version = await pipe.execute()
+            stored = True
+        except RedisError as e:
+            logger.warning(f'Failed to read cache {key} ({e})')
+            self.errors += 1
+        if raw is not None:
+            self.l2_hits += 1
+            value = adapter.validate_json(raw)
+        else:
+            self.misses += 1
+            # a replica behind the write that invalidated the key would put the old value back
+            with primary_reads():
+                value = await loader()
+            if stored and self._generations.get(key, 0) == generation:
+                await self._store(key, field, adapter.dump_json(value).decode(), version=version)
+        if self.listening and self._generations.get(key, 0) == generation:
+            self._put_l1(key, field, value)
+        return value
+
+    async def update(self, key: str, adapter: TypeAdapter, change: Callable[[Any], Any], field: str = None):
+        """
+        write through, apply a committed write to the value in redis and drop the copies of the
+        other processes. The value is replaced only if no other process wrote or invalidated the
+        key since it was read, otherwise, or when it is not cached or change returns None, the key
+        is invalidated and loaded again on the next read
+        :param key:
+        :param adapter:
+        :param change: the value after the write
+        :param field:
+        :return:
+        """
+        if not self.enabled:
+            await self.invalidate(key)
+            return
+        # a load racing the write is not stored over the value
+        self._evict([key])
+        generation_key = self.generation_key(key)
+        value = None
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(generation_key)
+                raw = await (pipe.hget(key, field) if field is not None else pipe.get(key))
+                if raw is not None:
+                    value = change(adapter.validate_json(raw))
+                if value is not None:
+                    pipe.multi()
+                    self._bump(pipe, key)
+                    self._write(pipe, key, field, adapter.dump_json(value).decode())
+                    await pipe.execute()
+        except WatchError:
+            value = None
+        except RedisError as e:
+            logger.warning(f'Failed to write cache {key} ({e})')
+            self.errors += 1
+            value = None
+        if value is None:
+            await self.invalidate(key)
+            return
+        try:
+            await self.redis.publish(self.channel, ujson.dumps({'origin': self.origin, 'keys': [key]}))
+            self.invalidations_sent += 1
+        except RedisError as e:
+            logger.warning(f'Failed to publish cache write {key} ({e})')
+            self.errors += 1
+        if self.listening:
+            self._put_l1(key, field, value)
+
+    @staticmethod
+    def generation_key(key: str) -> str:
+        """
+        :param key:
+        :return:
+        """
+        return f'{key}:generation'
+
+    def _bump(self, pipe, key: str):
+        generation_key = self.generation_key(key)
+        pipe.incr(generation_key)
+        # outlives any load, an expired generation reads as a new one
+        pipe.expire(generation_key, self.l2_ttl)
+
+    def _write(self, pipe, key: str, field: Optional[str], raw: str):
+        if field is None:
+            pipe.set(key, raw, ex=self.l2_ttl)
+            return
+        pipe.hset(key, field, raw)
+        pipe.expire(key, self.l2_ttl)
+
+    async def _store(self, key: str, field: Optional[str], raw: str, version: Optional[str]) -> bool:
+        """
+        :param key:
+        :param field:
+        :param raw:
+        :param version: generation of the key read before the value was loaded
+        :return: whether the value was stored
+        """
+        generation_key = self.generation_key(key)
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(generation_key)
+                if await pipe.get(generation_key) != version:
+                    return False
+                pipe.multi()
+                self._write(pipe, key, field, raw)
+                await pipe.execute()
+            return True
+        except WatchError:
+            return False
+        except RedisError as e:
+            logger.warning(f'Failed to write cache {key} ({e})')
+            self.errors += 1
+            return False
+
+    def _put_l1(self, key: str, field: Optional[str], value: Any):
+        self._l1.setdefault(key, {})[field] = (time.monotonic() + self.l1_ttl, copy.deepcopy(value))
+
+    def _evict(self, keys: List[str]):
+        for key in keys:
+            self._l1.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    async def invalidate(self, *keys: str):
+        """
+        drop the keys in every process, call after the write is committed
+        :param keys:
+        :return:
+        """
+        if not (self.enabled or self._hooks) or not keys:
+            return
+        self._evict(list(keys))
+        try:
+            if self.enabled:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    for key in keys:
+                        self._bump(pipe, key)
+                    pipe.delete(*keys)
+                    await pipe.execute()
+            await self.redis.publish(self.channel, ujson.dumps({'origin': self.origin, 'keys': list(keys)}))
+            self.invalidations_sent += 1
+        except RedisError as e:
+            logger.warning(f'Failed to invalidate cache {keys} ({e})')
+            self.errors += 1
+
+    def _on_message(self, data: str):
+        try:
+            message = ujson.loads(data)
+            keys = list(message['keys'])
+        except (TypeError, ValueError, KeyError) as e:
+            logger.warning(f'Invalid cache invalidation {data} ({e})')
+            return
+        self.invalidations_received += 1
+        if message.get('origin') == self.origin:
+            return
+        self._evict(keys)
+        for hook in self._hooks:
+            hook(keys)
+
+    async def start(self):
+        """
+        start listening for invalidations of other processes, when the cache is enabled or a hook is registered
+        :return:
+        """
+        if (self.enabled or self._hooks) and self._listener is None:
+            self._stopping = False
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        """
+        :return:
+        """
+        if self._listener is not None:
+            # the cancellation can be swallowed by a message arriving at the same time,
+            # the flag ends the loop at the next message or poll timeout
+            self._stopping = True
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self):
+        delay = 1
+        while not self._stopping:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # anything published while we were not subscribed is lost, start from an empty L1
+                self._l1.clear()
+                self.listening = True
+                delay = 1
+                while not self._stopping:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
+                    if message is not None and message['type'] == 'message':
+                        self._on_message(message['data'])
+            except RedisError as e:
+                logger.warning(f'Cache invalidation listener disconnected, retry in {delay}s ({e})')
+                self.errors += 1
+            finally:
+                self.listening = False
+                self._l1.clear()
+                await pubsub.aclose()
+            if self._stopping:
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        reads = self.l1_hits + self.l2_hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'listening': self.listening,
+            'l1_keys': len(self._l1),
+            'l1_hits': self.l1_hits,
+            'l2_hits': self.l2_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.l1_hits + self.l2_hits) / reads, 4) if reads else None,
+            'errors': self.errors,
+            'invalidations_sent': self.invalidations_sent,
+            'invalidations_received': self.invalidations_received,
+        }
+
+
+shared_cache = SharedCache(
+    channel=get_redis_key('cache:invalidate'),
+    l1_ttl=settings.CACHE_L1_TTL,
+    l2_ttl=settings.CACHE_L2_TTL,
+    enabled=settings.CACHE_ENABLED
+)
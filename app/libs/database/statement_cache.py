@@ -0,0 +1,324 @@
+"""
+Compiled statement cache
+"""
+import re
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.sql import elements, functions, selectable, dml, schema
+from sqlalchemy.sql.type_api import TypeEngine
+
+__all__ = ['CompiledStatement', 'StatementCache', 'statement_shape']
+
+_ANON_ID = re.compile(r'%\((\d+) ')
+
+
+class _Uncacheable(Exception):
+    """The statement contains a construct the shape walker does not understand"""
+
+
+class CompiledStatement(NamedTuple):
+    """Final `$n` SQL text and the position of each `$n` in the bind list of the shape"""
+    sql: str
+    positions: Tuple[int, ...]
+
+
+class _ShapeWalker:
+    """
+    Walk a SQLAlchemy 1.3 expression tree and produce a hashable key that only depends on
+    the SQL it compiles to, collecting the bind parameters in walk order along the way.
+    Unknown constructs raise _Uncacheable so they always go through the compiler.
+    """
+
+    def __init__(self):
+        self.binds: List[elements.BindParameter] = []
+        self._anon: Dict[str, int] = {}
+
+    def name(self, value) -> Any:
+        if value is None:
+            return None
+        if isinstance(value, elements._anonymous_label):  # noqa
+            return 'anon', _ANON_ID.sub(self._anon_index, value)
+        return str(value), getattr(value, 'quote', None)
+
+    def _anon_index(self, match: re.Match) -> str:
+        return f'%({self._anon.setdefault(match.group(1), len(self._anon))} '
+
+    def walk(self, element) -> Hashable:
+        if element is None:
+            return None
+        visit = _VISITORS_BY_TYPE.get(type(element))
+        if visit is None:
+            visit = _resolve_visitor(type(element))
+        return visit(self, element)
+
+    def walk_all(self, items) -> tuple:
+        return tuple(self.walk(item) for item in items)
+
+    def from_name(self, from_clause) -> Hashable:
+        if from_clause is None:
+            return None
+        if isinstance(from_clause, selectable.TableClause):
+            return 'table', from_clause.schema if isinstance(from_clause, schema.Table) else None, self.name(from_clause.name)
+        if isinstance(from_clause, selectable.Alias):
+            return 'alias', self.name(from_clause.name)
+        raise _Uncacheable(type(from_clause))
+
+
+def _type_key(type_: TypeEngine) -> Hashable:
+    # the postgresql compiler renders JSON and ARRAY operators after the type of the expression,
+    # data['a'].as_string() and data['a'].as_integer() only differ in their type
+    return type(type_), repr(type_)
+
+
+def _visit_bind(walker: _ShapeWalker, bind: elements.BindParameter):
+    if bind.expanding or bind.isoutparam:
+        raise _Uncacheable('expanding bind')
+    walker.binds.append(bind)
+    return 'bind', walker.name(bind.key), type(bind.type)
+
+
+def _visit_column(walker: _ShapeWalker, column: elements.ColumnClause):
+    return 'column', walker.name(column.name), column.is_literal, walker.from_name(column.table)
+
+
+def _visit_table(walker: _ShapeWalker, table: selectable.TableClause):
+    return walker.from_name(table)
+
+
+def _visit_label(walker: _ShapeWalker, label: elements.Label):
+    return 'label', walker.name(label.name), _type_key(label.type), walker.walk(label.element)
+
+
+def _visit_binary(walker: _ShapeWalker, binary: elements.BinaryExpression):
+    modifiers = tuple(sorted((key, repr(value)) for key, value in binary.modifiers.items()))
+    return (
+        'binary', type(binary), binary.operator, binary.negate, modifiers, _type_key(binary.type),
+        walker.walk(binary.left), walker.walk(binary.right)
+    )
+
+
+def _visit_unary(walker: _ShapeWalker, unary: elements.UnaryExpression):
+    return 'unary', type(unary), unary.operator, unary.modifier, _type_key(unary.type), walker.walk(unary.element)
+
+
+def _visit_clause_list(walker: _ShapeWalker, clause_list: elements.ClauseList):
+    return (
+        'list', type(clause_list), clause_list.operator, clause_list.group, clause_list.group_contents,
+        walker.walk_all(clause_list.clauses)
+    )
+
+
+def _visit_grouping(walker: _ShapeWalker, grouping):
+    return 'grouping', type(grouping), walker.walk(grouping.element)
+
+
+def _visit_constant(_: _ShapeWalker, element):
+    return 'constant', type(element)
+
+
+def _visit_text(_: _ShapeWalker, text: elements.TextClause):
+    if text._bindparams:  # noqa
+        raise _Uncacheable('text with bind parameters')
+    return 'text', text.text
+
+
+def _visit_cast(walker: _ShapeWalker, cast: elements.Cast):
+    return 'cast', _type_key(cast.type), walker.walk(cast.clause)
+
+
+def _visit_label_reference(walker: _ShapeWalker, reference):
+    return 'label_reference', type(reference), walker.walk(reference.element)
+
+
+def _visit_textual_label_reference(_: _ShapeWalker, reference):
+    return 'textual_label_reference', reference.element
+
+
+def _visit_function(walker: _ShapeWalker, function: functions.FunctionElement):
+    return (
+        'function', type(function), getattr(function, 'name', None), tuple(getattr(function, 'packagenames', ())),
+        _type_key(function.type), walker.walk(function.clause_expr)
+    )
+
+
+def _visit_over(walker: _ShapeWalker, over: elements.Over):
+    return (
+        'over', over.range_, over.rows,
+        walker.walk(over.element), walker.walk(over.partition_by), walker.walk(over.order_by)
+    )
+
+
+def _visit_join(walker: _ShapeWalker, join: selectable.Join):
+    return 'join', join.isouter, join.full, walker.walk(join.left), walker.walk(join.right), walker.walk(join.onclause)
+
+
+def _visit_alias(walker: _ShapeWalker, alias: selectable.Alias):
+    if isinstance(alias, selectable.CTE):
+        if alias._restates or alias._prefixes or alias._suffixes or alias._cte_alias is not None:  # noqa
+            raise _Uncacheable('cte variant')
+        return 'cte', walker.name(alias.name), alias.recursive, walker.walk(alias.element)
+    if type(alias) is not selectable.Alias:
+        raise _Uncacheable(type(alias))
+    return 'alias', walker.name(alias.name), walker.walk(alias.element)
+
+
+def _visit_select(walker: _ShapeWalker, select: selectable.Select):
+    # pylint: disable=protected-access
+    if (
+        select._for_update_arg is not None or
+        select._prefixes or select._suffixes or select._hints or select._statement_hints or
+        select._correlate or select._correlate_except is not None or
+        select._execution_options
+    ):
+        raise _Uncacheable('select variant')
+    distinct = select._distinct
+    if isinstance(distinct, (list, tuple)):
+        distinct = walker.walk_all(distinct)
+    return (
+        'select', select.use_labels, select._auto_correlate, distinct,
+        walker.walk_all(select._raw_columns),
+        walker.walk_all(select._from_obj),
+        walker.walk(select._whereclause),
+        walker.walk(select._group_by_clause),
+        walker.walk(select._having),
+        walker.walk(select._order_by_clause),
+        walker.walk(select._limit_clause),
+        walker.walk(select._offset_clause),
+    )
+
+
+def _visit_delete(walker: _ShapeWalker, delete: dml.Delete):
+    # pylint: disable=protected-access
+    if delete._returning or delete._prefixes or delete._hints or delete._extra_froms:
+        raise _Uncacheable('delete variant')
+    return 'delete', walker.walk(delete.table), walker.walk(delete._whereclause)
+
+
+_VISITORS: List[Tuple[type, Callable]] = [
+    (elements.BindParameter, _visit_bind),
+    (elements.Label, _visit_label),
+    (elements.ColumnClause, _visit_column),
+    (selectable.TableClause, _visit_table),
+    (elements.BinaryExpression, _visit_binary),
+    (elements.UnaryExpression, _visit_unary),
+    (elements.ClauseList, _visit_clause_list),
+    (selectable.ScalarSelect, _visit_grouping),
+    (elements.Grouping, _visit_grouping),
+    (selectable.FromGrouping, _visit_grouping),
+    (elements.Null, _visit_constant),
+    (elements.True_, _visit_constant),
+    (elements.False_, _visit_constant),
+    (elements.TextClause, _visit_text),
+    (elements.Cast, _visit_cast),
+    (elements._label_reference, _visit_label_reference),  # noqa
+    (elements._textual_label_reference, _visit_textual_label_reference),  # noqa
+    (elements.Over, _visit_over),
+    (functions.FunctionElement, _visit_function),
+    (selectable.Join, _visit_join),
+    (selectable.Alias, _visit_alias),
+    (selectable.Select, _visit_select),
+    (dml.Delete, _visit_delete),
+]
+_VISITORS_BY_TYPE: Dict[type, Callable] = {}
+
+# these subclasses compile differently from their base class
+_UNSUPPORTED = (
+    elements.Case,
+    elements.TypeCoerce,
+    elements.CollectionAggregate,
+    elements.AsBoolean,
+    elements.IndexExpression,
+    functions.FunctionAsBinary,
+    selectable.Lateral,
+    selectable.TableSample,
+    selectable.Exists,
+    selectable.CompoundSelect,
+    selectable.TextAsFrom,
+    selectable.SelectBase,
+)
+
+
+def _raise_uncacheable(_: _ShapeWalker, element):
+    raise _Uncacheable(type(element))
+
+
+def _resolve_visitor(element_type: type) -> Callable:
+    visit = _raise_uncacheable
+    if not issubclass(element_type, _UNSUPPORTED) or issubclass(element_type, selectable.Select):
+        for base, candidate in _VISITORS:
+            if issubclass(element_type, base):
+                visit = candidate
+                break
+    _VISITORS_BY_TYPE[element_type] = visit
+    return visit
+
+
+def statement_shape(statement) -> Optional[Tuple[Hashable, List[elements.BindParameter]]]:
+    """
+    structural key of a statement and its bind parameters in walk order,
+    None when the statement cannot be cached
+    :param statement:
+    :return:
+    """
+    walker = _ShapeWalker()
+    try:
+        key = walker.walk(statement)
+    except _Uncacheable:
+        return None
+    return key, walker.binds
+
+
+class StatementCache:
+    """LRU cache of compiled statements keyed on their structural shape"""
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Hashable, CompiledStatement] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def get(self, key: Hashable) -> Optional[CompiledStatement]:
+        """
+        :param key:
+        :return:
+        """
+        compiled = self._entries.get(key)
+        if compiled is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return compiled
+
+    def put(self, key: Hashable, compiled: CompiledStatement):
+        """
+        :param key:
+        :param compiled:
+        :return:
+        """
+        self._entries[key] = compiled
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = self.uncacheable = 0
+
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'uncacheable': self.uncacheable,
+        }
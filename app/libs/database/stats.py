@@ -0,0 +1,20 @@
+"""
+Database runtime stats
+"""
+from app.libs.database.aio_orm import prepared_statement_cache, replicas, statement_cache
+from app.libs.database.aio_pg import pool_stats
+
+__all__ = ['database_stats']
+
+
+def database_stats() -> dict:
+    """
+    pools, replicas and statement caches of this process
+    :return:
+    """
+    return {
+        'pools': pool_stats(),
+        'replicas': replicas.stats(),
+        'statement_cache': statement_cache.stats(),
+        'prepared_statements': prepared_statement_cache.stats(),
+    }
@@ -0,0 +1,331 @@
+"""
+Write-behind buffer of upserts
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import asyncpg
+
+from app.config import settings
+from app.libs.database.aio_orm import Session, TableTypes
+from app.libs.database.pool_metrics import LatencyHistogram
+from app.libs.logger import logger
+
+__all__ = ['WriteBehindBuffer', 'write_behind']
+
+OnFlushed = Callable[[], Awaitable[Any]]
+Row = Tuple[dict, Optional[OnFlushed]]
+# the database is unreachable, every row is kept for the next flush
+CONNECTION_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.InterfaceError, asyncpg.PostgresConnectionError)
+
+
+class _TableBuffer:
+    __slots__ = ('table', 'conflict_cols', 'update', 'rows', 'attempts')
+
+    def __init__(self, table: TableTypes, conflict_cols: Sequence[str], update: bool):
+        self.table = table
+        self.conflict_cols = tuple(conflict_cols)
+        self.update = update
+        # key of the conflict columns: merged record and the callback of its latest put
+        self.rows: Dict[tuple, Row] = {}
+        # key of the conflict columns: failed writes of the row
+        self.attempts: Dict[tuple, int] = {}
+
+    @property
+    def name(self) -> str:
+        return getattr(self.table, '__tablename__', str(self.table))
+
+
+class WriteBehindBuffer:
+    """
+    Upserts queued in memory, coalesced by the conflict columns of their table and written in one
+    transaction every flush_interval seconds or as soon as max_rows are pending, tables in the
+    order they were registered. Each table is written with Session.bulk_upsert, records with the
+    same columns in one COPY and merge, so a column missing from a record keeps its stored value.
+    A flush failing on the connection puts its rows back under the rows queued since. A flush the
+    database rejects is written again a row at a time, a rejected row is put back and dropped once
+    it failed max_attempts flushes, so it does not hold back the other rows.
+    """
+
+    def __init__(self, flush_interval: float = 0.2, max_rows: int = 500, max_attempts: int = 5, enabled: bool = True):
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.max_attempts = max_attempts
+        self.enabled = enabled
+        self.session: Optional[Session] = None
+        self._tables: Dict[Any, _TableBuffer] = {}
+        self._lock = asyncio.Lock()
+        self._full = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.queued = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped = 0
+        self.flush_latency = LatencyHistogram()
+
+    @property
+    def running(self) -> bool:
+        """
+        the flusher is running, rows put now are written without waiting for a caller
+        :return:
+        """
+        return self._flusher is not None and not self._stopping
+
+    @property
+    def pending(self) -> int:
+        """
+        :return:
+        """
+        return sum(len(buffer.rows) for buffer in self._tables.values())
+
+    def has_pending(self, table: TableTypes, **values) -> bool:
+        """
+        :param table: a registered table
+        :param values: column values of the rows, every row of the table when empty
+        :return: a pending row of the table has the values
+        """
+        rows = self._tables[table].rows
+        if not values:
+            return bool(rows)
+        return any(
+            all(record.get(column) == value for column, value in values.items())
+            for record, _ in rows.values()
+        )
+
+    def register(self, table: TableTypes, conflict_cols: Sequence[str], update: bool = True):
+        """
+        :param table:
+        :param conflict_cols: columns of the primary key or unique constraint rows are coalesced on
+        :param update: update the stored row on conflict, otherwise only insert missing rows
+        :return:
+        """
+        self._tables[table] = _TableBuffer(table, conflict_cols, update)
+
+    def put(self, table: TableTypes, record: dict, on_flushed: OnFlushed = None):
+        """
+        queue an upsert, a pending upsert of the same row is merged with it
+        :param table: a registered table
+        :param record: column values
+        :param on_flushed: awaited after the transaction writing the row is committed
+        :return:
+        """
+        buffer = self._tables[table]
+        key = tuple(record[column] for column in buffer.conflict_cols)
+        self.queued += 1
+        pending = buffer.rows.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            # later values win, an insert-only row keeps what was queued first
+            record = {**pending[0], **record} if buffer.update else pending[0]
+        buffer.rows[key] = (record, on_flushed)
+        if self.pending >= self.max_rows:
+            self._full.set()
+
+    async def flush(self) -> int:
+        """
+        write every pending row
+        :return: rows written
+        """
+        async with self._lock:
+            batches = [(buffer, buffer.rows) for buffer in self._tables.values() if buffer.rows]
+            if not batches:
+                return 0
+            for buffer, _ in batches:
+                buffer.rows = {}
+            start = time.perf_counter()
+            try:
+                await self._commit(batches)
+            except CONNECTION_ERRORS:
+                self.failed_flushes += 1
+                self._restore(batches)
+                raise
+            except Exception as e:  # pylint: disable=broad-except
+                self.failed_flushes += 1
+                logger.warning(f'Failed to flush the write-behind buffer, writing its rows one at a time ({e})')
+                batches = await self._commit_rows(batches)
+            self.flush_latency.observe(time.perf_counter() - start)
+            for buffer, rows in batches:
+                if buffer.attempts:
+                    for key in rows:
+                        buffer.attempts.pop(key, None)
+        count = sum(len(rows) for _, rows in batches)
+        self.flushes += 1
+        self.flushed += count
+        for _, rows in batches:
+            for _, on_flushed in rows.values():
+                if on_flushed is not None:
+                    await on_flushed()
+        return count
+
+    async def _commit(self, batches: List[Tuple[_TableBuffer, Dict[tuple, Row]]]):
+        if self.session is None:
+            self.session = Session()
+        try:
+            for buffer, rows in batches:
+                await self._write(buffer, [record for record, _ in rows.values()])
+            await self.session.commit()
+        except Exception:
+            await self.session.rollback()
+            raise
+        finally:
+            await self.session.close()
+
+    async def _commit_rows(
+        self,
+        batches: List[Tuple[_TableBuffer, Dict[tuple, Row]]]
+    ) -> List[Tuple[_TableBuffer, Dict[tuple, Row]]]:
+        """
+        write the rows of a rejected flush one transaction each
+        :param batches:
+        :return: the rows written
+        """
+        written = []
+        for index, (buffer, rows) in enumerate(batches):
+            written.append((buffer, {}))
+            tried = set()
+            for key, row in rows.items():
+                try:
+                    await self._commit([(buffer, {key: row})])
+                except CONNECTION_ERRORS:
+                    # the rows not tried yet are kept as they are
+                    untried = {key: row for key, row in rows.items() if key not in tried}
+                    self._restore([(buffer, untried)] + batches[index + 1:])
+                    raise
+                except Exception as e:  # pylint: disable=broad-except
+                    self._reject(buffer, key, row, e)
+                else:
+                    written[-1][1][key] = row
+                tried.add(key)
+        return written
+
+    def _reject(self, buffer: _TableBuffer, key: tuple, row: Row, error: Exception):
+        attempts = buffer.attempts.get(key, 0) + 1
+        if attempts < self.max_attempts:
+            buffer.attempts[key] = attempts
+            self._restore([(buffer, {key: row})])
+            return
+        buffer.attempts.pop(key, None)
+        self.dropped += 1
+        logger.error(f'Dropped the write-behind row {key} of {buffer.name} after {attempts} attempts ({error}): {row[0]}')
+
+    async def _write(self, buffer: _TableBuffer, records: List[dict]):
+        shapes: Dict[tuple, List[dict]] = {}
+        for record in records:
+            shapes.setdefault(tuple(sorted(record)), []).append(record)
+        for columns, shape in shapes.items():
+            await self.session.bulk_upsert(
+                buffer.table,
+                records=[tuple(record[column] for column in columns) for record in shape],
+                conflict_cols=buffer.conflict_cols,
+                update_cols=None if buffer.update else [],
+                columns=columns
+            )
+
+    @staticmethod
+    def _restore(batches: List[Tuple[_TableBuffer, Dict[tuple, Row]]]):
+        for buffer, rows in batches:
+            for key, (record, on_flushed) in rows.items():
+                newer = buffer.rows.get(key)
+                if newer is None:
+                    buffer.rows[key] = (record, on_flushed)
+                elif buffer.update:
+                    buffer.rows[key] = ({**record, **newer[0]}, newer[1])
+                else:
+                    buffer.rows[key] = (record, newer[1])
+
+    async def sync(self):
+        """
+        write pending rows before a direct write of the buffered tables
+        :return:
+        """
+        if self.pending:
+            await self.flush()
+
+    async def sync_read(self, *rows: Tuple[TableTypes, dict]):
+        """
+        write the pending rows a read depends on, a read of rows that are not pending does not wait
+        for a flush. A failed flush is logged and the read is served from what is committed
+        :param rows: tables and the column values of the rows read, an empty dict reads the whole table
+        :return:
+        """
+        if not any(self.has_pending(table, **values) for table, values in rows):
+            return
+        try:
+            await self.flush()
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f'Failed to flush the write-behind buffer before a read ({e})')
+
+    async def start(self):
+        """
+        :return:
+        """
+        if self.enabled and self._flusher is None:
+            self._stopping = False
+            self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self, attempts: int = 3):
+        """
+        stop the flusher and write what is still pending
+        :param attempts: flushes tried before the pending rows are given up
+        :return:
+        """
+        if self._flusher is not None:
+            self._stopping = True
+            self._full.set()
+            await self._flusher
+            self._flusher = None
+        for attempt in range(attempts):
+            try:
+                await self.sync()
+                return
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning(f'Failed to flush the write-behind buffer on shutdown, attempt {attempt + 1} ({e})')
+                await asyncio.sleep(self.flush_interval)
+        if self.pending:
+            logger.error(f'Lost {self.pending} write-behind rows on shutdown')
+
+    async def _run(self):
+        delay = self.flush_interval
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            if self._stopping:
+                return
+            try:
+                await self.sync()
+                delay = self.flush_interval
+            except Exception as e:  # pylint: disable=broad-except
+                delay = min(delay * 2, 30)
+                logger.warning(f'Failed to flush the write-behind buffer, retry in {delay}s ({e})')
+
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            'enabled': self.enabled,
+            'running': self.running,
+            'pending': self.pending,
+            'queued': self.queued,
+            'coalesced': self.coalesced,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'dropped': self.dropped,
+            'flush_latency': self.flush_latency.snapshot(),
+        }
+
+
+write_behind = WriteBehindBuffer(
+    flush_interval=settings.WRITE_BEHIND_INTERVAL_MS / 1000,
+    max_rows=settings.WRITE_BEHIND_MAX_ROWS,
+    max_attempts=settings.WRITE_BEHIND_MAX_ATTEMPTS,
+    enabled=settings.WRITE_BEHIND
+)
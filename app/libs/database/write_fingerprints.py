@@ -0,0 +1,156 @@
+"""
+Fingerprints of persisted rows
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import ujson
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.config import settings
+from app.libs.consts.redis_keys import get_redis_key
+from app.libs.database.aio_redis import RedisPool
+from app.libs.logger import logger
+
+__all__ = ['WriteFingerprints', 'write_fingerprints']
+
+
+class WriteFingerprints:
+    """
+    Fingerprint of the last values written for a row, so an idempotent upsert of the same values
+    can be skipped. Fingerprints live in a per-process LRU and, with use_redis, in Redis for the
+    other processes, both expire after ttl so a row changed outside these writers is written again
+    at the latest ttl seconds later. Writers that change the same rows must forget their keys.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        ttl: int = 3600,
+        max_size: int = 100_000,
+        enabled: bool = True,
+        use_redis: bool = True
+    ):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.max_size = max_size
+        self.enabled = enabled
+        self.use_redis = use_redis
+        self._redis: Optional[Redis] = None
+        self._fingerprints: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+        self.skipped = 0
+        self.written = 0
+        self.errors = 0
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = RedisPool().create()
+        return self._redis
+
+    @staticmethod
+    def fingerprint(data: dict) -> str:
+        """
+        :param data: values of the write
+        :return:
+        """
+        return hashlib.blake2b(ujson.dumps(data, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+    async def unchanged(self, key: str, fingerprint: str) -> bool:
+        """
+        the last write of key had the same fingerprint, count a skipped write when it had
+        :param key:
+        :param fingerprint:
+        :return:
+        """
+        if not self.enabled:
+            return False
+        entry = self._fingerprints.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._fingerprints.move_to_end(key)
+            stored = entry[1]
+        elif self.use_redis:
+            try:
+                stored = await self.redis.get(f'{self.prefix}:{key}')
+            except RedisError as e:
+                logger.warning(f'Failed to read write fingerprint {key} ({e})')
+                self.errors += 1
+                stored = None
+            if isinstance(stored, bytes):
+                stored = stored.decode()
+            if stored == fingerprint:
+                self._set(key, fingerprint)
+        else:
+            stored = None
+        if stored == fingerprint:
+            self.skipped += 1
+            return True
+        return False
+
+    async def remember(self, key: str, fingerprint: str):
+        """
+        record the fingerprint of a committed write
+        :param key:
+        :param fingerprint:
+        :return:
+        """
+        self.written += 1
+        if not self.enabled:
+            return
+        self._set(key, fingerprint)
+        if self.use_redis:
+            try:
+                await self.redis.set(f'{self.prefix}:{key}', fingerprint, ex=self.ttl)
+            except RedisError as e:
+                logger.warning(f'Failed to write write fingerprint {key} ({e})')
+                self.errors += 1
+
+    async def forget(self, *keys: str):
+        """
+        write the rows again on the next upsert, call after another writer changed them
+        :param keys:
+        :return:
+        """
+        if not self.enabled or not keys:
+            return
+        for key in keys:
+            self._fingerprints.pop(key, None)
+        if self.use_redis:
+            try:
+                await self.redis.delete(*(f'{self.prefix}:{key}' for key in keys))
+            except RedisError as e:
+                logger.warning(f'Failed to delete write fingerprints {keys} ({e})')
+                self.errors += 1
+
+    def _set(self, key: str, fingerprint: str):
+        self._fingerprints[key] = (time.monotonic() + self.ttl, fingerprint)
+        self._fingerprints.move_to_end(key)
+        while len(self._fingerprints) > self.max_size:
+            self._fingerprints.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        attempts = self.skipped + self.written
+        return {
+            'enabled': self.enabled,
+            'use_redis': self.use_redis,
+            'keys': len(self._fingerprints),
+            'skipped': self.skipped,
+            'written': self.written,
+            'skip_ratio': round(self.skipped / attempts, 4) if attempts else None,
+            'errors': self.errors,
+        }
+
+
+write_fingerprints = WriteFingerprints(
+    prefix=get_redis_key('fingerprint'),
+    ttl=settings.WRITE_FINGERPRINT_TTL,
+    max_size=settings.WRITE_FINGERPRINT_MAX_SIZE,
+    enabled=settings.WRITE_FINGERPRINTS,
+    use_redis=settings.WRITE_FINGERPRINT_REDIS
+)
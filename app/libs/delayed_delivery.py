@@ -0,0 +1,107 @@
+"""
+Delayed delivery of replies
+"""
+import asyncio
+import functools
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from app.libs.logger import logger
+
+__all__ = ['DelayedDelivery', 'delayed_delivery']
+
+Deliver = Callable[[], Awaitable[None]]
+
+
+class DelayedDelivery:
+    """
+    Runs a delivery after a delay in a task of its own, so the handler scheduling a reply returns
+    right away instead of waiting out the delay. Deliveries of one key, a chat, go out in the order
+    they were scheduled, and a reply sent without a delay waits for them with wait(key), so the
+    replies of a chat keep their order. stop delivers what is still waiting at once.
+    """
+
+    def __init__(self):
+        # task -> future that ends its wait early
+        self._tasks: Dict[asyncio.Task, asyncio.Future] = {}
+        # key -> its last scheduled delivery
+        self._keys: Dict[Hashable, asyncio.Task] = {}
+        self.scheduled = 0
+        self.delivered = 0
+        self.failed = 0
+
+    def schedule(self, delay: float, deliver: Deliver, key: Hashable = None) -> asyncio.Task:
+        """
+        :param delay: seconds to wait before deliver is awaited
+        :param deliver:
+        :param key: deliveries of a key are delivered one after another
+        :return:
+        """
+        self.scheduled += 1
+        wake = asyncio.get_running_loop().create_future()
+        previous = self._keys.get(key) if key is not None else None
+        task = asyncio.create_task(self._run(delay, wake, deliver, previous))
+        self._tasks[task] = wake
+        if key is not None:
+            self._keys[key] = task
+        task.add_done_callback(functools.partial(self._done, key))
+        return task
+
+    def _done(self, key: Any, task: asyncio.Task):
+        self._tasks.pop(task, None)
+        if key is not None and self._keys.get(key) is task:
+            del self._keys[key]
+
+    async def wait(self, key: Hashable):
+        """
+        wait for the deliveries scheduled for key, call before sending to it without a delay
+        :param key:
+        :return:
+        """
+        task = self._keys.get(key)
+        if task is not None and task is not asyncio.current_task():
+            await asyncio.wait([task])
+
+    async def _run(self, delay: float, wake: asyncio.Future, deliver: Deliver, previous: Optional[asyncio.Task]):
+        if delay > 0:
+            await asyncio.wait([wake], timeout=delay)
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await deliver()
+        except Exception as e:  # pylint: disable=broad-except
+            self.failed += 1
+            logger.exception(e)
+        else:
+            self.delivered += 1
+
+    @property
+    def pending(self) -> int:
+        """
+        :return:
+        """
+        return len(self._tasks)
+
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            'pending': self.pending,
+            'scheduled': self.scheduled,
+            'delivered': self.delivered,
+            'failed': self.failed,
+        }
+
+    async def stop(self):
+        """
+        deliver the waiting replies now and wait for them
+        :return:
+        """
+        for wake in self._tasks.values():
+            if not wake.done():
+                wake.set_result(None)
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+
+delayed_delivery = DelayedDelivery()
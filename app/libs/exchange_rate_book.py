@@ -0,0 +1,199 @@
+"""
+In-process book of vendor exchange rates
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from app.config import settings
+from app.libs.consts.enums import OperationType, PaymentAccountStatus
+from app.libs.consts.redis_keys import get_optimal_exchange_rate_key
+from app.libs.database.shared_cache import shared_cache
+
+__all__ = ['ExchangeRateBook', 'exchange_rate_book']
+
+
+class _Quote:
+    __slots__ = ('group_id', 'currency_id', 'buy_rate', 'sell_rate', 'updated_at')
+
+    def __init__(self, group_id: int, currency_id: UUID, buy_rate, sell_rate, updated_at: Optional[datetime]):
+        self.group_id = group_id
+        self.currency_id = currency_id
+        self.buy_rate = buy_rate
+        self.sell_rate = sell_rate
+        self.updated_at = updated_at.timestamp() if updated_at else 0
+
+
+class _Group:
+    __slots__ = ('title', 'status')
+
+    def __init__(self, title: Optional[str], status: Optional[str]):
+        self.title = title
+        self.status = status
+
+
+class ExchangeRateBook:
+    """
+    Vendor rates per currency symbol with the best PREPARING vendor of each side cached,
+    the lowest buy_rate for BUY and the highest sell_rate for SELL, ties go to the latest update.
+    A change of a rate or a group status only drops the cached best of the symbols it touches.
+    """
+
+    def __init__(self, max_age: float = 300):
+        self.max_age = max_age
+        self.lock = asyncio.Lock()
+        self._loaded_at: Optional[float] = None
+        self._quotes: Dict[str, Dict[Tuple[int, UUID], _Quote]] = {}
+        self._symbols: Dict[UUID, str] = {}
+        self._groups: Dict[int, _Group] = {}
+        self._group_symbols: Dict[int, Set[str]] = {}
+        self._best: Dict[Tuple[str, OperationType], Optional[dict]] = {}
+
+    @property
+    def is_fresh(self) -> bool:
+        """
+        the book was loaded and is younger than max_age
+        :return:
+        """
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.max_age
+
+    def invalidate(self):
+        """
+        reload from the database on the next lookup
+        :return:
+        """
+        self._loaded_at = None
+
+    def load(self, records: Iterable[dict]):
+        """
+        replace the book with rows of exchange rate joined with currency and telegram chat group
+        :param records: group_id, group_name, payment_account_status, currency_id, currency,
+            buy_rate, sell_rate, updated_at
+        :return:
+        """
+        self._quotes, self._symbols, self._groups, self._group_symbols, self._best = {}, {}, {}, {}, {}
+        for record in records:
+            group_id, currency_id, symbol = record['group_id'], record['currency_id'], record['currency']
+            self._symbols[currency_id] = symbol
+            self._groups[group_id] = _Group(record['group_name'], record['payment_account_status'])
+            self._group_symbols.setdefault(group_id, set()).add(symbol)
+            self._quotes.setdefault(symbol, {})[(group_id, currency_id)] = _Quote(
+                group_id, currency_id, record['buy_rate'], record['sell_rate'], record['updated_at']
+            )
+        self._loaded_at = time.monotonic()
+
+    def update_rates(
+        self,
+        group_id: int,
+        rates: Iterable[Tuple[UUID, Optional[float], Optional[float]]],
+        updated_at: datetime
+    ):
+        """
+        apply rates written by batch_update_exchange_rate, a group or currency the book does not
+        know yet makes the next lookup reload the book
+        :param group_id:
+        :param rates: currency_id, buy_rate, sell_rate
+        :param updated_at:
+        :return:
+        """
+        if group_id not in self._groups:
+            self.invalidate()
+            return
+        for currency_id, buy_rate, sell_rate in rates:
+            symbol = self._symbols.get(currency_id)
+            if symbol is None:
+                self.invalidate()
+                return
+            self._quotes.setdefault(symbol, {})[(group_id, currency_id)] = _Quote(
+                group_id, currency_id, buy_rate, sell_rate, updated_at
+            )
+            self._group_symbols.setdefault(group_id, set()).add(symbol)
+            self._drop_best(symbol)
+
+    def update_group_status(self, group_id: int, status: PaymentAccountStatus):
+        """
+        apply a payment account status written by update_payment_account_status
+        :param group_id:
+        :param status:
+        :return:
+        """
+        group = self._groups.get(group_id)
+        if group is None:
+            # a group without rates never shows up in a lookup
+            return
+        group.status = status.value if isinstance(status, PaymentAccountStatus) else status
+        for symbol in self._group_symbols.get(group_id, ()):
+            self._drop_best(symbol)
+
+    def update_group(self, group_id: int, title: str, status: Optional[PaymentAccountStatus] = None):
+        """
+        apply a title and payment account status written by set_group
+        :param group_id:
+        :param title:
+        :param status: None keeps the status of the book
+        :return:
+        """
+        group = self._groups.get(group_id)
+        if group is None:
+            return
+        group.title = title
+        if status is not None:
+            group.status = status.value if isinstance(status, PaymentAccountStatus) else status
+        for symbol in self._group_symbols.get(group_id, ()):
+            self._drop_best(symbol)
+
+    def _drop_best(self, symbol: str):
+        self._best.pop((symbol, OperationType.BUY), None)
+        self._best.pop((symbol, OperationType.SELL), None)
+
+    def best(self, currency: str, operation_type: OperationType) -> Optional[dict]:
+        """
+        :param currency: currency symbol
+        :param operation_type:
+        :return: group_id, group_name, currency_id, currency, buy_rate and sell_rate of the optimal
+            PREPARING vendor, None when no vendor has a rate for the side
+        """
+        key = (currency, operation_type)
+        try:
+            return self._best[key]
+        except KeyError:
+            result = self._best[key] = self._find_best(currency, operation_type)
+            return result
+
+    def _find_best(self, currency: str, operation_type: OperationType) -> Optional[dict]:
+        is_buy = operation_type == OperationType.BUY
+        best, best_key = None, None
+        for quote in self._quotes.get(currency, {}).values():
+            rate = quote.buy_rate if is_buy else quote.sell_rate
+            if rate is None or self._groups[quote.group_id].status != PaymentAccountStatus.PREPARING.value:
+                continue
+            # lower buy rate or higher sell rate first, then the latest update
+            key = (rate if is_buy else -rate, -quote.updated_at)
+            if best_key is None or key < best_key:
+                best, best_key = quote, key
+        if best is None:
+            return None
+        return {
+            'group_id': best.group_id,
+            'group_name': self._groups[best.group_id].title,
+            'currency_id': best.currency_id,
+            'currency': currency,
+            'buy_rate': best.buy_rate,
+            'sell_rate': best.sell_rate,
+        }
+
+
+exchange_rate_book = ExchangeRateBook(max_age=settings.EXCHANGE_RATE_BOOK_MAX_AGE)
+
+
+def _reload_on_invalidate(keys: List[str]):
+    # another process changed a rate or a vendor status
+    if get_optimal_exchange_rate_key() in keys:
+        exchange_rate_book.invalidate()
+
+
+# the listener of the shared cache runs for the hook, also with CACHE_ENABLED off
+if settings.EXCHANGE_RATE_BOOK:
+    shared_cache.on_invalidate(_reload_on_invalidate)
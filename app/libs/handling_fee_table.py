@@ -0,0 +1,164 @@
+"""
+In-process table of resolved handling fees
+"""
+import asyncio
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from app.config import settings
+from app.libs.consts.redis_keys import get_handling_fee_table_key
+from app.libs.database.shared_cache import shared_cache
+
+__all__ = ['HandlingFeeTable', 'handling_fee_table']
+
+
+class HandlingFeeTable:
+    """
+    Effective handling fee item per (group_id, currency_id): the item of the config of the group,
+    or the item of the global config when the group has no config or its config has no item for
+    the currency. A group the table does not know has no config, its lookups use the global config.
+    A change of an item or of the config of a group only recomputes the rows it touches.
+    """
+
+    def __init__(self, max_age: float = 300):
+        self.max_age = max_age
+        self.lock = asyncio.Lock()
+        self._loaded_at: Optional[float] = None
+        self._items: Dict[UUID, Dict[UUID, Any]] = {}
+        self._global_config_id: Optional[UUID] = None
+        self._group_configs: Dict[int, Optional[UUID]] = {}
+        self._config_groups: Dict[UUID, Set[int]] = {}
+        self._resolved: Dict[Tuple[int, UUID], Any] = {}
+
+    @property
+    def is_fresh(self) -> bool:
+        """
+        the table was loaded and is younger than max_age
+        :return:
+        """
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.max_age
+
+    def invalidate(self):
+        """
+        reload from the database on the next lookup
+        :return:
+        """
+        self._loaded_at = None
+
+    def load(
+        self,
+        global_config_id: Optional[UUID],
+        items: Iterable[Tuple[UUID, Any]],
+        groups: Iterable[Tuple[int, Optional[UUID]]]
+    ):
+        """
+        replace the table
+        :param global_config_id: id of the global config, None without one
+        :param items: handling fee config id and item, the item has a currency_id
+        :param groups: telegram chat group id and its handling fee config id
+        :return:
+        """
+        self._items, self._group_configs, self._config_groups = {}, {}, {}
+        self._global_config_id = global_config_id
+        for config_id, item in items:
+            self._items.setdefault(config_id, {})[item.currency_id] = item
+        for group_id, config_id in groups:
+            self._set_group_config(group_id, config_id)
+        self._rebuild()
+        self._loaded_at = time.monotonic()
+
+    def update_item(self, config_id: UUID, item: Any):
+        """
+        apply an item written by create_handling_fee_config_item or update_handling_fee_config_item
+        :param config_id:
+        :param item:
+        :return:
+        """
+        self._items.setdefault(config_id, {})[item.currency_id] = item
+        if config_id == self._global_config_id:
+            groups = self._group_configs.keys()
+        else:
+            groups = self._config_groups.get(config_id, ())
+        for group_id in groups:
+            self._resolve(group_id, item.currency_id)
+
+    def update_config(self, config_id: UUID, is_global: bool):
+        """
+        apply the global flag written by create_handling_fee_config or update_handling_fee_config
+        :param config_id:
+        :param is_global:
+        :return:
+        """
+        if is_global and self._global_config_id != config_id:
+            self._global_config_id = config_id
+        elif not is_global and self._global_config_id == config_id:
+            self._global_config_id = None
+        else:
+            return
+        # the fallback of every group changed
+        self._rebuild()
+
+    def update_group(self, group_id: int, config_id: Optional[UUID]):
+        """
+        apply the handling fee config of a group written by update_group
+        :param group_id:
+        :param config_id:
+        :return:
+        """
+        self._set_group_config(group_id, config_id)
+        for key in [key for key in self._resolved if key[0] == group_id]:
+            del self._resolved[key]
+        for currency_id in self._currencies(config_id):
+            self._resolve(group_id, currency_id)
+
+    def get(self, group_id: int, currency_id: UUID) -> Optional[Any]:
+        """
+        :param group_id:
+        :param currency_id:
+        :return: effective item of the group for the currency, None when neither the config of
+            the group nor the global config has one
+        """
+        if group_id in self._group_configs:
+            return self._resolved.get((group_id, currency_id))
+        return self._items.get(self._global_config_id, {}).get(currency_id)
+
+    def _set_group_config(self, group_id: int, config_id: Optional[UUID]):
+        previous = self._group_configs.get(group_id)
+        if previous is not None:
+            self._config_groups.get(previous, set()).discard(group_id)
+        self._group_configs[group_id] = config_id
+        if config_id is not None:
+            self._config_groups.setdefault(config_id, set()).add(group_id)
+
+    def _currencies(self, config_id: Optional[UUID]) -> Set[UUID]:
+        return set(self._items.get(config_id, {})) | set(self._items.get(self._global_config_id, {}))
+
+    def _rebuild(self):
+        self._resolved = {}
+        for group_id, config_id in self._group_configs.items():
+            for currency_id in self._currencies(config_id):
+                self._resolve(group_id, currency_id)
+
+    def _resolve(self, group_id: int, currency_id: UUID):
+        item = self._items.get(self._group_configs[group_id], {}).get(currency_id)
+        if item is None:
+            item = self._items.get(self._global_config_id, {}).get(currency_id)
+        if item is None:
+            self._resolved.pop((group_id, currency_id), None)
+        else:
+            self._resolved[(group_id, currency_id)] = item
+
+
+handling_fee_table = HandlingFeeTable(max_age=settings.HANDLING_FEE_TABLE_MAX_AGE)
+
+
+def _reload_on_invalidate(keys: List[str]):
+    # another process changed a handling fee config or the config of a group
+    if get_handling_fee_table_key() in keys:
+        handling_fee_table.invalidate()
+
+
+# the listener of the shared cache runs for the hook, also with CACHE_ENABLED off
+if settings.HANDLING_FEE_TABLE:
+    shared_cache.on_invalidate(_reload_on_invalidate)
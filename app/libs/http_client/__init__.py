@@ -1,8 +1,13 @@
 """
 Top-level package for http_client.
 """
+from .circuit_breaker import CircuitOpenError
+from .deadline import DeadlineExceeded, deadline
 from .http_client import http_client
 
 __all__ = [
+    'CircuitOpenError',
+    'DeadlineExceeded',
+    'deadline',
     'http_client'
 ]
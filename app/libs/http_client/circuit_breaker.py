@@ -0,0 +1,154 @@
+"""
+Circuit breaker and retry budget of a host
+"""
+import random
+import time
+from typing import Optional
+
+import httpx
+
+__all__ = ['CircuitBreaker', 'CircuitOpenError', 'RetryBudget', 'backoff_delay']
+
+
+class CircuitOpenError(httpx.TransportError):
+    """The circuit breaker of the host is open, the request was not sent"""
+
+
+class CircuitBreaker:
+    """
+    Closed until failure_threshold requests in a row failed, then open: requests fail fast for
+    reset_timeout seconds. After that it is half-open and lets one trial request through, the
+    breaker closes when it succeeds and opens again when it fails. A trial that never reports back
+    is given up after another reset_timeout.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._changed_at = time.monotonic()
+        self._trial_at: Optional[float] = None
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        """
+        :return:
+        """
+        if self._state == self.OPEN and time.monotonic() - self._changed_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def allow(self) -> bool:
+        """
+        a request may be sent now, counts a rejected request when it may not
+        :return:
+        """
+        now = time.monotonic()
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and (self._trial_at is None or now - self._trial_at >= self.reset_timeout):
+            self._set_state(self.HALF_OPEN, now)
+            self._trial_at = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        """
+        :return:
+        """
+        self.successes += 1
+        self._failures = 0
+        self._trial_at = None
+        if self._state != self.CLOSED:
+            self._set_state(self.CLOSED, time.monotonic())
+
+    def record_failure(self):
+        """
+        :return:
+        """
+        self.failures += 1
+        self._failures += 1
+        self._trial_at = None
+        if self._state == self.HALF_OPEN or (self._state == self.CLOSED and self._failures >= self.failure_threshold):
+            self.opened += 1
+            self._set_state(self.OPEN, time.monotonic())
+
+    def _set_state(self, state: str, now: float):
+        if state != self._state:
+            self._state = state
+            self._changed_at = now
+
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            'state': self.state,
+            'consecutive_failures': self._failures,
+            'successes': self.successes,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'opened': self.opened,
+        }
+
+
+class RetryBudget:
+    """
+    Retries of a host are paid from a balance every request adds ratio to, capped at max_balance,
+    so retries stay a fraction of the traffic when the host degrades
+    """
+
+    def __init__(self, ratio: float = 0.2, max_balance: float = 10):
+        self.ratio = ratio
+        self.max_balance = max_balance
+        self._balance = max_balance
+        self.retries = 0
+        self.exhausted = 0
+
+    def deposit(self):
+        """
+        :return:
+        """
+        self._balance = min(self.max_balance, self._balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        """
+        :return: a retry may be made
+        """
+        if self._balance < 1:
+            self.exhausted += 1
+            return False
+        self._balance -= 1
+        self.retries += 1
+        return True
+
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            'balance': round(self._balance, 2),
+            'retries': self.retries,
+            'exhausted': self.exhausted,
+        }
+
+
+def backoff_delay(attempt: int, interval: float, max_delay: float) -> float:
+    """
+    exponential backoff with full jitter
+    :param attempt: retries made so far
+    :param interval: delay before the first retry
+    :param max_delay:
+    :return: seconds to wait before the next attempt
+    """
+    return random.uniform(0, min(max_delay, interval * 2 ** attempt))
@@ -0,0 +1,47 @@
+"""
+Request deadlines
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+import httpx
+
+__all__ = ['DeadlineExceeded', 'deadline', 'remaining_time']
+
+_deadline: ContextVar[Optional[float]] = ContextVar('http_client_deadline', default=None)
+
+
+class DeadlineExceeded(httpx.TimeoutException):
+    """The deadline of the current update or request has passed"""
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """
+    bound the time http requests made inside the block may take, timeouts and retries are cut to fit.
+    A deadline set further out keeps the earlier one
+    :param seconds: None for no deadline
+    :return:
+    """
+    if seconds is None:
+        yield
+        return
+    expires = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(expires if current is None else min(current, expires))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """
+    :return: seconds until the current deadline, None without a deadline
+    """
+    expires = _deadline.get()
+    if expires is None:
+        return None
+    return expires - time.monotonic()
@@ -6,12 +6,15 @@ import sys
 import time
 from copy import deepcopy
 from dataclasses import dataclass
-from typing import Any, Dict, Optional, Union, overload, AsyncIterator
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Any, Dict, Optional, Tuple, Union, overload, AsyncIterator
 
 import httpx
 from httpx._types import FileTypes  # noqa
 
 from app.config import settings
+from app.libs.http_client.circuit_breaker import CircuitBreaker, CircuitOpenError, RetryBudget, backoff_delay
+from app.libs.http_client.deadline import DeadlineExceeded, remaining_time
 
 request_logger = logging.getLogger("http_client")
 handler = logging.StreamHandler(sys.stdout)
@@ -153,10 +156,17 @@ class HttpResponse:
 class HttpSession:
     """HttpSession"""
 
-    def __init__(self, url: str, defaults: HttpDefaults = None, options: HttpOptions = None):
+    def __init__(
+        self,
+        url: str,
+        defaults: HttpDefaults = None,
+        options: HttpOptions = None,
+        http_client: 'HttpClient' = None
+    ):
         self._options = options or HttpOptions()
         self._options.url = url
         self._client: Optional[httpx.AsyncClient] = None
+        self._http_client = http_client
         self._from_session: bool = False
         self.defaults: HttpDefaults = defaults
         self._st = time.time()
@@ -169,6 +179,12 @@ class HttpSession:
     async def _ensure_client_build(self):
         if self._client:
             return True
+        if self._http_client is not None:
+            self._client = self._http_client.pooled_client(self._build_url(), verify=self._options.verify)
+            if self._client is not None:
+                # owned by the HttpClient, kept open for the next request
+                self._from_session = True
+                return True
         self._client = httpx.AsyncClient(
             timeout=self._options.timeout or self.defaults.timeout,
             verify=self._options.verify
@@ -181,6 +197,8 @@ class HttpSession:
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._from_session:
+            return
         await self._client.__aexit__(exc_type, exc_val, exc_tb)
 
     @property
@@ -422,6 +440,65 @@ class HttpSession:
         self._log_verbose(lambda: f'{self._format_log_response(response)}')
         return self._format_returns(response)
 
+    def _host_guards(self, url: str) -> Tuple[Optional[CircuitBreaker], Optional[RetryBudget]]:
+        if self._http_client is None or not url.startswith('http'):
+            return None, None
+        host = httpx.URL(url).netloc.decode()
+        return self._http_client.breaker(host), self._http_client.retry_budget(host)
+
+    def _before_attempt(
+        self,
+        params: dict,
+        breaker: Optional[CircuitBreaker],
+        budget: Optional[RetryBudget],
+        attempt: int
+    ):
+        remaining = remaining_time()
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeadlineExceeded(f'Deadline exceeded before {self._options.url}')
+            params['timeout'] = min(self._options.timeout or self.defaults.timeout, remaining)
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError(f'Circuit breaker of {self._options.url} is open')
+        if budget is not None and attempt == 0:
+            budget.deposit()
+
+    def _retry_delay(self, attempt: int, is_last_time: bool, budget: Optional[RetryBudget]) -> Optional[float]:
+        """
+        :return: seconds to wait before the next attempt, None when there is none
+        """
+        if is_last_time:
+            return None
+        delay = 0
+        if self._options.retry_interval is not None:
+            max_backoff = self._http_client.max_backoff if self._http_client else self._options.retry_interval
+            delay = backoff_delay(attempt, self._options.retry_interval, max_backoff)
+        remaining = remaining_time()
+        if remaining is not None and remaining <= delay:
+            return None
+        if budget is not None and not budget.withdraw():
+            return None
+        return delay
+
+    def _after_response(
+        self,
+        response: httpx.Response,
+        attempt: int,
+        is_last_time: bool,
+        breaker: Optional[CircuitBreaker],
+        budget: Optional[RetryBudget]
+    ) -> Optional[float]:
+        """
+        :return: seconds to wait before retrying a server error, None to return the response
+        """
+        if response.status_code < 500:
+            if breaker is not None:
+                breaker.record_success()
+            return None
+        if breaker is not None:
+            breaker.record_failure()
+        return self._retry_delay(attempt, is_last_time, budget)
+
     def _retry_error_debug_log(
         self,
         method: str,
@@ -462,28 +539,15 @@ class HttpSession:
         assert method, 'method cannot be none'
         method = method.upper()
         params = self._build_params(method)
+        breaker, budget = self._host_guards(params['url'])
         self._log_verbose(lambda: f'{method} {self._format_log_url(params)}')
         self._log_verbose(lambda: f'{self._format_log_params(params)}')
         max_retries = 1 if not self._options.max_retries else self._options.max_retries + 1
         for i in range(max_retries):
             is_last_time = (i + 1) == max_retries
+            self._before_attempt(params, breaker, budget, attempt=i)
             try:
                 response = httpx.request(method=method, **params)
-                if (
-                    response.status_code >= 500
-                    and not is_last_time
-                    and self._options.retry_interval is not None
-                ):
-                    time.sleep(self._options.retry_interval)
-                formatted_response = self._format_response(
-                    method,
-                    response,
-                    retry_count=i,
-                    is_last_time=is_last_time
-                )
-                if not formatted_response:
-                    continue
-                return formatted_response
             except (
                 asyncio.TimeoutError,
                 ConnectionRefusedError,
@@ -491,17 +555,31 @@ class HttpSession:
                 httpx.ConnectTimeout,
                 httpx.ReadTimeout
             ) as exc:  # pylint: disable=invalid-name
-                if i == max_retries - 1:
+                if breaker is not None:
+                    breaker.record_failure()
+                delay = self._retry_delay(i, is_last_time, budget)
+                if delay is None:
                     raise exc
-                if self._options.retry_interval is not None:
-                    time.sleep(self._options.retry_interval)
                 self._retry_error_debug_log(
                     method.upper(),
                     is_last_time=is_last_time,
                     exception=exc,
                     retry_count=i
                 )
+                time.sleep(delay)
                 continue
+            delay = self._after_response(response, i, is_last_time, breaker, budget)
+            if delay:
+                time.sleep(delay)
+            formatted_response = self._format_response(
+                method,
+                response,
+                retry_count=i,
+                is_last_time=delay is None
+            )
+            if not formatted_response:
+                continue
+            return formatted_response
 
     async def aget(self) -> HttpResponse:
         """aget"""
@@ -528,76 +606,205 @@ class HttpSession:
         assert method, 'method cannot be none'
         method = method.upper()
         params = self._build_params(method)
+        breaker, budget = self._host_guards(params['url'])
         is_created = await self._ensure_client_build()
         max_retries = 1 if not self._options.max_retries else self._options.max_retries + 1
         self._log_verbose(lambda: f'{method} {self._format_log_url(params)}')
         self._log_verbose(lambda: f'{self._format_log_params(params)}')
-        for i in range(max_retries):
-            is_last_time = (i + 1) == max_retries
-            try:
-                response = await self._client.request(method=method, **params)
-                if (
-                    response.status_code >= 500
-                    and not is_last_time
-                    and self._options.retry_interval is not None
-                ):
-                    await asyncio.sleep(self._options.retry_interval)
+        try:
+            for i in range(max_retries):
+                is_last_time = (i + 1) == max_retries
+                self._before_attempt(params, breaker, budget, attempt=i)
+                try:
+                    response = await self._client.request(method=method, **params)
+                except (
+                    asyncio.TimeoutError,
+                    ConnectionRefusedError,
+                    httpx.ConnectTimeout,
+                    httpx.ConnectError,
+                    httpx.ReadTimeout,
+                    httpx.RemoteProtocolError
+                ) as exc:  # pylint: disable=invalid-name
+                    if breaker is not None:
+                        breaker.record_failure()
+                    delay = self._retry_delay(i, is_last_time, budget)
+                    if delay is None:
+                        raise exc
+                    self._retry_error_debug_log(
+                        method.upper(),
+                        is_last_time=is_last_time,
+                        exception=exc,
+                        retry_count=i
+                    )
+                    await asyncio.sleep(delay)
+                    continue
+                delay = self._after_response(response, i, is_last_time, breaker, budget)
+                if delay:
+                    await asyncio.sleep(delay)
                 formatted_response = self._format_response(
                     method,
                     response,
                     retry_count=i,
-                    is_last_time=is_last_time
+                    is_last_time=delay is None
                 )
                 if not formatted_response:
                     continue
-                if not is_created and not self._client.is_closed:
-                    await self._client.aclose()
                 return formatted_response
-            except (
-                asyncio.TimeoutError,
-                ConnectionRefusedError,
-                httpx.ConnectTimeout,
-                httpx.ConnectError,
-                httpx.ReadTimeout,
-                httpx.RemoteProtocolError
-            ) as exc:  # pylint: disable=invalid-name
-                if is_last_time:
-                    if not is_created and not self._client.is_closed:
-                        await self._client.aclose()
-                    raise exc
-                if self._options.retry_interval is not None:
-                    await asyncio.sleep(self._options.retry_interval)
-                self._retry_error_debug_log(
-                    method.upper(),
-                    is_last_time=is_last_time,
-                    exception=exc,
-                    retry_count=i
-                )
-                continue
-            finally:
-                if is_last_time and not is_created and not self._client.is_closed:
-                    await self._client.aclose()
+        finally:
+            if not is_created and not self._client.is_closed:
+                await self._client.aclose()
 
     async def aclose(self):
         """aclose"""
-        if not self._client:
+        if not self._client or self._from_session:
             return
         await self._client.aclose()
 
 
-# pylint: disable=too-few-public-methods
 class HttpClient:
-    """HttpClient"""
-
-    def __init__(self, defaults: HttpDefaults = None):
+    """
+    HttpClient, between start and aclose requests share one long-lived httpx.AsyncClient per
+    origin and verify flag, so connections are kept alive instead of being set up for every request.
+    Outside of that window every request builds and closes its own AsyncClient.
+    Requests of a host share its circuit breaker and retry budget, retries back off exponentially
+    with jitter up to max_backoff seconds.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(
+        self,
+        defaults: HttpDefaults = None,
+        limits: httpx.Limits = None,
+        http2: bool = False,
+        pooled: bool = True,
+        breakers: bool = True,
+        breaker_failures: int = 5,
+        breaker_reset_timeout: float = 30,
+        retry_budget_ratio: float = 0.2,
+        max_backoff: float = 10
+    ):
         self.defaults: HttpDefaults = defaults or HttpDefaults(verbose=settings.DEBUG)
+        self.limits = limits or httpx.Limits()
+        self.http2 = http2
+        self.pooled = pooled
+        self.breakers = breakers
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.retry_budget_ratio = retry_budget_ratio
+        self.max_backoff = max_backoff
+        self._started = False
+        self._clients: Dict[Tuple[str, bool], httpx.AsyncClient] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._retry_budgets: Dict[str, RetryBudget] = {}
+
+    @property
+    def started(self) -> bool:
+        """started"""
+        return self._started
 
     def create(self, url: str = None) -> HttpSession:
         """
         :param url:
         :return:
         """
-        return HttpSession(url, self.defaults, HttpOptions())
+        return HttpSession(url, self.defaults, HttpOptions(), http_client=self)
+
+    def pooled_client(self, url: str, verify: bool = True) -> Optional[httpx.AsyncClient]:
+        """
+        :param url: absolute url of the request
+        :param verify:
+        :return: the shared client of the origin of url, None while not started
+        """
+        if not self._started or not url.startswith('http'):
+            return None
+        origin = str(httpx.URL(url).copy_with(path='/', query=None, fragment=None))
+        client = self._clients.get((origin, verify))
+        if client is None or client.is_closed:
+            client = self._clients[(origin, verify)] = httpx.AsyncClient(
+                timeout=self.defaults.timeout,
+                verify=verify,
+                limits=self.limits,
+                http2=self.http2,
+                # cookies are per request, responses must not leave cookies for the next caller
+                cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+            )
+        return client
+
+    def breaker(self, host: str) -> Optional[CircuitBreaker]:
+        """
+        :param host: host and port
+        :return: None when breakers are off
+        """
+        if not self.breakers:
+            return None
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker(
+                failure_threshold=self.breaker_failures,
+                reset_timeout=self.breaker_reset_timeout
+            )
+        return breaker
+
+    def retry_budget(self, host: str) -> RetryBudget:
+        """
+        :param host: host and port
+        :return:
+        """
+        budget = self._retry_budgets.get(host)
+        if budget is None:
+            budget = self._retry_budgets[host] = RetryBudget(ratio=self.retry_budget_ratio)
+        return budget
+
+    async def start(self, *urls: str):
+        """
+        :param urls: origins to create clients for ahead of the first request
+        :return:
+        """
+        if not self.pooled:
+            return
+        self._started = True
+        for url in urls:
+            if url:
+                self.pooled_client(url)
 
+    async def aclose(self):
+        """
+        close the shared clients and their connections
+        :return:
+        """
+        self._started = False
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
 
-http_client = HttpClient()
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            'pooled': self.pooled,
+            'started': self._started,
+            'http2': self.http2,
+            'max_connections': self.limits.max_connections,
+            'max_keepalive_connections': self.limits.max_keepalive_connections,
+            'keepalive_expiry': self.limits.keepalive_expiry,
+            'origins': sorted({origin for origin, _ in self._clients}),
+            'breakers': {host: breaker.stats() for host, breaker in self._breakers.items()},
+            'retry_budgets': {host: budget.stats() for host, budget in self._retry_budgets.items()},
+        }
+
+
+http_client = HttpClient(
+    limits=httpx.Limits(
+        max_connections=settings.HTTP_CLIENT_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_CLIENT_KEEPALIVE_EXPIRY
+    ),
+    http2=settings.HTTP_CLIENT_HTTP2,
+    pooled=settings.HTTP_CLIENT_POOL,
+    breakers=settings.HTTP_CLIENT_BREAKERS,
+    breaker_failures=settings.HTTP_CLIENT_BREAKER_FAILURES,
+    breaker_reset_timeout=settings.HTTP_CLIENT_BREAKER_RESET_TIMEOUT,
+    retry_budget_ratio=settings.HTTP_CLIENT_RETRY_BUDGET_RATIO,
+    max_backoff=settings.HTTP_CLIENT_MAX_BACKOFF
+)
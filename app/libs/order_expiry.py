@@ -0,0 +1,230 @@
+"""
+Expiry engine of unpaid orders
+"""
+import asyncio
+import heapq
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+import pytz
+
+from app.config import settings
+from app.libs.broadcaster import TokenBucket
+from app.libs.logger import logger
+from app.schemas.order import ExpiredOrder, OrderExpiration
+
+__all__ = ['OrderExpiry', 'order_expiry']
+
+LoadExpirations = Callable[[], Awaitable[List[OrderExpiration]]]
+# ids of due orders and the time they were found due -> the orders the call expired
+ExpireOrders = Callable[[List[UUID], datetime], Awaitable[List[ExpiredOrder]]]
+NotifyExpired = Callable[[ExpiredOrder], Awaitable[None]]
+
+
+class OrderExpiry:
+    """
+    Expires orders waiting for payment when their expiration_of_pay passes. Pending deadlines are
+    kept in a heap, restored on start and every reload_interval seconds from the partial index of
+    the orders waiting for payment, so deadlines set by other processes are picked up as well.
+    Due orders are expired batch_size at a time, expire only changes orders that are still waiting
+    and past their deadline, so a paid order or a deadline handled by another process is a no-op.
+    The deadlines are compared with the time of the sweep, not the clock of the database, so an
+    order taken off the heap is not missed when the clocks disagree.
+    The chats of expired orders are told at most notify_rate messages a second.
+    """
+
+    def __init__(self, batch_size: int = 500, notify_rate: float = 20, reload_interval: float = 300):
+        self.batch_size = batch_size
+        self.reload_interval = reload_interval
+        self.bucket = TokenBucket(rate=notify_rate, capacity=max(1.0, notify_rate))
+        self._heap: List[Tuple[float, UUID]] = []
+        # order id -> its current deadline, heap entries of another deadline are stale
+        self._deadlines: Dict[UUID, float] = {}
+        self._notifications: Optional[asyncio.Queue] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._load: Optional[LoadExpirations] = None
+        self._expire: Optional[ExpireOrders] = None
+        self._notify: Optional[NotifyExpired] = None
+        self.expired = 0
+        self.notified = 0
+        self.failed = 0
+        self.sweeps = 0
+        self.reloads = 0
+
+    @property
+    def pending(self) -> int:
+        """
+        :return:
+        """
+        return len(self._deadlines)
+
+    def schedule(self, order_id: UUID, expiration_of_pay: datetime):
+        """
+        expire the order at expiration_of_pay unless it is paid before
+        :param order_id:
+        :param expiration_of_pay:
+        :return:
+        """
+        deadline = expiration_of_pay.timestamp()
+        if self._deadlines.get(order_id) == deadline:
+            return
+        self._deadlines[order_id] = deadline
+        heapq.heappush(self._heap, (deadline, order_id))
+        if self._wake is not None and self._heap[0][1] == order_id:
+            self._wake.set()
+
+    def cancel(self, order_id: UUID):
+        """
+        :param order_id:
+        :return:
+        """
+        self._deadlines.pop(order_id, None)
+
+    def restore(self, expirations: List[OrderExpiration]):
+        """
+        :param expirations: orders waiting for payment and their deadlines
+        :return:
+        """
+        for expiration in expirations:
+            self.schedule(order_id=expiration.id, expiration_of_pay=expiration.expiration_of_pay)
+
+    def due(self, now: float = None) -> List[UUID]:
+        """
+        take at most batch_size orders past their deadline off the heap
+        :param now:
+        :return:
+        """
+        now = time.time() if now is None else now
+        order_ids = []
+        while self._heap and self._heap[0][0] <= now and len(order_ids) < self.batch_size:
+            deadline, order_id = heapq.heappop(self._heap)
+            if self._deadlines.get(order_id) != deadline:
+                continue
+            del self._deadlines[order_id]
+            order_ids.append(order_id)
+        return order_ids
+
+    def next_deadline(self) -> Optional[float]:
+        """
+        :return:
+        """
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    async def sweep(self, now: float = None) -> int:
+        """
+        expire the due orders and queue their notifications
+        :param now:
+        :return: orders expired
+        """
+        now = time.time() if now is None else now
+        expired = 0
+        while True:
+            order_ids = self.due(now)
+            if not order_ids:
+                return expired
+            self.sweeps += 1
+            try:
+                orders = await self._expire(order_ids, datetime.fromtimestamp(now, tz=pytz.UTC))
+            except Exception:
+                # the next reload schedules them again
+                self.failed += len(order_ids)
+                raise
+            expired += len(orders)
+            self.expired += len(orders)
+            if self._notifications is not None:
+                for order in orders:
+                    self._notifications.put_nowait(order)
+
+    async def start(self, load: LoadExpirations, expire: ExpireOrders, notify: NotifyExpired):
+        """
+        :param load: orders waiting for payment and their deadlines
+        :param expire:
+        :param notify: tells the chat its order expired
+        :return:
+        """
+        if self._tasks:
+            return
+        self._load, self._expire, self._notify = load, expire, notify
+        self._wake = asyncio.Event()
+        self._notifications = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._run()), asyncio.create_task(self._run_notifications())]
+
+    async def _reload(self):
+        self.restore(await self._load())
+        self.reloads += 1
+
+    async def _run(self):
+        reload_at = 0.0
+        while True:
+            try:
+                if time.monotonic() >= reload_at:
+                    reload_at = time.monotonic() + self.reload_interval
+                    await self._reload()
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # pylint: disable=broad-except
+                logger.exception(e)
+                reload_at = min(reload_at, time.monotonic() + 1)
+            timeout = reload_at - time.monotonic()
+            deadline = self.next_deadline()
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.time())
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_notifications(self):
+        while True:
+            order = await self._notifications.get()
+            await self.bucket.acquire()
+            try:
+                await self._notify(order)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning(f"Failed to notify the expiry of order {order.order_no} ({e})")
+            else:
+                self.notified += 1
+
+    async def stop(self):
+        """
+        stop sweeping, orders still pending expire after the next start
+        :return:
+        """
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+        self._tasks = []
+        self._wake = None
+        self._notifications = None
+
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        deadline = self.next_deadline()
+        return {
+            'running': bool(self._tasks),
+            'pending': self.pending,
+            'next_deadline': datetime.fromtimestamp(deadline, tz=pytz.UTC) if deadline is not None else None,
+            'expired': self.expired,
+            'notifications_queued': self._notifications.qsize() if self._notifications is not None else 0,
+            'notified': self.notified,
+            'failed': self.failed,
+            'sweeps': self.sweeps,
+            'reloads': self.reloads,
+        }
+
+
+order_expiry = OrderExpiry(
+    batch_size=settings.ORDER_EXPIRY_BATCH_SIZE,
+    notify_rate=settings.ORDER_EXPIRY_NOTIFY_RATE,
+    reload_interval=settings.ORDER_EXPIRY_RELOAD_INTERVAL
+)
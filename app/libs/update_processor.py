@@ -0,0 +1,136 @@
+"""
+Telegram update processor
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from app.libs.database.pool_metrics import LatencyHistogram
+from app.libs.http_client.deadline import deadline
+
+__all__ = ['ChatOrderedUpdateProcessor']
+
+
+class _Chat:
+    __slots__ = ('lock', 'updates')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.updates = 0
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates of different chats concurrently on at most `workers` updates at a time, while
+    updates of the same chat run one after another in the order they were received.
+    An update waiting for an earlier update of its chat does not hold a worker, so one busy chat
+    cannot starve the others. max_pending_updates bounds the updates inside the processor, it does
+    not bound the update queue: the fetcher of the application still starts a task for every update
+    it takes off the queue, and the tasks beyond max_pending_updates wait on the semaphore of
+    BaseUpdateProcessor. The http requests of an update share a deadline of update_deadline seconds
+    from the moment it gets a worker.
+    """
+
+    __slots__ = (
+        'workers', '_workers', '_chats', 'pending', 'active', 'processed', 'failed',
+        'update_deadline', 'wait_latency', 'process_latency'
+    )
+
+    def __init__(self, workers: int, max_pending_updates: int = 1024, update_deadline: Optional[float] = None):
+        super().__init__(max_concurrent_updates=max(workers, max_pending_updates))
+        if workers < 1:
+            raise ValueError('workers must be a positive integer')
+        self.workers = workers
+        self.update_deadline = update_deadline
+        self._workers = asyncio.Semaphore(workers)
+        self._chats: Dict[int, _Chat] = {}
+        self.pending = 0
+        self.active = 0
+        self.processed = 0
+        self.failed = 0
+        self.wait_latency = LatencyHistogram()
+        self.process_latency = LatencyHistogram()
+
+    @staticmethod
+    def _chat_id(update: object) -> Optional[int]:
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """
+        :param update:
+        :param coroutine:
+        :return:
+        """
+        received = time.perf_counter()
+        chat_id = self._chat_id(update)
+        chat = None
+        if chat_id is not None:
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _Chat()
+            chat.updates += 1
+        self.pending += 1
+        waiting = True
+        try:
+            if chat is not None:
+                # asyncio.Lock wakes its waiters first in, first out
+                await chat.lock.acquire()
+            try:
+                async with self._workers:
+                    self.pending -= 1
+                    waiting = False
+                    self.active += 1
+                    started = time.perf_counter()
+                    self.wait_latency.observe(started - received)
+                    try:
+                        with deadline(self.update_deadline):
+                            await coroutine
+                    except Exception:
+                        self.failed += 1
+                        raise
+                    finally:
+                        self.active -= 1
+                        self.processed += 1
+                        self.process_latency.observe(time.perf_counter() - started)
+            finally:
+                if chat is not None:
+                    chat.lock.release()
+        finally:
+            if waiting:
+                self.pending -= 1
+            if chat is not None:
+                chat.updates -= 1
+                if not chat.updates:
+                    del self._chats[chat_id]
+
+    async def initialize(self) -> None:
+        """
+        :return:
+        """
+
+    async def shutdown(self) -> None:
+        """
+        :return:
+        """
+
+    def stats(self) -> dict:
+        """
+        :return:
+        """
+        return {
+            'workers': self.workers,
+            'max_pending_updates': self.max_concurrent_updates,
+            'update_deadline': self.update_deadline,
+            'pending': self.pending,
+            'active': self.active,
+            'chats': len(self._chats),
+            'processed': self.processed,
+            'failed': self.failed,
+            'wait_latency': self.wait_latency.snapshot(),
+            'process_latency': self.process_latency.snapshot(),
+        }
@@ -7,17 +7,45 @@ from fastapi import FastAPI
 from fastapi_limiter import FastAPILimiter
 
 from app.config import settings
+from app.libs.broadcaster import broadcaster
 from app.libs.database import RedisPool
+from app.libs.database.shared_cache import shared_cache
+from app.libs.database.write_behind import write_behind
+from app.libs.delayed_delivery import delayed_delivery
+from app.libs.http_client import http_client
 from app.libs.logger import logger
+from app.libs.order_expiry import order_expiry
 
 
 @asynccontextmanager
-async def lifespan(_: FastAPI):
+async def lifespan(app: FastAPI):
     """
     Lifespan
-    :param _:
+    :param app:
     """
     logger.info("Starting lifespan")
+    await shared_cache.start()
+    await write_behind.start()
+    await http_client.start(settings.GINA_URL, settings.JCN_VENDORS_BOT_URL)
+    if settings.EXCHANGE_RATE_BOOK:
+        try:
+            await app.container.exchange_rate_provider().load_exchange_rate_book()
+        except Exception as e:  # pylint: disable=broad-except
+            # the first lookup loads the book again
+            logger.warning(f"Failed to load the exchange rate book ({e})")
+    if settings.HANDLING_FEE_TABLE:
+        try:
+            await app.container.handling_fee_provider().load_handling_fee_table()
+        except Exception as e:  # pylint: disable=broad-except
+            # the first lookup loads the table again
+            logger.warning(f"Failed to load the handling fee table ({e})")
+    if settings.ORDER_EXPIRY:
+        order_provider = app.container.order_provider()
+        await order_expiry.start(
+            load=order_provider.get_order_expirations,
+            expire=order_provider.expire_orders,
+            notify=app.container.telegram_message_handler().notify_order_expired
+        )
     redis_connection = RedisPool().create(db=1)
     await FastAPILimiter.init(
         redis=redis_connection,
@@ -25,3 +53,13 @@ async def lifespan(_: FastAPI):
     )
     yield
     await FastAPILimiter.close()
+    # deadlines still pending are restored from the database on the next start
+    await order_expiry.stop()
+    # chats a broadcast did not reach yet stay pending until it is resumed
+    await broadcaster.stop()
+    # replies waiting for their delay are sent before the bot goes away
+    await delayed_delivery.stop()
+    # rows queued by the last updates are written before the process exits
+    await write_behind.stop()
+    await http_client.aclose()
+    await shared_cache.stop()
@@ -59,9 +59,18 @@ class SysCart(ModelBase, AuditMixin, DeletedMixin):
 class SysOrder(ModelBase, BaseMixin):
     """SysOrder"""
     __tablename__ = "order"
-    __table_args__ = {"schema": "public"}
+    __table_args__ = (
+        sa.Index("ix_public_order_created_at_id", "created_at", "id"),
+        # deadlines of the orders waiting for payment, read by the expiry engine
+        sa.Index(
+            "ix_public_order_expiration_of_pay_wait_for_payment",
+            "expiration_of_pay",
+            postgresql_where=sa.text("status = 'wait_for_payment'")
+        ),
+        {"schema": "public"}
+    )
 
-    order_no = Column(sa.String(32), index=True, comment="Order No")
+    order_no = Column(sa.String(32), index=True, unique=True, comment="Order No")
     cart_id = Column(
         UUID,
         sa.ForeignKey(
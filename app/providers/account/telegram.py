@@ -1,14 +1,21 @@
 """
 AccountProvider
 """
-from typing import List, Tuple, Optional
+from functools import partial
+from typing import Awaitable, Callable, List, Tuple, Optional
 
 import sqlalchemy as sa
 from redis.asyncio import Redis
 
 from app.libs.consts.enums import BotType, PaymentAccountStatus
+from app.libs.consts.redis_keys import get_handling_fee_table_key, get_optimal_exchange_rate_key
 from app.libs.database import RedisPool, Session
+from app.libs.database.shared_cache import shared_cache
+from app.libs.database.write_behind import write_behind
+from app.libs.database.write_fingerprints import write_fingerprints
 from app.libs.decorators.sentry_tracer import distributed_trace
+from app.libs.exchange_rate_book import exchange_rate_book
+from app.libs.handling_fee_table import handling_fee_table
 from app.models import (
     SysTelegramAccount,
     SysTelegramChatGroup,
@@ -20,6 +27,33 @@ from app.models import (
 )
 from app.serializers.v1.telegram import TelegramAccount, TelegramChatGroup, GroupMember, GroupInfo, UpdateGroupInfo, GroupQuery
 
+# setup_account_info writes groups before the accounts and members referencing them
+write_behind.register(SysTelegramChatGroup, conflict_cols=["id"])
+write_behind.register(SysTelegramAccount, conflict_cols=["id"])
+write_behind.register(SysTelegramChatGroupMember, conflict_cols=["account_id", "chat_group_id"], update=False)
+
+
+def _in_exchange_rate_book(chat_group: TelegramChatGroup) -> bool:
+    # the title and payment account status of a vendor decide the optimal vendor and its name
+    return chat_group.bot_type == BotType.VENDORS or chat_group.payment_account_status is not None
+
+
+async def _write_group_through(chat_group: TelegramChatGroup, remember: Callable[[], Awaitable] = None):
+    """
+    apply a committed group to the exchange rate book of every process
+    :param chat_group:
+    :param remember: fingerprint of the write-behind row, remembered first
+    :return:
+    """
+    if remember is not None:
+        await remember()
+    exchange_rate_book.update_group(
+        group_id=chat_group.id,
+        title=chat_group.title,
+        status=chat_group.payment_account_status
+    )
+    await shared_cache.invalidate(get_optimal_exchange_rate_key())
+
 
 class TelegramAccountProvider:
     """TelegramAccountProvider"""
@@ -39,8 +73,12 @@ class TelegramAccountProvider:
         :param account:
         :return:
         """
+        await write_behind.sync()
         data = account.model_dump(exclude_none=True)
         update_data = account.model_dump(exclude={"id"}, exclude_none=True)
+        fingerprint_key, fingerprint = f"account:{account.id}", write_fingerprints.fingerprint(data)
+        if await write_fingerprints.unchanged(fingerprint_key, fingerprint):
+            return
         try:
             await (
                 self._session.insert(SysTelegramAccount)
@@ -49,6 +87,7 @@ class TelegramAccountProvider:
                 .execute()
             )
             await self._session.commit()
+            await write_fingerprints.remember(fingerprint_key, fingerprint)
         except Exception as e:
             await self._session.rollback()
             raise e
@@ -62,8 +101,12 @@ class TelegramAccountProvider:
         :param chat_group:
         :return:
         """
+        await write_behind.sync()
         data = chat_group.model_dump(exclude_none=True)
         update_data = chat_group.model_dump(exclude={"id"}, exclude_none=True)
+        fingerprint_key, fingerprint = f"group:{chat_group.id}", write_fingerprints.fingerprint(data)
+        if await write_fingerprints.unchanged(fingerprint_key, fingerprint):
+            return
         try:
             await (
                 self._session.insert(SysTelegramChatGroup)
@@ -72,11 +115,14 @@ class TelegramAccountProvider:
                 .execute()
             )
             await self._session.commit()
+            await write_fingerprints.remember(fingerprint_key, fingerprint)
         except Exception as e:
             await self._session.rollback()
             raise e
         finally:
             await self._session.close()
+        if _in_exchange_rate_book(chat_group):
+            await _write_group_through(chat_group)
 
     @distributed_trace()
     async def init_chat_group_member(self, data: dict):
@@ -85,6 +131,11 @@ class TelegramAccountProvider:
         :param data:
         :return:
         """
+        await write_behind.sync()
+        # an existing member is never updated, the fingerprint only records that the row exists
+        fingerprint_key = f"member:{data['account_id']}:{data['chat_group_id']}"
+        if await write_fingerprints.unchanged(fingerprint_key, "1"):
+            return
         try:
             await (
                 self._session.insert(SysTelegramChatGroupMember)
@@ -93,12 +144,40 @@ class TelegramAccountProvider:
                 .execute()
             )
             await self._session.commit()
+            await write_fingerprints.remember(fingerprint_key, "1")
         except Exception as e:
             await self._session.rollback()
             raise e
         finally:
             await self._session.close()
 
+    @distributed_trace()
+    async def queue_account_info(self, account: TelegramAccount, chat_group: TelegramChatGroup, is_customer_service: bool = False):
+        """
+        queue the upserts of set_account, set_group and init_chat_group_member on the write-behind buffer
+        :param account:
+        :param chat_group:
+        :param is_customer_service:
+        :return:
+        """
+        for table, fingerprint_key, data in (
+            (SysTelegramChatGroup, f"group:{chat_group.id}", chat_group.model_dump(exclude_none=True)),
+            (SysTelegramAccount, f"account:{account.id}", account.model_dump(exclude_none=True)),
+            (
+                SysTelegramChatGroupMember,
+                f"member:{account.id}:{chat_group.id}",
+                {"account_id": account.id, "chat_group_id": chat_group.id, "is_customer_service": is_customer_service}
+            ),
+        ):
+            # an existing member is never updated, its fingerprint only records that the row exists
+            fingerprint = "1" if table is SysTelegramChatGroupMember else write_fingerprints.fingerprint(data)
+            if await write_fingerprints.unchanged(fingerprint_key, fingerprint):
+                continue
+            on_flushed = partial(write_fingerprints.remember, fingerprint_key, fingerprint)
+            if table is SysTelegramChatGroup and _in_exchange_rate_book(chat_group):
+                on_flushed = partial(_write_group_through, chat_group, on_flushed)
+            write_behind.put(table, data, on_flushed=on_flushed)
+
     @distributed_trace()
     async def delete_chat_group_member(self, account_id: int, group_id: int, force: bool = False):
         """
@@ -108,6 +187,7 @@ class TelegramAccountProvider:
         :param force:
         :return:
         """
+        await write_behind.sync()
         try:
             if force:
                 await (
@@ -125,6 +205,7 @@ class TelegramAccountProvider:
                     .execute()
                 )
             await self._session.commit()
+            await write_fingerprints.forget(f"member:{account_id}:{group_id}")
         except Exception as e:
             await self._session.rollback()
             raise e
@@ -138,6 +219,7 @@ class TelegramAccountProvider:
         :param bot_type:
         :return:
         """
+        await write_behind.sync_read((SysTelegramChatGroup, {}))
         try:
             result = await (
                 self._session.select(
@@ -158,12 +240,17 @@ class TelegramAccountProvider:
             await self._session.close()
 
     @distributed_trace()
-    async def get_chat_groups(self, query: GroupQuery) -> Tuple[List[GroupInfo], int]:
+    async def get_chat_groups(self, query: GroupQuery) -> Tuple[List[GroupInfo], Optional[int]]:
         """
 
-        :param query:
+        :param query: page_index pages by offset, cursor by keyset on the group id without counting the total
         :return:
         """
+        await write_behind.sync_read(
+            (SysTelegramChatGroup, {}),
+            (SysTelegramChatGroupMember, {}),
+            (SysTelegramAccount, {})
+        )
         try:
             customer_service_cte = (
                 self._session.select(
@@ -210,7 +297,7 @@ class TelegramAccountProvider:
                 .cte("group_type_cte")
             )
 
-            result, count = await (
+            select = (
                 self._session.select(
                     SysTelegramChatGroup.id,
                     SysTelegramChatGroup.title,
@@ -243,10 +330,13 @@ class TelegramAccountProvider:
                     customer_service_cte.c.customer_services,
                     group_type_cte.c.group_types
                 )
+                .after(query.cursor, SysTelegramChatGroup.id)
                 .limit(query.page_size)
-                .offset(query.page_index * query.page_size)
-                .fetchpages(as_model=GroupInfo)
             )
+            if query.cursor is None:
+                result, count = await select.offset(query.page_index * query.page_size).fetchpages(as_model=GroupInfo)
+            else:
+                result, count = await select.fetch(as_model=GroupInfo), None
         except Exception as e:
             raise e
         else:
@@ -261,6 +351,10 @@ class TelegramAccountProvider:
         :param group_id:
         :return:
         """
+        await write_behind.sync_read(
+            (SysTelegramChatGroup, {"id": group_id}),
+            (SysTelegramChatGroupMember, {"chat_group_id": group_id})
+        )
         try:
             customer_service_cte = (
                 self._session.select(
@@ -342,6 +436,7 @@ class TelegramAccountProvider:
         :param group_info:
         :return:
         """
+        await write_behind.sync()
         data = group_info.model_dump(exclude={"customer_service_ids", "group_type_ids"})
         try:
             await (
@@ -355,6 +450,8 @@ class TelegramAccountProvider:
             raise e
         else:
             await self._session.commit()
+            handling_fee_table.update_group(group_id=group_id, config_id=group_info.handling_fee_config_id)
+            await shared_cache.invalidate(get_handling_fee_table_key())
         finally:
             await self._session.close()
 
@@ -372,6 +469,7 @@ class TelegramAccountProvider:
         :param account_id:
         :return:
         """
+        await write_behind.sync()
         try:
             await (
                 self._session.update(SysTelegramChatGroupMember)
@@ -398,6 +496,7 @@ class TelegramAccountProvider:
         :param chat_group_id:
         :return:
         """
+        await write_behind.sync_read((SysTelegramChatGroupMember, {"chat_group_id": chat_group_id}))
         try:
             members = await (
                 self._session.select(
@@ -434,6 +533,7 @@ class TelegramAccountProvider:
         :param group_id:
         :return:
         """
+        await write_behind.sync_read((SysTelegramChatGroupMember, {"chat_group_id": group_id}))
         try:
             members = await (
                 self._session.select(
@@ -476,6 +576,7 @@ class TelegramAccountProvider:
         :param status:
         :return:
         """
+        await write_behind.sync()
         try:
             await (
                 self._session.update(SysTelegramChatGroup)
@@ -488,5 +589,9 @@ class TelegramAccountProvider:
             raise e
         else:
             await self._session.commit()
+            # the status is part of the fingerprint of set_group, its next write must not be skipped
+            await write_fingerprints.forget(f"group:{group_id}")
+            exchange_rate_book.update_group_status(group_id=group_id, status=status)
+            await shared_cache.invalidate(get_optimal_exchange_rate_key())
         finally:
             await self._session.close()
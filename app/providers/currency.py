@@ -6,8 +6,11 @@ from uuid import UUID
 
 from redis.asyncio import Redis
 
+from app.libs.consts.redis_keys import get_all_exchange_rate_key, get_optimal_exchange_rate_key
 from app.libs.database import RedisPool, Session
+from app.libs.database.shared_cache import shared_cache
 from app.libs.decorators.sentry_tracer import distributed_trace
+from app.libs.exchange_rate_book import exchange_rate_book
 from app.models import SysCurrency
 from app.schemas.currency import Currency
 
@@ -121,6 +124,9 @@ class CurrencyProvider:
             raise e
         finally:
             await self._session.close()
+        # the snapshot of every rate and the exchange rate book hold the symbol of the currency
+        exchange_rate_book.invalidate()
+        await shared_cache.invalidate(get_all_exchange_rate_key(), get_optimal_exchange_rate_key())
 
     @distributed_trace()
     async def change_sequence(self, currency_id: UUID, sequence: float):
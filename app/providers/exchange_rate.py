@@ -2,20 +2,34 @@
 ExchangeRateProvider
 """
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import pytz
 import sqlalchemy as sa
+from pydantic import TypeAdapter
 from redis.asyncio import Redis
 
+from app.config import settings
 from app.libs.consts.enums import PaymentAccountStatus, OperationType
+from app.libs.consts.redis_keys import (
+    get_all_exchange_rate_key,
+    get_group_exchange_rate_key,
+    get_optimal_exchange_rate_key,
+)
 from app.libs.database import RedisPool, Session
+from app.libs.database.replica import primary_reads
+from app.libs.database.shared_cache import shared_cache
 from app.libs.decorators.sentry_tracer import distributed_trace
+from app.libs.exchange_rate_book import ExchangeRateBook, exchange_rate_book
 from app.libs.logger import logger
-from app.schemas.exchange_rate import OptimalExchangeRate
+from app.schemas.exchange_rate import ExchangeRateBookEntry, OptimalExchangeRate
 from app.serializers.v1.exchange_rate import GroupExchangeRate, CurrencyIdExRate, CurrencyExRate
 from app.models import SysExchangeRate, SysCurrency, SysTelegramChatGroup
 
+_GROUP_EXCHANGE_RATES = TypeAdapter(List[GroupExchangeRate])
+_CURRENCY_ID_EX_RATES = TypeAdapter(List[CurrencyIdExRate])
+_OPTIMAL_EXCHANGE_RATE = TypeAdapter(Optional[OptimalExchangeRate])
+
 
 class ExchangeRateProvider:
     """ExchangeRateProvider"""
@@ -34,6 +48,16 @@ class ExchangeRateProvider:
         Get all exchange rate
         :return:
         """
+        return await shared_cache.get(
+            key=get_all_exchange_rate_key(),
+            adapter=_GROUP_EXCHANGE_RATES,
+            loader=self._fetch_all_exchange_rate
+        )
+
+    async def _fetch_all_exchange_rate(self) -> List[GroupExchangeRate]:
+        """
+        :return:
+        """
         try:
             records = await (
                 self._session.select(
@@ -68,6 +92,17 @@ class ExchangeRateProvider:
         Get exchange rate
         :return:
         """
+        return await shared_cache.get(
+            key=get_group_exchange_rate_key(group_id),
+            adapter=_CURRENCY_ID_EX_RATES,
+            loader=lambda: self._fetch_exchange_rate(group_id=group_id)
+        )
+
+    async def _fetch_exchange_rate(self, group_id: int) -> List[CurrencyIdExRate]:
+        """
+        :param group_id:
+        :return:
+        """
         try:
             result = await (
                 self._session.select(
@@ -85,6 +120,55 @@ class ExchangeRateProvider:
         finally:
             await self._session.close()
 
+    @distributed_trace()
+    async def load_exchange_rate_book(self):
+        """
+        Load every vendor rate into the exchange rate book
+        :return:
+        """
+        with primary_reads():
+            records = await self._fetch_exchange_rate_book_entries()
+        exchange_rate_book.load(record.model_dump() for record in records)
+        logger.info(f"Loaded {len(records)} exchange rates into the exchange rate book.")
+
+    async def _fetch_exchange_rate_book_entries(self, currencies: List[str] = None) -> List[ExchangeRateBookEntry]:
+        """
+        :param currencies: currency symbols, defaults: every currency
+        :return:
+        """
+        try:
+            records = await (
+                self._session.select(
+                    SysExchangeRate.telegram_chat_group_id.label("group_id"),
+                    SysTelegramChatGroup.title.label("group_name"),
+                    SysTelegramChatGroup.payment_account_status,
+                    SysExchangeRate.currency_id,
+                    SysCurrency.symbol.label("currency"),
+                    SysExchangeRate.buy_rate,
+                    SysExchangeRate.sell_rate,
+                    SysExchangeRate.updated_at,
+                )
+                .join(SysTelegramChatGroup, SysTelegramChatGroup.id == SysExchangeRate.telegram_chat_group_id)
+                .join(SysCurrency, SysCurrency.id == SysExchangeRate.currency_id)
+                .where(currencies is not None, lambda: SysCurrency.symbol.in_(currencies))
+                .fetch(as_model=ExchangeRateBookEntry)
+            )
+        except Exception as e:
+            raise e
+        else:
+            return records
+        finally:
+            await self._session.close()
+
+    async def _ensure_exchange_rate_book(self):
+        """
+        :return:
+        """
+        if not exchange_rate_book.is_fresh:
+            async with exchange_rate_book.lock:
+                if not exchange_rate_book.is_fresh:
+                    await self.load_exchange_rate_book()
+
     @distributed_trace()
     async def get_optimal_exchange_rate(
         self,
@@ -97,16 +181,72 @@ class ExchangeRateProvider:
         :param operation_type:
         :return:
         """
+        if not settings.EXCHANGE_RATE_BOOK:
+            return await shared_cache.get(
+                key=get_optimal_exchange_rate_key(),
+                field=f"{currency}:{operation_type.value}",
+                adapter=_OPTIMAL_EXCHANGE_RATE,
+                loader=lambda: self.query_optimal_exchange_rate(currency=currency, operation_type=operation_type)
+            )
+        await self._ensure_exchange_rate_book()
+        optimal_exchange_rate = exchange_rate_book.best(currency=currency, operation_type=operation_type)
+        if optimal_exchange_rate is None:
+            return None
+        return OptimalExchangeRate(**optimal_exchange_rate)
+
+    @distributed_trace()
+    async def get_optimal_exchange_rates(
+        self,
+        keys: Iterable[Tuple[str, OperationType]]
+    ) -> Dict[Tuple[str, OperationType], Optional[OptimalExchangeRate]]:
+        """
+        Get optimal exchange rates of many currencies and operation types, without the exchange rate book
+        the rates of the requested currencies are read with one query
+        :param keys: currency and operation type
+        :return:
+        """
+        keys = set(keys)
+        if not keys:
+            return {}
+        if settings.EXCHANGE_RATE_BOOK:
+            await self._ensure_exchange_rate_book()
+            book = exchange_rate_book
+        else:
+            book = ExchangeRateBook()
+            records = await self._fetch_exchange_rate_book_entries(currencies=sorted({currency for currency, _ in keys}))
+            book.load(record.model_dump() for record in records)
+        result = {}
+        for currency, operation_type in keys:
+            optimal_exchange_rate = book.best(currency=currency, operation_type=operation_type)
+            result[(currency, operation_type)] = OptimalExchangeRate(**optimal_exchange_rate) if optimal_exchange_rate else None
+        return result
+
+    @distributed_trace()
+    async def query_optimal_exchange_rate(
+        self,
+        currency: str,
+        operation_type: OperationType
+    ) -> Optional[OptimalExchangeRate]:
+        """
+        Get optimal exchange rate from the database
+        :param currency:
+        :param operation_type:
+        :return:
+        """
         if operation_type == OperationType.BUY:
-            sa_func = sa.func.min(SysExchangeRate.buy_rate)
+            rate_column = SysExchangeRate.buy_rate
+            sa_func = sa.func.min(rate_column)
         else:
-            sa_func = sa.func.max(SysExchangeRate.sell_rate)
+            rate_column = SysExchangeRate.sell_rate
+            sa_func = sa.func.max(rate_column)
         try:
             optimal_exchange_rate = (
                 self._session.select(sa_func)
                 .select_from(SysExchangeRate)
                 .outerjoin(SysCurrency, SysCurrency.id == SysExchangeRate.currency_id)
+                .outerjoin(SysTelegramChatGroup, SysTelegramChatGroup.id == SysExchangeRate.telegram_chat_group_id)
                 .where(SysCurrency.symbol == currency)
+                .where(SysTelegramChatGroup.payment_account_status == PaymentAccountStatus.PREPARING.value)
                 .subquery()
             )
 
@@ -122,7 +262,7 @@ class ExchangeRateProvider:
                 .outerjoin(SysTelegramChatGroup, SysTelegramChatGroup.id == SysExchangeRate.telegram_chat_group_id)
                 .outerjoin(SysCurrency, SysCurrency.id == SysExchangeRate.currency_id)
                 .where(SysCurrency.symbol == currency)
-                .where(SysExchangeRate.buy_rate == optimal_exchange_rate)
+                .where(rate_column == optimal_exchange_rate)
                 .where(SysTelegramChatGroup.payment_account_status == PaymentAccountStatus.PREPARING.value)
                 .order_by(SysExchangeRate.updated_at.desc())
                 .fetchrow(as_model=OptimalExchangeRate)
@@ -141,24 +281,23 @@ class ExchangeRateProvider:
         Update exchange rate
         :return:
         """
-        await self._session.execute("CREATE TEMP TABLE tmp_exchange_rate  (LIKE public.exchange_rate INCLUDING ALL);")
         try:
-            exchange_rate_records = []
             now = datetime.now(tz=pytz.UTC)
-            for exchange_rate in exchange_rates:
-                exchange_rate_records.append((
-                    group_id,
-                    exchange_rate.currency_id,
-                    exchange_rate.buy_rate,
-                    exchange_rate.sell_rate,
-                    now,
-                    "system",
-                    now,
-                    "system",
-                ))
-            await self._session.copy_records_to_table(
-                'tmp_exchange_rate',
-                records=exchange_rate_records,
+            result = await self._session.bulk_upsert(
+                SysExchangeRate,
+                records=[
+                    (
+                        group_id,
+                        exchange_rate.currency_id,
+                        exchange_rate.buy_rate,
+                        exchange_rate.sell_rate,
+                        now,
+                        "system",
+                        now,
+                        "system",
+                    )
+                    for exchange_rate in exchange_rates
+                ],
                 columns=[
                     "telegram_chat_group_id",
                     "currency_id",
@@ -169,20 +308,28 @@ class ExchangeRateProvider:
                     "updated_at",
                     "updated_by",
                 ],
+                conflict_cols=["telegram_chat_group_id", "currency_id"],
+                update_cols=["buy_rate", "sell_rate"],
+                update_values={"updated_at": sa.func.now(), "updated_by": "system"}
             )
-            insert_record = await self._session.execute(
-                """
-                INSERT INTO public.exchange_rate
-                SELECT * FROM tmp_exchange_rate
-                ON CONFLICT (telegram_chat_group_id, currency_id) DO UPDATE
-                SET buy_rate = EXCLUDED.buy_rate, sell_rate = EXCLUDED.sell_rate, updated_at = now(), updated_by = 'system';
-                """
-            )
-            logger.info(f"Inserted or updated {insert_record} records.")
+            logger.info(f"Inserted {result.inserted} and updated {result.updated} exchange rate records.")
         except Exception as e:
             await self._session.rollback()
             raise e
-        finally:
-            await self._session.execute("DROP TABLE IF EXISTS tmp_exchange_rate;")
+        else:
             await self._session.commit()
+            exchange_rate_book.update_rates(
+                group_id=group_id,
+                rates=[
+                    (exchange_rate.currency_id, exchange_rate.buy_rate, exchange_rate.sell_rate)
+                    for exchange_rate in exchange_rates
+                ],
+                updated_at=now
+            )
+            await shared_cache.invalidate(
+                get_group_exchange_rate_key(group_id),
+                get_all_exchange_rate_key(),
+                get_optimal_exchange_rate_key()
+            )
+        finally:
             await self._session.close()
@@ -1,13 +1,20 @@
 """
 HandlingFeeProvider
 """
-from typing import List, Tuple, Optional
+from typing import Dict, Iterable, List, Tuple, Optional
 from uuid import UUID
 
+import sqlalchemy as sa
 from redis.asyncio import Redis
 
+from app.config import settings
+from app.libs.consts.redis_keys import get_handling_fee_table_key
 from app.libs.database import RedisPool, Session
+from app.libs.database.replica import primary_reads
+from app.libs.database.shared_cache import shared_cache
 from app.libs.decorators.sentry_tracer import distributed_trace
+from app.libs.handling_fee_table import HandlingFeeTable, handling_fee_table
+from app.libs.logger import logger
 from app.models import SysHandlingFeeConfig, SysHandlingFeeConfigItem, SysTelegramChatGroup
 from app.serializers.v1.handling_fee import HandlingFeeConfig, HandlingFeeConfigItem, HandlingFeeConfigBase
 
@@ -202,6 +209,117 @@ class HandlingFeeProvider:
         finally:
             await self._session.close()
 
+    @distributed_trace()
+    async def load_handling_fee_table(self):
+        """
+        Load every handling fee config item and the config of every group into the handling fee table
+        :return:
+        """
+        with primary_reads():
+            global_config_id, items, groups = await self._fetch_handling_fee_table()
+        handling_fee_table.load(global_config_id=global_config_id, items=items, groups=groups)
+        logger.info(f"Loaded {len(items)} handling fee config items of {len(groups)} groups into the handling fee table.")
+
+    async def _fetch_handling_fee_table(
+        self,
+        group_ids: List[int] = None
+    ) -> Tuple[Optional[UUID], List[Tuple[UUID, HandlingFeeConfigItem]], List[Tuple[int, Optional[UUID]]]]:
+        """
+        :param group_ids: defaults: every group
+        :return: global config id, items of the configs of the groups and of the global config, groups
+        """
+        try:
+            groups = await (
+                self._session.select(
+                    SysTelegramChatGroup.id,
+                    SysTelegramChatGroup.handling_fee_config_id
+                )
+                .where(group_ids is not None, lambda: SysTelegramChatGroup.id.in_(group_ids))
+                .fetch()
+            )
+            groups = [
+                (group["id"], UUID(group["handling_fee_config_id"]) if group["handling_fee_config_id"] else None)
+                for group in groups
+            ]
+            config_ids = list({config_id for _, config_id in groups if config_id is not None})
+            records = await (
+                self._session.select(
+                    SysHandlingFeeConfigItem.handling_fee_config_id,
+                    SysHandlingFeeConfig.is_global,
+                    SysHandlingFeeConfigItem.currency_id,
+                    SysHandlingFeeConfigItem.buy_calculation_type,
+                    SysHandlingFeeConfigItem.buy_value,
+                    SysHandlingFeeConfigItem.sell_calculation_type,
+                    SysHandlingFeeConfigItem.sell_value
+                )
+                .join(SysHandlingFeeConfig, SysHandlingFeeConfig.id == SysHandlingFeeConfigItem.handling_fee_config_id)
+                .where(
+                    group_ids is not None,
+                    lambda: sa.or_(
+                        SysHandlingFeeConfig.is_global.is_(True),
+                        SysHandlingFeeConfigItem.handling_fee_config_id.in_(config_ids)
+                    )
+                )
+                .fetch()
+            )
+        except Exception as e:
+            raise e
+        else:
+            global_config_id, items = None, []
+            for record in records:
+                config_id = UUID(record.pop("handling_fee_config_id"))
+                if record.pop("is_global"):
+                    global_config_id = config_id
+                items.append((config_id, HandlingFeeConfigItem(**record)))
+            return global_config_id, items, groups
+        finally:
+            await self._session.close()
+
+    async def _ensure_handling_fee_table(self):
+        """
+        :return:
+        """
+        if not handling_fee_table.is_fresh:
+            async with handling_fee_table.lock:
+                if not handling_fee_table.is_fresh:
+                    await self.load_handling_fee_table()
+
+    @distributed_trace()
+    async def get_resolved_handling_fee_item(self, group_id: int, currency_id: UUID) -> Optional[HandlingFeeConfigItem]:
+        """
+        get the handling fee item of the group for the currency, the global item when the group has none
+        :param group_id:
+        :param currency_id:
+        :return:
+        """
+        await self._ensure_handling_fee_table()
+        return handling_fee_table.get(group_id=group_id, currency_id=currency_id)
+
+    @distributed_trace()
+    async def get_resolved_handling_fee_items(
+        self,
+        keys: Iterable[Tuple[int, UUID]]
+    ) -> Dict[Tuple[int, UUID], Optional[HandlingFeeConfigItem]]:
+        """
+        get the resolved handling fee items of many groups and currencies, without the handling fee table
+        the configs of the requested groups are read with two queries
+        :param keys: group id and currency id
+        :return:
+        """
+        keys = set(keys)
+        if not keys:
+            return {}
+        if settings.HANDLING_FEE_TABLE:
+            await self._ensure_handling_fee_table()
+            table = handling_fee_table
+        else:
+            table = HandlingFeeTable()
+            global_config_id, items, groups = await self._fetch_handling_fee_table(
+                group_ids=sorted({group_id for group_id, _ in keys})
+            )
+            table.load(global_config_id=global_config_id, items=items, groups=groups)
+        return {(group_id, currency_id): table.get(group_id=group_id, currency_id=currency_id) for group_id, currency_id in keys}
+
     @distributed_trace()
     async def create_handling_fee_config(self, config: HandlingFeeConfig):
         """
@@ -222,6 +340,8 @@ class HandlingFeeProvider:
             raise e
         else:
             await self._session.commit()
+            handling_fee_table.update_config(config_id=config.id, is_global=config.is_global)
+            await shared_cache.invalidate(get_handling_fee_table_key())
         finally:
             await self._session.close()
 
@@ -246,6 +366,8 @@ class HandlingFeeProvider:
             raise e
         else:
             await self._session.commit()
+            handling_fee_table.update_item(config_id=config_id, item=item)
+            await shared_cache.invalidate(get_handling_fee_table_key())
         finally:
             await self._session.close()
 
@@ -270,6 +392,8 @@ class HandlingFeeProvider:
             raise e
         else:
             await self._session.commit()
+            handling_fee_table.update_config(config_id=config_id, is_global=config.is_global)
+            await shared_cache.invalidate(get_handling_fee_table_key())
         finally:
             await self._session.close()
 
@@ -298,5 +422,7 @@ class HandlingFeeProvider:
             raise e
         else:
             await self._session.commit()
+            handling_fee_table.update_item(config_id=config_id, item=item)
+            await shared_cache.invalidate(get_handling_fee_table_key())
         finally:
             await self._session.close()
@@ -1,9 +1,11 @@
 """
 MessageProvider
 """
+from typing import Dict, List, Optional
 from uuid import UUID
 
-from app.libs.consts.enums import BotType
+import sqlalchemy as sa
+
 from app.libs.database import Session
 
 from app.models import SysMessage, SysMessageHistory
@@ -80,3 +82,139 @@ class MessageProvider:
             await self._session.commit()
         finally:
             await self._session.close()
+
+    async def create_message_histories(self, message_histories: List[BroadcastMessageHistory]):
+        """
+        create pending message histories in one statement, existing chats of the message are kept
+        :param message_histories:
+        :return:
+        """
+        try:
+            await self._session.bulk_upsert(
+                SysMessageHistory,
+                records=[
+                    (message_history.id, message_history.message_id, message_history.chat_group_id)
+                    for message_history in message_histories
+                ],
+                columns=["id", "message_id", "chat_group_id"],
+                conflict_cols=["message_id", "chat_group_id"],
+                update_cols=[]
+            )
+        except Exception as e:
+            await self._session.rollback()
+            raise e
+        else:
+            await self._session.commit()
+        finally:
+            await self._session.close()
+
+    async def update_message_histories(self, message_histories: List[BroadcastMessageHistory]):
+        """
+        write the status of sent and failed message histories in one statement
+        :param message_histories:
+        :return:
+        """
+        try:
+            await self._session.bulk_upsert(
+                SysMessageHistory,
+                records=[
+                    (
+                        message_history.id,
+                        message_history.message_id,
+                        message_history.chat_group_id,
+                        message_history.status,
+                        message_history.telegram_message_id,
+                        message_history.telegram_error_code,
+                        message_history.telegram_error_description
+                    )
+                    for message_history in message_histories
+                ],
+                columns=[
+                    "id",
+                    "message_id",
+                    "chat_group_id",
+                    "status",
+                    "telegram_message_id",
+                    "telegram_error_code",
+                    "telegram_error_description"
+                ],
+                conflict_cols=["id"],
+                update_cols=["status", "telegram_message_id", "telegram_error_code", "telegram_error_description"],
+                update_values={"updated_at": sa.func.now()}
+            )
+        except Exception as e:
+            await self._session.rollback()
+            raise e
+        else:
+            await self._session.commit()
+        finally:
+            await self._session.close()
+
+    async def get_message(self, message_id: UUID) -> Optional[BroadcastMessage]:
+        """
+        get message
+        :param message_id:
+        :return:
+        """
+        try:
+            message = await (
+                self._session.select(SysMessage.id, SysMessage.content, SysMessage.type)
+                .where(SysMessage.id == message_id)
+                .where(SysMessage.is_deleted.is_(False))
+                .fetchrow(as_model=BroadcastMessage)
+            )
+        except Exception as e:
+            raise e
+        else:
+            return message
+        finally:
+            await self._session.close()
+
+    async def get_pending_message_histories(self, message_id: UUID) -> List[BroadcastMessageHistory]:
+        """
+        get the message histories of the chats the message was not sent to yet
+        :param message_id:
+        :return:
+        """
+        try:
+            message_histories = await (
+                self._session.select(
+                    SysMessageHistory.id,
+                    SysMessageHistory.message_id,
+                    SysMessageHistory.chat_group_id
+                )
+                .where(SysMessageHistory.message_id == message_id)
+                .where(SysMessageHistory.status.is_(None))
+                .where(SysMessageHistory.is_deleted.is_(False))
+                .fetch(as_model=BroadcastMessageHistory)
+            )
+        except Exception as e:
+            raise e
+        else:
+            return message_histories
+        finally:
+            await self._session.close()
+
+    async def count_message_histories(self, message_id: UUID) -> Dict[Optional[str], int]:
+        """
+        count the message histories of a message by status, None for the pending ones
+        :param message_id:
+        :return:
+        """
+        try:
+            rows = await (
+                self._session.select(
+                    SysMessageHistory.status,
+                    sa.func.count().label("count")
+                )
+                .where(SysMessageHistory.message_id == message_id)
+                .where(SysMessageHistory.is_deleted.is_(False))
+                .group_by(SysMessageHistory.status)
+                .fetch()
+            )
+        except Exception as e:
+            raise e
+        else:
+            return {row["status"]: row["count"] for row in rows}
+        finally:
+            await self._session.close()
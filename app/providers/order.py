@@ -2,21 +2,34 @@
 OrderProvider
 """
 from datetime import datetime
-from typing import Optional
+from typing import Callable, List, Optional
 from uuid import UUID
 
-import pytz
 import sqlalchemy as sa
+from asyncpg import UniqueViolationError
+from pydantic import TypeAdapter
 from redis.asyncio import Redis
+from redis.exceptions import RedisError
 
 from app.config import settings
 from app.libs.consts.enums import CartStatus, OrderStatus
+from app.libs.consts.redis_keys import get_chat_state_key
 from app.libs.database import Session, RedisPool
+from app.libs.database.order_no_allocator import order_no_allocator
+from app.libs.database.shared_cache import shared_cache
 from app.libs.decorators.sentry_tracer import distributed_trace
+from app.libs.logger import logger
 from app.models import SysCart, SysOrder
-from app.schemas.order import Order, Cart
+from app.schemas.order import Order, Cart, ChatState, ExpiredOrder, OrderExpiration
 from app.serializers.v1.order import OrderDetail, OrderBase
 
+_CHAT_STATE = TypeAdapter(ChatState)
+# columns of an order detail that come from its cart
+_CART_FIELDS = (set(Cart.model_fields) & set(OrderDetail.model_fields)) - {"id", "status"}
+_ORDER_NO_INDEX = "ix_public_order_order_no"
+# a number taken by another order is drawn again this many times
+_ORDER_NO_ATTEMPTS = 3
+
 
 class OrderProvider:
     """OrderProvider"""
@@ -41,16 +54,18 @@ class OrderProvider:
     async def get_order_page(
         self,
         page_index: int = 0,
-        page_size: int = 10
-    ) -> tuple[list[OrderDetail], int]:
+        page_size: int = 10,
+        cursor: Optional[str] = None
+    ) -> tuple[list[OrderDetail], Optional[int]]:
         """
         get order by pages
-        :param page_index:
+        :param page_index: offset mode, ignored when cursor is given
         :param page_size:
+        :param cursor: keyset mode, the next_cursor of the previous page, the total is not counted
         :return:
         """
         try:
-            result, count = await (
+            select = (
                 self._session.select(
                     SysOrder.id,
                     SysOrder.order_no,
@@ -75,11 +90,13 @@ class OrderProvider:
                     SysOrder.description
                 )
                 .outerjoin(SysCart, SysOrder.cart_id == SysCart.id)
-                .order_by(SysOrder.created_at.desc())
+                .after(cursor, SysOrder.created_at, SysOrder.id, descending=True)
                 .limit(page_size)
-                .offset(page_index * page_size)
-                .fetchpages(as_model=OrderDetail)
             )
+            if cursor is None:
+                result, count = await select.offset(page_index * page_size).fetchpages(as_model=OrderDetail)
+            else:
+                result, count = await select.fetch(as_model=OrderDetail), None
         except Exception as e:
             raise e
         else:
@@ -130,6 +147,86 @@ class OrderProvider:
         finally:
             await self._session.close()
 
+    @distributed_trace()
+    async def get_chat_state(self, group_id: int) -> ChatState:
+        """
+        latest order that is not done and pending cart of a chat, cached until they are written
+        :param group_id:
+        :return:
+        """
+        if not settings.CHAT_STATE_CACHE:
+            return await self._fetch_chat_state(group_id=group_id)
+        return await shared_cache.get(
+            key=get_chat_state_key(group_id),
+            adapter=_CHAT_STATE,
+            loader=lambda: self._fetch_chat_state(group_id=group_id)
+        )
+
+    async def _fetch_chat_state(self, group_id: int) -> ChatState:
+        """
+        :param group_id:
+        :return:
+        """
+        return ChatState(
+            order=await self._fetch_order_by_group_id(group_id=group_id),
+            cart=await self._fetch_cart_by_group_id(group_id=group_id)
+        )
+
+    async def _write_chat_state(self, group_id: int, change: Callable[[ChatState], Optional[ChatState]]):
+        """
+        apply a committed write to the cached state of the chat
+        :param group_id:
+        :param change: the state after the write, None when it has to be loaded again
+        :return:
+        """
+        if not settings.CHAT_STATE_CACHE:
+            return
+        await shared_cache.update(key=get_chat_state_key(group_id), adapter=_CHAT_STATE, change=change)
+
+    async def _write_cart_through(self, cart: Cart):
+        """
+        :param cart: the cart as committed
+        :return:
+        """
+        def change(state: ChatState) -> ChatState:
+            order = state.order
+            if order is not None and order.cart_id == cart.id:
+                order = OrderDetail.model_validate(
+                    {**order.model_dump(), **{name: getattr(cart, name) for name in _CART_FIELDS}}
+                )
+            pending = state.cart
+            if cart.status == CartStatus.PENDING:
+                if pending is None or pending.id == cart.id:
+                    pending = cart
+            elif pending is not None and pending.id == cart.id:
+                # _swap keeps at most one pending cart in a chat
+                pending = None
+            return ChatState(order=order, cart=pending)
+
+        await self._write_chat_state(group_id=cart.group_id, change=change)
+
+    async def _write_order_through(self, order_id: UUID):
+        """
+        :param order_id: id of an order that was just committed
+        :return:
+        """
+        if not settings.CHAT_STATE_CACHE:
+            return
+        order = await self.get_order_by_id(order_id=order_id)
+        if order is None:
+            return
+
+        def change(state: ChatState) -> Optional[ChatState]:
+            latest = state.order
+            if order.status == OrderStatus.DONE:
+                # an older order may be the latest one that is not done now
+                return state if latest is None or latest.id != order.id else None
+            if latest is None or latest.id == order.id or order.created_at >= latest.created_at:
+                return ChatState(order=order, cart=state.cart)
+            return state
+
+        await self._write_chat_state(group_id=order.group_id, change=change)
+
     @distributed_trace()
     async def get_order_by_group_id(self, group_id: int, status: Optional[OrderStatus] = None) -> OrderDetail:
         """
@@ -138,6 +235,20 @@ class OrderProvider:
         :param status:
         :return:
         """
+        if not settings.CHAT_STATE_CACHE:
+            return await self._fetch_order_by_group_id(group_id=group_id, status=status)
+        order = (await self.get_chat_state(group_id=group_id)).order
+        if order is None or status is None or order.status == status:
+            return order
+        # an older order may have the status
+        return await self._fetch_order_by_group_id(group_id=group_id, status=status)
+
+    async def _fetch_order_by_group_id(self, group_id: int, status: Optional[OrderStatus] = None) -> OrderDetail:
+        """
+        :param group_id:
+        :param status:
+        :return:
+        """
         try:
             result = await (
                 self._session.select(
@@ -204,6 +315,15 @@ class OrderProvider:
         :param group_id:
         :return:
         """
+        if not settings.CHAT_STATE_CACHE:
+            return await self._fetch_cart_by_group_id(group_id=group_id)
+        return (await self.get_chat_state(group_id=group_id)).cart
+
+    async def _fetch_cart_by_group_id(self, group_id: int) -> Optional[Cart]:
+        """
+        :param group_id:
+        :return:
+        """
         try:
             cart = await (
                 self._session.select(SysCart)
@@ -241,9 +361,10 @@ class OrderProvider:
             raise e
         else:
             await self._session.commit()
-            return cart.id
         finally:
             await self._session.close()
+        await self._write_cart_through(cart=cart)
+        return cart.id
 
     @distributed_trace()
     async def update_cart(self, cart: Cart) -> None:
@@ -267,6 +388,7 @@ class OrderProvider:
             await self._session.commit()
         finally:
             await self._session.close()
+        await self._write_cart_through(cart=cart)
 
     @distributed_trace()
     async def update_cart_status(self, cart_id: UUID, status: CartStatus) -> None:
@@ -290,6 +412,10 @@ class OrderProvider:
             await self._session.commit()
         finally:
             await self._session.close()
+        if settings.CHAT_STATE_CACHE:
+            cart = await self.get_cart_by_id(cart_id=cart_id)
+            if cart is not None:
+                await self._write_cart_through(cart=cart)
 
     @distributed_trace()
     async def generate_order_no(self) -> str:
@@ -297,19 +423,34 @@ class OrderProvider:
         generate order no
         :return:
         """
-        today = datetime.now(tz=pytz.UTC).strftime('%Y%m%d')
-        count = await (
-            self._session.select(sa.func.count(SysOrder.id))
+        if settings.ORDER_NO_ALLOCATOR:
+            try:
+                return await order_no_allocator.allocate(seed=self._last_order_sequence)
+            except RedisError as e:
+                logger.warning(f"Failed to allocate an order no, numbering after the last order of today ({e})")
+        # numbers reserved by the allocator are skipped, a count of the orders of today falls behind them
+        today = order_no_allocator.today()
+        sequence = await self._last_order_sequence(day=today) + 1
+        return f"{order_no_allocator.prefix}{today}{str(sequence).zfill(order_no_allocator.digits)}"
+
+    async def _last_order_sequence(self, day: str) -> int:
+        """
+        last sequence number of the order numbers of a day
+        :param day: yyyymmdd
+        :return:
+        """
+        prefix = f"{order_no_allocator.prefix}{day}"
+        last_order_no = await (
+            self._session.select(sa.func.max(SysOrder.order_no))
             .where(
                 sa.and_(
-                    SysOrder.created_at >= sa.func.CURRENT_DATE(),
-                    SysOrder.created_at < sa.func.CURRENT_DATE() + sa.text("INTERVAL '1 day'")
+                    SysOrder.order_no >= prefix,
+                    SysOrder.order_no <= prefix + "9" * order_no_allocator.digits
                 )
             )
             .fetchval()
         )
-        count = int(count) + 1
-        return f"O{today}{str(count).zfill(7)}"
+        return int(last_order_no[len(prefix):]) if last_order_no else 0
 
     @distributed_trace()
     async def create_order(self, order: Order) -> OrderBase:
@@ -318,23 +459,29 @@ class OrderProvider:
         :param order:
         :return:
         """
-        order_no = await self.generate_order_no()
-        order.order_no = order_no
-        order_values = order.model_dump()
-        try:
-            await (
-                self._session.insert(SysOrder)
-                .values(**order_values)
-                .execute()
-            )
-        except Exception as e:
-            await self._session.rollback()
-            raise e
-        else:
-            await self._session.commit()
-            return OrderBase(id=order.id, order_no=order_no)
-        finally:
-            await self._session.close()
+        for attempt in range(_ORDER_NO_ATTEMPTS):
+            order.order_no = await self.generate_order_no()
+            try:
+                await (
+                    self._session.insert(SysOrder)
+                    .values(**order.model_dump())
+                    .execute()
+                )
+            except UniqueViolationError as e:
+                await self._session.rollback()
+                if e.constraint_name != _ORDER_NO_INDEX or attempt == _ORDER_NO_ATTEMPTS - 1:
+                    raise e
+                logger.warning(f"Order no {order.order_no} is taken, drawing another one")
+            except Exception as e:
+                await self._session.rollback()
+                raise e
+            else:
+                await self._session.commit()
+                break
+            finally:
+                await self._session.close()
+        await self._write_order_through(order_id=order.id)
+        return OrderBase(id=order.id, order_no=order.order_no)
 
     @distributed_trace()
     async def update_order(self, order: Order) -> None:
@@ -358,6 +505,7 @@ class OrderProvider:
             await self._session.commit()
         finally:
             await self._session.close()
+        await self._write_order_through(order_id=order.id)
 
     @distributed_trace()
     async def update_order_status(self, order_id: str, status: str) -> None:
@@ -381,6 +529,7 @@ class OrderProvider:
             await self._session.commit()
         finally:
             await self._session.close()
+        await self._write_order_through(order_id=order_id)
 
     @distributed_trace()
     async def update_order_description(self, order_id: UUID, description: str) -> None:
@@ -404,3 +553,56 @@ class OrderProvider:
             await self._session.commit()
         finally:
             await self._session.close()
+        await self._write_order_through(order_id=order_id)
+
+    @distributed_trace()
+    async def get_order_expirations(self) -> List[OrderExpiration]:
+        """
+        orders waiting for payment and their deadlines, read from the partial index on expiration_of_pay
+        :return:
+        """
+        try:
+            expirations = await (
+                self._session.select(SysOrder.id, SysOrder.expiration_of_pay)
+                .where(SysOrder.status == OrderStatus.WAIT_FOR_PAYMENT.value)
+                .where(SysOrder.expiration_of_pay.isnot(None))
+                .fetch(as_model=OrderExpiration)
+            )
+        except Exception as e:
+            raise e
+        else:
+            return expirations
+        finally:
+            await self._session.close()
+
+    @distributed_trace()
+    async def expire_orders(self, order_ids: List[UUID], now: datetime) -> List[ExpiredOrder]:
+        """
+        expire the orders still waiting for payment after their deadline, in one statement
+        :param order_ids:
+        :param now: time the deadlines are compared with, the clock of the caller that found them due
+        :return: the orders expired, an order paid or expired meanwhile is left as is
+        """
+        try:
+            orders = await self._session.execute_returning(
+                'UPDATE public."order" AS o SET status = $1, updated_at = now() '
+                'FROM public.cart AS c '
+                'WHERE o.id = ANY($2::uuid[]) AND o.status = $3 AND o.expiration_of_pay <= $4 '
+                'AND c.id = o.cart_id '
+                'RETURNING o.id, o.order_no, c.group_id, c.language, c.message_id',
+                OrderStatus.EXPIRE.value,
+                order_ids,
+                OrderStatus.WAIT_FOR_PAYMENT.value,
+                now,
+                as_model=ExpiredOrder
+            )
+        except Exception as e:
+            await self._session.rollback()
+            raise e
+        else:
+            await self._session.commit()
+        finally:
+            await self._session.close()
+        if settings.CHAT_STATE_CACHE and orders:
+            await shared_cache.invalidate(*dict.fromkeys(get_chat_state_key(order.group_id) for order in orders))
+        return orders
@@ -2,15 +2,17 @@
 PriceProvider
 """
 from decimal import Decimal, ROUND_HALF_UP
-from typing import Optional
+from typing import Dict, List, Optional
 from uuid import UUID
 
+from app.config import settings
 from app.libs.consts.enums import CalculationType, OperationType
 from app.libs.decorators.sentry_tracer import distributed_trace
 from app.libs.utils.calculator import Calculator
 from app.providers import ExchangeRateProvider, HandlingFeeProvider
 from app.schemas.exchange_rate import OptimalExchangeRate
 from app.schemas.price import PriceInfo
+from app.serializers.v1.exchange_rate import QuoteQuery
 from app.serializers.v1.handling_fee import HandlingFeeConfigItem
 
 
@@ -49,6 +51,8 @@ class PriceProvider:
             group_id=group_id,
             currency_id=exchange_rate.currency_id
         )
+        if not handling_fee:
+            return None
 
         calculation_type = handling_fee.buy_calculation_type if operation_type == OperationType.BUY else handling_fee.sell_calculation_type
         rate = exchange_rate.buy_rate if operation_type == OperationType.BUY else exchange_rate.sell_rate
@@ -64,6 +68,50 @@ class PriceProvider:
             price=price,
         )
 
+    @distributed_trace()
+    async def get_price_infos(self, queries: List[QuoteQuery]) -> List[Optional[PriceInfo]]:
+        """
+        get price infos of many groups, currencies and operation types, the rates and handling fees of
+        all queries are loaded at once
+        :param queries:
+        :return: price info of each query, None when there is no rate or handling fee
+        """
+        exchange_rates = await self._exchange_rate_provider.get_optimal_exchange_rates(
+            keys=[(query.currency, query.operation_type) for query in queries]
+        )
+        handling_fees = await self._handling_fee_provider.get_resolved_handling_fee_items(
+            keys=[
+                (query.group_id, exchange_rates[(query.currency, query.operation_type)].currency_id)
+                for query in queries
+                if exchange_rates[(query.currency, query.operation_type)]
+            ]
+        )
+        # many queries share the vendor and the handling fee, price each combination once
+        prices: Dict[tuple, float] = {}
+        result = []
+        for query in queries:
+            exchange_rate = exchange_rates[(query.currency, query.operation_type)]
+            handling_fee = handling_fees.get((query.group_id, exchange_rate.currency_id)) if exchange_rate else None
+            if not handling_fee:
+                result.append(None)
+                continue
+            if query.operation_type == OperationType.BUY:
+                key = (exchange_rate.buy_rate, handling_fee.buy_calculation_type, handling_fee.buy_value)
+            else:
+                key = (exchange_rate.sell_rate, handling_fee.sell_calculation_type, handling_fee.sell_value)
+            price = prices.get(key)
+            if price is None:
+                price = prices[key] = self.calculate_fee(calculation_type=key[1], rate=key[0], fee=key[2])
+            result.append(
+                PriceInfo(
+                    vendor_name=exchange_rate.group_name,
+                    vendor_id=exchange_rate.group_id,
+                    original_rate=key[0],
+                    price=price,
+                )
+            )
+        return result
+
     @distributed_trace()
     async def get_exchange_rate(
         self,
@@ -96,6 +144,11 @@ class PriceProvider:
         :param currency_id:
         :return:
         """
+        if settings.HANDLING_FEE_TABLE:
+            return await self._handling_fee_provider.get_resolved_handling_fee_item(
+                group_id=group_id,
+                currency_id=currency_id
+            )
         handling_fee = await self._handling_fee_provider.get_handling_fee_item_by_group_and_currency(
             group_id=group_id,
             currency_id=currency_id
@@ -9,6 +9,7 @@ from .demo import router as demo_router
 from .exchange_rate import router as exchange_rate_router
 from .files import router as file_router
 from .handling_fee import router as handling_fee_router
+from .internal import router as internal_router
 from .telegram import router as telegram_router
 from .order import router as order_router
 from .user import router as user_router
@@ -21,6 +22,7 @@ router.include_router(file_router, prefix="/files", tags=["Files"])
 router.include_router(handling_fee_router, prefix="/handling_fee", tags=["Handling Fee"])
 router.include_router(order_router, prefix="/order", tags=["Order"])
 router.include_router(user_router, prefix="/user", tags=["User"])
+router.include_router(internal_router, prefix="/internal", tags=["Internal"])
 
 if settings.IS_DEV:
     router.include_router(demo_router, prefix="/demo", tags=["Demo"])
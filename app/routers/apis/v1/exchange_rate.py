@@ -13,7 +13,7 @@ from app.libs.depends import (
     DEFAULT_RATE_LIMITERS,
 )
 from app.route_classes import LogRoute
-from app.serializers.v1.exchange_rate import UpdateExchangeRate, ExchangeRateResponse
+from app.serializers.v1.exchange_rate import UpdateExchangeRate, ExchangeRateResponse, QuoteRequest, QuoteResponse
 
 router = APIRouter(
     dependencies=DEFAULT_RATE_LIMITERS,
@@ -21,6 +21,24 @@ router = APIRouter(
 )
 
 
+@router.post(
+    path="/quotes",
+    response_model=QuoteResponse,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(check_access_token)]
+)
+@inject
+async def get_quotes(
+    model: QuoteRequest,
+    exchange_rate_handler: ExchangeRateHandler = Depends(Provide[Container.exchange_rate_handler])
+):
+    """
+    Get prices of many groups, currencies and operation types
+    :return:
+    """
+    return await exchange_rate_handler.get_quotes(model=model)
+
+
 @router.get(
     path="/{group_id}",
     response_model=ExchangeRateResponse,
@@ -0,0 +1,122 @@
+"""
+Internal API Router
+"""
+from fastapi import APIRouter, Depends
+from starlette import status
+
+from app.bot import application
+from app.libs.database import database_stats
+from app.libs.database.order_no_allocator import order_no_allocator
+from app.libs.database.shared_cache import shared_cache
+from app.libs.database.write_behind import write_behind
+from app.libs.database.write_fingerprints import write_fingerprints
+from app.libs.depends import check_api_key_authenticator
+from app.libs.http_client import http_client
+from app.libs.order_expiry import order_expiry
+from app.libs.update_processor import ChatOrderedUpdateProcessor
+from app.route_classes import LogRoute
+
+router = APIRouter(
+    dependencies=[Depends(check_api_key_authenticator)],
+    route_class=LogRoute
+)
+
+
+@router.get(
+    path="/database/stats",
+    status_code=status.HTTP_200_OK
+)
+async def get_database_stats():
+    """
+    Get pool sizing, acquire latency and statement cache stats of this process
+    :return:
+    """
+    return database_stats()
+
+
+@router.get(
+    path="/cache/stats",
+    status_code=status.HTTP_200_OK
+)
+async def get_cache_stats():
+    """
+    Get hit ratio and invalidations of the shared cache of this process
+    :return:
+    """
+    return shared_cache.stats()
+
+
+@router.get(
+    path="/write_fingerprints/stats",
+    status_code=status.HTTP_200_OK
+)
+async def get_write_fingerprint_stats():
+    """
+    Get the upserts of telegram accounts, groups and members this process skipped
+    :return:
+    """
+    return write_fingerprints.stats()
+
+
+@router.get(
+    path="/write_behind/stats",
+    status_code=status.HTTP_200_OK
+)
+async def get_write_behind_stats():
+    """
+    Get queued, coalesced and flushed rows of the write-behind buffer of this process
+    :return:
+    """
+    return write_behind.stats()
+
+
+@router.get(
+    path="/order_no/stats",
+    status_code=status.HTTP_200_OK
+)
+async def get_order_no_stats():
+    """
+    Get the order numbers this process allocated and its reserved block
+    :return:
+    """
+    return order_no_allocator.stats()
+
+
+@router.get(
+    path="/order_expiry/stats",
+    status_code=status.HTTP_200_OK
+)
+async def get_order_expiry_stats():
+    """
+    Get the pending deadlines, expired orders and sent notices of the order expiry engine of this process
+    :return:
+    """
+    return order_expiry.stats()
+
+
+@router.get(
+    path="/http_client/stats",
+    status_code=status.HTTP_200_OK
+)
+async def get_http_client_stats():
+    """
+    Get connection-pool limits, circuit breakers and retry budgets of the http client of this process
+    :return:
+    """
+    return http_client.stats()
+
+
+@router.get(
+    path="/telegram/updates/stats",
+    status_code=status.HTTP_200_OK
+)
+async def get_telegram_update_stats():
+    """
+    Get queue depth and per-update latency of the telegram update processor of this process
+    :return:
+    """
+    processor = application.update_processor
+    return {
+        "queue_depth": application.update_queue.qsize(),
+        **(processor.stats() if isinstance(processor, ChatOrderedUpdateProcessor) else {"workers": processor.max_concurrent_updates}),
+    }
@@ -1,6 +1,7 @@
 """
 Order API router
 """
+from typing import Optional
 from uuid import UUID
 
 from dependency_injector.wiring import inject, Provide
@@ -34,18 +35,21 @@ router = APIRouter(
 async def get_order_page(
     page_index: int = 0,
     page_size: int = 10,
+    cursor: Optional[str] = None,
     order_handler: OrderHandler = Depends(Provide[Container.order_handler])
 ):
     """
-    get order by pages
+    get order by pages, by page_index or by the next_cursor of the previous page
     :param page_index:
     :param page_size:
+    :param cursor:
     :param order_handler:
     :return:
     """
     return await order_handler.get_order_page(
         page_index=page_index,
-        page_size=page_size
+        page_size=page_size,
+        cursor=cursor
     )
 
 
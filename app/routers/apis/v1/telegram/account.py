@@ -198,6 +198,7 @@ async def get_chat_groups(
     currency_id: UUID = Query(default=None, description="Currency ID"),
     handling_fee_config_id: UUID = Query(default=None, description="Handling Fee Config ID"),
     group_type_ids: list[UUID] = Depends(parse_uuid_list),
+    cursor: str = Query(default=None, description="Next Cursor of the previous page"),
     telegram_account_handler: TelegramAccountHandler = Depends(Provide[Container.telegram_account_handler])
 ):
     """
@@ -211,6 +212,7 @@ async def get_chat_groups(
     :param currency_id:
     :param handling_fee_config_id:
     :param group_type_ids:
+    :param cursor:
     :param telegram_account_handler:
     :return:
     """
@@ -223,7 +225,8 @@ async def get_chat_groups(
         payment_account_status=payment_account_status,
         currency_id=currency_id,
         handling_fee_config_id=handling_fee_config_id,
-        group_type_ids=group_type_ids
+        group_type_ids=group_type_ids,
+        cursor=cursor
     )
     return await telegram_account_handler.get_chat_groups(group_query=group_query)
 
@@ -1,8 +1,10 @@
 """
 Telegram Messages API Router
 """
+from uuid import UUID
+
 from dependency_injector.wiring import inject, Provide
-from fastapi import APIRouter, Depends, BackgroundTasks
+from fastapi import APIRouter, Depends
 from starlette import status
 
 from app.containers import Container
@@ -11,6 +13,7 @@ from app.libs.depends import check_all_authenticators, DEFAULT_RATE_LIMITERS
 from app.route_classes import LogRoute
 from app.serializers.v1.telegram import (
     TelegramBroadcast,
+    BroadcastProgress,
     PaymentAccount,
     ConfirmPay,
     OrderPaymentAccountStatus, GroupPaymentAccountStatus,
@@ -27,23 +30,59 @@ router = APIRouter(
 
 @router.post(
     path="/broadcast",
+    response_model=BroadcastProgress,
     status_code=status.HTTP_202_ACCEPTED
 )
 @inject
 async def broadcast(
     model: TelegramBroadcast,
-    background_tasks: BackgroundTasks,
     telegram_message_handler: TelegramMessageHandler = Depends(Provide[Container.telegram_message_handler])
 ):
     """
 
     :param model:
-    :param background_tasks:
     :param telegram_message_handler:
     :return:
     """
-    background_tasks.add_task(telegram_message_handler.broadcast_message, model=model)
-    return {"message": "accepted"}
+    return await telegram_message_handler.broadcast_message(model=model)
+
+
+@router.get(
+    path="/broadcast/{message_id}",
+    response_model=BroadcastProgress,
+    status_code=status.HTTP_200_OK
+)
+@inject
+async def get_broadcast_progress(
+    message_id: UUID,
+    telegram_message_handler: TelegramMessageHandler = Depends(Provide[Container.telegram_message_handler])
+):
+    """
+
+    :param message_id:
+    :param telegram_message_handler:
+    :return:
+    """
+    return await telegram_message_handler.get_broadcast_progress(message_id=message_id)
+
+
+@router.post(
+    path="/broadcast/{message_id}/resume",
+    response_model=BroadcastProgress,
+    status_code=status.HTTP_202_ACCEPTED
+)
+@inject
+async def resume_broadcast(
+    message_id: UUID,
+    telegram_message_handler: TelegramMessageHandler = Depends(Provide[Container.telegram_message_handler])
+):
+    """
+
+    :param message_id:
+    :param telegram_message_handler:
+    :return:
+    """
+    return await telegram_message_handler.resume_broadcast_message(message_id=message_id)
 
 
 @router.post(
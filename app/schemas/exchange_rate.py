@@ -1,6 +1,7 @@
 """
 Model for Exchange Rate
 """
+from datetime import datetime
 from typing import Optional
 from uuid import UUID
 
@@ -17,3 +18,17 @@ class OptimalExchangeRate(BaseModel):
     currency: str
     buy_rate: Optional[float]
     sell_rate: Optional[float]
+
+
+class ExchangeRateBookEntry(BaseModel):
+    """
+    ExchangeRateBookEntry
+    """
+    group_id: int
+    group_name: Optional[str]
+    payment_account_status: Optional[str]
+    currency_id: UUID
+    currency: str
+    buy_rate: Optional[float]
+    sell_rate: Optional[float]
+    updated_at: Optional[datetime]
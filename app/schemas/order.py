@@ -8,6 +8,7 @@ from uuid import UUID
 from pydantic import BaseModel, Field, ConfigDict
 
 from app.libs.consts.enums import CartStatus, OrderStatus, Language
+from app.serializers.v1.order import OrderDetail
 from .mixins import UUIDBaseModel
 
 
@@ -46,3 +47,28 @@ class Order(UUIDBaseModel):
     receive_receipt_at: Optional[datetime] = Field(default=None, description="Receive Receipt Time")
     status: OrderStatus = Field(default=OrderStatus.WAIT_FOR_PAYMENT_ACCOUNT, description="Status")
     done_at: Optional[datetime] = Field(default=None, description="Done Time")
+
+
+class ChatState(BaseModel):
+    """
+    ChatState
+    """
+    order: Optional[OrderDetail] = Field(default=None, description="Latest order that is not done")
+    cart: Optional[Cart] = Field(default=None, description="Pending cart")
+
+
+class OrderExpiration(UUIDBaseModel):
+    """
+    OrderExpiration
+    """
+    expiration_of_pay: datetime = Field(description="Payment Time")
+
+
+class ExpiredOrder(UUIDBaseModel):
+    """
+    ExpiredOrder
+    """
+    order_no: str = Field(description="Order No")
+    group_id: int = Field(description="Group ID")
+    language: Language = Field(default=Language.ZH_TW, description="Language")
+    message_id: Optional[int] = Field(default=None, description="Message ID")
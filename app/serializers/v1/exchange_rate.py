@@ -6,6 +6,9 @@ from uuid import UUID
 
 from pydantic import BaseModel, Field
 
+from app.libs.consts.enums import OperationType
+from app.schemas.price import PriceInfo
+
 
 class ExchangeRateBase(BaseModel):
     """
@@ -50,3 +53,33 @@ class UpdateExchangeRate(BaseModel):
     """
     group_id: int = Field(title="Group ID")
     currency_rates: List[CurrencyIdExRate] = Field(title="Exchange Rate")
+
+
+class QuoteQuery(BaseModel):
+    """
+    Quote Query
+    """
+    group_id: int = Field(title="Group ID", description="Group the handling fee of the quote applies to")
+    currency: str = Field(title="Currency", description="Currency symbol")
+    operation_type: OperationType = Field(title="Operation Type")
+
+
+class QuoteRequest(BaseModel):
+    """
+    Quote Request
+    """
+    quotes: List[QuoteQuery] = Field(title="Quotes", min_length=1, max_length=1000)
+
+
+class Quote(QuoteQuery):
+    """
+    Quote
+    """
+    price_info: Optional[PriceInfo] = Field(default=None, title="Price Info", description="None when there is no price")
+
+
+class QuoteResponse(BaseModel):
+    """
+    Quote Response
+    """
+    quotes: List[Quote] = Field(title="Quotes")
@@ -48,7 +48,8 @@ class OrderList(BaseModel):
     OrderList
     """
     orders: list[OrderDetail]
-    total: int
+    total: Optional[int] = Field(default=None, description="Total, not counted when paging by cursor")
+    next_cursor: Optional[str] = Field(default=None, description="Cursor of the next page")
 
 
 class UpdateOrder(BaseModel):
@@ -1,11 +1,10 @@
 """
 Serializers for Telegram Account API
 """
-import json
 from typing import Optional, List
 from uuid import UUID
 
-from pydantic import BaseModel, Field, field_validator, ConfigDict
+from pydantic import BaseModel, Field, field_validator, ConfigDict, TypeAdapter, ValidationInfo
 
 from app.libs.consts.enums import BotType, PaymentAccountStatus
 from app.libs.shared import validator
@@ -93,6 +92,13 @@ class GroupQuery(BaseModel):
     currency_id: Optional[UUID] = Field(default=None, description="Currency ID")
     handling_fee_config_id: Optional[UUID] = Field(default=None, description="Handling Fee Config ID")
     group_type_ids: Optional[List[UUID]] = Field(default=None, description="Group Types")
+    cursor: Optional[str] = Field(default=None, description="Next Cursor of the previous page")
+
+
+_JSON_ARRAY_ADAPTERS = {
+    "customer_services": TypeAdapter(List[GroupMember]),
+    "group_types": TypeAdapter(List[TelegramGroupType]),
+}
 
 
 class GroupInfo(BaseModel):
@@ -111,15 +117,16 @@ class GroupInfo(BaseModel):
     group_types: Optional[list[TelegramGroupType]] = Field(default=[])
 
     @field_validator("customer_services", "group_types", mode="before")
-    def validate_json_string(cls, value: List[str]):
+    def validate_json_string(cls, value: List[str], info: ValidationInfo):
         """
         Validate JSON String
         :param value:
+        :param info:
         :return:
         """
         if validator.is_empty(value):
             return []
-        return [json.loads(item) for item in value]
+        return _JSON_ARRAY_ADAPTERS[info.field_name].validate_json(f"[{','.join(value)}]")
 
 
 class GroupList(BaseModel):
@@ -133,8 +140,9 @@ class GroupPage(BaseModel):
     """
     Group Page
     """
-    total: int = Field(default=0)
+    total: Optional[int] = Field(default=0, description="Total, not counted when paging by cursor")
     groups: List[GroupInfo] = Field(default=[])
+    next_cursor: Optional[str] = Field(default=None, description="Cursor of the next page")
 
 
 class UpdateGroupInfo(BaseModel):
@@ -1,6 +1,7 @@
 """
 Serializers for Telegram Messages API
 """
+from typing import Optional
 from uuid import UUID
 
 from pydantic import BaseModel, Field
@@ -17,6 +18,20 @@ class TelegramBroadcast(BaseModel):
     type: BotType = Field(description="Bot Type")
 
 
+class BroadcastProgress(BaseModel):
+    """
+    Broadcast Progress
+    """
+    message_id: UUID = Field(description="Message ID")
+    state: str = Field(description="State, running / finished / cancelled / failed")
+    total: int = Field(description="Chats")
+    sent: int = Field(description="Sent")
+    failed: int = Field(description="Failed")
+    pending: int = Field(description="Pending")
+    retried: int = Field(default=0, description="Retries after telegram asked to slow down")
+    elapsed: Optional[float] = Field(default=None, description="Seconds the broadcast ran in this process")
+
+
 class PaymentAccount(BaseModel):
     """
     Payment Account
@@ -0,0 +1,5 @@
+"""
+Benchmarks, kept out of the test suite. Run one module from the project root,
+e.g. `python -m benchmarks.database`; the ones needing the configured database
+only run with BENCHMARK_DATABASE=1.
+"""
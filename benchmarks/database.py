@@ -0,0 +1,269 @@
+"""
+Benchmarks of the database layer against the fakes of the test suite
+"""
+import asyncio
+import os
+import time
+import timeit
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from typing import Callable
+from unittest.mock import patch
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+
+from app.config import settings
+from app.libs.consts.enums import OrderStatus
+from app.libs.database import RedisPool, Session, shared_cache as shared_cache_module
+from app.libs.database.aio_orm import statement_cache
+from app.libs.database.row_mapper import RowMapper
+from app.libs.database.write_fingerprints import WriteFingerprints
+from app.models import SysCart, SysOrder
+from app.providers import OrderProvider, TelegramAccountProvider
+from app.providers.account import telegram as telegram_provider_module
+from app.serializers.v1.order import OrderDetail
+from app.serializers.v1.telegram import TelegramAccount, TelegramChatGroup
+from app.serializers.v1.telegram.account import GroupInfo
+from tests.fixtures.database import (
+    FakePool,
+    FakeRedis,
+    fake_session,
+    group_record,
+    order_page_result,
+    order_record,
+    pool_queries,
+    upsert_result
+)
+from tests.fixtures.orders import FakeOrderTables, chat_state_provider, intent_workload
+from tests.fixtures.telegram import fake_fingerprints, receive_messages, telegram_write_behind
+
+BENCHMARK_DATABASE = os.getenv("BENCHMARK_DATABASE")
+
+
+def _patcher(stack: ExitStack) -> Callable[[object, str, object], None]:
+    """
+    a setattr for the shared fakes, undone when the stack closes
+    :param stack:
+    :return:
+    """
+    return lambda target, name, value: stack.enter_context(patch.object(target, name, value))
+
+
+async def session_leasing(count: int = 20):
+    """
+    N concurrent get_order_by_group_id calls, a connection per task against one serialized connection
+    :param count:
+    :return:
+    """
+    results = {}
+    for name, concurrent, lookups in (("single", True, 1), ("concurrent", True, count), ("serialized", False, count)):
+        with patch.object(settings, "CHAT_STATE_CACHE", False):
+            order_provider = OrderProvider(session=fake_session(FakePool(latency=0.05), concurrent=concurrent), redis=RedisPool())
+            start = time.perf_counter()
+            await asyncio.gather(*[
+                order_provider.get_order_by_group_id(group_id=-1000000000000 - index)
+                for index in range(lookups)
+            ])
+            results[name] = time.perf_counter() - start
+    print("order lookups: " + ", ".join(f"{name} {elapsed:.3f}s" for name, elapsed in results.items()))
+
+
+def statement_cache_cpu(lookups: int = 500):
+    """
+    per-query python CPU of formatting the order lookup, before and after the cache
+    :param lookups:
+    :return:
+    """
+    session = Session(use_poll=True)
+    statements = [
+        session.select(SysOrder.id, SysOrder.order_no, SysCart.group_id, SysOrder.status)
+        .outerjoin(SysCart, SysOrder.cart_id == SysCart.id)
+        .where(SysCart.group_id == group_id)
+        .where(SysOrder.status != OrderStatus.DONE.value)
+        .order_by(SysOrder.created_at.desc())
+        ._select.statement
+        for group_id in range(lookups)
+    ]
+
+    def measure() -> float:
+        start = time.process_time()
+        for item in statements:
+            session._format_statement(item)
+        return (time.process_time() - start) / len(statements)
+
+    maxsize = statement_cache.maxsize
+    statement_cache.clear()
+    try:
+        statement_cache.maxsize = 0
+        uncached = measure()
+        statement_cache.maxsize = 512
+        cached = measure()
+    finally:
+        statement_cache.maxsize = maxsize
+    print(f"statement cache: uncached {uncached * 1e6:.0f}us, cached {cached * 1e6:.0f}us a query")
+
+
+def row_mapper():
+    """
+    the row mapper against model_validate per row
+    :return:
+    """
+    mapper = RowMapper()
+    for model, make_record in ((OrderDetail, order_record), (GroupInfo, group_record)):
+        for size in (1_000, 10_000):
+            records = [make_record(index) for index in range(size)]
+            validated = min(timeit.repeat(lambda: [model.model_validate(dict(record)) for record in records], number=1, repeat=3))
+            mapped = min(timeit.repeat(lambda: mapper.map(records, as_model=model), number=1, repeat=3))
+            print(f"{model.__name__} x {size}: model_validate {validated * 1000:.1f}ms, row mapper {mapped * 1000:.1f}ms")
+
+
+async def window_count_pages():
+    """
+    an order page with the window count against a separate count query
+    :return:
+    """
+    results = {}
+    for window_count in (True, False):
+        with patch.object(settings, "SQL_WINDOW_COUNT_PAGES", window_count):
+            pool = FakePool(latency=0.05, result=order_page_result(total=25))
+            order_provider = OrderProvider(session=fake_session(pool), redis=RedisPool())
+            start = time.perf_counter()
+            await order_provider.get_order_page(page_index=1, page_size=10)
+            results[window_count] = time.perf_counter() - start
+    print(f"order page: window count {results[True]:.3f}s, count query {results[False]:.3f}s")
+
+
+async def bulk_upsert():
+    """
+    bulk_upsert against one insert().on_conflict_do_update() per record, on the configured database
+    :return:
+    """
+    table = sa.Table(
+        "bulk_upsert_benchmark", sa.MetaData(),
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("value", sa.Float),
+        sa.Column("updated_at", sa.DateTime(timezone=True)),
+    )
+    session = Session()
+    await session.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS bulk_upsert_benchmark (id integer PRIMARY KEY, value float, updated_at timestamptz)"
+    )
+    try:
+        for size in (10, 1_000, 100_000):
+            records = [(index, float(index), datetime.now(tz=timezone.utc)) for index in range(size)]
+            start = time.perf_counter()
+            for record_id, value, updated_at in records:
+                statement = insert(table).values(id=record_id, value=value, updated_at=updated_at)
+                await session.execute(statement.on_conflict_do_update(
+                    index_elements=["id"],
+                    set_=dict(value=statement.excluded.value, updated_at=statement.excluded.updated_at)
+                ))
+            looped = time.perf_counter() - start
+            start = time.perf_counter()
+            await session.bulk_upsert(table, records=records, columns=["id", "value", "updated_at"], conflict_cols=["id"])
+            bulk = time.perf_counter() - start
+            print(f"{size:,} rows: looped insert {looped * 1000:.1f}ms, bulk_upsert {bulk * 1000:.1f}ms")
+    finally:
+        await session.rollback()
+        await session.close()
+
+
+async def write_fingerprints(messages: int = 10_000, groups: int = 100):
+    """
+    upserts of the messages of 100 groups, with and without fingerprints
+    :param messages:
+    :param groups:
+    :return:
+    """
+    results = {}
+    for name, fingerprints in (("always", fake_fingerprints(enabled=False)), ("fingerprints", fake_fingerprints(FakeRedis()))):
+        with ExitStack() as stack:
+            start = time.perf_counter()
+            writes = await receive_messages(fingerprints, _patcher(stack), messages=messages, groups=groups)
+            results[name] = (writes, time.perf_counter() - start)
+    print(f"{messages:,} messages: " + ", ".join(
+        f"{name} {writes:,} upserts in {elapsed:.2f}s" for name, (writes, elapsed) in results.items()
+    ))
+
+
+async def write_behind_join(members: int = 500):
+    """
+    a group join, synchronous upserts against the write-behind buffer
+    :param members:
+    :return:
+    """
+    group = TelegramChatGroup(id=-1001, title="group", type="supergroup", in_group=True, bot_type="customer")
+    accounts = [TelegramAccount(id=index, username=f"user{index}", first_name="customer") for index in range(members)]
+    results = {}
+    for name in ("sync", "write_behind"):
+        pool = FakePool(latency=0.001, result=upsert_result)
+        buffer = telegram_write_behind(pool)
+        fingerprints = WriteFingerprints(prefix="benchmark", use_redis=False)
+        with patch.object(telegram_provider_module, "write_behind", buffer), patch.object(telegram_provider_module, "write_fingerprints", fingerprints):
+            provider = TelegramAccountProvider(session=fake_session(pool), redis=RedisPool())
+            start = time.perf_counter()
+            for account in accounts:
+                if name == "sync":
+                    await provider.set_account(account=account)
+                    await provider.set_group(chat_group=group)
+                    await provider.init_chat_group_member({"account_id": account.id, "chat_group_id": group.id})
+                else:
+                    await provider.queue_account_info(account=account, chat_group=group)
+            update_path = time.perf_counter() - start
+            await buffer.flush()
+            results[name] = (update_path, time.perf_counter() - start, len(pool_queries(pool)))
+    print(f"{members} member join: " + ", ".join(
+        f"{name} {update_path * 1000:,.0f}ms in the update path, {total * 1000:,.0f}ms total, {queries} statements"
+        for name, (update_path, total, queries) in results.items()
+    ))
+
+
+async def chat_state(messages: int = 1_000):
+    """
+    an intent workload of one chat, without and with the chat state cache
+    :param messages:
+    :return:
+    """
+    results = {}
+    cache = shared_cache_module.shared_cache
+    for cached in (False, True):
+        tables = FakeOrderTables()
+        tables.set_order(status=OrderStatus.WAIT_FOR_PAYMENT.value)
+        with ExitStack() as stack:
+            provider, worker = await chat_state_provider(_patcher(stack), tables, cached=cached)
+            hits, reads = cache.l1_hits + cache.l2_hits, cache.l1_hits + cache.l2_hits + cache.misses
+            try:
+                start = time.perf_counter()
+                await intent_workload(provider, tables, messages=messages)
+                elapsed = time.perf_counter() - start
+            finally:
+                await worker.stop()
+        reads = cache.l1_hits + cache.l2_hits + cache.misses - reads
+        hit_ratio = (cache.l1_hits + cache.l2_hits - hits) / reads if reads else 0
+        results[cached] = (elapsed / messages, tables.selects, hit_ratio)
+    print(
+        f"{messages:,} messages: uncached {results[False][0] * 1000:.2f}ms a message, {results[False][1]} selects; "
+        f"cached {results[True][0] * 1000:.2f}ms a message, {results[True][1]} selects, hit ratio {results[True][2]:.3f}"
+    )
+
+
+async def main():
+    """
+    :return:
+    """
+    await session_leasing()
+    statement_cache_cpu()
+    row_mapper()
+    await window_count_pages()
+    await write_fingerprints()
+    await write_behind_join()
+    await chat_state()
+    if BENCHMARK_DATABASE:
+        await bulk_upsert()
+    else:
+        print("bulk upsert: set BENCHMARK_DATABASE=1 to run against the configured database")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
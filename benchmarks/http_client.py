@@ -0,0 +1,81 @@
+"""
+Benchmarks of the http client against the stub server of the test suite
+"""
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from app.libs.http_client.http_client import HttpClient, HttpDefaults
+from tests.fixtures.http_client import StubServer
+
+
+def _percentile(latencies: list, percentile: float) -> float:
+    return statistics.quantiles(latencies, n=100)[int(percentile) - 1]
+
+
+async def pooled_latency(requests: int = 200):
+    """
+    p50 and p99 of requests against a local stub server, a client per request against shared clients
+    :param requests:
+    :return:
+    """
+    results = {}
+    for name in ("per_request", "pooled"):
+        server = StubServer()
+        async with server as url:
+            client = HttpClient(defaults=HttpDefaults(base_url=url))
+            if name == "pooled":
+                await client.start(url)
+            latencies = []
+            for index in range(requests):
+                start = time.perf_counter()
+                await client.create(url="/messages").add_json({"index": index}).apost()
+                latencies.append(time.perf_counter() - start)
+            await client.aclose()
+        results[name] = (_percentile(latencies, 50), _percentile(latencies, 99), server.connections)
+    print(f"{requests} requests: " + ", ".join(
+        f"{name} p50 {p50 * 1000:.2f}ms p99 {p99 * 1000:.2f}ms {connections} connections"
+        for name, (p50, p99, connections) in results.items()
+    ))
+
+
+async def degraded_host(updates: int = 20):
+    """
+    updates calling a host that stopped answering in time, without and with a breaker
+    :param updates:
+    :return:
+    """
+    results = {}
+    for breakers in (False, True):
+        server = StubServer(delay=0.2)
+        async with server as url:
+            client = HttpClient(defaults=HttpDefaults(base_url=url, timeout=0.05), breakers=breakers)
+            await client.start(url)
+            start = time.perf_counter()
+            for _ in range(updates):
+                try:
+                    await client.create(url="/messages").retry(2, retry_interval=0.01).aget()
+                except httpx.TransportError:
+                    pass
+            results[breakers] = (time.perf_counter() - start, server.requests)
+            await client.aclose()
+            # let the stub answer the requests it still holds
+            await asyncio.sleep(server.delay)
+    print(f"{updates} updates against a degraded host: " + ", ".join(
+        f"{'breaker' if breakers else 'no breaker'} {elapsed * 1000:,.0f}ms {requests} requests"
+        for breakers, (elapsed, requests) in results.items()
+    ))
+
+
+async def main():
+    """
+    :return:
+    """
+    await pooled_latency()
+    await degraded_host()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
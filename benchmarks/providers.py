@@ -0,0 +1,130 @@
+"""
+Benchmarks of the providers against the configured database, set BENCHMARK_DATABASE=1 to run them
+and BENCHMARK_ORDERS=1000000 to seed the order table for the page depth benchmark
+"""
+import asyncio
+import os
+import time
+from uuid import uuid4
+
+from app.containers import Container
+from app.libs.consts.enums import OperationType
+from app.libs.database import Session
+from app.libs.database.keyset import encode_cursor
+from app.serializers.v1.exchange_rate import QuoteQuery
+
+BENCHMARK_DATABASE = os.getenv("BENCHMARK_DATABASE")
+BENCHMARK_ORDERS = int(os.getenv("BENCHMARK_ORDERS", "0"))
+
+
+async def order_page_depth(container: Container):
+    """
+    page 1 against page 10,000 by offset and by cursor on a seeded order table
+    :param container:
+    :return:
+    """
+    order_provider = container.order_provider()
+    page_size = BENCHMARK_ORDERS // 10_000
+    session = Session()
+    cart_id = uuid4()
+    await session.execute(
+        "INSERT INTO public.cart (id, status, created_by, updated_by) VALUES ($1, 'benchmark', 'benchmark', 'benchmark')",
+        cart_id
+    )
+    await session.execute(
+        """
+        INSERT INTO public."order" (order_no, cart_id, status, created_at, created_by, updated_by, description)
+        SELECT 'BM' || n, $1, 'done', now() - n * interval '1 second', 'benchmark', 'benchmark', 'benchmark'
+        FROM generate_series(1, $2) AS n
+        """,
+        cart_id, BENCHMARK_ORDERS
+    )
+    await session.commit()
+    try:
+        previous_page, _ = await order_provider.get_order_page(page_index=9_998, page_size=page_size)
+        cursor = encode_cursor(previous_page[-1].created_at, previous_page[-1].id)
+        timings = {}
+        for name, kwargs in [
+            ("offset page 1", dict(page_index=0)),
+            ("offset page 10000", dict(page_index=9_999)),
+            ("cursor page 10000", dict(cursor=cursor)),
+        ]:
+            start = time.perf_counter()
+            await order_provider.get_order_page(page_size=page_size, **kwargs)
+            timings[name] = time.perf_counter() - start
+        print(", ".join(f"{name}: {elapsed * 1000:.1f}ms" for name, elapsed in timings.items()))
+    finally:
+        await session.execute('DELETE FROM public."order" WHERE cart_id = $1', cart_id)
+        await session.execute("DELETE FROM public.cart WHERE id = $1", cart_id)
+        await session.commit()
+        await session.close()
+
+
+async def exchange_rate_book(container: Container):
+    """
+    lookups per second of the book against the SQL lookup
+    :param container:
+    :return:
+    """
+    exchange_rate_provider = container.exchange_rate_provider()
+    await exchange_rate_provider.load_exchange_rate_book()
+    results = {}
+    for name, lookup, count in (
+        ("sql", exchange_rate_provider.query_optimal_exchange_rate, 1_000),
+        ("book", exchange_rate_provider.get_optimal_exchange_rate, 100_000),
+    ):
+        start = time.perf_counter()
+        for index in range(count):
+            await lookup(currency="GCASH", operation_type=OperationType.BUY if index % 2 else OperationType.SELL)
+        results[name] = count / (time.perf_counter() - start)
+    print(f"exchange rate lookups/s: sql {results['sql']:,.0f}, book {results['book']:,.0f}")
+
+
+async def price_infos(container: Container, count: int = 1_000):
+    """
+    quotes of one batch against one get_price_info call each
+    :param container:
+    :param count:
+    :return:
+    """
+    price_provider = container.price_provider()
+    queries = [
+        QuoteQuery(
+            group_id=-1002050270240,
+            currency="GCASH" if index % 3 else "USDT",
+            operation_type=OperationType.BUY if index % 2 else OperationType.SELL
+        )
+        for index in range(count)
+    ]
+    start = time.perf_counter()
+    for query in queries:
+        await price_provider.get_price_info(
+            group_id=query.group_id,
+            currency=query.currency,
+            operation_type=query.operation_type
+        )
+    single = time.perf_counter() - start
+    start = time.perf_counter()
+    await price_provider.get_price_infos(queries)
+    batch = time.perf_counter() - start
+    print(f"{count:,} quotes: get_price_info {single * 1000:,.1f}ms, get_price_infos {batch * 1000:,.1f}ms")
+
+
+async def main():
+    """
+    :return:
+    """
+    if not BENCHMARK_DATABASE:
+        print("set BENCHMARK_DATABASE=1 to run against the configured database")
+        return
+    container = Container()
+    await exchange_rate_book(container)
+    await price_infos(container)
+    if BENCHMARK_ORDERS:
+        await order_page_depth(container)
+    else:
+        print("order page depth: set BENCHMARK_ORDERS=1000000 to seed the order table")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,164 @@
+"""
+Benchmarks of the telegram update path against the stubs of the test suite
+"""
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytz
+
+from app.config import settings
+from app.libs.consts.enums import GinaIntention, MessageStatus, OrderStatus
+from app.libs.delayed_delivery import delayed_delivery
+from app.libs.order_expiry import OrderExpiry
+from app.libs.update_processor import ChatOrderedUpdateProcessor
+from tests.fixtures.orders import FakeOrders, order_expirations
+from tests.fixtures.telegram import (
+    BroadcastBot,
+    FakeBot,
+    FakeHistories,
+    StubExchangeRateGina,
+    StubGina,
+    StubOrderProvider,
+    StubPriceProvider,
+    StubTelegramAccountProvider,
+    broadcast_engine,
+    broadcast_histories,
+    chat_update,
+    messages_handler,
+    run_updates
+)
+
+
+async def update_throughput(chats: int = 16, updates_per_chat: int = 4):
+    """
+    updates a second with a stubbed gina by worker count
+    :param chats:
+    :param updates_per_chat:
+    :return:
+    """
+    results = {}
+    for workers in (1, 4, 16):
+        start = time.perf_counter()
+        await run_updates(ChatOrderedUpdateProcessor(workers=workers), chats=chats, updates_per_chat=updates_per_chat)
+        results[workers] = chats * updates_per_chat / (time.perf_counter() - start)
+    print("updates/s by workers: " + ", ".join(f"{workers}: {rate:,.0f}" for workers, rate in results.items()))
+
+
+async def broadcast(chats: int = 2_000):
+    """
+    one history insert, send and history update after another against the engine
+    :param chats:
+    :return:
+    """
+    bot, store = BroadcastBot(), FakeHistories()
+    histories = broadcast_histories(uuid.uuid4(), chats)
+    start = time.perf_counter()
+    for history in histories[:200]:
+        await store.write([history])
+        history.telegram_message_id = await bot.send_message(history.chat_group_id)
+        history.status = MessageStatus.SENT
+        await store.write([history])
+    sequential = (time.perf_counter() - start) * chats / 200
+
+    bot, store = BroadcastBot(), FakeHistories()
+    engine = broadcast_engine(workers=64, rate=1000, batch_size=100)
+    message_id = uuid.uuid4()
+    start = time.perf_counter()
+    engine.start(message_id, broadcast_histories(message_id, chats), bot.send_message, store.write)
+    await engine.wait(message_id)
+    parallel = time.perf_counter() - start
+    print(
+        f"{chats:,} chats: sequential {sequential:,.1f}s (extrapolated from 200), "
+        f"engine {parallel:,.2f}s with {store.writes} history writes"
+    )
+
+
+async def reply_latency(updates: int = 10):
+    """
+    end to end reply latency with stubbed gina, database and telegram, without and with the prefetch
+    :param updates:
+    :return:
+    """
+    for intention in (GinaIntention.HUMAN_CUSTOMER_SERVICE, GinaIntention.SWAP):
+        results = {}
+        for prefetch in (False, True):
+            with patch.object(settings, "TELEGRAM_PREFETCH_CHAT_CONTEXT", prefetch):
+                bot = FakeBot()
+                handler = messages_handler(
+                    gina=StubGina(intention=intention, reply="#CUSTOMER_SERVICE# will help"),
+                    order_provider=StubOrderProvider(order=SimpleNamespace(status=OrderStatus.WAIT_FOR_PAYMENT)),
+                    account_provider=StubTelegramAccountProvider()
+                )
+                latencies = []
+                for update_id in range(updates):
+                    start = time.perf_counter()
+                    await handler.receive_message(chat_update(bot, update_id), None)
+                    latencies.append(time.perf_counter() - start)
+            results[prefetch] = sorted(latencies)[len(latencies) // 2]
+        print(f"{intention.value} reply p50: sequential {results[False] * 1000:.0f}ms, prefetched {results[True] * 1000:.0f}ms")
+
+
+async def exchange_rate_reply():
+    """
+    how long an exchange rate update holds the handler and when its rate is delivered
+    :return:
+    """
+    bot = FakeBot()
+    handler = messages_handler(
+        gina=StubExchangeRateGina(),
+        order_provider=StubOrderProvider(),
+        account_provider=StubTelegramAccountProvider()
+    )
+    handler._messages_controller._price_provider = StubPriceProvider()  # pylint: disable=protected-access
+    start = time.perf_counter()
+    await handler.receive_message(chat_update(bot, 1), None)
+    occupancy = time.perf_counter() - start
+    while delayed_delivery.pending:
+        await asyncio.sleep(0.01)
+    delivered = time.perf_counter() - start
+    print(f"exchange rate update: handler held {occupancy * 1000:.0f}ms, rate delivered after {delivered:.2f}s")
+
+
+async def order_expiry(pending: int = 100_000):
+    """
+    orders waiting for payment past their deadline, one UPDATE per order against the engine
+    :param pending:
+    :return:
+    """
+    orders = FakeOrders(order_expirations(1000, -1))
+    start = time.perf_counter()
+    for expiration in list(orders.waiting.values()):
+        await orders.expire([expiration.id], datetime.now(tz=pytz.UTC))
+    per_order = (time.perf_counter() - start) * pending / 1000
+
+    orders = FakeOrders(order_expirations(pending, -1))
+    engine = OrderExpiry(batch_size=500)
+    engine._expire = orders.expire
+    start = time.perf_counter()
+    engine.restore(await orders.load())
+    restored = time.perf_counter() - start
+    await engine.sweep()
+    swept = time.perf_counter() - start - restored
+    print(
+        f"{pending:,} pending orders: one update per order {per_order:,.1f}s (extrapolated from 1,000), "
+        f"engine restore {restored:.2f}s and sweep {swept:.2f}s in {len(orders.batches)} updates"
+    )
+
+
+async def main():
+    """
+    :return:
+    """
+    await update_throughput()
+    await broadcast()
+    await reply_latency()
+    await exchange_rate_reply()
+    await order_expiry()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
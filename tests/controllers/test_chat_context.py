@@ -0,0 +1,122 @@
+"""
+Test chat context prefetch
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+
+from app.config import settings
+from app.controllers import ChatContext
+from app.libs.consts.enums import GinaIntention, OrderStatus
+from app.schemas.gina import GinaResponse
+from tests.fixtures.telegram import (
+    FakeBot,
+    StubGina,
+    StubOrderProvider,
+    StubTelegramAccountProvider,
+    chat_update,
+    messages_handler
+)
+
+
+@pytest.mark.asyncio
+async def test_order_lookup_is_shared():
+    """
+    the prefetched order answers lookups of any status, an older order of the status is queried
+    :return:
+    """
+    order = SimpleNamespace(status=OrderStatus.WAIT_FOR_PAYMENT)
+    orders = StubOrderProvider(order=order)
+    context = ChatContext(group_id=-1, telegram_account_provider=StubTelegramAccountProvider(), order_provider=orders)
+    context.prefetch(ChatContext.ORDER)
+    assert await context.order() is order
+    assert await context.order(status=OrderStatus.WAIT_FOR_PAYMENT) is order
+    assert orders.queries == 1
+    assert await context.order(status=OrderStatus.WAIT_FOR_PAYMENT_ACCOUNT) is None
+    assert orders.queries == 2
+    context.close()
+
+
+@pytest.mark.asyncio
+async def test_unused_lookups_are_cancelled():
+    """
+    :return:
+    """
+    accounts = StubTelegramAccountProvider()
+    context = ChatContext(group_id=-1, telegram_account_provider=accounts, order_provider=StubOrderProvider())
+    assert (await context.chat_group()).currency_symbol == "USD"
+    assert (await context.chat_group()).currency_symbol == "USD"
+    assert accounts.queries == 1
+    context.prefetch(ChatContext.CUSTOMER_SERVICES)
+    tasks = list(context._tasks.values())  # pylint: disable=protected-access
+    context.close()
+    await asyncio.sleep(0)
+    assert [task.cancelled() for task in tasks] == [False, True]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("max_concurrency", [1, 2])
+async def test_prefetch_holds_at_most_max_concurrency_lookups(max_concurrency: int):
+    """
+    every lookup prefetched, no more than max_concurrency of them run at once
+    :return:
+    """
+    context = ChatContext(
+        group_id=-1,
+        telegram_account_provider=StubTelegramAccountProvider(),
+        order_provider=StubOrderProvider(),
+        max_concurrency=max_concurrency
+    )
+    running, peak = [0], [0]
+
+    def track(loader):
+        async def load():
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            try:
+                return await loader()
+            finally:
+                running[0] -= 1
+
+        return load
+
+    context._loaders = {name: track(loader) for name, loader in context._loaders.items()}  # pylint: disable=protected-access
+    context.prefetch()
+    assert (await context.customer_services())[0].username == "service"
+    assert await context.order() is None
+    assert peak[0] == max_concurrency
+    context.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("intention", [GinaIntention.HUMAN_CUSTOMER_SERVICE, GinaIntention.SWAP])
+async def test_prefetch_overlaps_gina(monkeypatch, intention: GinaIntention):
+    """
+    with the prefetch the lookups of the chat run while gina answers, the replies are the same
+    :return:
+    """
+    results = {}
+    for prefetch in (False, True):
+        monkeypatch.setattr(settings, "TELEGRAM_PREFETCH_CHAT_CONTEXT", prefetch)
+        bot = FakeBot()
+        gina = StubGina(intention=intention, reply="#CUSTOMER_SERVICE# will help")
+        orders = StubOrderProvider(order=SimpleNamespace(status=OrderStatus.WAIT_FOR_PAYMENT))
+        accounts = StubTelegramAccountProvider()
+        handler = messages_handler(gina=gina, order_provider=orders, account_provider=accounts)
+        answer, overlapped = gina.telegram_messages, []
+
+        async def telegram_messages(update: Update, telegram_file=None) -> GinaResponse:
+            response = await answer(update, telegram_file)
+            overlapped.append(orders.queries + accounts.queries)
+            return response
+
+        gina.telegram_messages = telegram_messages
+        for update_id in range(3):
+            orders.queries = accounts.queries = 0
+            await handler.receive_message(chat_update(bot, update_id), None)
+        results[prefetch] = (overlapped, bot.replies)
+    assert results[True][1] == results[False][1]
+    assert results[False][0] == [0, 0, 0]
+    assert all(results[True][0])
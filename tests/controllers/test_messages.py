@@ -0,0 +1,63 @@
+"""
+Test messages controller
+"""
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.libs.delayed_delivery import delayed_delivery
+from tests.fixtures.telegram import (
+    FakeBot,
+    StubExchangeRateGina,
+    StubOrderProvider,
+    StubPriceProvider,
+    StubTelegramAccountProvider,
+    chat_update,
+    messages_handler
+)
+
+
+@pytest.mark.asyncio
+async def test_exchange_rate_reply_does_not_hold_the_handler():
+    """
+    the exchange rate follows the gina reply after the delay, the handler returns right away
+    :return:
+    """
+    bot = FakeBot()
+    handler = messages_handler(
+        gina=StubExchangeRateGina(),
+        order_provider=StubOrderProvider(),
+        account_provider=StubTelegramAccountProvider()
+    )
+    handler._messages_controller._price_provider = StubPriceProvider()  # pylint: disable=protected-access
+
+    await handler.receive_message(chat_update(bot, 1), None)
+    assert bot.replies == ["let me check"]
+    assert delayed_delivery.pending == 1
+
+    while delayed_delivery.pending:
+        await asyncio.sleep(0.01)
+    assert bot.replies == ["let me check", "The current `PHP-USDT` exchange rate is `56.5`"]
+
+
+@pytest.mark.asyncio
+async def test_next_update_of_the_chat_is_answered_after_the_exchange_rate(monkeypatch):
+    """
+    the replies of an update arriving during the delay follow the exchange rate reply
+    :return:
+    """
+    monkeypatch.setattr(settings, "TELEGRAM_EXCHANGE_RATE_REPLY_DELAY", 0.1)
+    bot = FakeBot()
+    handler = messages_handler(
+        gina=StubExchangeRateGina(),
+        order_provider=StubOrderProvider(),
+        account_provider=StubTelegramAccountProvider()
+    )
+    handler._messages_controller._price_provider = StubPriceProvider()  # pylint: disable=protected-access
+    await handler.receive_message(chat_update(bot, 1), None)
+    await handler.receive_message(chat_update(bot, 2), None)
+    while delayed_delivery.pending:
+        await asyncio.sleep(0.01)
+    rate = "The current `PHP-USDT` exchange rate is `56.5`"
+    assert bot.replies == ["let me check", rate, "let me check", rate]
@@ -2,5 +2,9 @@
 Top-level package for tests.fixtures.
 """
 from .controllers import *
+from .database import *
 from .providers import *
 from .handlers import *
+from .http_client import *
+from .orders import *
+from .telegram import *
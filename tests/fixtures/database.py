@@ -0,0 +1,428 @@
+"""
+Fixtures for database
+"""
+import asyncio
+import itertools
+import json
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Iterable, List, Optional
+
+import asyncpg
+import pytest
+from asyncpg.protocol.protocol import _create_record  # noqa
+from asyncpg.transaction import TransactionState
+from redis.exceptions import WatchError
+
+from app.libs.database import Session
+from app.libs.database.aio_orm import PAGE_TOTAL
+from app.libs.database.shared_cache import SharedCache
+
+
+def make_record(**values) -> asyncpg.Record:
+    """
+    build a real asyncpg.Record without a database
+    :param values:
+    :return:
+    """
+    mapping = {name: index for index, name in enumerate(values)}
+    return _create_record(mapping, tuple(values.values()))
+
+
+def order_record(index: int, **kwargs) -> asyncpg.Record:
+    """
+    a record shaped like the OrderDetail queries of OrderProvider
+    :param index:
+    :param kwargs:
+    :return:
+    """
+    values = dict(
+        id=uuid.uuid4(),
+        order_no=f"A{index:06d}",
+        cart_id=uuid.uuid4(),
+        payment_currency="USD",
+        payment_amount=100.5,
+        exchange_currency="TWD",
+        exchange_amount=3000,
+        original_exchange_rate=30.1,
+        with_fee_exchange_rate=Decimal("30.5"),
+        message_id=None if index % 2 else index,
+        group_name="group",
+        group_id=-100 - index,
+        vendor_name="vendor",
+        vendor_id=-200,
+        account_name="account",
+        account_id=index,
+        language="zh-tw",
+        status="wait_for_payment",
+        payment_message_id=None,
+        created_at=datetime(2024, 1, 1, 12, 0, index % 60),
+        description=None
+    )
+    values.update(kwargs)
+    return make_record(**values)
+
+
+def group_record(index: int) -> asyncpg.Record:
+    """
+    a record shaped like the GroupInfo queries of TelegramAccountProvider
+    :param index:
+    :return:
+    """
+    return make_record(
+        id=-100 - index,
+        title=f"group {index}",
+        in_group=True,
+        bot_type="vendors",
+        description=None,
+        payment_account_status=None if index % 2 else "preparing",
+        customer_services=[
+            json.dumps(dict(id=i, username="cs", first_name="c", last_name=None, full_name="c s", name="cs", is_customer_service=True))
+            for i in range(3)
+        ],
+        currency_symbol="USD",
+        handling_fee_name=None,
+        group_types=None if index % 3 else [json.dumps(dict(id=str(uuid.uuid4()), name="VIP"))]
+    )
+
+
+class FakeTransaction:
+    """FakeTransaction"""
+
+    def __init__(self, conn: "FakeConnection"):
+        self._conn = conn
+        self._state = TransactionState.NEW
+
+    async def start(self):
+        self._state = TransactionState.STARTED
+        self._conn.transactions += 1
+
+    async def commit(self):
+        self._state = TransactionState.COMMITTED
+
+    async def rollback(self):
+        self._state = TransactionState.ROLLEDBACK
+
+
+class FakePreparedStatement:
+    """FakePreparedStatement"""
+
+    def __init__(self, conn: "FakeConnection", sql: str):
+        self._conn = conn
+        self._sql = sql
+
+    async def _query(self, method: str, args: tuple):
+        if self._conn.invalidate:
+            self._conn.invalidate = False
+            raise asyncpg.InvalidCachedStatementError("cached statement plan is invalid")
+        return await self._conn._query(method, self._sql, args)
+
+    async def fetch(self, *args, timeout: float = None):
+        return await self._query("fetch", args)
+
+    async def fetchrow(self, *args, timeout: float = None):
+        return await self._query("fetchrow", args)
+
+    async def fetchval(self, *args, column: int = 0, timeout: float = None):
+        return await self._query("fetchval", args)
+
+
+class FakeCursor:
+    """asyncpg.Cursor stand-in that reads batches from the iterable the connection answers with"""
+
+    def __init__(self, conn: "FakeConnection", rows: Iterable):
+        self._conn = conn
+        self._rows = iter(rows or ())
+        self.fetches = 0
+
+    async def fetch(self, n: int, *, timeout: float = None) -> list:
+        self.fetches += 1
+        await asyncio.sleep(self._conn.latency)
+        return list(itertools.islice(self._rows, n))
+
+
+class FakeConnection:
+    """asyncpg.Connection stand-in that answers every query after a fixed latency"""
+
+    def __init__(self, latency: float = 0, result: Callable = None):
+        self.latency = latency
+        self.result = result or (lambda method, sql, args: None)
+        self.queries = []
+        self.transactions = 0
+        self.prepared = []
+        self.invalidate = False
+        self.cursors = []
+
+    def is_closed(self) -> bool:
+        return False
+
+    def transaction(self, isolation: str = None) -> FakeTransaction:
+        return FakeTransaction(self)
+
+    async def prepare(self, sql: str, timeout: float = None) -> FakePreparedStatement:
+        self.prepared.append(sql)
+        await asyncio.sleep(self.latency)
+        return FakePreparedStatement(self, sql)
+
+    async def _query(self, method: str, sql: str, args: tuple):
+        self.queries.append((method, sql, args))
+        await asyncio.sleep(self.latency)
+        return self.result(method, sql, args)
+
+    async def execute(self, sql: str, *args, timeout: float = None):
+        return await self._query("execute", sql, args)
+
+    async def fetch(self, sql: str, *args, timeout: float = None):
+        return await self._query("fetch", sql, args)
+
+    async def fetchrow(self, sql: str, *args, timeout: float = None):
+        return await self._query("fetchrow", sql, args)
+
+    async def fetchval(self, sql: str, *args, timeout: float = None):
+        return await self._query("fetchval", sql, args)
+
+    async def cursor(self, sql: str, *args, prefetch: int = None, timeout: float = None) -> FakeCursor:
+        cursor = FakeCursor(self, await self._query("cursor", sql, args))
+        self.cursors.append(cursor)
+        return cursor
+
+    async def copy_records_to_table(self, table_name: str, *, records, columns=None, schema_name=None, timeout=None):
+        return await self._query("copy", table_name, (list(records), list(columns or [])))
+
+
+class FakePool:
+    """asyncpg.Pool stand-in that hands out FakeConnection"""
+
+    def __init__(self, latency: float = 0, result: Callable = None):
+        self.latency = latency
+        self.result = result
+        self.idle: list[FakeConnection] = []
+        self.in_use: set[FakeConnection] = set()
+        self.max_in_use = 0
+        self.acquired = 0
+        self.released = 0
+
+    async def acquire(self, timeout: Optional[float] = None) -> FakeConnection:
+        conn = self.idle.pop() if self.idle else FakeConnection(latency=self.latency, result=self.result)
+        self.in_use.add(conn)
+        self.acquired += 1
+        self.max_in_use = max(self.max_in_use, len(self.in_use))
+        return conn
+
+    async def release(self, conn: FakeConnection, timeout: Optional[float] = None):
+        self.in_use.discard(conn)
+        self.idle.append(conn)
+        self.released += 1
+
+    def get_size(self) -> int:
+        return len(self.idle) + len(self.in_use)
+
+    def get_idle_size(self) -> int:
+        return len(self.idle)
+
+    def get_min_size(self) -> int:
+        return 0
+
+    def get_max_size(self) -> int:
+        return 100
+
+
+@pytest.fixture
+def fake_pool() -> FakePool:
+    """
+    fake_pool
+    :return:
+    """
+    return FakePool(latency=0.05)
+
+
+def fake_session(pool: FakePool, concurrent: bool = True) -> Session:
+    """
+    a session leasing its connections from a FakePool
+    :param pool:
+    :param concurrent:
+    :return:
+    """
+    session = Session(use_poll=True, concurrent=concurrent)
+    session._pool = pool
+    return session
+
+
+def pool_queries(pool: FakePool) -> list:
+    """
+    the (method, sql, args) sent on every connection of the pool
+    :param pool:
+    :return:
+    """
+    return [(method, sql, args) for conn in pool.idle + list(pool.in_use) for method, sql, args in conn.queries]
+
+
+def order_page_result(total: int) -> Callable:
+    """
+    answer the page and count queries of OrderProvider.get_order_page for an order table of total rows
+    :param total:
+    :return:
+    """
+    def result(method, sql, args):
+        if method == "fetchval":
+            return total
+        *_, limit, offset = args if "OFFSET" in sql else (*args, 0)
+        size = max(0, min(limit, total - offset))
+        return [order_record(offset + index, **{PAGE_TOTAL: total}) for index in range(size)]
+    return result
+
+
+def upsert_result(method: str, sql: str, args: tuple):
+    """
+    answer the merge of Session.bulk_upsert as if every record was inserted
+    :param method:
+    :param sql:
+    :param args:
+    :return:
+    """
+    if method == "fetch":
+        return [make_record(inserted=len(args), updated=0)]
+    return None
+
+
+class FakeRedis:
+    """redis.asyncio.Redis stand-in, instances sharing a store act like processes sharing a server"""
+
+    def __init__(self, store: dict = None, channels: dict = None, latency: float = 0):
+        self.store = {} if store is None else store
+        self.channels = {} if channels is None else channels
+        self.latency = latency
+        self.commands = []
+        # commands of an executing pipeline share its round trip
+        self.pipelined = False
+
+    async def _round_trip(self):
+        if not self.pipelined:
+            await asyncio.sleep(self.latency)
+
+    async def get(self, key: str):
+        self.commands.append(("get", key))
+        return self.store.get(key)
+
+    async def set(self, key: str, value: str, ex: int = None, nx: bool = False):
+        self.commands.append(("set", key))
+        await self._round_trip()
+        if nx and key in self.store:
+            return None
+        self.store[key] = value
+        return True
+
+    async def incr(self, key: str) -> int:
+        return await self.incrby(key)
+
+    async def incrby(self, key: str, amount: int = 1) -> int:
+        self.commands.append(("incrby", key))
+        await self._round_trip()
+        self.store[key] = str(int(self.store.get(key, 0)) + amount)
+        return int(self.store[key])
+
+    async def hget(self, key: str, field: str):
+        self.commands.append(("hget", key, field))
+        return self.store.get(key, {}).get(field)
+
+    async def hset(self, key: str, field: str, value: str):
+        self.commands.append(("hset", key, field))
+        self.store.setdefault(key, {})[field] = value
+
+    async def expire(self, key: str, seconds: int):
+        pass
+
+    async def delete(self, *keys: str):
+        self.commands.append(("delete", *keys))
+        for key in keys:
+            self.store.pop(key, None)
+
+    async def publish(self, channel: str, message: str):
+        for queue in self.channels.get(channel, []):
+            queue.put_nowait({"type": "message", "channel": channel, "data": message})
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self)
+
+    def pubsub(self) -> "FakePubSub":
+        return FakePubSub(self)
+
+
+class FakePipeline:
+    """redis pipeline stand-in that runs the queued commands on execute, watched keys abort it when they change"""
+
+    def __init__(self, redis: FakeRedis):
+        self._redis = redis
+        self._commands = []
+        self._watched = {}
+        self._multi = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def watch(self, *keys: str):
+        self._watched.update({key: self._redis.store.get(key) for key in keys})
+
+    def multi(self):
+        self._multi = True
+
+    def __getattr__(self, item):
+        if self._watched and not self._multi:
+            # commands after watch run at once
+            return getattr(self._redis, item)
+        return lambda *args, **kwargs: self._commands.append((getattr(self._redis, item), args, kwargs))
+
+    async def execute(self):
+        await self._redis._round_trip()
+        if any(self._redis.store.get(key) != value for key, value in self._watched.items()):
+            raise WatchError("Watched variable changed.")
+        self._redis.pipelined = True
+        try:
+            return [await command(*args, **kwargs) for command, args, kwargs in self._commands]
+        finally:
+            self._redis.pipelined = False
+
+
+class FakePubSub:
+    """redis pubsub stand-in"""
+
+    def __init__(self, redis: FakeRedis):
+        self._redis = redis
+        self._queue = asyncio.Queue()
+
+    async def subscribe(self, *channels: str):
+        for channel in channels:
+            self._redis.channels.setdefault(channel, []).append(self._queue)
+
+    async def get_message(self, ignore_subscribe_messages: bool = False, timeout: float = 0.0):
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        for queues in self._redis.channels.values():
+            if self._queue in queues:
+                queues.remove(self._queue)
+
+
+async def cache_worker(redis: FakeRedis, enabled: bool = True, hook: Callable[[List[str]], None] = None) -> SharedCache:
+    """
+    a SharedCache of one worker process on the FakeRedis, listening for invalidations
+    :param redis:
+    :param enabled: a disabled cache listens only with a hook
+    :param hook: registered with on_invalidate before the listener starts
+    :return:
+    """
+    cache = SharedCache(channel="test:cache:invalidate", enabled=enabled)
+    cache._redis = redis
+    if hook is not None:
+        cache.on_invalidate(hook)
+    await cache.start()
+    while not cache.listening:
+        await asyncio.sleep(0)
+    return cache
@@ -0,0 +1,154 @@
+"""
+Fixtures for orders
+"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+
+import asyncpg
+import pytz
+
+from app.config import settings
+from app.libs.consts.enums import CartStatus
+from app.libs.database import RedisPool, shared_cache as shared_cache_module
+from app.libs.database.shared_cache import SharedCache
+from app.providers import OrderProvider
+from app.schemas.order import Cart, ExpiredOrder, OrderExpiration
+from tests.fixtures.database import FakePool, FakeRedis, cache_worker, fake_session, make_record, order_record
+
+GROUP_ID = -1001
+QUERY_LATENCY = 0.002
+UPDATE_LATENCY = 0.002
+
+
+class FakeOrderTables:
+    """the order and cart of one chat, answering the queries of OrderProvider"""
+
+    def __init__(self):
+        self.order: Optional[asyncpg.Record] = None
+        self.cart: Optional[asyncpg.Record] = None
+        self.selects = 0
+        self.fail_writes = False
+
+    def set_cart(self, cart: Optional[Cart]):
+        self.cart = make_record(**cart.model_dump()) if cart else None
+
+    def set_order(self, **kwargs):
+        self.order = order_record(1, group_id=GROUP_ID, **kwargs)
+
+    def result(self, method: str, sql: str, args: tuple):
+        if self.fail_writes and method == "execute":
+            raise RuntimeError("write failed")
+        if method == "fetchval":
+            return 0
+        if method != "fetchrow":
+            return None
+        self.selects += 1
+        if "JOIN" in sql:
+            return self.order
+        if CartStatus.PENDING.value in args and self.cart is not None and self.cart["status"] != CartStatus.PENDING:
+            return None
+        return self.cart
+
+
+def order_cart(**kwargs) -> Cart:
+    """
+    a pending cart of the chat GROUP_ID
+    :param kwargs:
+    :return:
+    """
+    values = dict(
+        message_id=1,
+        group_name="group",
+        group_id=GROUP_ID,
+        vendor_name="vendor",
+        vendor_id=-200,
+        account_name="account",
+        account_id=1,
+        payment_currency="PHP",
+        payment_amount=5650,
+        exchange_currency="USDT",
+        exchange_amount=100,
+        original_exchange_rate=56.5,
+        with_fee_exchange_rate=56.5
+    )
+    values.update(kwargs)
+    return Cart(**values)
+
+
+async def chat_state_provider(
+    patch: Callable[[object, str, object], None],
+    tables: FakeOrderTables,
+    cached: bool = True
+) -> Tuple[OrderProvider, SharedCache]:
+    """
+    an OrderProvider on the tables, with the shared cache on a FakeRedis
+    :param patch: monkeypatch.setattr, or a setattr undone once the caller is done
+    :param tables:
+    :param cached: CHAT_STATE_CACHE
+    :return: the provider and the cache worker to stop afterwards
+    """
+    cache = await cache_worker(FakeRedis())
+    patch(shared_cache_module.shared_cache, "_redis", cache.redis)
+    patch(shared_cache_module.shared_cache, "listening", True)
+    patch(shared_cache_module.shared_cache, "_l1", {})
+    patch(settings, "CHAT_STATE_CACHE", cached)
+    session = fake_session(FakePool(latency=QUERY_LATENCY, result=tables.result))
+    return OrderProvider(session=session, redis=RedisPool()), cache
+
+
+async def intent_workload(provider: OrderProvider, tables: FakeOrderTables, messages: int):
+    """
+    each message reads the order, one in ten reads the cart and writes it
+    :param provider:
+    :param tables:
+    :param messages:
+    :return:
+    """
+    cart = order_cart()
+    for index in range(messages):
+        await provider.get_order_by_group_id(group_id=GROUP_ID)
+        if index % 10 == 0:
+            if await provider.get_cart_by_group_id(group_id=GROUP_ID) is None:
+                await provider.create_cart(cart=cart)
+            else:
+                await provider.update_cart(cart=cart)
+            tables.set_cart(cart)
+
+
+class FakeOrders:
+    """orders waiting for payment, expire answers like the batched UPDATE ... RETURNING"""
+
+    def __init__(self, expirations: List[OrderExpiration] = None):
+        self.waiting = {expiration.id: expiration for expiration in expirations or []}
+        self.batches: List[int] = []
+        self.notified: List[ExpiredOrder] = []
+
+    async def load(self) -> List[OrderExpiration]:
+        return list(self.waiting.values())
+
+    async def expire(self, order_ids: List[uuid.UUID], now: datetime) -> List[ExpiredOrder]:
+        await asyncio.sleep(UPDATE_LATENCY)
+        self.batches.append(len(order_ids))
+        expired = [
+            order_id for order_id in order_ids
+            if order_id in self.waiting and self.waiting[order_id].expiration_of_pay <= now
+        ]
+        for order_id in expired:
+            del self.waiting[order_id]
+        return [ExpiredOrder(id=order_id, order_no=f"O{index}", group_id=-index - 1) for index, order_id in enumerate(expired)]
+
+    async def notify(self, order: ExpiredOrder):
+        self.notified.append(order)
+
+
+def order_expirations(count: int, seconds: float) -> List[OrderExpiration]:
+    """
+    count orders whose payment is due in seconds, negative seconds are past due
+    :param count:
+    :param seconds:
+    :return:
+    """
+    expiration_of_pay = datetime.now(tz=pytz.UTC) + timedelta(seconds=seconds)
+    return [OrderExpiration(expiration_of_pay=expiration_of_pay) for _ in range(count)]
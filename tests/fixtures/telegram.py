@@ -0,0 +1,362 @@
+"""
+Fixtures for telegram
+"""
+import asyncio
+import random
+import uuid
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+import telegram
+from telegram import Bot, Chat, Message, Update, User
+from telegram.ext import Application, ContextTypes, MessageHandler, filters
+
+from app.controllers import MessagesController
+from app.handlers.telegram_bot import TelegramBotMessagesHandler
+from app.libs.broadcaster import Broadcaster
+from app.libs.consts.enums import GinaAction, GinaIntention, Language, OrderStatus
+from app.libs.database import RedisPool
+from app.libs.database.write_behind import WriteBehindBuffer
+from app.libs.database.write_fingerprints import WriteFingerprints
+from app.libs.update_processor import ChatOrderedUpdateProcessor
+from app.models import SysTelegramAccount, SysTelegramChatGroup, SysTelegramChatGroupMember
+from app.providers import TelegramAccountProvider
+from app.providers.account import telegram as telegram_provider_module
+from app.schemas.broadcast_message import BroadcastMessageHistory
+from app.schemas.gina import GinaResponse
+from app.serializers.v1.telegram import TelegramAccount, TelegramChatGroup
+from tests.fixtures.database import FakePool, FakeRedis, fake_session, pool_queries
+
+GINA_LATENCY = 0.06
+DB_LATENCY = 0.02
+TELEGRAM_LATENCY = 0.015
+SEND_LATENCY = 0.02
+WRITE_LATENCY = 0.002
+
+
+class FakeBot(Bot):
+    """Bot whose calls take a fixed round trip and never reach telegram"""
+
+    def __init__(self):
+        super().__init__("123456:ABCDEF")
+        with self._unfrozen():
+            self.replies: List[str] = []
+
+    async def send_message(self, chat_id, text, *args, **kwargs):
+        await asyncio.sleep(TELEGRAM_LATENCY)
+        self.replies.append(text)
+
+    async def send_chat_action(self, chat_id, action, *args, **kwargs):
+        await asyncio.sleep(TELEGRAM_LATENCY)
+        return True
+
+
+class StubOrderProvider:
+    """orders of a chat, one query a lookup"""
+
+    def __init__(self, order=None):
+        self.order = order
+        self.queries = 0
+
+    async def get_order_by_group_id(self, group_id: int, status: OrderStatus = None):
+        self.queries += 1
+        await asyncio.sleep(DB_LATENCY)
+        if self.order is None or (status is not None and self.order.status != status):
+            return None
+        return self.order
+
+    async def get_cart_by_group_id(self, group_id: int):
+        self.queries += 1
+        await asyncio.sleep(DB_LATENCY)
+
+
+class StubTelegramAccountProvider:
+    """chat groups and their customer services, one query a lookup"""
+
+    def __init__(self):
+        self.queries = 0
+
+    async def get_chat_group(self, group_id: int):
+        self.queries += 1
+        await asyncio.sleep(DB_LATENCY)
+        return SimpleNamespace(id=group_id, currency_symbol="USD")
+
+    async def get_group_customer_services(self, group_id: int) -> List[TelegramAccount]:
+        self.queries += 1
+        await asyncio.sleep(DB_LATENCY)
+        return [TelegramAccount(id=7, username="service", first_name="service")]
+
+
+class StubPriceProvider:
+    """one vendor quoting every currency"""
+
+    async def get_price_info(self, group_id: int, currency: str, operation_type):
+        return SimpleNamespace(price=56.5, vendor_name="vendor", vendor_id=1)
+
+
+class StubGina:
+    """gina classifying every message with one intention"""
+
+    def __init__(self, intention: GinaIntention, reply: str):
+        self.intention = intention
+        self.reply = reply
+
+    async def telegram_messages(self, update: Update, telegram_file=None) -> GinaResponse:
+        await asyncio.sleep(GINA_LATENCY)
+        return GinaResponse(reply=self.reply, intention=self.intention)
+
+
+class StubExchangeRateGina:
+    """gina answering every message as an exchange rate question"""
+
+    async def telegram_messages(self, update, telegram_file=None) -> GinaResponse:
+        return GinaResponse(
+            reply="let me check",
+            intention=GinaIntention.EXCHANGE_RATE,
+            action=GinaAction.EXCHANGE_RATE,
+            payment_currency="php",
+            exchange_currency="usdt",
+            language=Language.EN_US
+        )
+
+
+def chat_update(bot: Bot, update_id: int) -> Update:
+    """
+    a text message of a customer in the group -1001
+    :param bot:
+    :param update_id:
+    :return:
+    """
+    chat = Chat(id=-1001, type=Chat.SUPERGROUP, title="group")
+    chat.set_bot(bot)
+    message = Message(
+        message_id=update_id,
+        date=None,
+        chat=chat,
+        from_user=User(id=1, first_name="customer", is_bot=False),
+        text="hello"
+    )
+    message.set_bot(bot)
+    return Update(update_id=update_id, message=message)
+
+
+def messages_handler(
+    gina,
+    order_provider: StubOrderProvider,
+    account_provider: StubTelegramAccountProvider
+) -> TelegramBotMessagesHandler:
+    """
+    a TelegramBotMessagesHandler on the stubs, skipping the account sync of every update
+    :param gina:
+    :param order_provider:
+    :param account_provider:
+    :return:
+    """
+    controller = MessagesController(
+        telegram_account_provider=account_provider,
+        price_provider=None,
+        order_provider=order_provider,
+        vendors_bot_provider=None
+    )
+    handler = TelegramBotMessagesHandler(
+        redis=RedisPool(),
+        telegram_account_provider=account_provider,
+        file_provider=None,
+        gina_provider=gina,
+        messages_controller=controller
+    )
+
+    async def setup_account_info(**kwargs):
+        pass
+
+    handler.setup_account_info = setup_account_info
+    return handler
+
+
+class OfflineBot(Bot):
+    """Bot that never talks to telegram"""
+
+    async def initialize(self):
+        self._bot_user = User(id=1, first_name="bot", is_bot=True)
+        self._initialized = True
+
+    async def shutdown(self):
+        self._initialized = False
+
+
+class CountingGina:
+    """Gina with a fixed response time, counting the calls it answers at once"""
+
+    def __init__(self, latency: float = 0.02):
+        self.latency = latency
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+
+    async def telegram_messages(self, message: str):
+        self.calls += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.active -= 1
+        return message
+
+
+def processor_update(update_id: int, chat_id: int, bot: Bot) -> Update:
+    """
+    a text message of the chat, its text names the chat and the update
+    :param update_id:
+    :param chat_id:
+    :param bot:
+    :return:
+    """
+    message = Message(
+        message_id=update_id,
+        date=None,
+        chat=Chat(id=chat_id, type=Chat.SUPERGROUP),
+        from_user=User(id=chat_id, first_name="customer", is_bot=False),
+        text=f"{chat_id}:{update_id}"
+    )
+    message.set_bot(bot)
+    return Update(update_id=update_id, message=message)
+
+
+async def run_updates(processor: ChatOrderedUpdateProcessor, chats: int, updates_per_chat: int):
+    """
+    put updates of the chats round-robin on the update queue and wait until all are processed
+    :param processor:
+    :param chats:
+    :param updates_per_chat:
+    :return: the counting gina and the message ids each chat processed, in order
+    """
+    gina = CountingGina()
+    seen: Dict[int, List[int]] = {}
+
+    async def receive_message(update: Update, _: ContextTypes.DEFAULT_TYPE):
+        await gina.telegram_messages(update.message.text)
+        seen.setdefault(update.effective_chat.id, []).append(update.message.message_id)
+
+    application = Application.builder().bot(OfflineBot("123456:ABCDEF")).updater(None).concurrent_updates(processor).build()
+    application.add_handler(MessageHandler(filters=filters.TEXT, callback=receive_message))
+    async with application:
+        await application.start()
+        for index in range(chats * updates_per_chat):
+            await application.update_queue.put(processor_update(index, -(index % chats) - 1, application.bot))
+        await application.update_queue.join()
+        while processor.active or processor.pending:
+            await asyncio.sleep(0.001)
+        await application.stop()
+    assert gina.calls == chats * updates_per_chat
+    return gina, seen
+
+
+class BroadcastBot:
+    """send_message with a fixed round trip, chats in retry_after answer RetryAfter once"""
+
+    def __init__(self, retry_after: Dict[int, float] = None, bad_chats: List[int] = None):
+        self.retry_after = dict(retry_after or {})
+        self.bad_chats = bad_chats or []
+        self.sent: List[int] = []
+
+    async def send_message(self, chat_id: int) -> int:
+        await asyncio.sleep(SEND_LATENCY)
+        if chat_id in self.retry_after:
+            raise telegram.error.RetryAfter(self.retry_after.pop(chat_id))
+        if chat_id in self.bad_chats:
+            raise telegram.error.BadRequest("Chat not found")
+        self.sent.append(chat_id)
+        return len(self.sent)
+
+
+class FakeHistories:
+    """message history table of a broadcast"""
+
+    def __init__(self):
+        self.rows: Dict[int, BroadcastMessageHistory] = {}
+        self.writes = 0
+
+    async def write(self, histories: List[BroadcastMessageHistory]):
+        await asyncio.sleep(WRITE_LATENCY)
+        self.writes += 1
+        for history in histories:
+            self.rows[history.chat_group_id] = history.model_copy()
+
+
+def broadcast_histories(message_id: uuid.UUID, chats: int) -> List[BroadcastMessageHistory]:
+    """
+    a pending history of the message for each of the chats
+    :param message_id:
+    :param chats:
+    :return:
+    """
+    return [BroadcastMessageHistory(message_id=message_id, chat_group_id=-index - 1) for index in range(chats)]
+
+
+def broadcast_engine(**kwargs) -> Broadcaster:
+    """
+    a Broadcaster whose options default to a small, fast engine
+    :param kwargs:
+    :return:
+    """
+    options = dict(workers=16, rate=10_000, chat_rate_per_minute=20, batch_size=50)
+    options.update(kwargs)
+    return Broadcaster(**options)
+
+
+def telegram_write_behind(pool: FakePool, **kwargs) -> WriteBehindBuffer:
+    """
+    a write-behind buffer of the telegram tables flushing to the pool
+    :param pool:
+    :param kwargs:
+    :return:
+    """
+    buffer = WriteBehindBuffer(**kwargs)
+    buffer.register(SysTelegramChatGroup, conflict_cols=["id"])
+    buffer.register(SysTelegramAccount, conflict_cols=["id"])
+    buffer.register(SysTelegramChatGroupMember, conflict_cols=["account_id", "chat_group_id"], update=False)
+    buffer.session = fake_session(pool)
+    return buffer
+
+
+def fake_fingerprints(redis: FakeRedis = None, **kwargs) -> WriteFingerprints:
+    """
+    write fingerprints kept in process, and on the FakeRedis when one is given
+    :param redis:
+    :param kwargs:
+    :return:
+    """
+    fingerprints = WriteFingerprints(prefix="test:fingerprint", use_redis=redis is not None, **kwargs)
+    fingerprints._redis = redis
+    return fingerprints
+
+
+async def receive_messages(
+    fingerprints: WriteFingerprints,
+    patch: Callable[[object, str, object], None],
+    messages: int,
+    groups: int
+) -> int:
+    """
+    run the upserts of setup_account_info for every message
+    :param fingerprints:
+    :param patch: monkeypatch.setattr, or a setattr undone once the caller is done
+    :param messages:
+    :param groups:
+    :return: statements sent to postgres
+    """
+    patch(telegram_provider_module, "write_fingerprints", fingerprints)
+    pool = FakePool(result=lambda method, sql, args: "INSERT 0 1")
+    provider = TelegramAccountProvider(session=fake_session(pool), redis=RedisPool())
+    rand = random.Random(16)
+    for index in range(messages):
+        group_id, user = -1000 - rand.randrange(groups), rand.randrange(10)
+        # a few customers change their username while chatting
+        username = f"user{user}" if index % 500 else f"user{user}_{index}"
+        account = TelegramAccount(id=group_id * 100 - user, username=username, first_name="customer", is_premium=False)
+        group = TelegramChatGroup(id=group_id, title=f"group {group_id}", type="supergroup", in_group=True, bot_type="customer")
+        await provider.set_account(account=account)
+        await provider.set_group(chat_group=group)
+        await provider.init_chat_group_member({"account_id": account.id, "chat_group_id": group_id, "is_customer_service": False})
+    return sum(1 for _, sql, _ in pool_queries(pool) if sql.startswith("INSERT"))
@@ -4,6 +4,7 @@ Test message handler.
 import pytest
 
 from app.handlers import TelegramMessageHandler
+from app.libs.broadcaster import broadcaster
 from app.libs.consts.enums import BotType
 from app.serializers.v1.telegram import TelegramBroadcast
 
@@ -23,4 +24,8 @@ async def test_broadcast_message(telegram_message_handler: TelegramMessageHandle
             -1002003483337
         ]
     )
-    await telegram_message_handler.broadcast_message(model=broadcast)
+    progress = await telegram_message_handler.broadcast_message(model=broadcast)
+    assert progress.total == 2
+    await broadcaster.wait(progress.message_id)
+    progress = await telegram_message_handler.get_broadcast_progress(message_id=progress.message_id)
+    assert progress.pending == 0
@@ -0,0 +1,270 @@
+"""
+Test aio_orm session
+"""
+import asyncio
+import resource
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import pytest
+import sqlalchemy as sa
+
+from app.config import settings
+from app.libs.database import Session, RedisPool
+from app.libs.database.aio_orm import UpsertResult
+from app.libs.database.keyset import InvalidCursorError, encode_cursor
+from app.models import SysExchangeRate, SysOrder
+from app.providers import OrderProvider
+from app.serializers.v1.order import OrderDetail
+from tests.fixtures.database import FakePool, fake_session, make_record, order_page_result, order_record
+
+
+async def _run_order_lookups(session: Session, count: int):
+    order_provider = OrderProvider(session=session, redis=RedisPool())
+    await asyncio.gather(*[
+        order_provider.get_order_by_group_id(group_id=-1000000000000 - index)
+        for index in range(count)
+    ])
+
+
+@pytest.mark.asyncio
+async def test_concurrent_session_leases_connection_per_task(fake_pool: FakePool):
+    """
+    N concurrent get_order_by_group_id calls each lease a connection of their own
+    :param fake_pool:
+    :return:
+    """
+    count = 20
+    await _run_order_lookups(fake_session(fake_pool, concurrent=True), count)
+    assert fake_pool.max_in_use == count
+    assert fake_pool.acquired == fake_pool.released
+
+    serialized_pool = FakePool(latency=fake_pool.latency)
+    await _run_order_lookups(fake_session(serialized_pool, concurrent=False), count)
+    assert serialized_pool.max_in_use == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_session_scopes_transaction_to_task(fake_pool: FakePool):
+    """
+    each task commits or rolls back its own transaction
+    :param fake_pool:
+    :return:
+    """
+    session = fake_session(fake_pool, concurrent=True)
+
+    async def write(commit: bool):
+        await session.execute("UPDATE sys_order SET description = 'x'")
+        tx = session._tx
+        if commit:
+            await session.commit()
+        else:
+            await session.rollback()
+        await session.close()
+        return tx
+
+    committed, rolled_back = await asyncio.gather(write(True), write(False))
+    assert committed is not rolled_back
+    assert committed._state.name == "COMMITTED"
+    assert rolled_back._state.name == "ROLLEDBACK"
+    assert not fake_pool.in_use
+
+
+@pytest.mark.asyncio
+async def test_concurrent_session_releases_unclosed_connection(fake_pool: FakePool):
+    """
+    a task that never closes the session still gives its connection back
+    :param fake_pool:
+    :return:
+    """
+    session = fake_session(fake_pool, concurrent=True)
+    await asyncio.create_task(session.fetchval("SELECT 1"))
+    await asyncio.sleep(0.01)
+    assert fake_pool.acquired == fake_pool.released == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("window_count", [True, False])
+async def test_fetchpages_counts_in_page_query(window_count: bool, monkeypatch):
+    """
+    the window count returns the page and the total in one round trip
+    :param window_count:
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setattr(settings, "SQL_WINDOW_COUNT_PAGES", window_count)
+    pool = FakePool(latency=0.05, result=order_page_result(total=25))
+    order_provider = OrderProvider(session=fake_session(pool, concurrent=True), redis=RedisPool())
+    orders, total = await order_provider.get_order_page(page_index=1, page_size=10)
+    conn, = pool.idle
+    assert total == 25
+    assert [order.order_no for order in orders] == [f"A{index:06d}" for index in range(10, 20)]
+    assert len(conn.queries) == (1 if window_count else 2)
+    assert ("count(*) OVER ()" in conn.queries[-1][1]) is window_count
+
+
+@pytest.mark.asyncio
+async def test_fetchpages_counts_empty_page_separately():
+    """
+    a page past the end has no row to carry the total
+    :return:
+    """
+    pool = FakePool(result=order_page_result(total=25))
+    order_provider = OrderProvider(session=fake_session(pool, concurrent=True), redis=RedisPool())
+    orders, total = await order_provider.get_order_page(page_index=3, page_size=10)
+    assert (orders, total) == ([], 25)
+    orders, total = await OrderProvider(
+        session=fake_session(FakePool(result=order_page_result(total=0)), concurrent=True),
+        redis=RedisPool()
+    ).get_order_page(page_index=0, page_size=10)
+    assert (orders, total) == ([], 0)
+
+
+@pytest.mark.asyncio
+async def test_fetch_page_after_cursor():
+    """
+    the cursor page filters on the keyset instead of skipping rows
+    :return:
+    """
+    pool = FakePool(result=order_page_result(total=25))
+    order_provider = OrderProvider(session=fake_session(pool, concurrent=True), redis=RedisPool())
+    created_at, order_id = datetime(2024, 1, 1, 12, 0, 0, 123456, tzinfo=timezone.utc), uuid4()
+    orders, total = await order_provider.get_order_page(page_size=10, cursor=encode_cursor(created_at, order_id))
+    (method, sql, args), = pool.idle[0].queries
+    assert total is None
+    assert len(orders) == 10
+    assert 'WHERE (public."order".created_at, public."order".id) < ($1, $2)' in sql
+    assert 'ORDER BY public."order".created_at DESC, public."order".id DESC' in sql
+    assert "OFFSET" not in sql
+    assert args == (created_at, order_id, 10)
+    with pytest.raises(InvalidCursorError):
+        await order_provider.get_order_page(cursor="not-a-cursor")
+    with pytest.raises(InvalidCursorError):
+        await order_provider.get_order_page(cursor=encode_cursor(created_at))
+
+
+def _order_rows(method, sql, args):
+    return (order_record(index) for index in range(25)) if method == "cursor" else None
+
+
+@pytest.mark.asyncio
+async def test_stream_reads_cursor_in_batches():
+    """
+    stream opens a server-side cursor inside the session transaction and fetches it batch by batch
+    :return:
+    """
+    pool = FakePool(result=_order_rows)
+    session = fake_session(pool, concurrent=True)
+    orders = [
+        order async for order in session.select(SysOrder).order_by(SysOrder.created_at).stream(batch_size=10, as_model=OrderDetail)
+    ]
+    conn, = pool.in_use
+    (method, sql, _), = conn.queries
+    assert method == "cursor" and 'ORDER BY public."order".created_at' in sql
+    assert conn.transactions == 1
+    assert conn.cursors[0].fetches == 4
+    assert [order.order_no for order in orders] == [f"A{index:06d}" for index in range(25)]
+    assert all(isinstance(order, OrderDetail) for order in orders)
+    await session.close()
+
+
+def _million_rows(method, sql, args):
+    return (make_record(id=index, name="order", amount=index * 1.5) for index in range(1_000_000))
+
+
+@pytest.mark.asyncio
+async def test_stream_memory_is_bounded():
+    """
+    iterating 1M rows keeps at most one batch alive
+    :return:
+    """
+    session = fake_session(FakePool(result=_million_rows), concurrent=True)
+    count = 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    async for _ in session.select(SysOrder).stream(batch_size=1_000):
+        count += 1
+    growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - max_rss
+    await session.close()
+    assert count == 1_000_000
+    # a fully materialised result of this size takes a few hundred MB
+    assert growth < 20 * 1024
+
+
+def _upsert_result(method, sql, args):
+    if method == "fetch":
+        return [make_record(inserted=2, updated=1)]
+    return None
+
+
+@pytest.mark.asyncio
+async def test_bulk_upsert_merges_staging_table():
+    """
+    records are copied into the staging table and merged in one statement
+    :return:
+    """
+    pool = FakePool(result=_upsert_result)
+    session = fake_session(pool, concurrent=True)
+    records = [
+        dict(telegram_chat_group_id=-1001, currency_id=uuid4(), buy_rate=1.0, sell_rate=2.0),
+        dict(telegram_chat_group_id=-1001, currency_id=uuid4(), buy_rate=3.0, sell_rate=4.0),
+    ]
+    result = await session.bulk_upsert(
+        SysExchangeRate,
+        records=records,
+        conflict_cols=["telegram_chat_group_id", "currency_id"],
+        update_values={"updated_at": sa.func.now(), "updated_by": "system"}
+    )
+    assert result == UpsertResult(inserted=2, updated=1)
+    (_, create, _), (_, table, (copied, columns)), (_, merge, params) = pool.in_use.pop().queries
+    assert create == (
+        'CREATE TEMP TABLE IF NOT EXISTS _staging_public_exchange_rate '
+        '(LIKE public.exchange_rate INCLUDING DEFAULTS) ON COMMIT DELETE ROWS; TRUNCATE _staging_public_exchange_rate;'
+    )
+    assert table == "_staging_public_exchange_rate"
+    assert columns == ["telegram_chat_group_id", "currency_id", "buy_rate", "sell_rate"]
+    assert copied == [tuple(record.values()) for record in records]
+    assert (
+        'INSERT INTO public.exchange_rate (telegram_chat_group_id, currency_id, buy_rate, sell_rate) '
+        'SELECT telegram_chat_group_id, currency_id, buy_rate, sell_rate FROM _staging_public_exchange_rate '
+        'ON CONFLICT (telegram_chat_group_id, currency_id) DO UPDATE SET buy_rate = EXCLUDED.buy_rate, '
+        'sell_rate = EXCLUDED.sell_rate, updated_at = now(), updated_by = $1 RETURNING xmax = 0 AS inserted'
+    ) in merge
+    assert params == ("system",)
+    assert await session.bulk_upsert(SysExchangeRate, records=[], conflict_cols=["id"]) == UpsertResult(0, 0)
+
+
+@pytest.mark.asyncio
+async def test_bulk_upsert_tuples_need_columns():
+    """
+    :return:
+    """
+    pool = FakePool(result=_upsert_result)
+    session = fake_session(pool, concurrent=True)
+    with pytest.raises(ValueError):
+        await session.bulk_upsert(SysExchangeRate, records=[(-1001, uuid4(), 1.0, 2.0)], conflict_cols=["id"])
+    result = await session.bulk_upsert(
+        SysExchangeRate,
+        records=[(-1001, uuid4(), 1.0, 2.0)],
+        columns=["telegram_chat_group_id", "currency_id", "buy_rate", "sell_rate"],
+        conflict_cols=["telegram_chat_group_id", "currency_id"]
+    )
+    assert result == UpsertResult(inserted=2, updated=1)
+
+
+@pytest.mark.asyncio
+async def test_bulk_upsert_keeps_last_record_per_conflict_key():
+    """
+    ON CONFLICT cannot update a row twice, only the last record of a conflict key is copied
+    :return:
+    """
+    pool = FakePool(result=_upsert_result)
+    session = fake_session(pool, concurrent=True)
+    currency_id = uuid4()
+    await session.bulk_upsert(
+        SysExchangeRate,
+        records=[(-1001, currency_id, 1.0, 2.0), (-1002, currency_id, 5.0, 6.0), (-1001, currency_id, 3.0, 4.0), (None, currency_id, 7.0, 8.0)],
+        columns=["telegram_chat_group_id", "currency_id", "buy_rate", "sell_rate"],
+        conflict_cols=["telegram_chat_group_id", "currency_id"]
+    )
+    _, (_, _, (copied, _)), _ = pool.in_use.pop().queries
+    assert copied == [(-1001, currency_id, 3.0, 4.0), (-1002, currency_id, 5.0, 6.0), (None, currency_id, 7.0, 8.0)]
@@ -0,0 +1,128 @@
+"""
+Test chat state cache of the order provider
+"""
+import pytest
+
+from app.libs.consts.enums import CartStatus, OrderStatus
+from app.libs.database import shared_cache as shared_cache_module
+from app.schemas.order import Order
+from tests.fixtures.orders import GROUP_ID, FakeOrderTables, chat_state_provider, intent_workload, order_cart
+
+
+@pytest.mark.asyncio
+async def test_reads_share_one_load(monkeypatch):
+    """
+    order and cart of a chat are loaded once, a status of another order is still queried
+    :return:
+    """
+    tables = FakeOrderTables()
+    tables.set_order(status=OrderStatus.WAIT_FOR_PAYMENT.value)
+    provider, worker = await chat_state_provider(monkeypatch.setattr, tables)
+    try:
+        for _ in range(3):
+            order = await provider.get_order_by_group_id(group_id=GROUP_ID)
+            assert order.status == OrderStatus.WAIT_FOR_PAYMENT
+            assert await provider.get_order_by_group_id(group_id=GROUP_ID, status=OrderStatus.WAIT_FOR_PAYMENT) == order
+            assert await provider.get_cart_by_group_id(group_id=GROUP_ID) is None
+        assert tables.selects == 2
+        await provider.get_order_by_group_id(group_id=GROUP_ID, status=OrderStatus.WAIT_FOR_PAYMENT_ACCOUNT)
+        assert tables.selects == 3
+    finally:
+        await worker.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_write_leaves_the_cached_cart(monkeypatch):
+    """
+    a cart the caller changed and failed to write is not what the next read of the chat gets
+    :return:
+    """
+    tables = FakeOrderTables()
+    tables.set_cart(order_cart())
+    provider, worker = await chat_state_provider(monkeypatch.setattr, tables)
+    try:
+        cart = await provider.get_cart_by_group_id(group_id=GROUP_ID)
+        payment_amount, loads = cart.payment_amount, tables.selects
+        cart.payment_amount += 5650
+        tables.fail_writes = True
+        with pytest.raises(RuntimeError):
+            await provider.update_cart(cart=cart)
+        cached = await provider.get_cart_by_group_id(group_id=GROUP_ID)
+        assert cached.payment_amount == payment_amount
+        assert tables.selects == loads
+    finally:
+        await worker.stop()
+
+
+@pytest.mark.asyncio
+async def test_writes_go_through_to_the_cache(monkeypatch):
+    """
+    a cart becomes an order and the order is done, the reads in between hit no database
+    :return:
+    """
+    tables = FakeOrderTables()
+    provider, worker = await chat_state_provider(monkeypatch.setattr, tables)
+    try:
+        assert await provider.get_cart_by_group_id(group_id=GROUP_ID) is None
+        loads = tables.selects
+
+        cart = order_cart()
+        await provider.create_cart(cart=cart)
+        tables.set_cart(cart)
+        assert (await provider.get_cart_by_group_id(group_id=GROUP_ID)).id == cart.id
+
+        cart.payment_amount = 11300
+        await provider.update_cart(cart=cart)
+        tables.set_cart(cart)
+        assert (await provider.get_cart_by_group_id(group_id=GROUP_ID)).payment_amount == 11300
+        assert tables.selects == loads
+
+        tables.set_cart(cart.model_copy(update={"status": CartStatus.CONFIRMED}))
+        await provider.update_cart_status(cart_id=cart.id, status=CartStatus.CONFIRMED)
+        order = Order(cart_id=cart.id)
+        tables.set_order(id=order.id, cart_id=cart.id, payment_amount=11300, status=OrderStatus.WAIT_FOR_PAYMENT_ACCOUNT.value)
+        await provider.create_order(order=order)
+        writes = tables.selects
+        assert await provider.get_cart_by_group_id(group_id=GROUP_ID) is None
+        latest = await provider.get_order_by_group_id(group_id=GROUP_ID)
+        assert (latest.id, latest.payment_amount) == (order.id, 11300)
+
+        order.status = OrderStatus.WAIT_FOR_PAYMENT
+        tables.set_order(id=order.id, cart_id=cart.id, status=OrderStatus.WAIT_FOR_PAYMENT.value)
+        await provider.update_order(order=order)
+        writes += 1
+        assert (await provider.get_order_by_group_id(group_id=GROUP_ID)).status == OrderStatus.WAIT_FOR_PAYMENT
+        assert tables.selects == writes
+
+        tables.set_order(id=order.id, cart_id=cart.id, status=OrderStatus.DONE.value)
+        await provider.update_order_status(order_id=str(order.id), status=OrderStatus.DONE.value)
+        tables.order = None
+        assert await provider.get_order_by_group_id(group_id=GROUP_ID) is None
+        # a done order makes the chat state load again
+        assert tables.selects == writes + 1 + 2
+    finally:
+        await worker.stop()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("cached", [False, True])
+async def test_chat_state_serves_intent_workload(cached: bool, monkeypatch):
+    """
+    1,000 messages of one chat load the chat state once with the cache, every time without it
+    :return:
+    """
+    tables = FakeOrderTables()
+    tables.set_order(status=OrderStatus.WAIT_FOR_PAYMENT.value)
+    provider, worker = await chat_state_provider(monkeypatch.setattr, tables, cached=cached)
+    cache = shared_cache_module.shared_cache
+    hits, reads = cache.l1_hits + cache.l2_hits, cache.l1_hits + cache.l2_hits + cache.misses
+    try:
+        await intent_workload(provider, tables, messages=1000)
+    finally:
+        await worker.stop()
+    if not cached:
+        assert tables.selects >= 1000
+        return
+    assert tables.selects <= 2
+    hit_ratio = (cache.l1_hits + cache.l2_hits - hits) / (cache.l1_hits + cache.l2_hits + cache.misses - reads)
+    assert hit_ratio > 0.99
@@ -0,0 +1,170 @@
+"""
+Test order number allocator
+"""
+import asyncio
+import uuid
+
+import pytest
+from asyncpg import UniqueViolationError
+from redis.exceptions import RedisError
+
+from app.config import settings
+from app.libs.database import RedisPool, Session
+from app.libs.database.order_no_allocator import OrderNoAllocator
+from app.providers import OrderProvider, order as order_provider_module
+from app.schemas.order import Order
+from tests.fixtures.database import FakePool, FakeRedis
+
+ORDERS = 10_000
+QUERY_LATENCY = 0.002
+REDIS_LATENCY = 0.0005
+
+
+def _allocator(redis: FakeRedis, **kwargs) -> OrderNoAllocator:
+    allocator = OrderNoAllocator(**kwargs)
+    allocator._redis = redis
+    return allocator
+
+
+def _seed(last: int = 0):
+    calls = []
+
+    async def seed(day: str) -> int:
+        calls.append(day)
+        return last
+
+    return seed, calls
+
+
+class FakeOrderTable:
+    """order table with the unique index on order_no, the max of _last_order_sequence reads it"""
+
+    def __init__(self, *order_nos: str):
+        self.order_nos = set(order_nos)
+        self.violations = 0
+
+    def result(self, method: str, sql: str, args: tuple):
+        if method == "execute" and sql.startswith('INSERT INTO public."order"'):
+            order_no, = [arg for arg in args if isinstance(arg, str) and arg.startswith("O")]
+            if order_no in self.order_nos:
+                self.violations += 1
+                raise UniqueViolationError.new({"M": "duplicate key", "n": "ix_public_order_order_no", "C": "23505"})
+            self.order_nos.add(order_no)
+        if method == "fetchval" and "max" in sql:
+            return max(self.order_nos, default=None)
+        return None
+
+
+def _provider(monkeypatch, table: FakeOrderTable, allocator: OrderNoAllocator) -> OrderProvider:
+    monkeypatch.setattr(settings, "CHAT_STATE_CACHE", False)
+    monkeypatch.setattr(order_provider_module, "order_no_allocator", allocator)
+    session = Session(use_poll=True, concurrent=True)
+    session._pool = FakePool(latency=QUERY_LATENCY, result=table.result)
+    return OrderProvider(session=session, redis=RedisPool())
+
+
+@pytest.mark.asyncio
+async def test_workers_allocate_unique_numbers():
+    """
+    4 workers sharing one counter hand out 10,000 numbers at once without a duplicate
+    :return:
+    """
+    redis = FakeRedis(latency=REDIS_LATENCY)
+    workers = [_allocator(redis, block_size=25) for _ in range(4)]
+    seed, calls = _seed()
+    numbers = await asyncio.gather(*(workers[index % 4].allocate(seed=seed) for index in range(ORDERS)))
+    assert len(set(numbers)) == ORDERS
+    assert {int(number[9:]) for number in numbers} == set(range(1, ORDERS + 1))
+    assert sum(worker.reservations for worker in workers) == ORDERS // 25
+    assert len(calls) == ORDERS // 25
+
+
+@pytest.mark.asyncio
+async def test_counter_starts_after_the_orders_of_the_day_and_rolls_over(monkeypatch):
+    """
+    :return:
+    """
+    allocator = _allocator(FakeRedis(), block_size=10)
+    seed, calls = _seed(last=41)
+    monkeypatch.setattr(OrderNoAllocator, "today", staticmethod(lambda: "20261018"))
+    assert await allocator.allocate(seed=seed) == "O202610180000042"
+    assert await allocator.allocate(seed=seed) == "O202610180000043"
+    monkeypatch.setattr(OrderNoAllocator, "today", staticmethod(lambda: "20261019"))
+    assert await allocator.allocate(seed=seed) == "O202610190000042"
+    assert calls == ["20261018", "20261019"]
+    assert allocator.stats()["reservations"] == 2
+
+
+@pytest.mark.asyncio
+async def test_flushed_counter_goes_on_after_the_last_order(monkeypatch):
+    """
+    a counter lost mid-day is seeded again from the database instead of starting at 1
+    :return:
+    """
+    redis = FakeRedis()
+    allocator = _allocator(redis, block_size=10)
+    monkeypatch.setattr(OrderNoAllocator, "today", staticmethod(lambda: "20261018"))
+    seed, calls = _seed(last=41)
+    assert await allocator.allocate(seed=seed) == "O202610180000042"
+    redis.store.clear()
+    for sequence in range(43, 52):
+        assert await allocator.allocate(seed=seed) == f"O20261018{sequence:07d}"
+    # other workers numbered orders up to 60 before the flush
+    seed, _ = _seed(last=60)
+    assert await allocator.allocate(seed=seed) == "O202610180000061"
+
+
+@pytest.mark.asyncio
+async def test_fallback_numbers_after_the_last_order(monkeypatch):
+    """
+    without redis the next number follows the highest one of today, numbers skipped by the
+    allocator leave the count of the orders behind it
+    :return:
+    """
+    allocator = _allocator(FakeRedis(), block_size=10)
+    day = allocator.today()
+
+    async def unavailable(seed):
+        raise RedisError("Connection refused")
+
+    monkeypatch.setattr(allocator, "allocate", unavailable)
+    table = FakeOrderTable(f"O{day}0000001", f"O{day}0000011")
+    provider = _provider(monkeypatch, table, allocator)
+    order = await provider.create_order(order=Order(cart_id=uuid.uuid4()))
+    assert order.order_no == f"O{day}0000012"
+
+
+@pytest.mark.asyncio
+async def test_taken_number_is_drawn_again(monkeypatch):
+    """
+    :return:
+    """
+    allocator = _allocator(FakeRedis(), block_size=10)
+    day = allocator.today()
+    order_nos = iter([f"O{day}0000001", f"O{day}0000002"])
+
+    async def allocate(seed):
+        return next(order_nos)
+
+    monkeypatch.setattr(allocator, "allocate", allocate)
+    table = FakeOrderTable(f"O{day}0000001")
+    provider = _provider(monkeypatch, table, allocator)
+    order = await provider.create_order(order=Order(cart_id=uuid.uuid4()))
+    assert order.order_no == f"O{day}0000002"
+    assert table.violations == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_orders_get_unique_numbers(monkeypatch):
+    """
+    10,000 orders created at once are numbered without a duplicate and one seed per block
+    :return:
+    """
+    allocator = _allocator(FakeRedis(latency=REDIS_LATENCY), block_size=10)
+    monkeypatch.setattr(settings, "ORDER_NO_ALLOCATOR", True)
+    table = FakeOrderTable()
+    provider = _provider(monkeypatch, table, allocator)
+    orders = await asyncio.gather(*(provider.create_order(order=Order(cart_id=uuid.uuid4())) for _ in range(ORDERS)))
+    assert len({order.order_no for order in orders}) == ORDERS
+    assert table.violations == 0
+    assert allocator.reservations == ORDERS // 10
@@ -0,0 +1,84 @@
+"""
+Test pool manager and metrics
+"""
+import asyncio
+
+import pytest
+
+from app.libs.database import aio_pg
+from app.libs.database.pool_metrics import LatencyHistogram, ManagedPool, PoolMetrics
+from tests.fixtures.database import FakePool
+
+
+class SlowPool(FakePool):
+    """every connection stays busy for longer than the acquire timeout"""
+
+    async def acquire(self, timeout: float = None):
+        await asyncio.sleep(timeout)
+        raise asyncio.TimeoutError()
+
+
+def test_latency_histogram():
+    """
+    observations land in the first bucket whose bound is not below them
+    :return:
+    """
+    histogram = LatencyHistogram(buckets=(1, 10, 100))
+    for seconds in (0.0005, 0.001, 0.005, 0.005, 0.2):
+        histogram.observe(seconds)
+    snapshot = histogram.snapshot()
+    assert snapshot["buckets"] == {"le_1": 2, "le_10": 2, "le_100": 0, "inf": 1}
+    assert snapshot["count"] == 5
+    assert snapshot["max_ms"] == 200
+    assert snapshot["p50_ms"] == 10
+    assert snapshot["p99_ms"] == 200
+    assert LatencyHistogram().snapshot()["p50_ms"] is None
+
+
+@pytest.mark.asyncio
+async def test_managed_pool_records_acquires(fake_pool: FakePool):
+    """
+    acquire latency, timeouts and in-use gauges are reported by stats
+    :param fake_pool:
+    :return:
+    """
+    pool = ManagedPool(fake_pool, PoolMetrics(), acquire_timeout=0.01)
+    first, second = await pool.acquire(), await pool.acquire()
+    await pool.release(first)
+    stats = pool.stats()
+    assert (stats["size"], stats["idle"], stats["in_use"]) == (2, 1, 1)
+    assert (stats["acquires"], stats["releases"]) == (2, 1)
+    assert stats["acquire_latency"]["count"] == 2
+    slow = ManagedPool(SlowPool(), PoolMetrics(), acquire_timeout=0.01)
+    with pytest.raises(asyncio.TimeoutError):
+        await slow.acquire()
+    assert slow.stats()["acquire_timeouts"] == 1
+    assert slow.stats()["acquire_latency"]["max_ms"] >= 10
+    await pool.release(second)
+
+
+@pytest.mark.asyncio
+async def test_create_pool_once_under_concurrency(monkeypatch):
+    """
+    concurrent callers wait for the pool being created instead of creating their own
+    :param monkeypatch:
+    :return:
+    """
+    created = []
+
+    async def create(**kwargs):
+        await asyncio.sleep(0.05)
+        created.append(kwargs)
+        return FakePool()
+
+    monkeypatch.setattr(aio_pg.asyncpg, "create_pool", create)
+    aio_pg.setup("TEST_POOL", dsn="postgresql://test", min_size=1, max_size=5)
+    try:
+        pools = await asyncio.gather(*[aio_pg.create_pool("TEST_POOL") for _ in range(10)])
+        assert len(created) == 1
+        assert all(pool is pools[0] for pool in pools)
+        assert created[0]["max_size"] == 5
+        assert created[0]["init"] == aio_pg._get_context("TEST_POOL").metrics.on_connect  # noqa
+        assert "TEST_POOL" in aio_pg.pool_stats()
+    finally:
+        aio_pg._AIO_DB_CONTEXTS.pop("TEST_POOL", None)  # noqa
@@ -0,0 +1,102 @@
+"""
+Test prepared statement cache
+"""
+import pytest
+
+from app.config import settings
+from app.libs.database import Session, RedisPool
+from app.libs.database.aio_orm import prepared_statement_cache
+from app.libs.database.prepared_statements import PreparedStatementCache
+from app.providers import OrderProvider
+from tests.fixtures.database import FakePool, FakeConnection
+
+
+class FakeProxy:
+    """pool connections are proxies around the real connection"""
+
+    def __init__(self, conn: FakeConnection):
+        self._con = conn
+
+    async def prepare(self, sql: str, timeout: float = None):
+        return await self._con.prepare(sql, timeout=timeout)
+
+
+@pytest.fixture
+def prepared_cache():
+    enabled, maxsize = prepared_statement_cache.enabled, prepared_statement_cache.maxsize
+    prepared_statement_cache.enabled = True
+    yield prepared_statement_cache
+    prepared_statement_cache.enabled, prepared_statement_cache.maxsize = enabled, maxsize
+
+
+@pytest.mark.asyncio
+async def test_provider_reads_reuse_prepared_statement(
+    prepared_cache: PreparedStatementCache,
+    fake_pool: FakePool,
+    monkeypatch
+):
+    """
+    the order lookup is prepared once per connection and reused afterwards
+    :param prepared_cache:
+    :param fake_pool:
+    :param monkeypatch:
+    :return:
+    """
+    # every lookup reaches the database
+    monkeypatch.setattr(settings, "CHAT_STATE_CACHE", False)
+    session = Session(use_poll=True, concurrent=False)
+    session._pool = fake_pool
+    order_provider = OrderProvider(session=session, redis=RedisPool())
+    hits = prepared_cache.hits
+    for group_id in range(10):
+        await order_provider.get_order_by_group_id(group_id=group_id)
+    conn, = fake_pool.idle
+    assert len(conn.prepared) == 1
+    assert len(conn.queries) == 10
+    assert prepared_cache.hits - hits == 9
+
+
+@pytest.mark.asyncio
+async def test_prepared_statement_cache_keys_on_underlying_connection():
+    """
+    a new proxy for the same pooled connection still hits
+    :return:
+    """
+    cache = PreparedStatementCache(enabled=True, maxsize=10)
+    conn = FakeConnection()
+    await cache.executor(FakeProxy(conn)).fetchval("SELECT 1")
+    await cache.executor(FakeProxy(conn)).fetchval("SELECT 1")
+    assert conn.prepared == ["SELECT 1"]
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_prepared_statement_cache_evicts_least_recently_used():
+    """
+    the cache is capped per connection
+    :return:
+    """
+    cache = PreparedStatementCache(enabled=True, maxsize=2)
+    conn = FakeConnection()
+    executor = cache.executor(conn)
+    for sql in ["SELECT 1", "SELECT 2", "SELECT 1", "SELECT 3", "SELECT 1", "SELECT 2"]:
+        await executor.fetch(sql)
+    assert conn.prepared == ["SELECT 1", "SELECT 2", "SELECT 3", "SELECT 2"]
+    assert cache.stats()["evictions"] == 2
+    assert cache.stats()["statements"] == 2
+
+
+@pytest.mark.asyncio
+async def test_prepared_statement_cache_reprepares_invalid_statement():
+    """
+    a statement invalidated by a schema change is prepared again
+    :return:
+    """
+    cache = PreparedStatementCache(enabled=True, maxsize=10)
+    conn = FakeConnection(result=lambda method, sql, args: 1)
+    executor = cache.executor(conn)
+    await executor.fetchval("SELECT 1")
+    conn.invalidate = True
+    assert await executor.fetchval("SELECT 1") == 1
+    assert conn.prepared == ["SELECT 1", "SELECT 1"]
+    assert cache.stats()["invalidations"] == 1
@@ -0,0 +1,142 @@
+"""
+Test read replica routing
+"""
+import asyncio
+from typing import Dict
+
+import pytest
+import sqlalchemy as sa
+
+from app.config import settings
+from app.libs.database import Session, aio_orm, aio_pg
+from app.libs.database.replica import ReplicaSet, primary_reads
+from app.models import SysOrder
+from tests.fixtures.database import FakePool
+
+
+def _replica_result(lag: float):
+    def result(method, sql, args):
+        if "pg_last_wal_replay_lsn" in sql:
+            return lag
+        return []
+
+    return result
+
+
+def _broken_replica_result(method, sql, args):
+    if "pg_last_wal_replay_lsn" in sql:
+        return 0
+    raise ConnectionResetError("connection reset by peer")
+
+
+@pytest.fixture
+def replicas(monkeypatch) -> Dict[str, FakePool]:
+    """
+    two replicas of the default pool, the second one 10 seconds behind
+    :param monkeypatch:
+    :return:
+    """
+    pools = {"TEST_REPLICA_0": FakePool(result=_replica_result(0)), "TEST_REPLICA_1": FakePool(result=_replica_result(10))}
+    for key, pool in pools.items():
+        aio_pg.setup(key, replica_of=aio_pg.Keys.POOL, dsn=f"postgresql://{key}").pool = pool
+    monkeypatch.setattr(aio_orm, "replicas", ReplicaSet(max_staleness=5, lag_check_interval=60))
+    monkeypatch.setattr(settings, "DATABASE_REPLICA_STICKY_SECONDS", 0.1)
+    yield pools
+    for key in pools:
+        aio_pg._AIO_DB_CONTEXTS.pop(key, None)  # noqa
+
+
+def _session(primary: FakePool, **kwargs) -> Session:
+    session = Session(use_poll=True, concurrent=True, use_replica=True, **kwargs)
+    session._pool = primary
+    return session
+
+
+def _reads(pool: FakePool) -> list:
+    return [
+        sql for conn in pool.idle + list(pool.in_use) for method, sql, _ in conn.queries
+        if "pg_last_wal_replay_lsn" not in sql
+    ]
+
+
+@pytest.mark.asyncio
+async def test_reads_go_to_fresh_replica(replicas: Dict[str, FakePool]):
+    """
+    reads outside a transaction use the replica within the staleness tolerance
+    :param replicas:
+    :return:
+    """
+    primary = FakePool(result=lambda method, sql, args: [])
+    session = _session(primary)
+    for _ in range(3):
+        await session.select(SysOrder.id).fetch()
+    await session.fetch("SELECT 1")
+    assert len(_reads(replicas["TEST_REPLICA_0"])) == 4
+    assert _reads(replicas["TEST_REPLICA_1"]) == []
+    assert _reads(primary) == []
+    await session.fetch("SELECT id FROM public.order FOR UPDATE")
+    await session.fetch(sa.select([SysOrder.id]).with_for_update())
+    assert len(_reads(primary)) == 2
+    lagging = _session(primary, max_staleness=30)
+    for _ in range(2):
+        await lagging.select(SysOrder.id).fetch()
+    assert len(_reads(replicas["TEST_REPLICA_1"])) == 1
+
+
+@pytest.mark.asyncio
+async def test_primary_reads_skip_the_replica(replicas: Dict[str, FakePool]):
+    """
+    reads of a primary_reads block, such as the loads of the shared cache, go to the primary
+    :param replicas:
+    :return:
+    """
+    primary = FakePool(result=lambda method, sql, args: [])
+    session = _session(primary)
+    with primary_reads():
+        await session.select(SysOrder.id).fetch()
+    assert len(_reads(primary)) == 1
+    assert _reads(replicas["TEST_REPLICA_0"]) == []
+    await session.select(SysOrder.id).fetch()
+    assert len(_reads(replicas["TEST_REPLICA_0"])) == 1
+
+
+@pytest.mark.asyncio
+async def test_writes_stick_to_primary(replicas: Dict[str, FakePool]):
+    """
+    reads in a transaction and right after its commit stay on the primary of the task
+    :param replicas:
+    :return:
+    """
+    primary = FakePool(result=lambda method, sql, args: [])
+    session = _session(primary)
+    await session.execute("UPDATE public.order SET status = 'CANCELLED'")
+    await session.select(SysOrder.id).fetch()
+    assert len(_reads(primary)) == 2
+    await session.commit()
+    await session.select(SysOrder.id).fetch()
+    assert len(_reads(primary)) == 3
+    # another task did not write
+    await asyncio.create_task(session.select(SysOrder.id).fetch())
+    assert len(_reads(replicas["TEST_REPLICA_0"])) == 1
+    await asyncio.sleep(0.1)
+    await session.select(SysOrder.id).fetch()
+    assert len(_reads(replicas["TEST_REPLICA_0"])) == 2
+    await session.close()
+
+
+@pytest.mark.asyncio
+async def test_unavailable_replica_falls_back_to_primary(replicas: Dict[str, FakePool]):
+    """
+    a replica that cannot be reached leaves the rotation and the read runs on the primary
+    :param replicas:
+    :return:
+    """
+    replicas["TEST_REPLICA_0"].result = _broken_replica_result
+    primary = FakePool(result=lambda method, sql, args: [])
+    session = _session(primary)
+    assert await session.select(SysOrder.id).fetch() == []
+    assert len(_reads(primary)) == 1
+    assert aio_orm.replicas.stats()["failures"] == 1
+    await session.select(SysOrder.id).fetch()
+    assert len(_reads(primary)) == 2
+    assert aio_orm.replicas.stats()["replicas"] == {"TEST_REPLICA_0": None, "TEST_REPLICA_1": 10}
@@ -0,0 +1,65 @@
+"""
+Test row mapper
+"""
+import uuid
+from datetime import datetime, date
+from decimal import Decimal
+
+import pytest
+from pydantic import ValidationError
+
+from app.libs.database.aio_orm import _format_dict
+from app.libs.database.row_mapper import RowMapper
+from app.serializers.v1.order import OrderDetail
+from app.serializers.v1.telegram.account import GroupInfo, TelegramChatGroup
+from tests.fixtures.database import make_record, order_record, group_record
+
+
+def assert_same(expected, actual):
+    assert type(expected) is type(actual)
+    assert expected == actual
+    assert list(expected.__dict__) == list(actual.__dict__)
+    assert expected.model_fields_set == actual.model_fields_set
+    assert expected.model_dump_json() == actual.model_dump_json()
+
+
+@pytest.mark.parametrize("model, records", [
+    (OrderDetail, [order_record(i) for i in range(10)]),
+    (GroupInfo, [group_record(i) for i in range(10)]),
+    (TelegramChatGroup, [make_record(id=i, title="t", type="group", in_group=False, bot_type="customer") for i in range(3)]),
+])
+def test_row_mapper_matches_model_validate(model, records):
+    """
+    mapped models are the same as validated ones
+    :param model:
+    :param records:
+    :return:
+    """
+    for expected, actual in zip([model.model_validate(dict(record)) for record in records], RowMapper().map(records, as_model=model)):
+        assert_same(expected, actual)
+
+
+def test_row_mapper_keeps_validation_errors():
+    """
+    rows the plan cannot trust still raise the pydantic error
+    :return:
+    """
+    mapper = RowMapper()
+    with pytest.raises(ValidationError):
+        mapper.map([order_record(0), order_record(1, group_name=None)], as_model=OrderDetail)
+    with pytest.raises(ValidationError):
+        mapper.map([order_record(0, status="unknown")], as_model=OrderDetail)
+    order, = mapper.map([order_record(0, group_id="-100")], as_model=OrderDetail)
+    assert order.group_id == -100
+
+
+def test_row_mapper_formats_dicts():
+    """
+    plain rows are formatted like Converter.format_value
+    :return:
+    """
+    records = [
+        make_record(id=uuid.uuid4(), created_at=None, day=date(2024, 1, 2), amount=Decimal("1.0"), tags=[uuid.uuid4()]),
+        make_record(id=uuid.uuid4(), created_at=datetime(2024, 1, 2, 3, 4, 5), day=None, amount=Decimal("2"), tags=[]),
+    ]
+    assert RowMapper().map(records) == [_format_dict(record) for record in records]
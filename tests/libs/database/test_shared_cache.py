@@ -0,0 +1,215 @@
+"""
+Test shared cache
+"""
+import asyncio
+from typing import List, Optional
+from uuid import uuid4
+
+import pytest
+from pydantic import TypeAdapter
+
+from app.libs.consts.redis_keys import get_group_exchange_rate_key
+from app.libs.database import RedisPool, Session, shared_cache as shared_cache_module
+from app.providers import ExchangeRateProvider
+from app.serializers.v1.exchange_rate import CurrencyIdExRate
+from tests.fixtures.database import FakePool, FakeRedis, cache_worker, make_record
+
+INTS = TypeAdapter(List[int])
+
+
+def _counting_loader(value):
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return value
+
+    return loader, calls
+
+
+@pytest.mark.asyncio
+async def test_invalidation_reaches_other_workers():
+    """
+    a value loaded by one worker is shared through redis and dropped everywhere on invalidate
+    :return:
+    """
+    store, channels = {}, {}
+    first, second = await cache_worker(FakeRedis(store, channels)), await cache_worker(FakeRedis(store, channels))
+    invalidated = []
+    second.on_invalidate(invalidated.append)
+    loader, calls = _counting_loader([1, 2, 3])
+    try:
+        assert await first.get("rates", INTS, loader) == [1, 2, 3]
+        assert await second.get("rates", INTS, loader) == [1, 2, 3]
+        assert await second.get("rates", INTS, loader) == [1, 2, 3]
+        assert len(calls) == 1
+        assert (first.misses, second.l2_hits, second.l1_hits) == (1, 1, 1)
+        await first.invalidate("rates")
+        await asyncio.sleep(0.01)
+        assert invalidated == [["rates"]]
+        assert "rates" not in store
+        assert await second.get("rates", INTS, loader) == [1, 2, 3]
+        assert len(calls) == 2
+        assert second.stats()["hit_ratio"] == round(2 / 3, 4)
+    finally:
+        await first.stop()
+        await second.stop()
+    assert not first.listening
+
+
+@pytest.mark.asyncio
+async def test_hooks_run_with_the_cache_disabled():
+    """
+    in-process tables reload on the invalidations of other workers even when L1 and L2 are off
+    :return:
+    """
+    store, channels = {}, {}
+    invalidated = []
+    first = await cache_worker(FakeRedis(store, channels), enabled=False, hook=lambda keys: None)
+    second = await cache_worker(FakeRedis(store, channels), enabled=False, hook=invalidated.append)
+    loader, calls = _counting_loader([1, 2, 3])
+    try:
+        assert await second.get("rates", INTS, loader) == [1, 2, 3]
+        assert await second.get("rates", INTS, loader) == [1, 2, 3]
+        assert len(calls) == 2 and not store
+        await first.invalidate("rates")
+        await asyncio.sleep(0.01)
+        assert invalidated == [["rates"]]
+        assert not store
+    finally:
+        await first.stop()
+        await second.stop()
+
+
+@pytest.mark.asyncio
+async def test_hash_fields_are_invalidated_together():
+    """
+    fields of one key share an invalidation
+    :return:
+    """
+    cache = await cache_worker(FakeRedis())
+    adapter = TypeAdapter(Optional[int])
+    try:
+        buy, buy_calls = _counting_loader(1)
+        sell, sell_calls = _counting_loader(None)
+        for _ in range(2):
+            assert await cache.get("optimal", adapter, buy, field="GCASH:buy") == 1
+            assert await cache.get("optimal", adapter, sell, field="GCASH:sell") is None
+        assert (len(buy_calls), len(sell_calls)) == (1, 1)
+        await cache.invalidate("optimal")
+        await cache.get("optimal", adapter, buy, field="GCASH:buy")
+        assert len(buy_calls) == 2
+    finally:
+        await cache.stop()
+
+
+@pytest.mark.asyncio
+async def test_load_racing_invalidation_is_not_stored():
+    """
+    a value loaded before a concurrent invalidation is returned but not cached
+    :return:
+    """
+    redis = FakeRedis()
+    cache = await cache_worker(redis)
+
+    async def slow_loader():
+        await asyncio.sleep(0.01)
+        return [1]
+
+    try:
+        load = asyncio.create_task(cache.get("rates", INTS, slow_loader))
+        await asyncio.sleep(0)
+        await cache.invalidate("rates")
+        assert await load == [1]
+        assert "rates" not in redis.store
+        assert cache.stats()["l1_keys"] == 0
+    finally:
+        await cache.stop()
+
+
+@pytest.mark.asyncio
+async def test_load_racing_remote_invalidation_is_not_stored():
+    """
+    another process invalidates while a load is running and its message has not arrived yet,
+    the generation in redis keeps the old value out of L2
+    :return:
+    """
+    store = {}
+    loading = await cache_worker(FakeRedis(store))
+    # no shared channels, the invalidation message never reaches the loading worker
+    writer = await cache_worker(FakeRedis(store))
+    loaded = asyncio.Event()
+
+    async def slow_loader():
+        loaded.set()
+        await asyncio.sleep(0.01)
+        return [1]
+
+    try:
+        load = asyncio.create_task(loading.get("rates", INTS, slow_loader))
+        await loaded.wait()
+        await writer.invalidate("rates")
+        assert await load == [1]
+        assert "rates" not in store
+        loader, calls = _counting_loader([2])
+        assert await writer.get("rates", INTS, loader) == [2]
+        assert store["rates"] == "[2]"
+    finally:
+        await loading.stop()
+        await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_updates_do_not_drop_a_write():
+    """
+    two processes write through the same key from one snapshot, the second update finds the
+    generation moved and invalidates the key instead of storing a value without the first write
+    :return:
+    """
+    store, channels = {}, {}
+    first = await cache_worker(FakeRedis(store, channels, latency=0.001))
+    second = await cache_worker(FakeRedis(store, channels, latency=0.001))
+    loader, calls = _counting_loader([1])
+    try:
+        await first.get("rates", INTS, loader)
+        await asyncio.gather(
+            first.update("rates", INTS, lambda value: value + [2]),
+            second.update("rates", INTS, lambda value: value + [3])
+        )
+        assert "rates" not in store
+        await second.update("rates", INTS, lambda value: value + [4])
+        assert "rates" not in store
+        await asyncio.sleep(0.01)
+        await first.get("rates", INTS, loader)
+        await first.update("rates", INTS, lambda value: value + [2])
+        assert store["rates"] == "[1,2]"
+    finally:
+        await first.stop()
+        await second.stop()
+
+
+@pytest.mark.asyncio
+async def test_provider_reads_through_cache(monkeypatch):
+    """
+    group exchange rates are read from postgres once until they are invalidated
+    :return:
+    """
+    cache = await cache_worker(FakeRedis())
+    monkeypatch.setattr(shared_cache_module.shared_cache, "_redis", cache.redis)
+    monkeypatch.setattr(shared_cache_module.shared_cache, "listening", True)
+    currency_id = uuid4()
+    pool = FakePool(result=lambda method, sql, args: [make_record(currency_id=currency_id, buy_rate=7.1, sell_rate=7.0)])
+    session = Session(use_poll=True, concurrent=True)
+    session._pool = pool
+    provider = ExchangeRateProvider(session=session, redis=RedisPool())
+    try:
+        for _ in range(3):
+            assert await provider.get_exchange_rate(group_id=-1001) == [
+                CurrencyIdExRate(currency_id=currency_id, buy_rate=7.1, sell_rate=7.0)
+            ]
+        assert len(pool.idle[0].queries) == 1
+        await shared_cache_module.shared_cache.invalidate(get_group_exchange_rate_key(-1001))
+        await provider.get_exchange_rate(group_id=-1001)
+        assert len(pool.idle[0].queries) == 2
+    finally:
+        await cache.stop()
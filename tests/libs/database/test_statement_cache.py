@@ -0,0 +1,157 @@
+"""
+Test compiled statement cache
+"""
+from datetime import datetime, timezone
+from uuid import UUID
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+from app.libs.consts.enums import OperationType, OrderStatus, BotType
+from app.libs.database import Session, RedisPool
+from app.libs.database.aio_orm import statement_cache
+from app.libs.database.keyset import encode_cursor
+from app.models import SysOrder, SysCart
+from app.providers import OrderProvider, ExchangeRateProvider, HandlingFeeProvider, TelegramAccountProvider
+from app.serializers.v1.telegram import GroupQuery
+from tests.fixtures.database import FakePool
+
+CURRENCY_ID = UUID("c3ef8919-dc0b-4166-a4a5-907cfc266978")
+
+PROVIDER_QUERIES = [
+    (OrderProvider, "get_order_by_group_id", dict(group_id=-1001), dict(group_id=-1002)),
+    (OrderProvider, "get_order_by_group_id", dict(group_id=-1001, status=OrderStatus.WAIT_FOR_PAYMENT), dict(group_id=-1002, status=OrderStatus.DONE)),
+    (OrderProvider, "get_order_page", dict(page_index=1, page_size=10), dict(page_index=3, page_size=20)),
+    (
+        OrderProvider, "get_order_page",
+        dict(page_size=10, cursor=encode_cursor(datetime(2024, 1, 1, tzinfo=timezone.utc), CURRENCY_ID)),
+        dict(page_size=20, cursor=encode_cursor(datetime(2024, 2, 1, tzinfo=timezone.utc), UUID(int=1)))
+    ),
+    (
+        ExchangeRateProvider, "query_optimal_exchange_rate",
+        dict(currency="GCASH", operation_type=OperationType.BUY),
+        dict(currency="PAYMAYA", operation_type=OperationType.BUY)
+    ),
+    (
+        HandlingFeeProvider, "get_handling_fee_item_by_group_and_currency",
+        dict(group_id=-1001, currency_id=CURRENCY_ID),
+        dict(group_id=-1002, currency_id=UUID(int=1))
+    ),
+    (TelegramAccountProvider, "get_chat_group", dict(group_id=-1001), dict(group_id=-1002)),
+    (
+        TelegramAccountProvider, "get_chat_groups",
+        dict(query=GroupQuery(page_size=20, page_index=1, title="a", bot_type=BotType.CUSTOMER)),
+        dict(query=GroupQuery(page_size=50, page_index=2, title="b", bot_type=BotType.VENDORS))
+    ),
+    (
+        TelegramAccountProvider, "get_chat_groups",
+        dict(query=GroupQuery(page_size=20, cursor=encode_cursor(-1001))),
+        dict(query=GroupQuery(page_size=50, cursor=encode_cursor(-1002)))
+    ),
+]
+
+
+async def _captured_queries(provider_class, method: str, kwargs: dict) -> list:
+    pool = FakePool()
+    session = Session(use_poll=True, concurrent=False)
+    session._pool = pool
+    provider = provider_class(session=session, redis=RedisPool())
+    await getattr(provider, method)(**kwargs)
+    return [query for conn in pool.idle for query in conn.queries]
+
+
+@pytest.fixture
+def cache():
+    maxsize = statement_cache.maxsize
+    statement_cache.clear()
+    yield statement_cache
+    statement_cache.maxsize = maxsize
+    statement_cache.clear()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("provider_class,method,warm_kwargs,kwargs", PROVIDER_QUERIES)
+async def test_cached_statement_matches_compiled(cache, provider_class, method, warm_kwargs, kwargs):
+    """
+    a cache hit binds the new values into exactly the SQL the compiler produces
+    :return:
+    """
+    cache.maxsize = 0
+    expected = await _captured_queries(provider_class, method, kwargs)
+    cache.maxsize = 512
+    await _captured_queries(provider_class, method, warm_kwargs)
+    hits = cache.hits
+    actual = await _captured_queries(provider_class, method, kwargs)
+    assert actual == expected
+    assert cache.hits - hits == len(expected)
+    assert cache.uncacheable == 0
+
+
+@pytest.mark.asyncio
+async def test_statement_cache_distinguishes_shapes(cache):
+    """
+    conditional where clauses produce different cache entries
+    :return:
+    """
+    session = Session(use_poll=True)
+
+    def statement(status):
+        return (
+            session.select(SysOrder.id)
+            .outerjoin(SysCart, SysOrder.cart_id == SysCart.id)
+            .where(SysCart.group_id == 1)
+            .where(status, lambda: SysOrder.status == status)
+            ._select.statement
+        )
+
+    without_status, _ = session._format_statement(statement(None))
+    with_status, params = session._format_statement(statement(OrderStatus.DONE.value))
+    assert without_status != with_status
+    assert params == [1, OrderStatus.DONE.value]
+    assert cache.stats()["size"] == 2
+
+
+@pytest.mark.asyncio
+async def test_statement_cache_compiles_lookup_once(cache):
+    """
+    the order lookup of 500 groups is compiled once, every other query is a cache hit
+    :return:
+    """
+    session = Session(use_poll=True)
+    for group_id in range(500):
+        statement = (
+            session.select(SysOrder.id, SysOrder.order_no, SysCart.group_id, SysOrder.status)
+            .outerjoin(SysCart, SysOrder.cart_id == SysCart.id)
+            .where(SysCart.group_id == group_id)
+            .where(SysOrder.status != OrderStatus.DONE.value)
+            .order_by(SysOrder.created_at.desc())
+            ._select.statement
+        )
+        _, params = session._format_statement(statement)
+        assert params[0] == group_id
+    assert (cache.misses, cache.hits) == (1, 499)
+    assert cache.stats()["size"] == 1
+
+
+@pytest.mark.asyncio
+async def test_statement_cache_distinguishes_expression_types(cache):
+    """
+    typed JSON operators compile after their type, a hit must not return the SQL of another type
+    :return:
+    """
+    table = sa.Table("typed", sa.MetaData(), sa.Column("data", JSONB), sa.Column("name", sa.String))
+    session = Session(use_poll=True)
+    expressions = [
+        table.c.data["a"].as_string() == table.c.name,
+        table.c.data["a"].as_integer() == table.c.name,
+        table.c.data["a"] == table.c.name,
+    ]
+    for expression in expressions:
+        statement = sa.select([table.c.name]).where(expression)
+        cache.maxsize = 0
+        expected, _ = session._format_statement(statement)
+        cache.maxsize = 512
+        actual, _ = session._format_statement(statement)
+        assert actual == expected
+    assert cache.stats()["size"] == len(expressions)
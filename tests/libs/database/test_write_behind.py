@@ -0,0 +1,178 @@
+"""
+Test write-behind buffer
+"""
+import asyncio
+
+import asyncpg
+import pytest
+
+from app.libs.database import RedisPool, Session
+from app.libs.database.write_fingerprints import WriteFingerprints
+from app.models import SysTelegramAccount, SysTelegramChatGroup, SysTelegramChatGroupMember
+from app.providers import TelegramAccountProvider
+from app.providers.account import telegram as telegram_provider_module
+from app.serializers.v1.telegram import TelegramAccount, TelegramChatGroup
+from tests.fixtures.database import FakePool, pool_queries, upsert_result
+from tests.fixtures.telegram import telegram_write_behind
+
+
+@pytest.mark.asyncio
+async def test_upserts_are_coalesced_by_key():
+    """
+    puts of one row are merged, records are copied per table and column set in registration order
+    :return:
+    """
+    pool = FakePool(result=upsert_result)
+    buffer = telegram_write_behind(pool)
+    flushed = []
+
+    async def on_flushed():
+        flushed.append(1)
+
+    buffer.put(SysTelegramAccount, {"id": 1, "username": "alice"})
+    buffer.put(SysTelegramAccount, {"id": 1, "first_name": "Alice"}, on_flushed=on_flushed)
+    buffer.put(SysTelegramAccount, {"id": 2, "username": "bob"})
+    buffer.put(SysTelegramChatGroupMember, {"account_id": 1, "chat_group_id": -1, "is_customer_service": True})
+    buffer.put(SysTelegramChatGroupMember, {"account_id": 1, "chat_group_id": -1, "is_customer_service": False})
+    buffer.put(SysTelegramChatGroup, {"id": -1, "title": "group"})
+    assert buffer.pending == 4
+    assert await buffer.flush() == 4
+    copies = [(table, args) for method, table, args in pool_queries(pool) if method == "copy"]
+    assert copies == [
+        ("_staging_public_telegram_chat_group", ([(-1, "group")], ["id", "title"])),
+        ("_staging_public_telegram_account", ([("Alice", 1, "alice")], ["first_name", "id", "username"])),
+        ("_staging_public_telegram_account", ([(2, "bob")], ["id", "username"])),
+        ("_staging_public_telegram_chat_group_member", ([(1, -1, True)], ["account_id", "chat_group_id", "is_customer_service"])),
+    ]
+    merges = [sql for method, sql, _ in pool_queries(pool) if method == "fetch"]
+    assert "ON CONFLICT (account_id, chat_group_id) DO NOTHING" in merges[-1]
+    assert flushed == [1]
+    stats = buffer.stats()
+    assert (stats["queued"], stats["coalesced"], stats["flushed"], stats["pending"]) == (6, 2, 4, 0)
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_rows():
+    """
+    rows of a failed flush are queued again under the values put since
+    :return:
+    """
+    failing = [True]
+
+    def result(method, sql, args):
+        if method == "copy" and failing[0]:
+            raise ConnectionResetError("connection reset by peer")
+        return upsert_result(method, sql, args)
+
+    pool = FakePool(result=result)
+    buffer = telegram_write_behind(pool)
+    buffer.put(SysTelegramAccount, {"id": 1, "username": "alice", "first_name": "Alice"})
+    with pytest.raises(ConnectionResetError):
+        await buffer.flush()
+    buffer.put(SysTelegramAccount, {"id": 1, "username": "alice2"})
+    assert buffer.pending == 1
+    failing[0] = False
+    await buffer.flush()
+    copies = [args for method, _, args in pool_queries(pool) if method == "copy"]
+    assert copies[-1] == ([("Alice", 1, "alice2")], ["first_name", "id", "username"])
+    assert buffer.stats()["failed_flushes"] == 1
+
+
+@pytest.mark.asyncio
+async def test_rejected_row_is_dropped_after_max_attempts():
+    """
+    a row the database rejects is written apart from the others and dropped after max_attempts flushes
+    :return:
+    """
+
+    def result(method, sql, args):
+        if method == "copy" and any(-99 in row for row in args[0]):
+            raise asyncpg.ForeignKeyViolationError.new({"M": "violates foreign key constraint", "C": "23503"})
+        return upsert_result(method, sql, args)
+
+    pool = FakePool(result=result)
+    buffer = telegram_write_behind(pool, max_attempts=3)
+    buffer.put(SysTelegramChatGroupMember, {"chat_group_id": -99, "account_id": 1})
+    buffer.put(SysTelegramChatGroupMember, {"chat_group_id": -1, "account_id": 1})
+    assert await buffer.flush() == 1
+    assert buffer.pending == 1
+    buffer.put(SysTelegramChatGroupMember, {"chat_group_id": -1, "account_id": 2})
+    assert await buffer.flush() == 1
+    assert await buffer.flush() == 0
+    stats = buffer.stats()
+    assert (stats["pending"], stats["dropped"], stats["failed_flushes"], stats["flushed"]) == (0, 1, 3, 2)
+
+
+@pytest.mark.asyncio
+async def test_reads_only_wait_for_their_rows(monkeypatch):
+    """
+    a read flushes only when a row it reads is pending, a failed flush does not fail the read
+    :return:
+    """
+    failing = [False]
+
+    def result(method, sql, args):
+        if method == "copy" and failing[0]:
+            raise ConnectionResetError("connection reset by peer")
+        if method == "fetch":
+            return []
+        return upsert_result(method, sql, args)
+
+    pool = FakePool(result=result)
+    session = Session(use_poll=True, concurrent=True)
+    session._pool = pool
+    buffer = telegram_write_behind(pool)
+    monkeypatch.setattr(telegram_provider_module, "write_behind", buffer)
+    provider = TelegramAccountProvider(session=session, redis=RedisPool())
+    buffer.put(SysTelegramChatGroupMember, {"chat_group_id": -1, "account_id": 1})
+    await provider.get_group_customer_services(group_id=-2)
+    assert (buffer.flushes, buffer.pending) == (0, 1)
+    failing[0] = True
+    assert await provider.get_group_customer_services(group_id=-1) == []
+    assert (buffer.failed_flushes, buffer.pending) == (1, 1)
+    failing[0] = False
+    await provider.get_chat_group_members(chat_group_id=-1)
+    assert (buffer.flushes, buffer.pending) == (1, 0)
+
+
+@pytest.mark.asyncio
+async def test_flushes_on_max_rows_and_on_stop():
+    """
+    the flusher writes as soon as max_rows are pending, stop writes the rest
+    :return:
+    """
+    pool = FakePool(result=upsert_result)
+    buffer = telegram_write_behind(pool, flush_interval=60, max_rows=3)
+    await buffer.start()
+    try:
+        for account_id in range(3):
+            buffer.put(SysTelegramAccount, {"id": account_id})
+        await asyncio.sleep(0.01)
+        assert buffer.flushed == 3
+        buffer.put(SysTelegramAccount, {"id": 3})
+    finally:
+        await buffer.stop()
+    assert (buffer.flushed, buffer.pending, buffer.running) == (4, 0, False)
+
+
+@pytest.mark.asyncio
+async def test_large_join_is_written_in_bulk(monkeypatch):
+    """
+    a group join of 500 members stays out of the update path and is flushed in a few statements
+    :return:
+    """
+    group = TelegramChatGroup(id=-1001, title="group", type="supergroup", in_group=True, bot_type="customer")
+    pool = FakePool(result=upsert_result)
+    session = Session(use_poll=True, concurrent=True)
+    session._pool = pool
+    buffer = telegram_write_behind(pool)
+    monkeypatch.setattr(telegram_provider_module, "write_behind", buffer)
+    monkeypatch.setattr(telegram_provider_module, "write_fingerprints", WriteFingerprints(prefix="test", use_redis=False))
+    provider = TelegramAccountProvider(session=session, redis=RedisPool())
+    for index in range(500):
+        account = TelegramAccount(id=index, username=f"user{index}", first_name="customer")
+        await provider.queue_account_info(account=account, chat_group=group)
+    assert pool_queries(pool) == []
+    await buffer.flush()
+    assert len(pool_queries(pool)) == 9
+    assert (buffer.flushed, buffer.pending) == (1001, 0)
@@ -0,0 +1,85 @@
+"""
+Test write fingerprints
+"""
+import pytest
+
+from app.libs.consts.enums import BotType, PaymentAccountStatus
+from app.libs.database import RedisPool, shared_cache as shared_cache_module
+from app.providers import TelegramAccountProvider
+from app.providers.account import telegram as telegram_provider_module
+from app.serializers.v1.telegram import TelegramChatGroup
+from tests.fixtures.database import FakePool, FakeRedis, fake_session, pool_queries
+from tests.fixtures.telegram import fake_fingerprints, receive_messages
+
+
+@pytest.mark.asyncio
+async def test_unchanged_after_remember():
+    """
+    the same values are skipped after their write, changed values are not
+    :return:
+    """
+    fingerprints = fake_fingerprints()
+    first = fingerprints.fingerprint({"id": 1, "username": "alice"})
+    assert first == fingerprints.fingerprint({"username": "alice", "id": 1})
+    assert not await fingerprints.unchanged("account:1", first)
+    await fingerprints.remember("account:1", first)
+    assert await fingerprints.unchanged("account:1", first)
+    assert not await fingerprints.unchanged("account:1", fingerprints.fingerprint({"id": 1, "username": "bob"}))
+    await fingerprints.forget("account:1")
+    assert not await fingerprints.unchanged("account:1", first)
+    assert fingerprints.stats()["skipped"] == 1
+
+
+@pytest.mark.asyncio
+async def test_shared_through_redis():
+    """
+    a write of one process is skipped by another process, expired and evicted fingerprints are not
+    :return:
+    """
+    store = {}
+    first, second = fake_fingerprints(FakeRedis(store)), fake_fingerprints(FakeRedis(store), max_size=1)
+    await first.remember("group:1", "a")
+    assert await second.unchanged("group:1", "a")
+    await second.remember("group:2", "b")
+    assert "group:1" not in second._fingerprints
+    await second.forget("group:1")
+    assert "test:fingerprint:group:1" not in store
+    assert not await fake_fingerprints(FakeRedis(store)).unchanged("group:1", "a")
+    expiring = fake_fingerprints(ttl=0)
+    await expiring.remember("group:3", "c")
+    assert not await expiring.unchanged("group:3", "c")
+
+
+@pytest.mark.asyncio
+async def test_fingerprints_skip_unchanged_upserts(monkeypatch):
+    """
+    2k messages of 20 groups, upserts with and without fingerprints
+    :return:
+    """
+    always = await receive_messages(fake_fingerprints(enabled=False), monkeypatch.setattr, messages=2_000, groups=20)
+    skipped = await receive_messages(fake_fingerprints(FakeRedis()), monkeypatch.setattr, messages=2_000, groups=20)
+    assert always == 6_000
+    # every account, group and member once, plus each username change and its revert
+    assert skipped <= 200 + 20 + 200 + 2 * 4
+    assert skipped < always * 0.1
+
+
+@pytest.mark.asyncio
+async def test_status_change_writes_the_group_again(monkeypatch):
+    """
+    a payment account status set by an admin is overwritten by the next set_group of the same values
+    :return:
+    """
+    monkeypatch.setattr(telegram_provider_module, "write_fingerprints", fake_fingerprints())
+    monkeypatch.setattr(shared_cache_module.shared_cache, "_redis", FakeRedis())
+    pool = FakePool(result=lambda method, sql, args: "INSERT 0 1")
+    provider = TelegramAccountProvider(session=fake_session(pool), redis=RedisPool())
+    group = TelegramChatGroup(
+        id=-1001, title="vendor", type="supergroup", in_group=True, bot_type=BotType.VENDORS,
+        payment_account_status=PaymentAccountStatus.PREPARING
+    )
+    await provider.set_group(chat_group=group)
+    await provider.set_group(chat_group=group)
+    await provider.update_payment_account_status(group_id=-1001, status=PaymentAccountStatus.OUT_OF_STOCK)
+    await provider.set_group(chat_group=group)
+    assert sum(1 for _, sql, _ in pool_queries(pool) if sql.startswith("INSERT")) == 2
@@ -0,0 +1,104 @@
+"""
+Test broadcast engine
+"""
+import asyncio
+import uuid
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+
+from app.libs import broadcaster as broadcaster_module
+from app.libs.broadcaster import BroadcastJob, TokenBucket
+from app.libs.consts.enums import MessageStatus
+from tests.fixtures.telegram import SEND_LATENCY, BroadcastBot, FakeHistories, broadcast_engine, broadcast_histories
+
+
+@pytest.mark.asyncio
+async def test_broadcast_writes_histories_in_batches():
+    """
+    :return:
+    """
+    bot, store = BroadcastBot(bad_chats=[-3]), FakeHistories()
+    engine = broadcast_engine()
+    message_id = uuid.uuid4()
+    job = engine.start(message_id, broadcast_histories(message_id, 120), bot.send_message, store.write)
+    assert engine.start(message_id, [], bot.send_message, store.write) is job
+    await engine.wait(message_id)
+    progress = job.progress()
+    assert (progress["state"], progress["sent"], progress["failed"], progress["pending"]) == (BroadcastJob.FINISHED, 119, 1, 0)
+    assert len(store.rows) == 120
+    assert store.rows[-3].status == MessageStatus.FAILED
+    assert store.rows[-3].telegram_error_description == "Chat not found"
+    assert all(row.status == MessageStatus.SENT and row.telegram_message_id for chat, row in store.rows.items() if chat != -3)
+    assert store.writes <= 4
+
+
+class FakeClock:
+    """monotonic clock and sleep of the broadcaster module, sleeping only moves the clock"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.mark.asyncio
+async def test_retry_after_pauses_the_bot(monkeypatch):
+    """
+    :return:
+    """
+    bot, store = BroadcastBot(retry_after={-1: 0.2}), FakeHistories()
+    engine = broadcast_engine(workers=4)
+    paused: List[float] = []
+    monkeypatch.setattr(engine.bucket, "pause", paused.append)
+    message_id = uuid.uuid4()
+    job = engine.start(message_id, broadcast_histories(message_id, 8), bot.send_message, store.write)
+    await engine.wait(message_id)
+    assert (job.sent, job.retried) == (8, 1)
+    assert -1 in bot.sent
+    assert paused == [0.2]
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_the_rate(monkeypatch):
+    """
+    :return:
+    """
+    clock = FakeClock()
+    monkeypatch.setattr(broadcaster_module, "time", SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(broadcaster_module, "asyncio", SimpleNamespace(sleep=clock.sleep))
+    bucket = TokenBucket(rate=128, capacity=8)
+    for _ in range(40):
+        await bucket.acquire()
+    # a burst of 8, the rest 128 a second
+    assert clock.now == 32 / 128
+    bucket.pause(1)
+    await bucket.acquire()
+    assert clock.now == 1 + 32 / 128
+
+
+@pytest.mark.asyncio
+async def test_stopped_broadcast_resumes_the_pending_chats():
+    """
+    :return:
+    """
+    bot, store = BroadcastBot(), FakeHistories()
+    engine = broadcast_engine(workers=2, batch_size=1000)
+    message_id = uuid.uuid4()
+    histories = broadcast_histories(message_id, 20)
+    job = engine.start(message_id, histories, bot.send_message, store.write)
+    await asyncio.sleep(SEND_LATENCY * 3.5)
+    await engine.stop()
+    assert job.state == BroadcastJob.CANCELLED
+    # what was sent before the stop is written
+    assert 0 < len(store.rows) == len(bot.sent) < 20
+    pending = [history for history in histories if history.chat_group_id not in store.rows]
+    job = engine.start(message_id, pending, bot.send_message, store.write)
+    await engine.wait(message_id)
+    assert job.state == BroadcastJob.FINISHED
+    assert sorted(bot.sent) == sorted(history.chat_group_id for history in histories)
@@ -0,0 +1,89 @@
+"""
+Test delayed delivery
+"""
+import asyncio
+from typing import List
+
+import pytest
+
+from app.libs.delayed_delivery import DelayedDelivery
+
+
+@pytest.mark.asyncio
+async def test_delivery_waits_for_its_delay():
+    """
+    :return:
+    """
+    scheduler = DelayedDelivery()
+    delivered: List[int] = []
+
+    async def deliver():
+        delivered.append(1)
+
+    task = scheduler.schedule(delay=0.1, deliver=deliver)
+    assert scheduler.pending == 1
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert not delivered
+    await task
+    assert delivered == [1]
+    assert scheduler.stats() == {'pending': 0, 'scheduled': 1, 'delivered': 1, 'failed': 0}
+
+
+@pytest.mark.asyncio
+async def test_failed_delivery_does_not_stop_the_others():
+    """
+    :return:
+    """
+    scheduler = DelayedDelivery()
+    delivered: List[int] = []
+
+    async def deliver(index: int):
+        if index == 1:
+            raise RuntimeError("telegram is down")
+        delivered.append(index)
+
+    tasks = [scheduler.schedule(delay=0.01, deliver=lambda index=index: deliver(index)) for index in range(3)]
+    await asyncio.wait(tasks)
+    assert sorted(delivered) == [0, 2]
+    assert (scheduler.delivered, scheduler.failed) == (2, 1)
+
+
+@pytest.mark.asyncio
+async def test_stop_delivers_the_waiting_replies_at_once():
+    """
+    :return:
+    """
+    scheduler = DelayedDelivery()
+    delivered: List[int] = []
+
+    async def deliver():
+        delivered.append(1)
+
+    for _ in range(5):
+        scheduler.schedule(delay=3600, deliver=deliver)
+    await asyncio.wait_for(scheduler.stop(), timeout=5)
+    assert (len(delivered), scheduler.pending) == (5, 0)
+
+
+@pytest.mark.asyncio
+async def test_deliveries_of_a_key_keep_their_order():
+    """
+    a later delivery of a chat and a reply waiting on it go out after its delayed reply,
+    other chats are not held
+    :return:
+    """
+    scheduler = DelayedDelivery()
+    delivered: List[str] = []
+
+    async def deliver(text: str):
+        delivered.append(text)
+
+    scheduler.schedule(delay=0.05, deliver=lambda: deliver("rate"), key=1)
+    scheduler.schedule(delay=0, deliver=lambda: deliver("follow-up"), key=1)
+    await scheduler.wait(2)
+    assert delivered == []
+    await scheduler.wait(1)
+    delivered.append("next reply")
+    assert delivered == ["rate", "follow-up", "next reply"]
+    assert scheduler.pending == 0
@@ -0,0 +1,96 @@
+"""
+Test exchange rate book
+"""
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from app.libs.consts.enums import OperationType, PaymentAccountStatus
+from app.libs.exchange_rate_book import ExchangeRateBook
+
+GCASH, USDT = uuid4(), uuid4()
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _record(group_id: int, currency_id, buy_rate, sell_rate, status=PaymentAccountStatus.PREPARING, age: int = 0):
+    return {
+        "group_id": group_id,
+        "group_name": f"vendor {group_id}",
+        "payment_account_status": status.value,
+        "currency_id": currency_id,
+        "currency": "GCASH" if currency_id == GCASH else "USDT",
+        "buy_rate": buy_rate,
+        "sell_rate": sell_rate,
+        "updated_at": NOW - timedelta(minutes=age),
+    }
+
+
+def _book() -> ExchangeRateBook:
+    book = ExchangeRateBook()
+    book.load([
+        _record(1, GCASH, 7.10, 7.00, age=5),
+        _record(2, GCASH, 7.05, 6.90),
+        _record(3, GCASH, 7.05, 7.20, age=10),
+        _record(4, GCASH, 6.50, 7.50, status=PaymentAccountStatus.OUT_OF_STOCK),
+        _record(5, GCASH, None, None),
+        _record(1, USDT, 32.0, 31.0),
+    ])
+    return book
+
+
+def test_best_rate_per_side():
+    """
+    BUY takes the lowest buy rate and SELL the highest sell rate of the PREPARING vendors
+    :return:
+    """
+    book = _book()
+    assert book.is_fresh
+    buy = book.best("GCASH", OperationType.BUY)
+    assert (buy["group_id"], buy["group_name"], buy["buy_rate"]) == (2, "vendor 2", 7.05)
+    sell = book.best("GCASH", OperationType.SELL)
+    assert (sell["group_id"], sell["sell_rate"]) == (3, 7.20)
+    assert book.best("USDT", OperationType.SELL)["currency_id"] == USDT
+    assert book.best("PHP", OperationType.BUY) is None
+
+
+def test_incremental_updates():
+    """
+    rate and status changes move the best vendor without reloading the book
+    :return:
+    """
+    book = _book()
+    book.update_group_status(group_id=4, status=PaymentAccountStatus.PREPARING)
+    assert book.best("GCASH", OperationType.BUY)["group_id"] == 4
+    book.update_group_status(group_id=4, status=PaymentAccountStatus.OUT_OF_STOCK)
+    book.update_rates(group_id=3, rates=[(GCASH, 7.05, 7.20)], updated_at=NOW + timedelta(minutes=1))
+    assert book.best("GCASH", OperationType.BUY)["group_id"] == 3
+    book.update_rates(group_id=1, rates=[(GCASH, 7.10, 7.30)], updated_at=NOW)
+    assert book.best("GCASH", OperationType.SELL)["group_id"] == 1
+    assert book.best("USDT", OperationType.BUY)["buy_rate"] == 32.0
+    assert book.is_fresh
+
+
+def test_group_written_by_set_group():
+    """
+    a new title or payment account status of a vendor is applied to the cached best
+    :return:
+    """
+    book = _book()
+    book.update_group(group_id=2, title="renamed")
+    assert book.best("GCASH", OperationType.BUY)["group_name"] == "renamed"
+    book.update_group(group_id=2, title="renamed", status=PaymentAccountStatus.OUT_OF_STOCK)
+    assert book.best("GCASH", OperationType.BUY)["group_id"] != 2
+    book.update_group(group_id=-1, title="unknown", status=PaymentAccountStatus.PREPARING)
+    assert book.is_fresh
+
+
+def test_unknown_group_or_currency_reloads():
+    """
+    rates of a group or currency the book has not seen make the next lookup reload the book
+    :return:
+    """
+    book = _book()
+    book.update_rates(group_id=1, rates=[(uuid4(), 1.0, 1.0)], updated_at=NOW)
+    assert not book.is_fresh
+    book = _book()
+    book.update_rates(group_id=99, rates=[(GCASH, 1.0, 1.0)], updated_at=NOW)
+    assert not book.is_fresh
@@ -0,0 +1,69 @@
+"""
+Test handling fee table
+"""
+from uuid import uuid4
+
+from app.libs.consts.enums import CalculationType
+from app.libs.handling_fee_table import HandlingFeeTable
+from app.serializers.v1.handling_fee import HandlingFeeConfigItem
+
+GCASH, USDT = uuid4(), uuid4()
+GLOBAL, VIP = uuid4(), uuid4()
+
+
+def _item(currency_id, value: float) -> HandlingFeeConfigItem:
+    return HandlingFeeConfigItem(
+        currency_id=currency_id,
+        buy_calculation_type=CalculationType.ADDITION,
+        buy_value=value,
+        sell_calculation_type=CalculationType.SUBTRACTION,
+        sell_value=value
+    )
+
+
+def _table() -> HandlingFeeTable:
+    table = HandlingFeeTable()
+    table.load(
+        global_config_id=GLOBAL,
+        items=[(GLOBAL, _item(GCASH, 0.5)), (GLOBAL, _item(USDT, 0.1)), (VIP, _item(GCASH, 0.2))],
+        groups=[(1, VIP), (2, None)]
+    )
+    return table
+
+
+def test_resolve_with_global_fallback():
+    """
+    the item of the config of the group wins, the global config fills the currencies it lacks
+    :return:
+    """
+    table = _table()
+    assert table.is_fresh
+    assert table.get(1, GCASH).buy_value == 0.2
+    assert table.get(1, USDT).buy_value == 0.1
+    assert table.get(2, GCASH).buy_value == 0.5
+    # a group created after the load has no config
+    assert table.get(3, USDT).buy_value == 0.1
+    assert table.get(1, uuid4()) is None
+
+
+def test_incremental_updates():
+    """
+    item, global flag and group changes are applied without reloading the table
+    :return:
+    """
+    table = _table()
+    table.update_item(VIP, _item(USDT, 0.3))
+    assert table.get(1, USDT).buy_value == 0.3
+    assert table.get(2, USDT).buy_value == 0.1
+    table.update_item(GLOBAL, _item(GCASH, 0.6))
+    assert (table.get(1, GCASH).buy_value, table.get(2, GCASH).buy_value) == (0.2, 0.6)
+    table.update_group(2, VIP)
+    table.update_group(1, None)
+    assert (table.get(1, USDT).buy_value, table.get(2, USDT).buy_value) == (0.1, 0.3)
+    table.update_config(GLOBAL, is_global=False)
+    assert table.get(1, GCASH) is None
+    assert table.get(2, GCASH).buy_value == 0.2
+    table.update_config(VIP, is_global=True)
+    assert table.get(1, GCASH).buy_value == 0.2
+    table.invalidate()
+    assert not table.is_fresh
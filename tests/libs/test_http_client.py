@@ -0,0 +1,153 @@
+"""
+Test http client
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.libs.http_client import CircuitOpenError, DeadlineExceeded, deadline
+from app.libs.http_client.circuit_breaker import CircuitBreaker, RetryBudget
+from app.libs.http_client.http_client import HttpClient, HttpDefaults
+from tests.fixtures.http_client import StubServer
+
+
+@pytest.mark.asyncio
+async def test_requests_share_connections():
+    """
+    a started client keeps one connection per origin alive and closes it on aclose
+    :return:
+    """
+    server = StubServer()
+    async with server as url:
+        client = HttpClient(defaults=HttpDefaults(base_url=url), limits=httpx.Limits(max_connections=4))
+        await client.start(url)
+        assert client.stats()["origins"] == [f"{url}/"]
+        for _ in range(3):
+            async with client.create(url="/messages") as session:
+                await session.aget()
+        await client.create(url=f"{url}/other").aget()
+        assert (server.connections, server.requests) == (1, 4)
+        shared = client.pooled_client(url)
+        assert not shared.is_closed
+        assert not shared.cookies
+        await client.aclose()
+        assert shared.is_closed
+        assert client.pooled_client(url) is None
+
+
+@pytest.mark.asyncio
+async def test_not_started_client_connects_per_request():
+    """
+    :return:
+    """
+    server = StubServer()
+    async with server as url:
+        client = HttpClient(defaults=HttpDefaults(base_url=url))
+        for _ in range(3):
+            await client.create(url="/messages").aget()
+        assert (server.connections, server.requests) == (3, 3)
+
+
+@pytest.mark.asyncio
+async def test_server_errors_are_retried_with_backoff():
+    """
+    :return:
+    """
+    server = StubServer(failures=2)
+    async with server as url:
+        client = HttpClient(defaults=HttpDefaults(base_url=url))
+        resp = await client.create(url="/messages").retry(3, retry_interval=0.01).aget()
+        assert resp.status_code == 200
+        assert server.requests == 3
+        stats = client.stats()
+        host = url.split("//")[1]
+        assert stats["retry_budgets"][host]["retries"] == 2
+        assert stats["breakers"][host]["state"] == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_breaker_fails_fast_and_recovers():
+    """
+    the breaker opens after consecutive failures, fails fast while open and closes after a good trial
+    :return:
+    """
+    server = StubServer(failures=3)
+    async with server as url:
+        client = HttpClient(defaults=HttpDefaults(base_url=url), breaker_failures=3, breaker_reset_timeout=0.1)
+        for _ in range(3):
+            resp = await client.create(url="/messages").aget()
+            assert resp.status_code == 503
+        breaker = client.breaker(url.split("//")[1])
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            await client.create(url="/messages").aget()
+        assert server.requests == 3
+        await asyncio.sleep(0.1)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        resp = await client.create(url="/messages").aget()
+        assert resp.status_code == 200
+        assert (breaker.state, breaker.opened, breaker.rejected) == (CircuitBreaker.CLOSED, 1, 1)
+
+
+def test_breaker_half_open_admits_one_trial():
+    """
+    :return:
+    """
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.05)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_retry_budget_limits_retries_to_a_share_of_requests():
+    """
+    :return:
+    """
+    budget = RetryBudget(ratio=0.25, max_balance=2)
+    retries = 0
+    for _ in range(100):
+        budget.deposit()
+        retries += budget.withdraw()
+    assert 25 <= retries <= 2 + 25
+    assert budget.stats()["exhausted"] == 100 - retries
+
+
+@pytest.mark.asyncio
+async def test_deadline_cuts_timeouts_and_retries():
+    """
+    :return:
+    """
+    server = StubServer(delay=0.5)
+    async with server as url:
+        client = HttpClient(defaults=HttpDefaults(base_url=url))
+        with deadline(0.1):
+            with pytest.raises(httpx.TimeoutException):
+                await client.create(url="/messages").retry(5, retry_interval=0.01).aget()
+            with pytest.raises(DeadlineExceeded):
+                await client.create(url="/messages").aget()
+        # no retry and no second request once the deadline is spent
+        assert server.requests == 1
+
+
+@pytest.mark.asyncio
+async def test_breaker_sheds_a_degraded_host():
+    """
+    20 updates calling a host that stopped answering in time only reach it until the breaker opens
+    :return:
+    """
+    server = StubServer(delay=0.2)
+    async with server as url:
+        client = HttpClient(defaults=HttpDefaults(base_url=url, timeout=0.05))
+        await client.start(url)
+        for _ in range(20):
+            with pytest.raises(httpx.TransportError):
+                await client.create(url="/messages").retry(2, retry_interval=0.01).aget()
+        await client.aclose()
+    assert server.requests == 5
+    assert client.breaker(url.split("//")[1]).state == CircuitBreaker.OPEN
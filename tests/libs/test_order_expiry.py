@@ -0,0 +1,131 @@
+"""
+Test order expiry engine
+"""
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from app.config import settings
+from app.libs.consts.enums import OrderStatus
+from app.libs.database import RedisPool, Session
+from app.libs.order_expiry import OrderExpiry
+from app.providers import OrderProvider
+from tests.fixtures.database import FakePool, make_record
+from tests.fixtures.orders import FakeOrders, order_expirations
+
+
+@pytest.mark.asyncio
+async def test_due_orders_expire_in_batches():
+    """
+    :return:
+    """
+    orders = FakeOrders(order_expirations(1200, -1) + order_expirations(5, 60))
+    engine = OrderExpiry(batch_size=500)
+    engine._expire = orders.expire
+    engine.restore(await orders.load())
+    assert engine.pending == 1205
+    assert await engine.sweep() == 1200
+    assert orders.batches == [500, 500, 200]
+    assert engine.pending == 5
+    assert engine.next_deadline() > time.time()
+
+
+@pytest.mark.asyncio
+async def test_rescheduled_and_cancelled_orders_are_not_expired():
+    """
+    :return:
+    """
+    paid, extended, due = order_expirations(3, -1)
+    orders = FakeOrders([paid, extended, due])
+    engine = OrderExpiry()
+    engine._expire = orders.expire
+    engine.restore(await orders.load())
+    engine.cancel(paid.id)
+    engine.schedule(order_id=extended.id, expiration_of_pay=datetime.now(tz=pytz.UTC) + timedelta(minutes=5))
+    engine.restore([due])
+    assert await engine.sweep() == 1
+    assert orders.batches == [1]
+    assert engine.pending == 1
+
+
+@pytest.mark.asyncio
+async def test_deadlines_are_compared_with_the_sweep_time():
+    """
+    an order due by the clock of the sweep is expired whatever the clock of the database says
+    :return:
+    """
+    expirations = order_expirations(5, 60)
+    orders = FakeOrders(expirations)
+    engine = OrderExpiry()
+    engine._expire = orders.expire
+    engine.restore(expirations)
+    assert await engine.sweep(now=expirations[0].expiration_of_pay.timestamp()) == 5
+    assert engine.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_engine_expires_on_deadline_and_bounds_notices(monkeypatch):
+    """
+    the running engine wakes at the deadline and tells the chats at most notify_rate a second
+    :return:
+    """
+    orders = FakeOrders(order_expirations(60, 0.05))
+    engine = OrderExpiry(batch_size=500, notify_rate=40)
+    tokens = []
+    acquire = engine.bucket.acquire
+
+    async def counted_acquire():
+        await acquire()
+        tokens.append(1)
+
+    monkeypatch.setattr(engine.bucket, "acquire", counted_acquire)
+    await engine.start(load=orders.load, expire=orders.expire, notify=orders.notify)
+    try:
+        late = order_expirations(1, 0.1)[0]
+        orders.waiting[late.id] = late
+        engine.schedule(order_id=late.id, expiration_of_pay=late.expiration_of_pay)
+        while len(orders.notified) < 61:
+            await asyncio.sleep(0.01)
+    finally:
+        await engine.stop()
+    assert orders.batches[0] == 60
+    stats = engine.stats()
+    assert (stats["expired"], stats["notified"], stats["pending"]) == (61, 61, 0)
+    # every notice waits for a token of the notify_rate bucket
+    assert len(tokens) == 61
+
+
+@pytest.mark.asyncio
+async def test_provider_expires_orders_in_one_statement(monkeypatch):
+    """
+    :return:
+    """
+    monkeypatch.setattr(settings, "CHAT_STATE_CACHE", False)
+    order_ids = [uuid.uuid4() for _ in range(3)]
+    statements = []
+
+    def result(method: str, sql: str, args: tuple):
+        statements.append((sql, args))
+        return [
+            make_record(id=order_id, order_no=f"O{index}", group_id=-1001, language="en-us", message_id=None)
+            for index, order_id in enumerate(order_ids[:2])
+        ]
+
+    session = Session(use_poll=True, concurrent=True)
+    session._pool = FakePool(result=result)
+    provider = OrderProvider(session=session, redis=RedisPool())
+    now = datetime.now(tz=pytz.UTC)
+    expired = await provider.expire_orders(order_ids=order_ids, now=now)
+    assert [order.id for order in expired] == order_ids[:2]
+    (sql, args), = statements
+    assert sql.startswith('UPDATE public."order"') and "RETURNING" in sql
+    assert "expiration_of_pay <= $4" in sql
+    assert args == (OrderStatus.EXPIRE.value, order_ids, OrderStatus.WAIT_FOR_PAYMENT.value, now)
+    # the update runs in a transaction on the primary, never as a prepared statement of the read path
+    conn, = session._pool.idle
+    assert conn.transactions == 1 and not conn.prepared
+    assert session._tx is None
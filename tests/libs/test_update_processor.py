@@ -0,0 +1,62 @@
+"""
+Test telegram update processor
+"""
+import pytest
+
+from app.libs.http_client.deadline import remaining_time
+from app.libs.update_processor import ChatOrderedUpdateProcessor
+from tests.fixtures.telegram import OfflineBot, processor_update, run_updates
+
+
+@pytest.mark.asyncio
+async def test_updates_of_a_chat_keep_their_order():
+    """
+    different chats run in parallel, each chat sees its updates in the order they were received
+    :return:
+    """
+    processor = ChatOrderedUpdateProcessor(workers=4)
+    _, seen = await run_updates(processor, chats=8, updates_per_chat=5)
+    assert len(seen) == 8
+    for message_ids in seen.values():
+        assert message_ids == sorted(message_ids)
+    stats = processor.stats()
+    assert (stats["processed"], stats["pending"], stats["active"], stats["chats"]) == (40, 0, 0, 0)
+    assert stats["process_latency"]["count"] == 40
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("workers", [1, 4, 16])
+async def test_workers_process_chats_in_parallel(workers: int):
+    """
+    as many chats are processed at once as there are workers
+    :return:
+    """
+    gina, _ = await run_updates(ChatOrderedUpdateProcessor(workers=workers), chats=16, updates_per_chat=4)
+    assert gina.max_active == workers
+
+
+@pytest.mark.asyncio
+async def test_one_chat_runs_sequentially():
+    """
+    updates of a single chat do not overlap whatever the worker count
+    :return:
+    """
+    gina, seen = await run_updates(ChatOrderedUpdateProcessor(workers=8), chats=1, updates_per_chat=5)
+    assert list(seen.values()) == [[0, 1, 2, 3, 4]]
+    assert gina.max_active == 1
+
+
+@pytest.mark.asyncio
+async def test_update_deadline_reaches_the_handler():
+    """
+    :return:
+    """
+    processor = ChatOrderedUpdateProcessor(workers=2, update_deadline=5)
+    remaining = []
+
+    async def handle():
+        remaining.append(remaining_time())
+
+    await processor.do_process_update(processor_update(1, -1, OfflineBot("123456:ABCDEF")), handle())
+    assert 4 < remaining[0] <= 5
+    assert remaining_time() is None
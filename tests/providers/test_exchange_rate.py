@@ -44,3 +44,19 @@ async def test_get_lowest_buying_exchange_rate(exchange_rate_provider: ExchangeR
         operation_type=operation_type
     )
     assert result is not None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("operation_type", [OperationType.BUY, OperationType.SELL])
+async def test_exchange_rate_book_matches_query(exchange_rate_provider: ExchangeRateProvider, operation_type: OperationType):
+    """
+    the book returns the same vendor as the SQL lookup
+    :param exchange_rate_provider:
+    :param operation_type:
+    :return:
+    """
+    await exchange_rate_provider.load_exchange_rate_book()
+    for currency in ("GCASH", "USDT"):
+        expected = await exchange_rate_provider.query_optimal_exchange_rate(currency=currency, operation_type=operation_type)
+        result = await exchange_rate_provider.get_optimal_exchange_rate(currency=currency, operation_type=operation_type)
+        assert result == expected
@@ -112,3 +112,19 @@ async def test_create_handling_fee_config_item(
             sell_value=0.45
         )
     )
+
+
+@pytest.mark.asyncio
+async def test_handling_fee_table_matches_query(
+    handling_fee_provider: HandlingFeeProvider
+):
+    """
+    the handling fee table resolves the same item as the group and global lookups
+    """
+    await handling_fee_provider.load_handling_fee_table()
+    group_id, currency_id = -1002050270240, UUID("4442ca9a-172c-4e0e-ae9a-db38a1126f2d")
+    expected = await handling_fee_provider.get_handling_fee_item_by_group_and_currency(group_id=group_id, currency_id=currency_id)
+    if not expected:
+        expected = await handling_fee_provider.get_handing_fee_global_item_by_currency(currency_id=currency_id)
+    result = await handling_fee_provider.get_resolved_handling_fee_item(group_id=group_id, currency_id=currency_id)
+    assert result == expected
@@ -8,6 +8,7 @@ import pytest
 import pytz
 
 from app.libs.consts.enums import Language, OrderStatus
+from app.libs.database.keyset import encode_cursor
 from app.providers import OrderProvider
 from app.schemas.order import Cart, Order
 
@@ -25,6 +26,21 @@ async def test_get_order_page(order_provider: OrderProvider):
     assert isinstance(result, list)
 
 
+@pytest.mark.asyncio
+async def test_get_order_page_by_cursor(order_provider: OrderProvider):
+    """
+    the cursor page continues where the offset page stopped
+    :param order_provider:
+    :return:
+    """
+    offset_page, _ = await order_provider.get_order_page(page_index=0, page_size=4)
+    first_page, _ = await order_provider.get_order_page(page_index=0, page_size=2)
+    cursor = encode_cursor(first_page[-1].created_at, first_page[-1].id)
+    second_page, count = await order_provider.get_order_page(page_size=2, cursor=cursor)
+    assert count is None
+    assert [order.id for order in first_page + second_page] == [order.id for order in offset_page]
+
+
 @pytest.mark.asyncio
 async def test_create_cart(order_provider: OrderProvider):
     """
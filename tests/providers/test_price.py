@@ -5,6 +5,7 @@ import pytest
 
 from app.libs.consts.enums import OperationType
 from app.providers import PriceProvider
+from app.serializers.v1.exchange_rate import QuoteQuery
 
 
 @pytest.mark.asyncio
@@ -23,3 +24,34 @@ async def test_get_price_info(price_provider: PriceProvider):
         operation_type=operation_type
     )
     print(price_info)
+
+
+def _queries(count: int) -> list:
+    return [
+        QuoteQuery(
+            group_id=-1002050270240,
+            currency="GCASH" if index % 3 else "USDT",
+            operation_type=OperationType.BUY if index % 2 else OperationType.SELL
+        )
+        for index in range(count)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_get_price_infos_matches_get_price_info(price_provider: PriceProvider):
+    """
+    the batch returns the price info of every query in order, None where get_price_info has no price either
+    :param price_provider:
+    :return:
+    """
+    queries = _queries(6)
+    price_infos = await price_provider.get_price_infos(queries)
+    assert len(price_infos) == len(queries)
+    assert any(price_info is not None for price_info in price_infos), "no quote is priced, the comparison checks nothing"
+    for query, price_info in zip(queries, price_infos):
+        expected = await price_provider.get_price_info(
+            group_id=query.group_id,
+            currency=query.currency,
+            operation_type=query.operation_type
+        )
+        assert price_info == expected